@@ -73,8 +73,16 @@ class DB( MySQL ):
     if result['OK']:
       self.maxQueueSize = int( result['Value'] )
 
+    # Connection pool and statement statistics tuning
+    self.minQueueSize = gConfig.getValue( self.cs_path + '/MinQueueSize', 1 )
+    idleTimeout = gConfig.getValue( self.cs_path + '/IdleConnectionTimeout', 600 )
+    maxConnectionAge = gConfig.getValue( self.cs_path + '/MaxConnectionAge', 3600 )
+    slowQueryTime = gConfig.getValue( self.cs_path + '/SlowQueryTime', 1.0 )
+
     MySQL.__init__( self, self.dbHost, self.dbUser, self.dbPass,
-                   self.dbName, self.dbPort, maxQueueSize = maxQueueSize, debug = debug )
+                   self.dbName, self.dbPort, maxQueueSize = self.maxQueueSize, debug = debug,
+                   minQueueSize = self.minQueueSize, idleTimeout = idleTimeout,
+                   maxConnectionAge = maxConnectionAge, slowQueryTime = slowQueryTime )
 
     if not self._connected:
       raise RuntimeError( 'Can not connect to DB %s, exiting...' % self.dbName )
@@ -88,6 +96,7 @@ class DB( MySQL ):
     #self.log.info("Password:       "+self.dbPass)
     self.log.info( "DBName:         " + self.dbName )
     self.log.info( "MaxQueue:       " + str( self.maxQueueSize ) )
+    self.log.info( "MinQueue:       " + str( self.minQueueSize ) )
     self.log.info( "==================================================" )
 
 #############################################################################
@@ -30,6 +30,8 @@ class ExecutorModule( object ):
                                                        *exeName.split( "/" ) )
     cls.__defaults[ 'ReconnectRetries' ] = 10
     cls.__defaults[ 'ReconnectSleep' ] = 5
+    #Tasks the mind can send in a single message
+    cls.__defaults[ 'BatchSize' ] = 1
     cls.__properties[ 'shifterProxy' ] = ''
     cls.__properties[ 'shifterProxyLocation' ] = os.path.join( cls.__defaults[ 'WorkDirectory' ],
                                                                '.shifterCred' )
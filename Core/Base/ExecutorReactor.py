@@ -46,6 +46,7 @@ class ExecutorReactor( object ):
       self.__mindName = mindName
       self.__modules = {}
       self.__maxTasks = 1
+      self.__batchSize = 1
       self.__reconnectSleep = 1
       self.__reconnectRetries = 10
       self.__extraArgs = {}
@@ -59,6 +60,7 @@ class ExecutorReactor( object ):
     def addModule( self, name, exeClass ):
       self.__modules[ name ] = exeClass
       self.__maxTasks = max( self.__maxTasks, exeClass.ex_getOption( "MaxTasks" ) )
+      self.__batchSize = max( self.__batchSize, exeClass.ex_getOption( "BatchSize" ) )
       self.__reconnectSleep = max( self.__reconnectSleep, exeClass.ex_getOption( "ReconnectSleep" ) )
       self.__reconnectRetries = max( self.__reconnectRetries, exeClass.ex_getOption( "ReconnectRetries" ) )
       self.__extraArgs[ name ] = exeClass.ex_getExtraArguments()
@@ -66,9 +68,11 @@ class ExecutorReactor( object ):
     def connect( self ):
       self.__msgClient = MessageClient( self.__mindName )
       self.__msgClient.subscribeToMessage( 'ProcessTask', self.__processTask )
+      self.__msgClient.subscribeToMessage( 'ProcessTasks', self.__processTasks )
       self.__msgClient.subscribeToDisconnect( self.__disconnected )
       result = self.__msgClient.connect( executorTypes = list( self.__modules.keys() ),
                                          maxTasks = self.__maxTasks,
+                                         batchSize = self.__batchSize,
                                          extraArgs = self.__extraArgs )
       if result[ 'OK' ]:
         self.__aliveLock.alive()
@@ -81,6 +85,7 @@ class ExecutorReactor( object ):
         gLogger.notice( "Trying to reconnect to %s" % self.__mindName )
         result = self.__msgClient.connect( executorTypes = list( self.__modules.keys() ),
                                            maxTasks = self.__maxTasks,
+                                           batchSize = self.__batchSize,
                                            extraArgs = self.__extraArgs )
 
         if result[ 'OK' ]:
@@ -131,10 +136,25 @@ class ExecutorReactor( object ):
       return self.__msgClient.sendMessage( msgObj )
 
     def __processTask( self, msgObj ):
-      eType = msgObj.eType
-      taskId = msgObj.taskId
-      taskStub = msgObj.taskStub
+      return self.__processOneTask( msgObj.eType, msgObj.taskId, msgObj.taskStub )
 
+    def __processTasks( self, msgObj ):
+      """ Process a batch of tasks. Each result is sent back as soon as the task
+          is done so the mind can go on with it while the rest are processed
+      """
+      eType = msgObj.eType
+      start = time.time()
+      for taskId, taskStub in zip( msgObj.taskIds, msgObj.taskStubs ):
+        result = self.__processOneTask( eType, taskId, taskStub )
+        if not result[ 'OK' ]:
+          #The mind requeues the rest of the batch when the executor disconnects
+          gLogger.error( "Could not send back task %s: %s" % ( taskId, result[ 'Message' ] ) )
+          return result
+      gLogger.verbose( "Processed %s %s tasks in %.2f secs" % ( len( msgObj.taskIds ), eType,
+                                                                time.time() - start ) )
+      return S_OK()
+
+    def __processOneTask( self, eType, taskId, taskStub ):
       result = self.__moduleProcess( eType, taskId, taskStub )
       if not result[ 'OK' ]:
         return self.__sendExecutorError( eType, taskId, result[ 'Message' ] )
@@ -2,6 +2,7 @@
 __RCSID__ = "$Id$"
 
 from DIRAC.Core.DISET.private.InnerRPCClient import InnerRPCClient
+from DIRAC.Core.Utilities.ReturnValues import S_OK
 
 class _MagicMethod:
 
@@ -41,6 +42,51 @@ class RPCClient:
       return getattr( self.__innerRPCClient, attrName )
     return _MagicMethod( self.__doRPC, attrName )
 
+class RPCBatch:
+  """
+  Queue calls to a service and execute all of them in one round trip
+
+    batch = RPCBatch( "WorkloadManagement/JobStateUpdate" )
+    batch.setJobStatus( 1, "Running", "", "JobAgent" )
+    batch.setJobStatus( 2, "Running", "", "JobAgent" )
+    result = batch.execute()
+
+  result[ 'Value' ] has the S_OK/S_ERROR of each call in the order they were queued
+  """
+
+  def __init__( self, *args, **kwargs ):
+    """
+    Constructor. Takes the same arguments as RPCClient
+    """
+    self.__innerRPCClient = InnerRPCClient( *args, **kwargs )
+    self.__calls = []
+
+  def __queueCall( self, sFunctionName, args ):
+    """
+    Queue the call and return its position in the batch
+    """
+    self.__calls.append( ( sFunctionName, args ) )
+    return S_OK( len( self.__calls ) - 1 )
+
+  def __getattr__( self, attrName ):
+    """
+    Function for emulating the existance of functions
+    """
+    if attrName.find( "__" ) == 0:
+      raise AttributeError( attrName )
+    return _MagicMethod( self.__queueCall, attrName )
+
+  def __len__( self ):
+    return len( self.__calls )
+
+  def execute( self ):
+    """
+    Execute the queued calls and empty the queue
+    """
+    calls = self.__calls
+    self.__calls = []
+    return self.__innerRPCClient.executeRPCBatch( calls )
+
 def executeRPCStub( rpcStub ):
   """
   Playback a stub
@@ -218,7 +218,29 @@ class RequestHandler( object ):
     self.__logRemoteQuery( "RPC/%s" % method, args )
     return self.__RPCCallFunction( method, args )
 
-  def __RPCCallFunction( self, method, args ):
+  def _rh_executeBatchedRPC( self, method, args ):
+    """
+    Execute one call of an RPC batch. The result is returned instead of sent, the
+    service sends the results of all the calls together
+
+    @type method: string
+    @param method: Method to execute
+    @type args: tuple
+    @param args: Arguments for the method
+    @return: S_OK/S_ERROR
+    """
+    startTime = time.time()
+    self.serviceInfoDict[ 'actionTuple' ] = ( 'RPC', method )
+    self.__logRemoteQuery( "RPC/%s" % method, args )
+    retVal = self.__RPCCallFunction( method, args, idleRead = False )
+    if not isReturnStructure( retVal ):
+      message = "Method %s for action RPC does not have a return value!" % method
+      gLogger.error( message )
+      retVal = S_ERROR( message )
+    self.__logRemoteQueryResponse( retVal, time.time() - startTime )
+    return retVal
+
+  def __RPCCallFunction( self, method, args, idleRead = True ):
     realMethod = "export_%s" % method
     gLogger.debug( "RPC to %s" % realMethod )
     try:
@@ -229,16 +251,18 @@ class RequestHandler( object ):
     if not dRetVal[ 'OK' ]:
       return dRetVal
     self.__lockManager.lock( method )
-    self.__msgBroker.addTransportId( self.__trid,
-                                     self.serviceInfoDict[ 'serviceName' ],
-                                     idleRead = True )
+    if idleRead:
+      self.__msgBroker.addTransportId( self.__trid,
+                                       self.serviceInfoDict[ 'serviceName' ],
+                                       idleRead = True )
     try:
       try:
         uReturnValue = oMethod( *args )
         return uReturnValue
       finally:
         self.__lockManager.unlock( method )
-        self.__msgBroker.removeTransport( self.__trid, closeTransport = False )
+        if idleRead:
+          self.__msgBroker.removeTransport( self.__trid, closeTransport = False )
     except Exception, v:
       gLogger.exception( "Uncaught exception when serving RPC", "Function %s" % method )
       return S_ERROR( "Server error while serving %s: %s" % ( method, str( v ) ) )
@@ -1,8 +1,11 @@
 
+import os
 import types
 import select
+import signal
 import time
 import socket
+import Queue
 
 try:
   import multiprocessing
@@ -14,6 +17,8 @@ from DIRAC.Core.DISET.private.Service import Service
 from DIRAC.Core.DISET.private.GatewayService import GatewayService
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
 from DIRAC.Core.Utilities import Network, Time
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
+from DIRAC.FrameworkSystem.Client.MonitoringClient import MonitoringClient
 from DIRAC.Core.Base.private.ModuleLoader import ModuleLoader
 from DIRAC.Core.DISET.private.Protocols import gProtocolDict
 from DIRAC.ConfigurationSystem.Client.Helpers import Registry
@@ -22,6 +27,7 @@ from DIRAC.ConfigurationSystem.Client import PathFinder
 class ServiceReactor:
 
   __transportExtraKeywords = { 'SSLSessionTimeout' : False, 
+                               'SSLSessionCacheSize' : False,
                                'IgnoreCRLs': False, 
                                'PacketTimeout': 'timeout' }
 
@@ -35,6 +41,10 @@ class ServiceReactor:
     self.__maxFD = 0
     self.__listeningConnections = {}
     self.__stats = ReactorStats()
+    self.__numClones = 1
+    self.__cloneId = 0
+    self.__statsQueue = False
+    self.__lastStatsReport = 0
 
   def initialize( self, servicesList ):
     try:
@@ -52,6 +62,18 @@ class ServiceReactor:
     for serviceName in self.__serviceModules:
       self.__services[ serviceName ] = Service( self.__serviceModules[ serviceName ] )
 
+    self.__numClones = max( [ self.__services[ svcName ].getConfig().getCloneProcesses()
+                              for svcName in self.__services ] )
+    if self.__numClones > 1:
+      result = self.__checkClonesSupport()
+      if result[ 'OK' ]:
+        #Services are initialized in each clone process after forking
+        return S_OK()
+      gLogger.error( "Cannot start clone processes. Running only one process", result[ 'Message' ] )
+      self.__numClones = 1
+    return self.__initializeServices()
+
+  def __initializeServices( self ):
     #Loop again to include the GW in case there is one (included in the __init__)
     for serviceName in self.__services:
       gLogger.info( "Initializing %s" % serviceName )
@@ -60,6 +82,15 @@ class ServiceReactor:
         return result
     return S_OK()
 
+  def __checkClonesSupport( self ):
+    if not multiprocessing:
+      return S_ERROR( "multiprocessing module is not available" )
+    testSocket = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+    try:
+      return Network.setReusePort( testSocket )
+    finally:
+      testSocket.close()
+
   def closeListeningConnections( self ):
     gLogger.info( "Closing listening connections..." )
     for svcName in self.__listeningConnections:
@@ -71,7 +102,7 @@ class ServiceReactor:
         del( self.__listeningConnections[ svcName ][ 'transport' ] )
     gLogger.info( "Connections closed" )
 
-  def __createListeners( self ):
+  def __createListeners( self, reusePort = False ):
     for serviceName in self.__services:
       svcCfg = self.__services[ serviceName ].getConfig()
       protocol = svcCfg.getProtocol()
@@ -91,6 +122,8 @@ class ServiceReactor:
           if kw == 'timeout':
             value = int( value )
           transportArgs[ kw ] = value
+      if reusePort:
+        transportArgs[ 'reusePort' ] = True
       gLogger.verbose( "Initializing %s transport" % protocol, svcCfg.getURL() )
       transport = gProtocolDict[ protocol ][ 'transport' ]( ( "", port ),
                                                             bServerMode = True, **transportArgs )
@@ -102,29 +135,243 @@ class ServiceReactor:
     return S_OK()
 
   def serve( self ):
+    if self.__numClones > 1:
+      return self.__serveWithClones()
     result = self.__createListeners()
     if not result[ 'OK' ]:
       self.__closeListeningConnections()
       return result
     for svcName in self.__listeningConnections:
       gLogger.always( "Listening at %s" % self.__services[ svcName ].getConfig().getURL() )
-    #Multiple clones not yet working. Disabled by default
-    if False and multiprocessing:
-      for svcName in self.__listeningConnections:
-        clones = self.__services[ svcName ].getConfig().getCloneProcesses()
-        for i in range( 1, clones ):
-          p = multiprocessing.Process( target = self.__startCloneProcess, args = ( svcName, i ) )
-          p.start()
-          gLogger.always( "Started clone process %s for %s" % ( i, svcName ) )
     while self.__alive:
       self.__acceptIncomingConnection()
 
-  #This function runs in a different process
-  def __startCloneProcess( self, svcName, i ):
-    self.__services[ svcName ].setCloneProcessId( i )
-    self.__alive = i
+  #Clone processes
+
+  def __serveWithClones( self ):
+    """
+    Fork one process per clone. Each of them initializes the services and listens
+    on the same ports (SO_REUSEPORT). This process only looks after them:
+    restarts dead clones, aggregates their monitoring and on SIGHUP replaces
+    them with new ones without closing the ports. SIGTERM and SIGINT stop everything
+    """
+    self.__statsQueue = multiprocessing.Queue()
+    self.__clones = {}
+    self.__retiringClones = []
+    self.__replacedClones = []
+    self.__restartRequested = False
+    self.__retireTime = 0
+    self.__cloneStats = {}
+    self.__initClonesMonitoring()
+    signal.signal( signal.SIGTERM, self.__stopSignal )
+    signal.signal( signal.SIGINT, self.__stopSignal )
+    signal.signal( signal.SIGHUP, self.__restartSignal )
+    for cloneId in range( 1, self.__numClones + 1 ):
+      self.__startClone( cloneId )
+    while self.__alive:
+      self.__collectClonesStats( 1 )
+      if self.__restartRequested:
+        self.__restartRequested = False
+        self.__restartClones()
+      self.__checkClones()
+    gLogger.always( "Stopping clone processes" )
+    self.__retiringClones.extend( [ self.__clones[ cloneId ][ 'process' ] for cloneId in self.__clones ] )
+    self.__retiringClones.extend( self.__replacedClones )
+    self.__clones = {}
+    self.__replacedClones = []
+    self.__stopRetiringClones( wait = True )
+    return S_OK()
+
+  def __stopSignal( self, sigNum, frame ):
+    self.__alive = False
+
+  def __restartSignal( self, sigNum, frame ):
+    self.__restartRequested = True
+
+  def __getCloneStopTimeout( self ):
+    return max( [ self.__services[ svcName ].getConfig().getCloneStopTimeout()
+                  for svcName in self.__services ] )
+
+  def __startClone( self, cloneId ):
+    process = multiprocessing.Process( target = self.__runClone, args = ( cloneId, ) )
+    process.daemon = False
+    process.start()
+    #The clone is ready once its first stats message arrives, it is sent when it listens
+    self.__clones[ cloneId ] = { 'process' : process, 'startTime' : time.time(), 'ready' : False }
+    gLogger.always( "Started clone process %s (pid %s)" % ( cloneId, process.pid ) )
+
+  def __restartClones( self ):
+    gLogger.always( "Restarting clone processes" )
+    #The old clones are only stopped once the new ones listen so no connection is refused
+    for cloneId in self.__clones:
+      self.__replacedClones.append( self.__clones[ cloneId ][ 'process' ] )
+    for cloneId in range( 1, self.__numClones + 1 ):
+      self.__startClone( cloneId )
+
+  def __retireReplacedClones( self ):
+    if not self.__replacedClones:
+      return
+    if [ cloneId for cloneId in self.__clones if not self.__clones[ cloneId ][ 'ready' ] ]:
+      return
+    gLogger.always( "New clone processes are ready. Stopping the old ones" )
+    for process in self.__replacedClones:
+      self.__stopClone( process )
+    self.__retiringClones.extend( self.__replacedClones )
+    self.__replacedClones = []
+    self.__retireTime = time.time()
+
+  def __stopClone( self, process ):
+    try:
+      os.kill( process.pid, signal.SIGTERM )
+    except OSError:
+      pass
+
+  def __stopRetiringClones( self, wait = False ):
+    if wait:
+      for process in self.__retiringClones:
+        self.__stopClone( process )
+      self.__retireTime = time.time()
+      while self.__retiringClones and time.time() - self.__retireTime < self.__getCloneStopTimeout():
+        self.__collectClonesStats( 0.5 )
+        self.__retiringClones = [ process for process in self.__retiringClones if process.is_alive() ]
+    else:
+      self.__retiringClones = [ process for process in self.__retiringClones if process.is_alive() ]
+      if not self.__retiringClones or time.time() - self.__retireTime < self.__getCloneStopTimeout():
+        return
+    for process in self.__retiringClones:
+      gLogger.warn( "Clone process %s did not stop in time. Killing it" % process.pid )
+      try:
+        os.kill( process.pid, signal.SIGKILL )
+      except OSError:
+        pass
+      process.join( 1 )
+    self.__retiringClones = []
+
+  def __checkClones( self ):
+    self.__retireReplacedClones()
+    if self.__retiringClones:
+      self.__stopRetiringClones()
+    now = time.time()
+    for cloneId in self.__clones:
+      cloneData = self.__clones[ cloneId ]
+      if cloneData[ 'process' ].is_alive():
+        continue
+      #Clones dying just after starting are restarted at most every 5 secs
+      if now - cloneData[ 'startTime' ] < 5:
+        continue
+      gLogger.error( "Clone process %s died (exit code %s). Restarting it" % ( cloneId,
+                                                                             cloneData[ 'process' ].exitcode ) )
+      for monitor in self.__clonesMonitors.values():
+        monitor.addMark( 'CloneRestarts' )
+      self.__startClone( cloneId )
+    for monitor in self.__clonesMonitors.values():
+      monitor.addMark( 'Clones', len( [ cloneId for cloneId in self.__clones
+                                        if self.__clones[ cloneId ][ 'process' ].is_alive() ] ) )
+
+  def __initClonesMonitoring( self ):
+    self.__clonesMonitors = {}
+    for svcName in self.__services:
+      monitor = MonitoringClient()
+      monitor.setComponentType( MonitoringClient.COMPONENT_SERVICE )
+      monitor.setComponentName( svcName )
+      monitor.setComponentLocation( self.__services[ svcName ].getConfig().getURL() )
+      monitor.initialize()
+      monitor.registerActivity( "Clones", "Running clone processes", "Framework", "processes", MonitoringClient.OP_MEAN )
+      monitor.registerActivity( "CloneRestarts", "Clone processes restarted", "Framework", "processes", MonitoringClient.OP_SUM )
+      monitor.registerActivity( "Connections", "Connections received", "Framework", "connections", MonitoringClient.OP_RATE )
+      monitor.registerActivity( "Queries", "Queries served", "Framework", "queries", MonitoringClient.OP_RATE )
+      monitor.registerActivity( 'PendingQueries', "Pending queries", 'Framework', 'queries', MonitoringClient.OP_MEAN )
+      monitor.registerActivity( 'ActiveQueries', "Active queries", 'Framework', 'threads', MonitoringClient.OP_MEAN )
+      self.__clonesMonitors[ svcName ] = monitor
+
+  def __collectClonesStats( self, timeout ):
+    """
+    Clones send ( cloneId, pid, { svcName : statsDict } ). Counters are sent as totals
+    and reported as increments, the thread pool status is added up
+    """
+    try:
+      cloneId, pid, statsDict = self.__statsQueue.get( timeout = timeout )
+    except Queue.Empty:
+      return
+    except ( IOError, OSError ):
+      #Interrupted by a signal
+      return
+    #Old and new clones share the id while restarting, the pid tells them apart
+    if cloneId in self.__clones and self.__clones[ cloneId ][ 'process' ].pid == pid:
+      self.__clones[ cloneId ][ 'ready' ] = True
+    for svcName in statsDict:
+      if svcName not in self.__clonesMonitors:
+        continue
+      monitor = self.__clonesMonitors[ svcName ]
+      svcStats = statsDict[ svcName ]
+      prevStats = self.__cloneStats.get( ( cloneId, svcName ), {} )
+      for key, activity in ( ( 'connections', 'Connections' ), ( 'queries', 'Queries' ) ):
+        increment = svcStats[ key ] - prevStats.get( key, 0 )
+        #A restarted clone starts counting from 0
+        if increment < 0:
+          increment = svcStats[ key ]
+        if increment:
+          monitor.addMark( activity, increment )
+      self.__cloneStats[ ( cloneId, svcName ) ] = svcStats
+      for key, activity in ( ( 'activeQueries', 'ActiveQueries' ), ( 'pendingQueries', 'PendingQueries' ) ):
+        monitor.addMark( activity, sum( [ self.__cloneStats[ statsKey ][ key ] for statsKey in self.__cloneStats
+                                          if statsKey[1] == svcName ] ) )
+
+  #This function runs in the clone process
+  def __runClone( self, cloneId ):
+    self.__cloneId = cloneId
+    self.__alive = True
+    signal.signal( signal.SIGTERM, self.__stopSignal )
+    signal.signal( signal.SIGINT, self.__stopSignal )
+    signal.signal( signal.SIGHUP, signal.SIG_IGN )
+    gThreadScheduler.resetAfterFork()
+    result = self.__initializeServices()
+    if not result[ 'OK' ]:
+      gLogger.fatal( "Clone %s cannot initialize services" % cloneId, result[ 'Message' ] )
+      os._exit( 1 )
+    for svcName in self.__services:
+      self.__services[ svcName ].setCloneProcessId( cloneId )
+    result = self.__createListeners( reusePort = True )
+    if not result[ 'OK' ]:
+      gLogger.fatal( "Clone %s cannot listen" % cloneId, result[ 'Message' ] )
+      self.__closeListeningConnections()
+      os._exit( 1 )
+    for svcName in self.__listeningConnections:
+      gLogger.always( "Clone %s listening at %s" % ( cloneId, self.__services[ svcName ].getConfig().getURL() ) )
+    #Tell the main process this clone is ready
+    self.__reportCloneStats( force = True )
     while self.__alive:
-      self.__acceptIncomingConnection( svcName )
+      self.__acceptIncomingConnection()
+      self.__reportCloneStats()
+    #Stop accepting connections and let the running queries finish
+    self.closeListeningConnections()
+    stopTimeout = self.__getCloneStopTimeout()
+    start = time.time()
+    while time.time() - start < stopTimeout:
+      if not [ svcName for svcName in self.__services if not self.__services[ svcName ].isIdle() ]:
+        break
+      time.sleep( 0.5 )
+    self.__reportCloneStats( force = True )
+    #Make sure the stats reach the main process before exiting
+    self.__statsQueue.close()
+    self.__statsQueue.join_thread()
+    gLogger.always( "Clone process %s stopped" % cloneId )
+    os._exit( 0 )
+
+  def __reportCloneStats( self, force = False ):
+    if not self.__cloneId:
+      return
+    now = time.time()
+    if not force and now - self.__lastStatsReport < 30:
+      return
+    self.__lastStatsReport = now
+    statsDict = {}
+    for svcName in self.__services:
+      statsDict[ svcName ] = self.__services[ svcName ].getStats()
+    try:
+      self.__statsQueue.put( ( self.__cloneId, os.getpid(), statsDict ) )
+    except Exception, e:
+      gLogger.warn( "Cannot send stats to the main process", str( e ) )
 
   def __getListeningSocketsList( self, svcName = False ):
     if svcName:
@@ -138,6 +385,7 @@ class ServiceReactor:
   def __acceptIncomingConnection( self, svcName = False ):
     sockets = self.__getListeningSocketsList( svcName )
     while self.__alive:
+      self.__reportCloneStats()
       try:
         inList, outList, exList = select.select( sockets, [], [], 10 )
         if len( inList ) == 0:
@@ -150,7 +398,8 @@ class ServiceReactor:
                 gLogger.warn( "Error while accepting a connection: ", retVal[ 'Message' ] )
                 return
               clientTransport = retVal[ 'Value' ]
-      except socket.error:
+      except ( socket.error, select.error ):
+        #select is interrupted by signals
         return
       self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
       #Is it banned?
@@ -40,7 +40,7 @@ class TransferClient( BaseClient ):
       self._disconnect( trid )
       return S_ERROR( "Cound not request transfer: %s" % str( e ) )
 
-  def sendFile( self, filename, fileId, token = "" ):
+  def sendFile( self, filename, fileId, token = "", fileSize = False ):
     """
     Send a file to server
 
@@ -50,6 +50,8 @@ class TransferClient( BaseClient ):
     @param fileId : Identification of the file being sent
     @type token : string
     @param token : Optional token for the file
+    @type fileSize : integer
+    @param fileSize : Bytes that will be sent, needed when sending from a file descriptor
     @return : S_OK/S_ERROR
     """
     fileHelper = FileHelper()
@@ -57,7 +59,9 @@ class TransferClient( BaseClient ):
     if not retVal[ 'OK' ]:
       return retVal
     fd = retVal[ 'Value' ]
-    retVal = self._sendTransferHeader( "FromClient", ( fileId, token, File.getSize( filename ) ) )
+    if fileSize is False:
+      fileSize = File.getSize( filename )
+    retVal = self._sendTransferHeader( "FromClient", ( fileId, token, fileSize ) )
     if not retVal[ 'OK' ]:
       return retVal
     trid, transport = retVal[ 'Value' ]
@@ -144,7 +148,8 @@ class TransferClient( BaseClient ):
       retVal = fileHelper.bulkToNetwork( fileList, compress, onthefly )
       if not retVal[ 'OK' ]:
         return retVal
-      retVal = transport.receiveData()      return retVal
+      retVal = transport.receiveData()
+      return retVal
     finally:
       self._disconnect( trid )
 
@@ -1,6 +1,7 @@
 # $HeadURL$
 __RCSID__ = "$Id$"
 
+import time
 import types
 import thread
 import DIRAC
@@ -12,6 +13,7 @@ from DIRAC.ConfigurationSystem.Client.Config import gConfig
 from DIRAC.ConfigurationSystem.Client.PathFinder import getServiceURL
 from DIRAC.Core.Security import CS
 from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
+from DIRAC.Core.DISET.private.ConnectionPool import getGlobalConnectionPool
 from DIRAC.Core.DISET.ThreadConfig import ThreadConfig
 
 class BaseClient:
@@ -31,6 +33,8 @@ class BaseClient:
   KW_PROXY_CHAIN = "proxyChain"
   KW_SKIP_CA_CHECK = "skipCACheck"
   KW_KEEP_ALIVE_LAPSE = "keepAliveLapse"
+  KW_COMPRESSION_THRESHOLD = "compressionThreshold"
+  KW_PERSISTENT_CONNECTION = "persistentConnection"
 
   __threadConfig = ThreadConfig()
 
@@ -45,10 +49,14 @@ class BaseClient:
     self.__idDict = {}
     self.__extraCredentials = ""
     self.__enableThreadCheck = False
+    #transport -> secs the server keeps the connection open waiting for another action
+    self.__keepAliveTransports = {}
     for initFunc in ( self.__discoverSetup, self.__discoverVO, self.__discoverTimeout,
                       self.__discoverURL, self.__discoverCredentialsToUse,
                       self.__checkTransportSanity,
-                      self.__setKeepAliveLapse ):
+                      self.__setKeepAliveLapse,
+                      self.__discoverCompression,
+                      self.__discoverPersistence ):
       result = initFunc()
       if not result[ 'OK' ] and self.__initStatus[ 'OK' ]:
         self.__initStatus = result
@@ -213,30 +221,65 @@ and this is thread %s
       #raise Exception( msgTxt )
 
 
-  def _connect( self ):
+  def __getConnectionKey( self ):
+    #Connections can only be shared by clients that would authenticate in the same way
+    credentials = []
+    for kw in ( self.KW_USE_CERTIFICATES, self.KW_PROXY_LOCATION, self.KW_PROXY_STRING,
+                self.KW_DELEGATED_DN, self.KW_DELEGATED_GROUP, self.KW_SKIP_CA_CHECK ):
+      credentials.append( str( self.kwargs.get( kw, "" ) ) )
+    return ( self.serviceURL, tuple( credentials ), str( self.__extraCredentials ), self.setup, self.vo )
+
+  def _connect( self, allowReuse = True ):
     self.__discoverExtraCredentials()
     if not self.__initStatus[ 'OK' ]:
       return self.__initStatus
     if self.__enableThreadCheck:
       self.__checkThreadID()
+    if allowReuse and self.__persistentConnection:
+      trid = getGlobalConnectionPool().get( self.__getConnectionKey() )
+      if trid:
+        transport = getGlobalTransportPool().get( trid )
+        if transport:
+          gLogger.debug( "Reusing connection to: %s" % self.serviceURL )
+          result = S_OK( ( trid, transport ) )
+          result[ 'reused' ] = True
+          return result
     gLogger.debug( "Connecting to: %s" % self.serviceURL )
     try:
+      startTime = time.time()
       transport = gProtocolDict[ self.__URLTuple[0] ][ 'transport' ]( self.__URLTuple[1:3], **self.kwargs )
       retVal = transport.initAsClient()
       if not retVal[ 'OK' ]:
         return S_ERROR( "Can't connect to %s: %s" % ( self.serviceURL, retVal ) )
     except Exception, e:
       return S_ERROR( "Can't connect to %s: %s" % ( self.serviceURL, e ) )
+    handshakeInfo = transport.getHandshakeInfo()
+    getGlobalConnectionPool().recordHandshake( handshakeInfo.get( 'time', time.time() - startTime ),
+                                               handshakeInfo.get( 'reused', False ) )
     trid = getGlobalTransportPool().add( transport )
     return S_OK( ( trid, transport ) )
 
-  def _disconnect( self, trid ):
-    getGlobalTransportPool().close( trid )
+  def _disconnect( self, trid, reusable = False ):
+    """
+    Close the connection or, if the server agreed and the caller says the
+    exchange finished cleanly, keep it for the next action
+    """
+    keepAliveTime = self.__keepAliveTransports.pop( getGlobalTransportPool().get( trid ), 0 )
+    if reusable and keepAliveTime:
+      getGlobalConnectionPool().put( self.__getConnectionKey(), trid, keepAliveTime )
+    else:
+      getGlobalTransportPool().close( trid )
 
   def _proposeAction( self, transport, action ):
     if not self.__initStatus[ 'OK' ]:
       return self.__initStatus
-    stConnectionInfo = ( ( self.__URLTuple[3], self.setup, self.vo ),
+    #Servers that don't know about the capabilities just ignore them
+    capabilities = {}
+    if self.__compressionThreshold and action[0] == "RPC":
+      capabilities[ 'compression' ] = 'zlib'
+    if self.__persistentConnection and action[0] == "RPC":
+      capabilities[ 'keepAlive' ] = True
+    stConnectionInfo = ( ( self.__URLTuple[3], self.setup, self.vo, capabilities ),
                          action,
                          self.__extraCredentials )
     retVal = transport.sendData( S_OK( stConnectionInfo ) )
@@ -250,6 +293,14 @@ and this is thread %s
       if 'delegate' in serverRequirements:
         gLogger.debug( "A delegation is requested" )
         serverReturn = self.__delegateCredentials( transport, serverRequirements[ 'delegate' ] )
+    if serverReturn[ 'OK' ]:
+      #Capabilities are agreed again for every action, even on reused connections
+      if serverReturn.get( 'compression' ) == 'zlib':
+        transport.setCompression( self.__compressionThreshold )
+      else:
+        transport.setCompression( 0 )
+      if serverReturn.get( 'keepAlive' ):
+        self.__keepAliveTransports[ transport ] = serverReturn[ 'keepAlive' ]
     return serverReturn
 
   def __delegateCredentials( self, transport, delegationRequest ):
@@ -284,6 +335,26 @@ and this is thread %s
     self.kwargs[ self.KW_KEEP_ALIVE_LAPSE ] = kaa
     return S_OK()
 
+  def __discoverCompression( self ):
+    #Compress payloads bigger than this if the server agrees. 0 disables it
+    if self.KW_COMPRESSION_THRESHOLD in self.kwargs:
+      threshold = self.kwargs[ self.KW_COMPRESSION_THRESHOLD ]
+    else:
+      threshold = gConfig.getValue( "/DIRAC/CompressionThreshold", 65536 )
+    try:
+      self.__compressionThreshold = max( 0, int( threshold ) )
+    except:
+      self.__compressionThreshold = 0
+    return S_OK()
+
+  def __discoverPersistence( self ):
+    #Keep RPC connections open for later calls if the server allows it
+    if self.KW_PERSISTENT_CONNECTION in self.kwargs:
+      self.__persistentConnection = bool( self.kwargs[ self.KW_PERSISTENT_CONNECTION ] )
+    else:
+      self.__persistentConnection = gConfig.getValue( "/DIRAC/PersistentConnections", True )
+    return S_OK()
+
   def _getBaseStub( self ):
     newKwargs = dict( self.kwargs )
     #Set DN
@@ -0,0 +1,151 @@
+# $HeadURL$
+__RCSID__ = "$Id$"
+
+import time
+import select
+import threading
+from DIRAC import gLogger, S_OK
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
+from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
+from DIRAC.Core.DISET.private.Transports.SSL.SessionManager import gSessionManager
+
+class ConnectionPool:
+  """
+  Authenticated RPC connections kept open between calls. Connections are grouped
+  by a key made of the URL, the credentials and the setup so they are only reused
+  by clients that would have opened an identical connection. The transports stay
+  in the global TransportPool while idle so they get its keep alives.
+  """
+
+  def __init__( self, maxIdlePerKey = 4, expirationMargin = 2 ):
+    self.__maxIdlePerKey = maxIdlePerKey
+    self.__expirationMargin = expirationMargin
+    self.__lock = threading.Lock()
+    #key -> [ ( trid, expirationTime ) ]
+    self.__idle = {}
+    self.__stats = { 'hits' : 0, 'misses' : 0, 'discarded' : 0,
+                     'handshakes' : 0, 'handshakeTime' : 0.0,
+                     'resumedHandshakes' : 0, 'resumedHandshakeTime' : 0.0 }
+    result = gThreadScheduler.addPeriodicTask( 30, self.__purgeExpired )
+    if not result[ 'OK' ]:
+      gLogger.error( "Cannot add connection purging task to thread scheduler", result[ 'Message' ] )
+
+  def __isHealthy( self, trid ):
+    transport = getGlobalTransportPool().get( trid )
+    if not transport:
+      return False
+    try:
+      #An idle connection should have nothing to read but keep alive responses
+      readable = select.select( [ transport.getSocket() ], [], [], 0 )[0]
+      if not readable:
+        return True
+      result = transport.receiveData( blockAfterKeepAlive = False )
+      return result[ 'OK' ] and result.get( 'keepAlive', False )
+    except Exception:
+      return False
+
+  def get( self, key ):
+    """
+    Get an idle connection for key. Returns the transport id or False
+    """
+    now = time.time()
+    while True:
+      self.__lock.acquire()
+      try:
+        idleList = self.__idle.get( key, [] )
+        if not idleList:
+          self.__stats[ 'misses' ] += 1
+          return False
+        trid, expirationTime = idleList.pop()
+      finally:
+        self.__lock.release()
+      if expirationTime > now and self.__isHealthy( trid ):
+        self.__lock.acquire()
+        try:
+          self.__stats[ 'hits' ] += 1
+        finally:
+          self.__lock.release()
+        return trid
+      self.__discard( trid )
+
+  def put( self, key, trid, keepAliveTime ):
+    """
+    Return a connection to the pool. The server closes it after keepAliveTime
+    secs of inactivity so it's considered expired a bit before that
+    """
+    expirationTime = time.time() + keepAliveTime - self.__expirationMargin
+    self.__lock.acquire()
+    try:
+      idleList = self.__idle.setdefault( key, [] )
+      if keepAliveTime > self.__expirationMargin and len( idleList ) < self.__maxIdlePerKey:
+        idleList.append( ( trid, expirationTime ) )
+        return
+    finally:
+      self.__lock.release()
+    self.__discard( trid )
+
+  def recordHandshake( self, handshakeTime, resumed = False ):
+    self.__lock.acquire()
+    try:
+      if resumed:
+        self.__stats[ 'resumedHandshakes' ] += 1
+        self.__stats[ 'resumedHandshakeTime' ] += handshakeTime
+      else:
+        self.__stats[ 'handshakes' ] += 1
+        self.__stats[ 'handshakeTime' ] += handshakeTime
+    finally:
+      self.__lock.release()
+
+  def getStats( self ):
+    """
+    Hits, misses, discarded connections, number of full and resumed SSL handshakes
+    and total secs spent in them. Includes the SSL session cache stats
+    """
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'idle' ] = sum( [ len( idleList ) for idleList in self.__idle.values() ] )
+    finally:
+      self.__lock.release()
+    for key, value in gSessionManager.getStats().items():
+      stats[ 'session%s' % key.capitalize() ] = value
+    return S_OK( stats )
+
+  def __discard( self, trid ):
+    """ Close a connection. Must be called without holding the lock
+    """
+    self.__lock.acquire()
+    try:
+      self.__stats[ 'discarded' ] += 1
+    finally:
+      self.__lock.release()
+    getGlobalTransportPool().close( trid )
+
+  def __purgeExpired( self ):
+    now = time.time()
+    expired = []
+    self.__lock.acquire()
+    try:
+      for key in self.__idle.keys():
+        alive = []
+        for trid, expirationTime in self.__idle[ key ]:
+          if expirationTime > now:
+            alive.append( ( trid, expirationTime ) )
+          else:
+            expired.append( trid )
+        if alive:
+          self.__idle[ key ] = alive
+        else:
+          del( self.__idle[ key ] )
+    finally:
+      self.__lock.release()
+    for trid in expired:
+      self.__discard( trid )
+
+gConnectionPool = False
+
+def getGlobalConnectionPool():
+  global gConnectionPool
+  if not gConnectionPool:
+    gConnectionPool = ConnectionPool()
+  return gConnectionPool
@@ -0,0 +1,255 @@
+# $HeadURL$
+__RCSID__ = "$Id$"
+
+import os
+import time
+import select
+import threading
+from DIRAC import gLogger, S_OK
+
+class _Poller:
+  """
+  Wait for readable file descriptors using the best mechanism available:
+  epoll, then poll and select as last resort
+  """
+
+  def __init__( self ):
+    if hasattr( select, 'epoll' ):
+      self.mechanism = 'epoll'
+      self.__poller = select.epoll()
+      self.__readMask = select.EPOLLIN | select.EPOLLPRI | select.EPOLLERR | select.EPOLLHUP
+    elif hasattr( select, 'poll' ):
+      self.mechanism = 'poll'
+      self.__poller = select.poll()
+      self.__readMask = select.POLLIN | select.POLLPRI | select.POLLERR | select.POLLHUP
+    else:
+      self.mechanism = 'select'
+      self.__poller = False
+    self.__fds = set()
+
+  def register( self, fd ):
+    if self.__poller:
+      if fd in self.__fds:
+        self.__poller.modify( fd, self.__readMask )
+      else:
+        self.__poller.register( fd, self.__readMask )
+    self.__fds.add( fd )
+
+  def unregister( self, fd ):
+    if fd not in self.__fds:
+      return
+    self.__fds.discard( fd )
+    if self.__poller:
+      try:
+        self.__poller.unregister( fd )
+      except Exception:
+        pass
+
+  def poll( self, timeout ):
+    """
+    Returns the list of file descriptors ready to be read. Timeout in secs
+    """
+    try:
+      if self.mechanism == 'epoll':
+        return [ fd for fd, dummy in self.__poller.poll( timeout ) ]
+      if self.mechanism == 'poll':
+        return [ fd for fd, dummy in self.__poller.poll( timeout * 1000 ) ]
+      return select.select( list( self.__fds ), [], [], timeout )[0]
+    except ( select.error, IOError, OSError ), e:
+      #Interrupted system call
+      if e.args and e.args[0] == 4:
+        return []
+      raise
+
+class ConnectionReactor:
+  """
+  Wait for data on many connections with a single thread. Connections are only
+  handed to the thread pool when there's something to process, so idle and slow
+  clients don't keep a worker thread busy.
+
+  Connections are watched either until they become readable (for instance to do
+  the SSL handshake) or until a whole message has been buffered. Keep alives
+  are answered directly by the reactor thread.
+  """
+
+  def __init__( self, name, threadPool, pollTimeout = 1 ):
+    self.__name = name
+    self.__threadPool = threadPool
+    self.__pollTimeout = pollTimeout
+    self.__log = gLogger.getSubLogger( "%sReactor" % name )
+    self.__poller = _Poller()
+    self.__lock = threading.Lock()
+    #fd -> watch dict
+    self.__watched = {}
+    #fds with data already buffered in the transport
+    self.__ready = set()
+    self.__stats = { 'dispatched' : 0, 'expired' : 0, 'errors' : 0, 'keepAlives' : 0 }
+    #Self pipe to wake up the reactor when connections are added
+    self.__wakeRead, self.__wakeWrite = os.pipe()
+    self.__poller.register( self.__wakeRead )
+    self.__reactorThread = False
+    self.__log.info( "Using %s to wait for connections" % self.__poller.mechanism )
+
+  def watch( self, transport, callback, args = (), timeout = 30,
+             waitForMessage = True, expireCallback = None ):
+    """
+    Queue callback( *args ) in the thread pool once transport is readable
+    (waitForMessage = False) or has received a complete message. If nothing
+    happens in timeout secs expireCallback is called instead, and if there's
+    none the transport is closed
+    """
+    fd = transport.getSocket().fileno()
+    self.__lock.acquire()
+    try:
+      self.__watched[ fd ] = { 'transport' : transport,
+                               'callback' : callback,
+                               'args' : args,
+                               'expiration' : time.time() + timeout,
+                               'waitForMessage' : waitForMessage,
+                               'expireCallback' : expireCallback }
+      if waitForMessage and transport.hasPendingData():
+        self.__ready.add( fd )
+      else:
+        self.__poller.register( fd )
+      self.__startReactorThread()
+    finally:
+      self.__lock.release()
+    self.__wakeUp()
+    return S_OK()
+
+  def getNumConnections( self ):
+    return len( self.__watched )
+
+  def getStats( self ):
+    stats = dict( self.__stats )
+    stats[ 'watched' ] = len( self.__watched )
+    stats[ 'mechanism' ] = self.__poller.mechanism
+    return stats
+
+  def __wakeUp( self ):
+    try:
+      os.write( self.__wakeWrite, "w" )
+    except OSError:
+      pass
+
+  def __startReactorThread( self ):
+    if self.__reactorThread and self.__reactorThread.isAlive():
+      return
+    self.__reactorThread = threading.Thread( target = self.__reactorLoop )
+    self.__reactorThread.setDaemon( True )
+    self.__reactorThread.start()
+
+  def __reactorLoop( self ):
+    lastExpirationCheck = time.time()
+    while True:
+      self.__lock.acquire()
+      try:
+        readyFDs = list( self.__ready )
+        self.__ready = set()
+      finally:
+        self.__lock.release()
+      if readyFDs:
+        pollTimeout = 0
+      else:
+        pollTimeout = self.__pollTimeout
+      try:
+        polledFDs = self.__poller.poll( pollTimeout )
+      except Exception:
+        self.__log.exception( "Exception while polling connections" )
+        time.sleep( 0.1 )
+        continue
+      for fd in readyFDs:
+        try:
+          self.__processFD( fd, polled = False )
+        except Exception:
+          self.__log.exception( "Exception while processing connection" )
+          self.__dropFD( fd, close = True )
+      for fd in polledFDs:
+        if fd == self.__wakeRead:
+          os.read( self.__wakeRead, 4096 )
+          continue
+        try:
+          self.__processFD( fd )
+        except Exception:
+          self.__log.exception( "Exception while processing connection" )
+          self.__dropFD( fd, close = True )
+      now = time.time()
+      if now - lastExpirationCheck >= self.__pollTimeout:
+        lastExpirationCheck = now
+        self.__expireConnections( now )
+
+  def __dropFD( self, fd, close = False ):
+    self.__lock.acquire()
+    try:
+      self.__ready.discard( fd )
+      self.__poller.unregister( fd )
+      watchDict = self.__watched.pop( fd, False )
+    finally:
+      self.__lock.release()
+    if watchDict and close:
+      self.__stats[ 'errors' ] += 1
+      try:
+        watchDict[ 'transport' ].close()
+      except Exception:
+        pass
+    return watchDict
+
+  def __processFD( self, fd, polled = True ):
+    watchDict = self.__watched.get( fd, False )
+    if not watchDict:
+      self.__poller.unregister( fd )
+      return
+    transport = watchDict[ 'transport' ]
+    if watchDict[ 'waitForMessage' ]:
+      #The socket can only be read without blocking if poll said so
+      if polled:
+        result = transport.readAvailable()
+      else:
+        result = transport.readBuffered()
+      if not result[ 'OK' ]:
+        self.__log.debug( "Dropping connection", result[ 'Message' ] )
+        self.__dropFD( fd, close = True )
+        return
+      while True:
+        msgType = transport.getBufferedMessageType()
+        if msgType != 'keepAlive':
+          break
+        self.__stats[ 'keepAlives' ] += 1
+        result = transport.receiveData( blockAfterKeepAlive = False )
+        if not result[ 'OK' ]:
+          self.__dropFD( fd, close = True )
+          return
+      if not msgType:
+        if not polled:
+          #Wait for the rest of the message
+          self.__lock.acquire()
+          try:
+            self.__poller.register( fd )
+          finally:
+            self.__lock.release()
+        return
+    self.__dropFD( fd )
+    self.__dispatch( watchDict[ 'callback' ], watchDict[ 'args' ] )
+
+  def __dispatch( self, callback, args ):
+    self.__stats[ 'dispatched' ] += 1
+    self.__threadPool.generateJobAndQueueIt( callback, args = args )
+
+  def __expireConnections( self, now ):
+    self.__lock.acquire()
+    try:
+      expired = [ fd for fd in self.__watched if self.__watched[ fd ][ 'expiration' ] < now ]
+    finally:
+      self.__lock.release()
+    for fd in expired:
+      watchDict = self.__dropFD( fd )
+      if not watchDict:
+        continue
+      self.__stats[ 'expired' ] += 1
+      if watchDict[ 'expireCallback' ]:
+        self.__dispatch( watchDict[ 'expireCallback' ], watchDict[ 'args' ] )
+      else:
+        try:
+          watchDict[ 'transport' ].close()
+        except Exception:
+          pass
@@ -10,23 +10,63 @@ class InnerRPCClient( BaseClient ):
 
   def executeRPC( self, functionName, args ):
     stub = ( self._getBaseStub(), functionName, args )
+    return self.__execute( ( "RPC", functionName ), args, stub )
+
+  def executeRPCBatch( self, calls ):
+    """
+    Execute a list of ( functionName, args ) in one round trip.
+    Returns S_OK( [ result of each call ] )
+    """
+    if not calls:
+      return S_OK( [] )
+    methods = []
+    for functionName, args in calls:
+      if functionName not in methods:
+        methods.append( functionName )
+    return self.__execute( ( "RPCBatch", ",".join( methods ) ), [ list( call ) for call in calls ] )
+
+  def __execute( self, action, args, stub = False ):
     retVal = self._connect()
     if not retVal[ 'OK' ]:
-      retVal[ 'rpcStub' ] = stub
+      if stub:
+        retVal[ 'rpcStub' ] = stub
       return retVal
-    trid, transport = retVal[ 'Value' ]
+    if retVal.get( 'reused' ):
+      result = self.__executeAction( retVal[ 'Value' ], action, args, stub )
+      if result[ 'OK' ] or not result.get( 'connectionError' ):
+        return result
+      #The server may have closed the idle connection. Try with a new one
+      retVal = self._connect( allowReuse = False )
+      if not retVal[ 'OK' ]:
+        if stub:
+          retVal[ 'rpcStub' ] = stub
+        return retVal
+    result = self.__executeAction( retVal[ 'Value' ], action, args, stub )
+    if 'connectionError' in result:
+      del( result[ 'connectionError' ] )
+    return result
+
+  def __executeAction( self, connection, action, args, stub ):
+    trid, transport = connection
+    reusable = False
     try:
-      retVal = self._proposeAction( transport, ( "RPC", functionName ) )
+      retVal = self._proposeAction( transport, action )
       if not retVal[ 'OK' ]:
-        retVal[ 'rpcStub' ] = stub
+        if stub:
+          retVal[ 'rpcStub' ] = stub
+        retVal[ 'connectionError' ] = True
         return retVal
       retVal = transport.sendData( S_OK( args ) )
       if not retVal[ 'OK' ]:
+        retVal[ 'connectionError' ] = True
         return retVal
       receivedData = transport.receiveData()
       if type( receivedData ) == types.DictType:
-        receivedData[ 'rpcStub' ] = stub
+        if stub:
+          receivedData[ 'rpcStub' ] = stub
+        reusable = True
       return receivedData
     finally:
-      self._disconnect( trid )
+      self._disconnect( trid, reusable )
+
 
@@ -1,6 +1,8 @@
 
 import os
 import time
+import types
+import Queue
 import DIRAC
 import threading
 from DIRAC import gConfig, gLogger, S_OK, S_ERROR, gMonitor
@@ -10,6 +12,7 @@ from DIRAC.FrameworkSystem.Client.MonitoringClient import MonitoringClient
 from DIRAC.Core.DISET.private.ServiceConfiguration import ServiceConfiguration
 from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
 from DIRAC.Core.DISET.private.MessageBroker import MessageBroker, MessageSender
+from DIRAC.Core.DISET.private.ConnectionReactor import ConnectionReactor
 from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
 from DIRAC.Core.Utilities.ThreadPool import ThreadPool
@@ -24,7 +27,8 @@ class Service:
   SVC_VALID_ACTIONS = { 'RPC' : 'export',
                         'FileTransfer': 'transfer',
                         'Message' : 'msg',
-                        'Connection' : 'Message' }
+                        'Connection' : 'Message',
+                        'RPCBatch' : 'RPC' }
   SVC_SECLOG_CLIENT = SecurityLogClient()
 
   def __init__( self, serviceData ):
@@ -43,6 +47,8 @@ class Service:
     self._stats = { 'queries' : 0, 'connections' : 0 }
     self._authMgr = AuthManager( "%s/Authorization" % PathFinder.getServiceSection( serviceData[ 'loadName' ] ) )
     self._transportPool = getGlobalTransportPool()
+    self._connReactor = False
+    self._idleReactor = False
     self.__cloneId = 0
     self.__maxFD = 0
 
@@ -75,6 +81,13 @@ class Service:
                                     self._cfg.getMaxWaitingPetitions() )
     self._threadPool.daemonize()
     self._msgBroker = MessageBroker( "%sMSB" % self._name, threadPool = self._threadPool )
+    if self._cfg.getReactorMode() == "Events":
+      self._connReactor = ConnectionReactor( self._name, self._threadPool )
+      self._idleReactor = self._connReactor
+    else:
+      self._connReactor = False
+      #Persistent connections wait for their next request here without holding a thread
+      self._idleReactor = ConnectionReactor( "%sIdle" % self._name, self._threadPool )
     #Create static dict
     self._serviceInfoDict = { 'serviceName' : self._name,
                               'serviceSectionPath' : PathFinder.getServiceSection( self._name ),
@@ -244,6 +257,11 @@ class Service:
     self._monitor.registerActivity( 'ActiveQueries', "Active queries", 'Framework', 'threads', MonitoringClient.OP_MEAN )
     self._monitor.registerActivity( 'RunningThreads', "Running threads", 'Framework', 'threads', MonitoringClient.OP_MEAN )
     self._monitor.registerActivity( 'MaxFD', "Max File Descriptors", 'Framework', 'fd', MonitoringClient.OP_MEAN )
+    self._monitor.registerActivity( 'CompressionRatio', "Compressed/raw payload size", 'Framework', '%', MonitoringClient.OP_MEAN )
+    self._monitor.registerActivity( 'CompressionTime', "Time spent (de)compressing", 'Framework', 'ms', MonitoringClient.OP_SUM )
+    self._monitor.registerActivity( 'HandshakeTime', "SSL handshake time", 'Framework', 'ms', MonitoringClient.OP_MEAN )
+    self._monitor.registerActivity( 'SessionReuse', "Resumed SSL sessions", 'Framework', '%', MonitoringClient.OP_MEAN )
+    self._monitor.registerActivity( 'IdleConnections', "Connections waiting for requests", 'Framework', 'connections', MonitoringClient.OP_MEAN )
 
     self._monitor.setComponentExtraParam( 'DIRACVersion', DIRAC.version )
     self._monitor.setComponentExtraParam( 'platform', DIRAC.platform )
@@ -265,17 +283,36 @@ class Service:
     self._monitor.addMark( 'ActiveQueries', self._threadPool.numWorkingThreads() )
     self._monitor.addMark( 'RunningThreads', threading.activeCount() )
     self._monitor.addMark( 'MaxFD', self.__maxFD )
+    if self._idleReactor:
+      self._monitor.addMark( 'IdleConnections', self._idleReactor.getNumConnections() )
     self.__maxFD = 0
 
 
   def getConfig( self ):
     return self._cfg
 
+  def getStats( self ):
+    """
+    Counters and thread pool status. Used to aggregate the monitoring of clone processes
+    """
+    return { 'connections' : self._stats[ 'connections' ],
+             'queries' : self._stats[ 'queries' ],
+             'activeQueries' : self._threadPool.numWorkingThreads(),
+             'pendingQueries' : self._threadPool.pendingJobs() }
+
+  def isIdle( self ):
+    return self._threadPool.numWorkingThreads() == 0 and self._threadPool.pendingJobs() == 0
+
   #End of initialization functions
 
   def handleConnection( self, clientTransport ):
     self._stats[ 'connections' ] += 1
     self._monitor.setComponentExtraParam( 'queries', self._stats[ 'connections' ] )
+    if self._connReactor:
+      #Don't take a thread until the client has sent something
+      self._connReactor.watch( clientTransport, self._handshakeInThread, args = ( clientTransport, ),
+                               timeout = self._cfg.getConnectionTimeout(), waitForMessage = False )
+      return
     self._threadPool.generateJobAndQueueIt( self._processInThread,
                                              args = ( clientTransport, ) )
 
@@ -296,35 +333,92 @@ class Service:
           return
       except:
         return
+      self.__reportHandshake( clientTransport )
       #Add to the transport pool
       trid = self._transportPool.add( clientTransport )
       if not trid:
         return
-      #Receive and check proposal
-      result = self._receiveAndCheckProposal( trid )
-      if not result[ 'OK' ]:
-        self._transportPool.sendAndClose( trid, result )
+      result = self._processAction( trid )
+      #Persistent connections wait for the next action in the reactor, not in this thread
+      if result and result.get( 'keepConnection' ):
+        self._idleReactor.watch( clientTransport, self._actionInThread, args = ( trid, ),
+                                 timeout = self._cfg.getPersistentConnectionTime(),
+                                 expireCallback = self._transportPool.close )
+      return result
+    finally:
+      self._lockManager.unlockGlobal()
+      if monReport:
+        self.__endReportToMonitoring( *monReport )
+        self.__reportCompression( clientTransport )
+
+  #Event driven process functions
+
+  def _handshakeInThread( self, clientTransport ):
+    self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
+    self._lockManager.lockGlobal()
+    try:
+      try:
+        result = clientTransport.handshake()
+        if not result[ 'OK' ]:
+          clientTransport.close()
+          return
+      except:
+        clientTransport.close()
         return
-      proposalTuple = result[ 'Value' ]
-      #Instantiate handler
-      result = self._instantiateHandler( trid, proposalTuple )
-      if not result[ 'OK' ]:
-        self._transportPool.sendAndClose( trid, result )
+      self.__reportHandshake( clientTransport )
+      trid = self._transportPool.add( clientTransport )
+      if not trid:
         return
-      handlerObj = result[ 'Value' ]
-      #Execute the action
-      result = self._processProposal( trid, proposalTuple, handlerObj )
-      #Close the connection if required
-      if result[ 'closeTransport' ] or not result[ 'OK' ]:
-        if not result[ 'OK' ]:
-          gLogger.error( "Error processing proposal", result[ 'Message' ] )
-        self._transportPool.close( trid )
+      self._connReactor.watch( clientTransport, self._actionInThread, args = ( trid, ),
+                               timeout = self._cfg.getConnectionTimeout(),
+                               expireCallback = self._transportPool.close )
+    finally:
+      self._lockManager.unlockGlobal()
+
+  def _actionInThread( self, trid ):
+    clientTransport = self._transportPool.get( trid )
+    if not clientTransport:
+      return
+    self._lockManager.lockGlobal()
+    try:
+      monReport = self.__startReportToMonitoring()
+    except Exception, e:
+      monReport = False
+    try:
+      result = self._processAction( trid )
+      #Persistent connections go back to the reactor until the next action
+      if result and result.get( 'keepConnection' ):
+        self._idleReactor.watch( clientTransport, self._actionInThread, args = ( trid, ),
+                                 timeout = self._cfg.getPersistentConnectionTime(),
+                                 expireCallback = self._transportPool.close )
       return result
     finally:
       self._lockManager.unlockGlobal()
       if monReport:
         self.__endReportToMonitoring( *monReport )
+        self.__reportCompression( clientTransport )
 
+  def _processAction( self, trid ):
+    #Receive and check proposal
+    result = self._receiveAndCheckProposal( trid )
+    if not result[ 'OK' ]:
+      self._transportPool.sendAndClose( trid, result )
+      return
+    proposalTuple = result[ 'Value' ]
+    #Instantiate handler
+    result = self._instantiateHandler( trid, proposalTuple )
+    if not result[ 'OK' ]:
+      self._transportPool.sendAndClose( trid, result )
+      return
+    handlerObj = result[ 'Value' ]
+    #Execute the action
+    result = self._processProposal( trid, proposalTuple, handlerObj )
+    #Close the connection if required
+    if result[ 'closeTransport' ] or not result[ 'OK' ]:
+      if not result[ 'OK' ]:
+        gLogger.error( "Error processing proposal", result[ 'Message' ] )
+      self._transportPool.close( trid )
+    return result
 
   def _createIdentityString( self, credDict, clientTransport = False ):
     if 'username' in credDict:
@@ -374,6 +468,13 @@ class Service:
     return S_OK( proposalTuple )
 
   def _authorizeProposal( self, actionTuple, trid, credDict ):
+    #Batches are authorized method by method
+    if actionTuple[0] == 'RPCBatch':
+      for method in actionTuple[1].split( "," ):
+        result = self._authorizeProposal( ( 'RPC', method ), trid, credDict )
+        if not result[ 'OK' ]:
+          return result
+      return S_OK()
     #Find CS path for the Auth rules
     referedAction = self._isMetaAction( actionTuple[0] )
     if referedAction:
@@ -446,11 +547,34 @@ class Service:
       return S_ERROR( "Server error while loading handler" )
     return S_OK( handlerInstance )
 
+  def _negotiateCapabilities( self, proposalTuple ):
+    """
+    Capabilities both peers agreed to use. They go in the ready notification
+    """
+    agreed = {}
+    if len( proposalTuple[0] ) < 4 or type( proposalTuple[0][3] ) != types.DictType:
+      return agreed
+    clientCapabilities = proposalTuple[0][3]
+    #Only RPC payloads are worth compressing
+    if proposalTuple[1][0] == 'RPC' and clientCapabilities.get( 'compression' ) == 'zlib' and \
+       self._cfg.getCompressionThreshold() > 0:
+      agreed[ 'compression' ] = 'zlib'
+    #Keep RPC connections open for the next action for a while
+    if proposalTuple[1][0] == 'RPC' and clientCapabilities.get( 'keepAlive' ) and \
+       self._cfg.getPersistentConnectionTime() > 0:
+      agreed[ 'keepAlive' ] = self._cfg.getPersistentConnectionTime()
+    return agreed
+
   def _processProposal( self, trid, proposalTuple, handlerObj ):
     #Notify the client we're ready to execute the action
-    retVal = self._transportPool.send( trid, S_OK() )
+    capabilities = self._negotiateCapabilities( proposalTuple )
+    readyMsg = S_OK()
+    readyMsg.update( capabilities )
+    retVal = self._transportPool.send( trid, readyMsg )
     if not retVal[ 'OK' ]:
       return retVal
+    if 'compression' in capabilities:
+      self._transportPool.get( trid ).setCompression( self._cfg.getCompressionThreshold() )
 
     messageConnection = False
     if proposalTuple[1] == ( 'Connection', 'new' ):
@@ -477,6 +601,9 @@ class Service:
         self._msgBroker.removeTransport( trid )
 
     result[ 'closeTransport' ] = not messageConnection or not result[ 'OK' ]
+    if result[ 'OK' ] and not messageConnection and 'keepAlive' in capabilities:
+      result[ 'closeTransport' ] = False
+      result[ 'keepConnection' ] = True
     return result
 
   def _mbConnect( self, trid, handlerObj = False ):
@@ -489,11 +616,80 @@ class Service:
 
   def _executeAction( self, trid, proposalTuple, handlerObj ):
     try:
+      if proposalTuple[1][0] == 'RPCBatch':
+        return self._executeRPCBatch( trid, proposalTuple, handlerObj )
       return handlerObj._rh_executeAction( proposalTuple )
     except Exception, e:
       gLogger.exception( "Exception while executing handler action" )
       return S_ERROR( "Server error while executing action: %s" % str( e ) )
 
+  def _executeRPCBatch( self, trid, proposalTuple, handlerObj ):
+    """
+    Execute a batch of RPC calls and send back the list of results. With more than
+    one RPCBatchThreads the calls are spread over the service thread pool. This
+    thread also takes calls from the batch so it finishes even if the pool is busy
+    """
+    retVal = self._transportPool.receive( trid )
+    if not retVal[ 'OK' ]:
+      return retVal
+    calls = retVal[ 'Value' ]
+    allowedMethods = proposalTuple[1][1].split( "," )
+    if type( calls ) not in ( types.ListType, types.TupleType ):
+      return self._transportPool.send( trid, S_ERROR( "Invalid RPC batch" ) )
+    if len( calls ) > self._cfg.getMaxRPCBatchSize():
+      return self._transportPool.send( trid, S_ERROR( "RPC batch is too big. Max size is %s" %
+                                                      self._cfg.getMaxRPCBatchSize() ) )
+    results = [ None ] * len( calls )
+    pendingCalls = Queue.Queue()
+    for iCall in range( len( calls ) ):
+      pendingCalls.put( iCall )
+    doneCond = threading.Condition()
+    doneCount = [ 0 ]
+
+    def processCalls( callHandler = False ):
+      while True:
+        try:
+          iCall = pendingCalls.get_nowait()
+        except Queue.Empty:
+          return
+        try:
+          method, args = calls[ iCall ]
+          if method not in allowedMethods:
+            result = S_ERROR( "Method %s was not in the batch proposal" % method )
+          else:
+            if not callHandler:
+              result = self._instantiateHandler( trid, proposalTuple )
+              if result[ 'OK' ]:
+                callHandler = result[ 'Value' ]
+            if callHandler:
+              result = callHandler._rh_executeBatchedRPC( method, tuple( args ) )
+        except Exception, e:
+          gLogger.exception( "Exception while executing batched call" )
+          result = S_ERROR( "Server error while executing batched call: %s" % str( e ) )
+        results[ iCall ] = result
+        doneCond.acquire()
+        try:
+          doneCount[0] += 1
+          doneCond.notifyAll()
+        finally:
+          doneCond.release()
+
+    self._msgBroker.addTransportId( trid, self._name, idleRead = True )
+    try:
+      for iHelper in range( min( self._cfg.getRPCBatchThreads(), len( calls ) ) - 1 ):
+        if not self._threadPool.generateJobAndQueueIt( processCalls, blocking = False )[ 'OK' ]:
+          break
+      processCalls( handlerObj )
+      doneCond.acquire()
+      try:
+        while doneCount[0] < len( calls ):
+          doneCond.wait( 1 )
+      finally:
+        doneCond.release()
+    finally:
+      self._msgBroker.removeTransport( trid, closeTransport = False )
+    return self._transportPool.send( trid, S_OK( results ) )
+
   def _mbReceivedMsg( self, trid, msgObj ):
     result = self._authorizeProposal( ( 'Message', msgObj.getName() ),
                                       trid,
@@ -516,6 +712,7 @@ class Service:
 
   def __startReportToMonitoring( self ):
     self._monitor.addMark( "Queries" )
+    self._stats[ 'queries' ] += 1
     now = time.time()
     stats = os.times()
     cpuTime = stats[0] + stats[2]
@@ -531,6 +728,23 @@ class Service:
       self._monitor.addMark( 'MEM', mem )
     return ( now, cpuTime )
 
+  def __reportHandshake( self, clientTransport ):
+    handshakeInfo = clientTransport.getHandshakeInfo()
+    if not handshakeInfo:
+      return
+    self._monitor.addMark( 'HandshakeTime', handshakeInfo[ 'time' ] * 1000 )
+    if handshakeInfo[ 'reused' ]:
+      self._monitor.addMark( 'SessionReuse', 100 )
+    else:
+      self._monitor.addMark( 'SessionReuse', 0 )
+
+  def __reportCompression( self, clientTransport ):
+    compStats = clientTransport.getCompressionStats( reset = True )
+    if not compStats[ 'rawBytes' ]:
+      return
+    self._monitor.addMark( 'CompressionRatio', compStats[ 'compressedBytes' ] * 100. / compStats[ 'rawBytes' ] )
+    self._monitor.addMark( 'CompressionTime', compStats[ 'time' ] * 1000 )
+
   def __endReportToMonitoring( self, initialWallTime, initialCPUTime ):
     wallTime = time.time() - initialWallTime
     stats = os.times()
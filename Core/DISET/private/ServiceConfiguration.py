@@ -80,6 +80,52 @@ class ServiceConfiguration:
     except:
       return 1
 
+  def getCloneStopTimeout( self ):
+    try:
+      return int( self.getOption( "CloneStopTimeout" ) )
+    except:
+      return 60
+
+  def getCompressionThreshold( self ):
+    try:
+      return int( self.getOption( "CompressionThreshold" ) )
+    except:
+      return 65536
+
+  def getPersistentConnectionTime( self ):
+    try:
+      return int( self.getOption( "PersistentConnectionTime" ) )
+    except:
+      return 0
+
+  def getMaxRPCBatchSize( self ):
+    try:
+      return int( self.getOption( "MaxRPCBatchSize" ) )
+    except:
+      return 1000
+
+  def getRPCBatchThreads( self ):
+    try:
+      return int( self.getOption( "RPCBatchThreads" ) )
+    except:
+      return 1
+
+  def getReactorMode( self ):
+    """
+    Threads: each connection gets a thread for its whole life
+    Events: connections only get a thread when there's a request to process
+    """
+    optionValue = self.getOption( "ReactorMode" )
+    if optionValue and optionValue.lower() == "events":
+      return "Events"
+    return "Threads"
+
+  def getConnectionTimeout( self ):
+    try:
+      return int( self.getOption( "ConnectionTimeout" ) )
+    except:
+      return 30
+
   def getPort( self ):
     try:
       return int( self.getOption( "Port" ) )
@@ -2,8 +2,8 @@
 __RCSID__ = "$Id$"
 
 import time
+import zlib
 import select
-import cStringIO
 try:
   from hashlib import md5
 except:
@@ -13,12 +13,39 @@ from DIRAC.Core.Utilities.ReturnValues import S_ERROR, S_OK
 from DIRAC.Core.Utilities import DEncode
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 
+class _InflatingDecoder( DEncode.StreamDecoder ):
+  """
+  Stream decoder for zlib compressed messages
+  """
+
+  def __init__( self ):
+    DEncode.StreamDecoder.__init__( self )
+    self.__inflater = zlib.decompressobj()
+    self.compressedBytes = 0
+    self.rawBytes = 0
+    self.inflateTime = 0
+
+  def feed( self, chunk ):
+    startTime = time.time()
+    chunk = self.__inflater.decompress( chunk )
+    self.inflateTime += time.time() - startTime
+    self.rawBytes += len( chunk )
+    return DEncode.StreamDecoder.feed( self, chunk )
+
+  def finish( self ):
+    chunk = self.__inflater.flush()
+    self.rawBytes += len( chunk )
+    DEncode.StreamDecoder.feed( self, chunk )
+    return DEncode.StreamDecoder.finish( self )
+
 class BaseTransport:
 
   bAllowReuseAddress = True
   iListenQueueSize = 5
   iReadTimeout = 600
   keepAliveMagic = "dka"
+  compressionMagic = "Z"
+  compressionLevel = 1
 
   def __init__( self, stServerAddress, bServerMode = False, **kwargs ):
     self.bServerMode = bServerMode
@@ -42,6 +69,9 @@ class BaseTransport:
         pass
     self.__lastActionTimestamp = time.time()
     self.__lastServerRenewTimestamp = self.__lastActionTimestamp
+    self.__compressionThreshold = 0
+    self.__compressionStats = { 'rawBytes' : 0, 'compressedBytes' : 0, 'time' : 0.0 }
+    self.handshakeInfo = {}
 
   def __updateLastActionTimestamp( self ):
     self.__lastActionTimestamp = time.time()
@@ -52,9 +82,40 @@ class BaseTransport:
   def getKeepAliveLapse( self ):
     return self.__keepAliveLapse
 
+  def setCompression( self, threshold ):
+    """
+    Compress outgoing messages bigger than threshold bytes. Only to be enabled
+    once the peer has agreed to it. 0 disables compression
+    """
+    self.__compressionThreshold = max( 0, threshold )
+
+  def getCompression( self ):
+    return self.__compressionThreshold
+
+  def getCompressionStats( self, reset = False ):
+    """
+    Bytes before and after compression and seconds spent (de)compressing
+    """
+    compStats = dict( self.__compressionStats )
+    if reset:
+      self.__compressionStats = { 'rawBytes' : 0, 'compressedBytes' : 0, 'time' : 0.0 }
+    return compStats
+
+  def __addCompressionStats( self, rawBytes, compressedBytes, spentTime ):
+    self.__compressionStats[ 'rawBytes' ] += rawBytes
+    self.__compressionStats[ 'compressedBytes' ] += compressedBytes
+    self.__compressionStats[ 'time' ] += spentTime
+
   def handshake( self ):
     return S_OK()
 
+  def getHandshakeInfo( self ):
+    """
+    Secs spent in the handshake ( 'time' ) and whether a cached session was resumed ( 'reused' ).
+    Empty if the transport has no handshake
+    """
+    return self.handshakeInfo
+
   def close( self ):
     self.oSocket.close()
 
@@ -100,6 +161,73 @@ class BaseTransport:
       return True
     return False
 
+  def waitForData( self, timeout ):
+    """
+    Wait up to timeout secs for data from the peer
+    """
+    if self.byteStream or self.receivedMessages:
+      return True
+    try:
+      inList = select.select( [ self.oSocket ], [], [], timeout )[0]
+    except Exception:
+      return False
+    return self.oSocket in inList
+
+  def hasPendingData( self ):
+    """
+    Data from the peer has already been read from the socket and is waiting to be processed
+    """
+    return len( self.byteStream ) > 0 or len( self.receivedMessages ) > 0
+
+  def readAvailable( self, bufSize = 16384 ):
+    """
+    Read into the buffer whatever the peer has already sent without blocking.
+    To be called only when the socket is known to be readable
+    """
+    try:
+      data = self.oSocket.recv( bufSize )
+    except Exception, e:
+      return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+    if not data:
+      return S_ERROR( "Peer closed connection" )
+    self.byteStream += data
+    return S_OK( len( data ) )
+
+  def readBuffered( self ):
+    """
+    Move into the buffer data already read from the socket by lower layers.
+    Never touches the socket
+    """
+    return S_OK( 0 )
+
+  def getBufferedMessageType( self ):
+    """
+    Check if the first message in the buffer has been completely received.
+    Returns False if not, 'keepAlive' for keep alives and 'message' for anything else
+    (including malformed data, receiveData will report it)
+    """
+    if self.receivedMessages:
+      return 'message'
+    msgType = 'message'
+    start = 0
+    if self.byteStream.startswith( BaseTransport.keepAliveMagic ):
+      msgType = 'keepAlive'
+      start = len( BaseTransport.keepAliveMagic )
+    iSeparatorPosition = self.byteStream.find( ":", start, start + 10 )
+    if iSeparatorPosition == -1:
+      if len( self.byteStream ) - start >= 10:
+        return 'message'
+      return False
+    if self.byteStream[ start:start + 1 ] == BaseTransport.compressionMagic:
+      start += 1
+    try:
+      pkgSize = int( self.byteStream[ start:iSeparatorPosition ] )
+    except ValueError:
+      return 'message'
+    if len( self.byteStream ) < iSeparatorPosition + 1 + pkgSize:
+      return False
+    return msgType
+
   def _read( self, bufSize = 4096, skipReadyCheck = False ):
     try:
       if skipReadyCheck or self._readReady():
@@ -118,11 +246,61 @@ class BaseTransport:
 
   def sendData( self, uData, prefix = False ):
     self.__updateLastActionTimestamp()
-    sCodedData = DEncode.encode( uData )
+    #The length goes first so old peers can still read the message. It is computed
+    #without encoding, the data is then encoded chunk by chunk while it is sent
+    try:
+      dataSize = DEncode.encodedSize( uData )
+    except Exception, e:
+      return S_ERROR( "Exception while encoding data: %s" % e )
     if prefix:
-      dataToSend = "%s%s:%s" % ( prefix, len( sCodedData ), sCodedData )
+      header = "%s%s:" % ( prefix, dataSize )
     else:
-      dataToSend = "%s:%s" % ( len( sCodedData ), sCodedData )
+      header = "%s:" % dataSize
+    if not prefix and self.__compressionThreshold and dataSize >= self.__compressionThreshold:
+      return self.__sendCompressed( uData, dataSize )
+    if dataSize <= self.packetSize:
+      try:
+        data = DEncode.encode( uData )
+      except Exception, e:
+        return S_ERROR( "Exception while encoding data: %s" % e )
+      return self.__sendBuffer( header + data )
+    #Big message. Send it piece by piece
+    result = self.__sendBuffer( header )
+    if not result[ 'OK' ]:
+      return result
+    sentSize = 0
+    try:
+      for chunk in DEncode.encodeInChunks( uData, self.packetSize ):
+        result = self.__sendBuffer( chunk )
+        if not result[ 'OK' ]:
+          return result
+        sentSize += len( chunk )
+    except Exception, e:
+      return S_ERROR( "Exception while encoding data: %s" % e )
+    if sentSize != dataSize:
+      return S_ERROR( "Sent %s bytes of data but announced %s" % ( sentSize, dataSize ) )
+    return S_OK()
+
+  def __sendCompressed( self, uData, dataSize ):
+    compressTime = 0
+    deflater = zlib.compressobj( self.compressionLevel )
+    #Only the compressed data is kept, its length has to be sent before it
+    cList = []
+    try:
+      for chunk in DEncode.encodeInChunks( uData, self.packetSize ):
+        startTime = time.time()
+        cList.append( deflater.compress( chunk ) )
+        compressTime += time.time() - startTime
+      startTime = time.time()
+      cList.append( deflater.flush() )
+      compressTime += time.time() - startTime
+    except Exception, e:
+      return S_ERROR( "Exception while compressing data: %s" % e )
+    cData = "".join( cList )
+    self.__addCompressionStats( dataSize, len( cData ), compressTime )
+    return self.__sendBuffer( "%s%s:%s" % ( BaseTransport.compressionMagic, len( cData ), cData ) )
+
+  def __sendBuffer( self, dataToSend ):
     for index in range( 0, len( dataToSend ), self.packetSize ):
       bytesToSend = min( self.packetSize, len( dataToSend ) - index )
       packSentBytes = 0
@@ -176,17 +354,29 @@ class BaseTransport:
         return self.__processKeepAlive( maxBufferSize, blockAfterKeepAlive )
       #From here it must be a real message!
       #Process the size and remove the msg length from the bytestream
-      pkgSize = int( self.byteStream[ :iSeparatorPosition ] )
+      #Compressed messages have the compression magic before the size
+      decoder = False
+      if self.byteStream[0] == BaseTransport.compressionMagic:
+        pkgSize = int( self.byteStream[ 1:iSeparatorPosition ] )
+        decoder = _InflatingDecoder()
+      else:
+        pkgSize = int( self.byteStream[ :iSeparatorPosition ] )
       pkgData = self.byteStream[ iSeparatorPosition + 1: ]
       readSize = len( pkgData )
+      #Malformed data is reported once the whole message is out of the stream
+      decodeError = False
       if readSize >= pkgSize:
         #If we already have all the data we need
         data = pkgData[ :pkgSize ]
         self.byteStream = pkgData[ pkgSize: ]
+        if decoder:
+          decodeError = self.__feedDecoder( decoder, data )
       else:
-        #If we still need to read stuff
-        pkgMem = cStringIO.StringIO()
-        pkgMem.write( pkgData )
+        #If we still need to read stuff, decode while the rest of the data arrives
+        if not decoder:
+          decoder = DEncode.StreamDecoder()
+        decodeError = self.__feedDecoder( decoder, pkgData )
+        self.byteStream = ""
         #Receive while there's still data to be received
         while readSize < pkgSize:
           retVal = self._read( pkgSize - readSize, skipReadyCheck = True )
@@ -196,21 +386,27 @@ class BaseTransport:
             return S_ERROR( "Peer closed connection" )
           rcvData = retVal[ 'Value' ]
           readSize += len( rcvData )
-          pkgMem.write( rcvData )
+          if readSize > pkgSize:
+            #Keep whatever belongs to the next message
+            extraSize = readSize - pkgSize
+            self.byteStream = rcvData[ -extraSize: ]
+            rcvData = rcvData[ :-extraSize ]
           if maxBufferSize and readSize > maxBufferSize:
             return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
-        #Data is here! take it out from the bytestream, dencode and return
-        if readSize == pkgSize:
-          data = pkgMem.getvalue()
-          self.byteStream = ""
-        else: #readSize > pkgSize:
-          pkgMem.seek( 0, 0 )
-          data = pkgMem.read( pkgSize )
-          self.byteStream = pkgMem.read()
+          if not decodeError:
+            decodeError = self.__feedDecoder( decoder, rcvData )
+      if decodeError:
+        return S_ERROR( "Could not decode received data: %s" % decodeError )
+      #Data is here! dencode and return
       try:
-        data = DEncode.decode( data )[0]
+        if decoder:
+          data = decoder.finish()[0]
+        else:
+          data = DEncode.decode( data )[0]
       except Exception, e:
         return S_ERROR( "Could not decode received data: %s" % str( e ) )
+      if isinstance( decoder, _InflatingDecoder ):
+        self.__addCompressionStats( decoder.rawBytes, pkgSize, decoder.inflateTime )
       if idleReceive:
         self.receivedMessages.append( data )
         return S_OK()
@@ -219,6 +415,16 @@ class BaseTransport:
       gLogger.exception( "Network error while receiving data" )
       return S_ERROR( "Network error while receiving data: %s" % str( e ) )
 
+  def __feedDecoder( self, decoder, data ):
+    """
+    Feed data to the decoder. Returns the decoding error or False
+    """
+    try:
+      decoder.feed( data )
+    except Exception, e:
+      return str( e ) or e.__class__.__name__
+    return False
+
   def __processKeepAlive( self, maxBufferSize, blockAfterKeepAlive = True ):
     gLogger.debug( "Received Keep Alive" )
     #Next message down the stream will be the ka data
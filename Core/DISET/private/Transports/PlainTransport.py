@@ -8,6 +8,7 @@ import os
 from DIRAC.Core.DISET.private.Transports.BaseTransport import BaseTransport
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.Core.Utilities.ReturnValues import S_ERROR, S_OK
+from DIRAC.Core.Utilities import Network
 
 class PlainTransport( BaseTransport ):
 
@@ -37,6 +38,10 @@ class PlainTransport( BaseTransport ):
     self.oSocket = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
     if self.bAllowReuseAddress:
       self.oSocket.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+    if self.extraArgsDict.get( 'reusePort', False ):
+      result = Network.setReusePort( self.oSocket )
+      if not result[ 'OK' ]:
+        return result
     self.oSocket.bind( self.stServerAddress )
     self.oSocket.listen( self.iListenQueueSize )
     return S_OK( self.oSocket )
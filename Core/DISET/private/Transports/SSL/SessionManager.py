@@ -1,28 +1,116 @@
 # $HeadURL$
 __RCSID__ = "$Id$"
 
+import time
+import threading
 import GSI
 
 class SessionManager:
+  """
+  Client side cache of SSL sessions. Sessions are kept in LRU order up to
+  maxSessions entries and are forgotten after lifeTime secs (servers drop
+  them from their own cache anyway after their session timeout)
+  """
 
-  def __init__( self ):
+  def __init__( self, maxSessions = False, lifeTime = False ):
+    self.__maxSessions = maxSessions
+    self.__lifeTime = lifeTime
+    self.__lock = threading.Lock()
+    #sessionId -> ( sessionObject, expirationTime )
     self.sessionsDict = {}
+    #sessionIds in LRU order. Most recently used at the end
+    self.__lru = []
+    self.__stats = { 'hits' : 0, 'misses' : 0, 'evicted' : 0, 'expired' : 0 }
+
+  def __loadConfig( self ):
+    #Imported here to avoid circular imports when loading the transports
+    from DIRAC import gConfig
+    if not self.__maxSessions:
+      self.__maxSessions = max( 1, gConfig.getValue( "/DIRAC/Security/SessionCacheSize", 100 ) )
+    if not self.__lifeTime:
+      self.__lifeTime = max( 1, gConfig.getValue( "/DIRAC/Security/SessionLifeTime", 300 ) )
 
   def __generateSession( self ):
     return GSI.SSL.Session()
 
+  def __touch( self, sessionId ):
+    try:
+      self.__lru.remove( sessionId )
+    except ValueError:
+      pass
+    self.__lru.append( sessionId )
+
+  def __drop( self, sessionId ):
+    del( self.sessionsDict[ sessionId ] )
+    try:
+      self.__lru.remove( sessionId )
+    except ValueError:
+      pass
+
   def get( self, sessionId ):
-    if sessionId not in self.sessionsDict:
-      self.sessionsDict[ sessionId ] = self.__generateSession()
-    return self.sessionsDict[ sessionId ]
+    self.__lock.acquire()
+    try:
+      if sessionId in self.sessionsDict:
+        self.__touch( sessionId )
+        return self.sessionsDict[ sessionId ][0]
+    finally:
+      self.__lock.release()
+    sessionObject = self.__generateSession()
+    self.set( sessionId, sessionObject )
+    return sessionObject
 
   def isValid( self, sessionId ):
-    return sessionId in self.sessionsDict and self.sessionsDict[ sessionId ].valid()
+    self.__lock.acquire()
+    try:
+      if sessionId not in self.sessionsDict:
+        self.__stats[ 'misses' ] += 1
+        return False
+      sessionObject, expirationTime = self.sessionsDict[ sessionId ]
+      if expirationTime < time.time() or not sessionObject.valid():
+        self.__drop( sessionId )
+        self.__stats[ 'expired' ] += 1
+        self.__stats[ 'misses' ] += 1
+        return False
+      self.__stats[ 'hits' ] += 1
+      return True
+    finally:
+      self.__lock.release()
 
   def free( self, sessionId ):
-    self.sessionsDict[ sessionId ].free()
+    self.__lock.acquire()
+    try:
+      if sessionId not in self.sessionsDict:
+        return
+      sessionObject = self.sessionsDict[ sessionId ][0]
+      self.__drop( sessionId )
+    finally:
+      self.__lock.release()
+    sessionObject.free()
 
   def set( self, sessionId, sessionObject ):
-    self.sessionsDict[ sessionId ] = sessionObject
+    if not self.__maxSessions or not self.__lifeTime:
+      self.__loadConfig()
+    self.__lock.acquire()
+    try:
+      self.sessionsDict[ sessionId ] = ( sessionObject, time.time() + self.__lifeTime )
+      self.__touch( sessionId )
+      while len( self.__lru ) > self.__maxSessions:
+        self.__drop( self.__lru[0] )
+        self.__stats[ 'evicted' ] += 1
+    finally:
+      self.__lock.release()
+
+  def getStats( self ):
+    """
+    Lookups that found a valid session, lookups that did not,
+    sessions evicted to make room and sessions that had expired
+    """
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'size' ] = len( self.sessionsDict )
+    finally:
+      self.__lock.release()
+    return stats
 
-gSessionManager = SessionManager()
\ No newline at end of file
+gSessionManager = SessionManager()
@@ -291,6 +291,14 @@ class SocketInfo:
       timeout = int( self.infoDict['SSLSessionTimeout'] )
       gLogger.debug( "Setting session timeout to %s" % timeout )
       self.sslContext.set_session_timeout( timeout )
+    if 'SSLSessionCacheSize' in self.infoDict:
+      cacheSize = int( self.infoDict['SSLSessionCacheSize'] )
+      #Not all GSI versions allow to bound the server session cache
+      if hasattr( self.sslContext, 'set_session_cache_size' ):
+        gLogger.debug( "Setting session cache size to %s" % cacheSize )
+        self.sslContext.set_session_cache_size( cacheSize )
+      else:
+        gLogger.warn( "This GSI version can't limit the SSL session cache size" )
     return S_OK()
 
   def doClientHandshake( self ):
@@ -88,7 +88,8 @@ class SocketInfoFactory:
     sessionId = sessionHash.hexdigest()
     socketInfo.sslContext.set_session_id( str( hash( sessionId ) ) )
     socketInfo.setSSLSocket( sslSocket )
-    if gSessionManager.isValid( sessionId ):
+    socketInfo.infoDict[ 'sessionId' ] = sessionId
+    if socketInfo.infoDict[ 'enableSessions' ] and gSessionManager.isValid( sessionId ):
       sslSocket.set_session( gSessionManager.get( sessionId ) )
     #Set the real timeout
     if socketInfo.infoDict[ 'timeout' ]:
@@ -126,15 +127,19 @@ class SocketInfoFactory:
     #Did the auth or the connection fail?
     if not retVal['OK']:
       return retVal
-    if 'enableSessions' in kwargs and kwargs[ 'enableSessions' ]:
-      sessionId = hash( hostAddress )
-      gSessionManager.set( sessionId, sslSocket.get_session() )
+    #Store the session under the same id __connect looks it up with
+    if socketInfo.infoDict[ 'enableSessions' ] and not sslSocket.session_reused():
+      gSessionManager.set( socketInfo.infoDict[ 'sessionId' ], sslSocket.get_session() )
     return S_OK( socketInfo )
 
   def getListeningSocket( self, hostAddress, listeningQueueSize = 5, reuseAddress = True, **kwargs ):
     osSocket = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
     if reuseAddress:
       osSocket.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+    if kwargs.get( 'reusePort', False ):
+      retVal = Network.setReusePort( osSocket )
+      if not retVal[ 'OK' ]:
+        return retVal
     retVal = self.generateServerInfo( kwargs )
     if not retVal[ 'OK' ]:
       return retVal
@@ -43,12 +43,15 @@ class SSLTransport( BaseTransport ):
     self.__locked = False
 
   def initAsClient( self ):
+    startTime = time.time()
     retVal = gSocketInfoFactory.getSocket( self.stServerAddress, **self.extraArgsDict )
     if not retVal[ 'OK' ]:
       return retVal
     self.oSocketInfo = retVal[ 'Value' ]
     self.oSocket = self.oSocketInfo.getSSLSocket()
-    if not self.oSocket.session_reused():
+    reused = self.oSocket.session_reused()
+    self.handshakeInfo = { 'time' : time.time() - startTime, 'reused' : reused }
+    if not reused:
       gLogger.debug( "New session connecting to server at %s" % str( self.stServerAddress ) )
     self.remoteAddress = self.oSocket.getpeername()
     return S_OK()
@@ -85,11 +88,14 @@ class SSLTransport( BaseTransport ):
     return S_OK()
 
   def handshake( self ):
+    startTime = time.time()
     retVal = self.oSocketInfo.doServerHandshake()
     if not retVal[ 'OK' ]:
       return retVal
     creds = retVal[ 'Value' ]
-    if not self.oSocket.session_reused():
+    reused = self.oSocket.session_reused()
+    self.handshakeInfo = { 'time' : time.time() - startTime, 'reused' : reused }
+    if not reused:
       gLogger.debug( "New session connecting from client at %s" % str( self.getRemoteAddress() ) )
     for key in creds.keys():
       self.peerCredentials[ key ] = creds[ key ]
@@ -137,6 +143,49 @@ class SSLTransport( BaseTransport ):
     finally:
       self.__unlock()
 
+  def hasPendingData( self ):
+    if BaseTransport.hasPendingData( self ):
+      return True
+    #Data already decrypted by the SSL layer is not seen by select
+    try:
+      return self.oSocket.pending() > 0
+    except Exception:
+      return False
+
+  def readAvailable( self, bufSize = 16384 ):
+    self.__lock()
+    try:
+      readBytes = 0
+      while True:
+        try:
+          data = self.oSocket.recv( bufSize )
+        except GSI.SSL.WantReadError:
+          #Only part of a SSL record has arrived
+          break
+        except GSI.SSL.WantWriteError:
+          break
+        except GSI.SSL.ZeroReturnError:
+          return S_ERROR( "Peer closed connection" )
+        except Exception, e:
+          return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+        if not data:
+          return S_ERROR( "Peer closed connection" )
+        self.byteStream += data
+        readBytes += len( data )
+        if not self.oSocket.pending():
+          break
+      return S_OK( readBytes )
+    finally:
+      self.__unlock()
+
+  def readBuffered( self ):
+    try:
+      if not self.oSocket.pending():
+        return S_OK( 0 )
+    except Exception, e:
+      return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+    return self.readAvailable()
+
   def isLocked( self ):
     return self.__locked
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: CloneProcessesBenchmark.py
+########################################################################
+""" Measure how a service scales with the number of clone processes
+
+    Clone processes listen on the same port with SO_REUSEPORT, like the ones
+    started by the ServiceReactor when CloneProcesses > 1. Each request waits
+    for a stand-in MySQL query (a sleep, the GIL is released as while waiting
+    for the real server) and then builds and encodes the result rows in python,
+    which is where a single process gets stuck on the GIL.
+
+    Usage: CloneProcessesBenchmark.py [maxClones] [clientProcesses] [secsPerRun] [queryMillisecs] [rows]
+"""
+__RCSID__ = "$Id $"
+
+import os
+import sys
+import time
+import socket
+import signal
+import multiprocessing
+from DIRAC.Core.Utilities import Network
+from DIRAC.Core.Utilities.ThreadPool import ThreadPool
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+
+WORKER_THREADS = 15
+
+def standInQuery( queryTime, numRows ):
+  """ What a DB handler does: wait for MySQL and turn the rows into the result structure """
+  time.sleep( queryTime )
+  rows = [ ( i, "/lhcb/data/file_%010d.raw" % i, "Waiting", i * 1024, 1.5 * i ) for i in range( numRows ) ]
+  records = [ dict( zip( ( 'FileID', 'LFN', 'Status', 'Size', 'Checksum' ), row ) ) for row in rows ]
+  return { 'OK' : True, 'Value' : records }
+
+def serveConnection( transport, queryTime, numRows ):
+  while True:
+    result = transport.receiveData()
+    if not result[ 'OK' ]:
+      transport.close()
+      return
+    transport.sendData( standInQuery( queryTime, numRows ) )
+
+def runClone( port, queryTime, numRows ):
+  signal.signal( signal.SIGTERM, lambda sigNum, frame: os._exit( 0 ) )
+  listener = PlainTransport( ( "127.0.0.1", port ), bServerMode = True, reusePort = True )
+  listener.iListenQueueSize = 128
+  result = listener.initAsServer()
+  if not result[ 'OK' ]:
+    print "Cannot listen: %s" % result[ 'Message' ]
+    os._exit( 1 )
+  threadPool = ThreadPool( WORKER_THREADS, WORKER_THREADS, 1000 )
+  threadPool.daemonize()
+  while True:
+    result = listener.acceptConnection()
+    if result[ 'OK' ]:
+      threadPool.generateJobAndQueueIt( serveConnection, args = ( result[ 'Value' ], queryTime, numRows ) )
+
+def runClient( port, endTime, counter ):
+  transport = PlainTransport( ( "127.0.0.1", port ) )
+  result = transport.initAsClient()
+  if not result[ 'OK' ]:
+    return
+  requests = 0
+  while time.time() < endTime:
+    transport.sendData( { 'OK' : True, 'Value' : 'getFiles' } )
+    result = transport.receiveData()
+    if not result[ 'OK' ]:
+      break
+    requests += 1
+  transport.close()
+  counter.acquire()
+  counter.value += requests
+  counter.release()
+
+def findFreePort():
+  sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+  sock.bind( ( "127.0.0.1", 0 ) )
+  port = sock.getsockname()[1]
+  sock.close()
+  return port
+
+def runClones( numClones, numClients, secsPerRun, queryTime, numRows ):
+  port = findFreePort()
+  clones = []
+  for i in range( numClones ):
+    process = multiprocessing.Process( target = runClone, args = ( port, queryTime, numRows ) )
+    process.start()
+    clones.append( process )
+  time.sleep( 1 )
+  counter = multiprocessing.Value( 'l', 0 )
+  endTime = time.time() + secsPerRun
+  clients = []
+  for i in range( numClients ):
+    process = multiprocessing.Process( target = runClient, args = ( port, endTime, counter ) )
+    process.start()
+    clients.append( process )
+  for process in clients:
+    process.join()
+  for process in clones:
+    process.terminate()
+    process.join()
+  return counter.value / float( secsPerRun )
+
+if __name__ == "__main__":
+  args = [ multiprocessing.cpu_count(), 32, 10, 2, 500 ]
+  for i in range( min( len( sys.argv ) - 1, len( args ) ) ):
+    args[i] = int( sys.argv[ i + 1 ] )
+  maxClones, numClients, secsPerRun, queryMillis, numRows = args
+  result = Network.setReusePort( socket.socket( socket.AF_INET, socket.SOCK_STREAM ) )
+  if not result[ 'OK' ]:
+    print result[ 'Message' ]
+    sys.exit( 1 )
+  print "%s cores, %s clients, %s ms per query, %s rows per result" % ( multiprocessing.cpu_count(), numClients,
+                                                                      queryMillis, numRows )
+  numClones = 1
+  baseRate = 0
+  while numClones <= maxClones:
+    rate = runClones( numClones, numClients, secsPerRun, queryMillis / 1000., numRows )
+    if not baseRate:
+      baseRate = rate
+    print "%3s clones: %8.1f queries/s (x%.2f)" % ( numClones, rate, rate / max( baseRate, 0.000001 ) )
+    numClones *= 2
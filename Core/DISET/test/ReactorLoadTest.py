@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: ReactorLoadTest.py
+########################################################################
+""" Compare the thread per connection and the event driven (ConnectionReactor)
+    ways of serving persistent connections
+
+    A stand-in echo service is started on localhost with a limited number of
+    worker threads, like a DISET service with MaxThreads. Some clients open
+    connections and leave them idle while the rest send requests as fast as
+    they can. Throughput and latency percentiles are printed for both modes.
+
+    Usage: ReactorLoadTest.py [activeClients] [idleClients] [requestsPerClient] [workerThreads]
+"""
+__RCSID__ = "$Id $"
+
+import sys
+import time
+import socket
+import threading
+from DIRAC.Core.Utilities.ThreadPool import ThreadPool
+from DIRAC.Core.DISET.private.ConnectionReactor import ConnectionReactor
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+
+IDLE_TIME = 30
+
+class StandInService:
+  """ Echo service. Answers each message with S_OK( message ) """
+
+  def __init__( self, mode, workerThreads ):
+    self.mode = mode
+    self.threadPool = ThreadPool( 1, workerThreads, 10000 )
+    self.threadPool.daemonize()
+    self.reactor = False
+    if mode == "Events":
+      self.reactor = ConnectionReactor( "LoadTest%s" % mode, self.threadPool )
+    self.listener = PlainTransport( ( "127.0.0.1", 0 ), bServerMode = True )
+    self.listener.iListenQueueSize = 1024
+    self.listener.initAsServer()
+    self.address = self.listener.getSocket().getsockname()
+    self.alive = True
+    acceptThread = threading.Thread( target = self.__acceptLoop )
+    acceptThread.setDaemon( True )
+    acceptThread.start()
+
+  def __acceptLoop( self ):
+    while self.alive:
+      try:
+        result = self.listener.acceptConnection()
+      except socket.error:
+        #Listening socket closed
+        return
+      if not result[ 'OK' ]:
+        continue
+      transport = result[ 'Value' ]
+      if self.reactor:
+        self.reactor.watch( transport, self.serveOne, args = ( transport, ), timeout = IDLE_TIME )
+      else:
+        self.threadPool.generateJobAndQueueIt( self.serveForever, args = ( transport, ) )
+
+  def __answer( self, transport ):
+    result = transport.receiveData()
+    if not result[ 'OK' ]:
+      transport.close()
+      return False
+    transport.sendData( { 'OK' : True, 'Value' : result[ 'Value' ] } )
+    return True
+
+  def serveForever( self, transport ):
+    """ Thread per connection: the thread waits for the next request """
+    while self.__answer( transport ):
+      if not transport.waitForData( IDLE_TIME ):
+        transport.close()
+        return
+
+  def serveOne( self, transport ):
+    """ Event driven: the connection goes back to the reactor after each request """
+    if self.__answer( transport ):
+      self.reactor.watch( transport, self.serveOne, args = ( transport, ), timeout = IDLE_TIME )
+
+  def stop( self ):
+    self.alive = False
+    self.listener.close()
+
+def openConnection( address ):
+  transport = PlainTransport( address )
+  result = transport.initAsClient()
+  if not result[ 'OK' ]:
+    raise Exception( result[ 'Message' ] )
+  return transport
+
+def activeClient( address, numRequests, latencies, lock ):
+  transport = openConnection( address )
+  payload = { 'OK' : True, 'Value' : [ "x" * 100 ] * 10 }
+  myLatencies = []
+  for i in range( numRequests ):
+    start = time.time()
+    transport.sendData( payload )
+    result = transport.receiveData()
+    myLatencies.append( time.time() - start )
+    if not result[ 'OK' ]:
+      break
+  transport.close()
+  lock.acquire()
+  latencies.extend( myLatencies )
+  lock.release()
+
+def percentile( sortedValues, pct ):
+  if not sortedValues:
+    return 0
+  return sortedValues[ min( len( sortedValues ) - 1, int( len( sortedValues ) * pct / 100. ) ) ]
+
+def runMode( mode, activeClients, idleClients, requestsPerClient, workerThreads ):
+  service = StandInService( mode, workerThreads )
+  #Idle clients send one request and keep the connection open
+  idleConnections = []
+  for i in range( idleClients ):
+    transport = openConnection( service.address )
+    transport.sendData( { 'OK' : True, 'Value' : 'hello' } )
+    idleConnections.append( transport )
+  time.sleep( 1 )
+  latencies = []
+  lock = threading.Lock()
+  threads = []
+  start = time.time()
+  for i in range( activeClients ):
+    th = threading.Thread( target = activeClient, args = ( service.address, requestsPerClient, latencies, lock ) )
+    th.setDaemon( True )
+    th.start()
+    threads.append( th )
+  for th in threads:
+    th.join( 300 )
+  elapsed = time.time() - start
+  for transport in idleConnections:
+    transport.close()
+  service.stop()
+  latencies.sort()
+  print "%-8s %6d requests in %7.2f secs: %8.1f req/s  p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms  max %8.2f ms" % \
+        ( mode, len( latencies ), elapsed, len( latencies ) / max( elapsed, 0.000001 ),
+          percentile( latencies, 50 ) * 1000, percentile( latencies, 95 ) * 1000,
+          percentile( latencies, 99 ) * 1000, percentile( latencies, 100 ) * 1000 )
+  if len( latencies ) < activeClients * requestsPerClient:
+    print "         %d requests did not complete" % ( activeClients * requestsPerClient - len( latencies ) )
+
+if __name__ == "__main__":
+  args = [ 50, 200, 200, 15 ]
+  for i in range( min( len( sys.argv ) - 1, len( args ) ) ):
+    args[i] = int( sys.argv[ i + 1 ] )
+  activeClients, idleClients, requestsPerClient, workerThreads = args
+  print "%s active clients x %s requests, %s idle connections, %s worker threads" % ( activeClients, requestsPerClient,
+                                                                                   idleClients, workerThreads )
+  for mode in ( "Threads", "Events" ):
+    runMode( mode, activeClients, idleClients, requestsPerClient, workerThreads )
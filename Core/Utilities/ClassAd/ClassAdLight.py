@@ -8,6 +8,8 @@
 
 __RCSID__ = "$Id$"
 
+from DIRAC.Core.Utilities.ClassAd.JDLParser import getJDLAttributes
+
 class ClassAd:
 
   def __init__( self, jdl ):
@@ -19,85 +21,9 @@ class ClassAd:
       self.contents = result
 
   def __analyse_jdl( self, jdl, index = 0 ):
-    """Analyse one [] jdl enclosure
-    """
-
-    jdl = jdl.strip()
-
-    # Strip all the blanks first
-    #temp = jdl.replace(' ','').replace('\n','')
-    temp = jdl
-
-    result = {}
-
-    if temp[0] != '[' or temp[-1] != ']':
-      print "Invalid JDL: it should start with [ and end with ]"
-      return result
-
-    # Parse the jdl string now
-    body = temp[1:-1]
-    index = 0
-    namemode = 1
-    valuemode = 0
-    while index < len( body ):
-      if namemode:
-        ind = body.find( "=", index )
-        if ind != -1:
-          name = body[index:ind]
-          index = ind + 1
-          valuemode = 1
-          namemode = 0
-        else:
-          break
-      elif valuemode:
-        ind1 = body.find( "[", index )
-        ind2 = body.find( ";", index )
-        if ind1 != -1 and ind1 < ind2:
-          value, newind = self.__find_subjdl( body, ind1 )
-        elif ind1 == -1 and ind2 == -1:
-          value = body[index:]
-          newind = len( body )
-        else:
-          if index == ind2:
-            return {}
-          else:
-            value = body[index:ind2]
-            newind = ind2 + 1
-
-        result[name.strip()] = value.strip().replace( '\n', '' )
-        index = newind
-        valuemode = 0
-        namemode = 1
-
-    return result
-
-  def __find_subjdl( self, body, index ):
-    """ Find a full [] enclosure starting from index
+    """Analyse one [] jdl enclosure, the parsed JDLs are cached
     """
-    result = ''
-    if body[index] != '[':
-      return ( result, 0 )
-
-    depth = 0
-    ind = index
-    while ( depth < 10 ):
-      ind1 = body.find( ']', ind + 1 )
-      ind2 = body.find( '[', ind + 1 )
-      if ind2 != -1 and ind2 < ind1:
-        depth += 1
-        ind = ind2
-      else:
-        if depth > 0:
-          depth -= 1
-          ind = ind1
-        else:
-          result = body[index:ind1 + 1]
-          if body[ind1 + 1] == ";":
-            return ( result, ind1 + 2 )
-          else:
-            return result, 0
-
-    return result, 0
+    return dict( getJDLAttributes( jdl ) )
 
   def insertAttributeInt( self, name, attribute ):
     """Insert a named integer attribute
@@ -0,0 +1,176 @@
+########################################################################
+# $HeadURL$
+########################################################################
+
+""" Tokenizer based JDL parser with a parse cache
+
+    The JDL is tokenized by compiled regular expressions: a value, quoted
+    strings included, is matched in one go up to the ; ending it, and only
+    the brackets of the sub JDLs are scanned one by one to find where they
+    close. Delimiters inside quoted strings are not special.
+
+    The result is an immutable map of attribute name to the expression of the
+    value, the same ClassAdLight used to produce by scanning the string.
+    Parsed JDLs are kept in a cache shared within the process, keyed by the
+    hash of the JDL with LRU eviction, because the same JDL gets parsed over
+    and over by the JobManager, the optimizers and the JobWrapper.
+"""
+
+__RCSID__ = "$Id$"
+
+import re
+import threading
+try:
+  import hashlib as md5
+except ImportError:
+  import md5
+
+#A quoted string, the closing quote may only be missing at the end of the JDL.
+#The tokens never overlap so that nothing can backtrack on invalid JDLs
+STRING = r'"[^"\\]*(?:\\.[^"\\]*)*\\?(?:"|\Z)'
+#Text of a value up to a ; or a sub JDL, quoted strings included
+VALUE_RE = re.compile( r'(?:[^"\[\];]+|%s)*' % STRING )
+#Brackets of a sub JDL, quoted strings skipped
+BRACKET_RE = re.compile( r'%s|[\[\]]' % STRING )
+DEFAULT_CACHE_SIZE = 2000
+
+class JDLAttributes( dict ):
+  """ Read only dictionary of the parsed JDL attributes
+  """
+
+  def __readOnly( self, *args, **kwargs ):
+    raise TypeError( "Parsed JDL attributes are read only" )
+
+  __setitem__ = __readOnly
+  __delitem__ = __readOnly
+  clear = __readOnly
+  pop = __readOnly
+  popitem = __readOnly
+  setdefault = __readOnly
+  update = __readOnly
+
+EMPTY_ATTRIBUTES = JDLAttributes()
+
+def parseJDL( jdl ):
+  """ Parse one [] JDL enclosure into a JDLAttributes map, empty if the JDL is
+      not valid
+  """
+  jdl = jdl.strip()
+  if jdl[:1] != '[' or jdl[-1:] != ']':
+    print "Invalid JDL: it should start with [ and end with ]"
+    return EMPTY_ATTRIBUTES
+
+  # The new lines are dropped from the values anyway
+  return scanJDL( jdl[1:-1].replace( '\n', '' ) )
+
+def scanJDL( body ):
+  """ Parse the body of a JDL value by value, in a single pass over the body
+  """
+  length = len( body )
+  result = {}
+  index = 0
+  while True:
+    ind = body.find( '=', index )
+    if ind == -1:
+      break
+    name = body[index:ind].strip()
+    start = ind + 1
+    index = VALUE_RE.match( body, start ).end()
+    # Skip the sub JDLs until the ; ending the value
+    while index < length and body[index] == '[':
+      depth = 0
+      for token in BRACKET_RE.finditer( body, index ):
+        if token.group() == '[':
+          depth += 1
+        elif token.group() == ']':
+          depth -= 1
+          if not depth:
+            break
+      if depth:
+        return EMPTY_ATTRIBUTES
+      index = VALUE_RE.match( body, token.end() ).end()
+    if index < length and body[index] == ']':
+      return EMPTY_ATTRIBUTES
+    # The last attribute may not be terminated
+    result[ name ] = body[start:index].strip()
+    index += 1
+  return JDLAttributes( result )
+
+class JDLCache:
+  """ LRU cache of the parsed JDLs keyed by the hash of the JDL
+  """
+
+  def __init__( self, maxSize = DEFAULT_CACHE_SIZE ):
+    self.__maxSize = maxSize
+    self.__lock = threading.Lock()
+    #jdlHash -> [ attributes, last use ]
+    self.__cache = {}
+    self.__tick = 0
+    self.__hits = 0
+    self.__misses = 0
+
+  def setMaxSize( self, maxSize ):
+    self.__lock.acquire()
+    try:
+      self.__maxSize = maxSize
+      self.__evict()
+    finally:
+      self.__lock.release()
+
+  def getStats( self ):
+    return { 'size' : len( self.__cache ), 'maxSize' : self.__maxSize,
+             'hits' : self.__hits, 'misses' : self.__misses }
+
+  def clear( self ):
+    self.__lock.acquire()
+    try:
+      self.__cache = {}
+    finally:
+      self.__lock.release()
+
+  def __evict( self ):
+    """ Drop the least recently used quarter once over the size. Must be called
+        holding the lock
+    """
+    if len( self.__cache ) <= self.__maxSize:
+      return
+    keep = self.__maxSize * 3 / 4
+    ranked = sorted( [ ( entry[1], jdlHash ) for jdlHash, entry in self.__cache.items() ] )
+    for lastUse, jdlHash in ranked[ :len( ranked ) - keep ]:
+      del( self.__cache[ jdlHash ] )
+
+  def parse( self, jdl ):
+    """ Attributes of the JDL, parsed only if not in the cache
+    """
+    if type( jdl ) == type( u'' ):
+      jdl = jdl.encode( 'utf-8' )
+    jdlHash = md5.md5( jdl ).digest()
+    self.__lock.acquire()
+    try:
+      self.__tick += 1
+      entry = self.__cache.get( jdlHash )
+      if entry:
+        entry[1] = self.__tick
+        self.__hits += 1
+        return entry[0]
+      self.__misses += 1
+    finally:
+      self.__lock.release()
+
+    attributes = parseJDL( jdl )
+    if not self.__maxSize:
+      return attributes
+    self.__lock.acquire()
+    try:
+      self.__cache[ jdlHash ] = [ attributes, self.__tick ]
+      self.__evict()
+    finally:
+      self.__lock.release()
+    return attributes
+
+gJDLCache = JDLCache()
+
+def getJDLAttributes( jdl ):
+  """ Parse the JDL through the process wide cache
+  """
+  return gJDLCache.parse( jdl )
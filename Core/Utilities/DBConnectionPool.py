@@ -0,0 +1,235 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Pool of DB connections used by the MySQL class
+
+    Connections are borrowed with get() and given back with put(). The pool
+    keeps between minSize and maxSize open connections:
+
+    - at most maxSize connections are borrowed at the same time, get() waits
+      up to waitTimeout secs for one to be given back
+    - connections idle for more than idleTimeout secs are closed, keeping at
+      least minSize of them
+    - connections older than maxAge secs are closed when given back or
+      borrowed, so none outlives a server side wait_timeout
+    - idle connections are pinged when borrowed and replaced if they are dead
+
+    Detached connections ( get( detached = True ) ) are handed out for good
+    and are not counted as borrowed. They can be given back with put() if
+    there's room for them.
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import threading
+from DIRAC import S_OK, S_ERROR, gLogger
+
+class DBConnectionPool:
+
+  def __init__( self, connectFunction, minSize = 1, maxSize = 3, idleTimeout = 600, maxAge = 3600,
+                pingOnBorrow = True, waitTimeout = 60 ):
+    """ connectFunction is called without arguments to open a new connection """
+    self.__connect = connectFunction
+    self.__maxSize = max( 1, maxSize )
+    self.__minSize = min( max( 0, minSize ), self.__maxSize )
+    self.__idleTimeout = idleTimeout
+    self.__maxAge = maxAge
+    self.__pingOnBorrow = pingOnBorrow
+    self.__waitTimeout = waitTimeout
+    self.__lock = threading.Condition( threading.Lock() )
+    #Idle connections as [ connection, creationTime, lastUseTime ]. Most recently used last
+    self.__idle = []
+    #id( connection ) -> creationTime of the borrowed ones
+    self.__borrowed = {}
+    self.__lastMaintenance = time.time()
+    self.__stats = { 'created' : 0, 'closed' : 0, 'borrowed' : 0, 'reused' : 0,
+                     'pingFailures' : 0, 'expired' : 0, 'waits' : 0, 'waitTime' : 0.0,
+                     'timeouts' : 0 }
+    self.log = gLogger.getSubLogger( "DBConnectionPool" )
+
+  def __newConnection( self ):
+    connection = self.__connect()
+    self.__stats[ 'created' ] += 1
+    return connection
+
+  def __close( self, connection ):
+    self.__stats[ 'closed' ] += 1
+    try:
+      connection.close()
+    except Exception:
+      pass
+
+  def __isAlive( self, connection ):
+    try:
+      connection.ping()
+      return True
+    except Exception:
+      self.__stats[ 'pingFailures' ] += 1
+      return False
+
+  def __popIdle( self, now ):
+    """ Get a usable idle connection or None. Must be called holding the lock """
+    while self.__idle:
+      connection, creationTime, lastUseTime = self.__idle.pop()
+      if now - creationTime > self.__maxAge or now - lastUseTime > self.__idleTimeout:
+        self.__stats[ 'expired' ] += 1
+        self.__close( connection )
+        continue
+      return connection, creationTime, now - lastUseTime
+    return None
+
+  def get( self, detached = False ):
+    """
+    Borrow a connection. Returns S_OK( connection ) or S_ERROR
+    """
+    self.__lock.acquire()
+    try:
+      now = time.time()
+      if not detached:
+        if len( self.__borrowed ) >= self.__maxSize:
+          self.__stats[ 'waits' ] += 1
+          while len( self.__borrowed ) >= self.__maxSize:
+            waitLeft = self.__waitTimeout - ( time.time() - now )
+            if waitLeft <= 0:
+              self.__stats[ 'timeouts' ] += 1
+              self.__stats[ 'waitTime' ] += time.time() - now
+              return S_ERROR( "Timeout waiting for a free DB connection (%s in use)" % len( self.__borrowed ) )
+            self.__lock.wait( waitLeft )
+          self.__stats[ 'waitTime' ] += time.time() - now
+          now = time.time()
+      idleData = self.__popIdle( now )
+      if not detached:
+        #Reserve the slot while connecting or pinging outside the lock
+        reservation = object()
+        self.__borrowed[ id( reservation ) ] = now
+    finally:
+      self.__lock.release()
+
+    connection = None
+    creationTime = now
+    try:
+      if idleData:
+        connection, creationTime, idleTime = idleData
+        #Recently used connections are trusted
+        if self.__pingOnBorrow and idleTime > 1 and not self.__isAlive( connection ):
+          self.__close( connection )
+          connection = None
+        else:
+          self.__stats[ 'reused' ] += 1
+      if not connection:
+        creationTime = time.time()
+        connection = self.__newConnection()
+    except Exception, e:
+      if not detached:
+        self.__release( id( reservation ) )
+      return S_ERROR( "Cannot open DB connection: %s" % str( e ) )
+
+    self.__lock.acquire()
+    try:
+      self.__stats[ 'borrowed' ] += 1
+      if not detached:
+        del( self.__borrowed[ id( reservation ) ] )
+        self.__borrowed[ id( connection ) ] = creationTime
+    finally:
+      self.__lock.release()
+    return S_OK( connection )
+
+  def __release( self, connId ):
+    self.__lock.acquire()
+    try:
+      self.__borrowed.pop( connId, None )
+      self.__lock.notify()
+    finally:
+      self.__lock.release()
+
+  def put( self, connection, discard = False ):
+    """
+    Give back a borrowed connection. Discarded connections are closed
+    """
+    now = time.time()
+    self.__lock.acquire()
+    try:
+      creationTime = self.__borrowed.pop( id( connection ), None )
+      if creationTime is None:
+        #Detached connection
+        creationTime = now
+        if len( self.__borrowed ) + len( self.__idle ) >= self.__maxSize:
+          discard = True
+      if now - creationTime > self.__maxAge:
+        self.__stats[ 'expired' ] += 1
+        discard = True
+      if not discard:
+        self.__idle.append( [ connection, creationTime, now ] )
+      self.__lock.notify()
+    finally:
+      self.__lock.release()
+    if discard:
+      self.__close( connection )
+    if now - self.__lastMaintenance > 30:
+      self.closeIdle()
+
+  def closeIdle( self ):
+    """
+    Close connections idle for too long or too old, keeping minSize of them
+    """
+    now = time.time()
+    self.__lastMaintenance = now
+    toClose = []
+    self.__lock.acquire()
+    try:
+      keep = []
+      #Oldest used first, so the most recently used ones are kept
+      for idleData in self.__idle:
+        connection, creationTime, lastUseTime = idleData
+        tooOld = now - creationTime > self.__maxAge
+        tooIdle = now - lastUseTime > self.__idleTimeout
+        if tooOld or ( tooIdle and len( self.__idle ) - len( toClose ) > self.__minSize ):
+          toClose.append( connection )
+        else:
+          keep.append( idleData )
+      self.__idle = keep
+      self.__stats[ 'expired' ] += len( toClose )
+    finally:
+      self.__lock.release()
+    for connection in toClose:
+      self.__close( connection )
+    return len( toClose )
+
+  def fill( self ):
+    """
+    Open connections until there are minSize of them
+    """
+    while len( self.__idle ) + len( self.__borrowed ) < self.__minSize:
+      try:
+        connection = self.__newConnection()
+      except Exception, e:
+        return S_ERROR( "Cannot open DB connection: %s" % str( e ) )
+      self.__lock.acquire()
+      try:
+        self.__idle.insert( 0, [ connection, time.time(), time.time() ] )
+      finally:
+        self.__lock.release()
+    return S_OK()
+
+  def close( self ):
+    self.__lock.acquire()
+    try:
+      idle = self.__idle
+      self.__idle = []
+    finally:
+      self.__lock.release()
+    for connection, creationTime, lastUseTime in idle:
+      self.__close( connection )
+
+  def getStats( self ):
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'idle' ] = len( self.__idle )
+      stats[ 'inUse' ] = len( self.__borrowed )
+      stats[ 'minSize' ] = self.__minSize
+      stats[ 'maxSize' ] = self.__maxSize
+    finally:
+      self.__lock.release()
+    return stats
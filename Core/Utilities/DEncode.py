@@ -221,6 +221,296 @@ g_dEncodeFunctions[ types.DictType ] = encodeDict
 g_dDecodeFunctions[ "d" ] = decodeDict
 
 
+#Iterative decoding engine
+#
+# Decodes the same wire format as the g_dDecodeFunctions table but without
+# recursion and without slicing the input for structural tokens. Partially
+# decoded containers are kept in an explicit stack so decoding can be suspended
+# when the input runs out and resumed once more bytes arrive.
+
+class _NeedMoreData( Exception ):
+
+  def __init__( self, position, needed = 1 ):
+    Exception.__init__( self, "Need more data at position %s" % position )
+    self.position = position
+    self.needed = needed
+
+_noKey = object()
+
+def _closeDateTime( dataType, tupleObject ):
+  if dataType == 'a':
+    return datetime.datetime( *tupleObject )
+  elif dataType == 'd':
+    return datetime.date( *tupleObject )
+  elif dataType == 't':
+    return datetime.time( *tupleObject )
+  raise Exception( "Unexpected type %s while decoding a datetime object" % dataType )
+
+def _decodeLoop( data, i, stack, final ):
+  """
+  Decode tokens from data starting at position i. Returns ( value, position ) once the
+  top level object is complete. If not final and the data is exhausted in the middle
+  of a token _NeedMoreData is raised with the position of the token start. The
+  container being filled is kept in local variables and saved back into the stack
+  when suspending, so the loop can be resumed from that position.
+  """
+  dLen = len( data )
+  index = data.index
+  if stack:
+    kind, container, key = stack.pop()
+  else:
+    kind, container, key = None, None, _noKey
+  try:
+    while True:
+      #i is only moved forward once the token has been completely read
+      c = data[ i ]
+      if c == 's':
+        colon = index( ":", i + 1 )
+        end = colon + 1 + int( data[ i + 1 : colon ] )
+        if end > dLen:
+          raise _NeedMoreData( i, end - dLen )
+        value = data[ colon + 1 : end ]
+        i = end
+      elif c == 'i':
+        end = index( "e", i + 1 )
+        value = int( data[ i + 1 : end ] )
+        i = end + 1
+      elif c == 'd' or c == 'l' or c == 't':
+        stack.append( ( kind, container, key ) )
+        kind = c
+        if c == 'd':
+          container = {}
+        else:
+          container = []
+        key = _noKey
+        i += 1
+        continue
+      elif c == 'e':
+        if kind is None or kind == 'z':
+          raise ValueError( "Unexpected end of container at position %s" % i )
+        value = container
+        if kind == 't':
+          value = tuple( value )
+        kind, container, key = stack.pop()
+        i += 1
+      elif c == 'n':
+        value = None
+        i += 1
+      elif c == 'b':
+        value = data[ i + 1 ] != "0"
+        i += 2
+      elif c == 'u':
+        colon = index( ":", i + 1 )
+        end = colon + 1 + int( data[ i + 1 : colon ] )
+        if end > dLen:
+          raise _NeedMoreData( i, end - dLen )
+        value = unicode( data[ colon + 1 : end ], 'utf-8' )
+        i = end
+      elif c == 'I':
+        end = index( "e", i + 1 )
+        value = long( data[ i + 1 : end ] )
+        i = end + 1
+      elif c == 'f':
+        end = index( "e", i + 1 )
+        if end + 1 >= dLen and not final:
+          #Can't know yet if this is the end marker or an exponent
+          raise _NeedMoreData( i )
+        if end + 1 < dLen and data[ end + 1 ] in ( '+', '-' ):
+          end = index( "e", end + 1 )
+        value = float( data[ i + 1 : end ] )
+        i = end + 1
+      elif c == 'z':
+        dataType = data[ i + 1 ]
+        stack.append( ( kind, container, key ) )
+        kind, container, key = 'z', dataType, _noKey
+        i += 2
+        continue
+      else:
+        raise ValueError( "Unknown type code '%s' at position %s" % ( c, i ) )
+      #Attach the value to the container being decoded
+      while True:
+        if kind == 'd':
+          if key is _noKey:
+            key = value
+          else:
+            container[ key ] = value
+            key = _noKey
+          break
+        elif kind == 'l' or kind == 't':
+          container.append( value )
+          break
+        elif kind == 'z':
+          value = _closeDateTime( container, value )
+          kind, container, key = stack.pop()
+        else:
+          return ( value, i )
+  except _NeedMoreData:
+    stack.append( ( kind, container, key ) )
+    raise
+  except ( ValueError, IndexError ), e:
+    #Missing terminator or truncated data. Only an error if there's no more data to come
+    if final:
+      if isinstance( e, IndexError ):
+        raise ValueError( "Truncated data at position %s" % i )
+      raise
+    stack.append( ( kind, container, key ) )
+    raise _NeedMoreData( i )
+
+class StreamDecoder:
+  """
+  Incremental decoder. Chunks of encoded data are fed as they arrive and decoded
+  as far as possible, so decoding overlaps with the network transfer.
+  """
+
+  def __init__( self ):
+    self.__data = ""
+    self.__pos = 0
+    self.__pending = []
+    self.__pendingLen = 0
+    self.__needed = 1
+    self.__stack = []
+    self.__value = None
+    self.__end = -1
+
+  def feed( self, chunk ):
+    """
+    Add a chunk of data and decode as much as possible. Returns True once the
+    encoded object is complete.
+    """
+    if self.__end > -1:
+      self.__pending.append( chunk )
+      return True
+    if chunk:
+      self.__pending.append( chunk )
+      self.__pendingLen += len( chunk )
+    #Don't bother joining until the incomplete token can be finished
+    if self.__pendingLen < self.__needed:
+      return False
+    return self.__decode( False )
+
+  def __decode( self, final ):
+    self.__pending.insert( 0, self.__data[ self.__pos: ] )
+    self.__data = "".join( self.__pending )
+    self.__pending = []
+    self.__pendingLen = 0
+    self.__pos = 0
+    try:
+      self.__value, self.__end = _decodeLoop( self.__data, 0, self.__stack, final )
+    except _NeedMoreData, e:
+      if final:
+        raise ValueError( "Truncated data: encoded object is not complete" )
+      self.__pos = e.position
+      self.__needed = e.needed
+      return False
+    return True
+
+  def isComplete( self ):
+    return self.__end > -1
+
+  def finish( self ):
+    """
+    Signal that no more data will be fed. Returns ( value, number of trailing bytes not used )
+    """
+    if self.__end == -1:
+      self.__decode( True )
+    trailing = len( self.__data ) - self.__end + sum( [ len( chunk ) for chunk in self.__pending ] )
+    return ( self.__value, trailing )
+
+#Streaming encoding
+#
+# The wire framing needs the length of the encoded data before the data itself,
+# so encodedSize computes it without building the string and encodeInChunks then
+# generates the encoded data in bounded pieces.
+
+_containerTypes = ( types.ListType, types.TupleType, types.DictType )
+
+def encodedSize( uObject ):
+  """
+  Length of encode( uObject ) without generating the encoded string
+  """
+  objType = type( uObject )
+  if objType == types.StringType:
+    sLen = len( uObject )
+    return len( str( sLen ) ) + sLen + 2
+  elif objType == types.DictType:
+    size = 2
+    for key in uObject:
+      size += encodedSize( key ) + encodedSize( uObject[ key ] )
+    return size
+  elif objType in ( types.ListType, types.TupleType ):
+    size = 2
+    for item in uObject:
+      size += encodedSize( item )
+    return size
+  elif objType in ( types.IntType, types.LongType, types.FloatType ):
+    return len( str( uObject ) ) + 2
+  elif objType == types.BooleanType:
+    return 2
+  elif objType == types.NoneType:
+    return 1
+  eList = []
+  g_dEncodeFunctions[ objType ]( uObject, eList )
+  return sum( [ len( piece ) for piece in eList ] )
+
+def _containerIterator( uObject ):
+  if type( uObject ) == types.DictType:
+    for key in sorted( uObject ):
+      yield key
+      yield uObject[ key ]
+  else:
+    for item in uObject:
+      yield item
+
+def encodeInChunks( uObject, chunkSize = 1048576 ):
+  """
+  Generator yielding the encoded object in chunks of at most chunkSize bytes.
+  "".join( encodeInChunks( obj ) ) == encode( obj )
+  """
+  eList = []
+  nextCheck = 1024
+  #Bytes in the pieces of eList before index counted
+  size = 0
+  counted = 0
+  stack = [ iter( ( uObject, ) ) ]
+  while stack:
+    for item in stack[-1]:
+      itemType = type( item )
+      if itemType in _containerTypes:
+        if itemType == types.DictType:
+          eList.append( "d" )
+        elif itemType == types.ListType:
+          eList.append( "l" )
+        else:
+          eList.append( "t" )
+        stack.append( _containerIterator( item ) )
+        break
+      g_dEncodeFunctions[ itemType ]( item, eList )
+      #Measuring every piece is expensive, so only check once in a while
+      if len( eList ) < nextCheck:
+        continue
+      nextCheck = len( eList ) + 1024
+      #Only the pieces added since the last check are measured
+      for piece in eList[ counted: ]:
+        size += len( piece )
+      counted = len( eList )
+      if size >= chunkSize:
+        data = "".join( eList )
+        end = len( data ) - len( data ) % chunkSize
+        for pos in xrange( 0, end, chunkSize ):
+          yield data[ pos : pos + chunkSize ]
+        eList = [ data[ end: ] ]
+        size = len( eList[0] )
+        counted = 1
+        nextCheck = 1024
+    else:
+      #Container exhausted
+      stack.pop()
+      if stack:
+        eList.append( "e" )
+  data = "".join( eList )
+  for pos in xrange( 0, len( data ), chunkSize ):
+    yield data[ pos : pos + chunkSize ]
+
 #Encode function
 def encode( uObject ):
   try:
@@ -231,14 +521,27 @@ def encode( uObject ):
   except Exception:
     raise
 
-def decode( data ):
+def decode( data, offset = 0 ):
   if not data:
     return data
+  if type( data ) != types.StringType:
+    #buffer/memoryview/bytearray are converted once instead of being sliced per token
+    if isinstance( data, memoryview ):
+      data = data.tobytes()
+    else:
+      data = str( data )
   try:
-    #print "DECODE FUNCTION : %s" % g_dDecodeFunctions[ sStream [ iIndex ] ]
-    return g_dDecodeFunctions[ data[ 0 ] ]( data, 0 )
-  except Exception:
-    raise
+    return _decodeLoop( data, offset, [], True )
+  except _NeedMoreData:
+    raise ValueError( "Truncated data: encoded object is not complete" )
+
+def decodeRecursive( data ):
+  """
+  Decode using the per type function table
+  """
+  if not data:
+    return data
+  return g_dDecodeFunctions[ data[ 0 ] ]( data, 0 )
 
 
 if __name__ == "__main__":
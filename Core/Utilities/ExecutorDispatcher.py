@@ -14,20 +14,23 @@ class ExecutorState:
     self.__lock = threading.Lock()
     self.__typeToId = {}
     self.__maxTasks = {}
+    self.__batchSize = {}
     self.__execTasks = {}
     self.__taskInExec = {}
 
   def _internals( self ):
     return { 'type2id' : dict( self.__typeToId ),
              'maxTasks' : dict( self.__maxTasks ),
+             'batchSize' : dict( self.__batchSize ),
              'execTasks' : dict( self.__execTasks ),
              'tasksInExec' : dict( self.__taskInExec ),
              'locked' : self.__lock.locked() }
 
-  def addExecutor( self, eId, eTypes, maxTasks = 1 ):
+  def addExecutor( self, eId, eTypes, maxTasks = 1, batchSize = 1 ):
     self.__lock.acquire()
     try:
       self.__maxTasks[ eId ] = max( 1, maxTasks )
+      self.__batchSize[ eId ] = max( 1, batchSize )
       if eId not in self.__execTasks:
         self.__execTasks[ eId ] = set()
       if type( eTypes ) not in ( types.ListType, types.TupleType ):
@@ -51,6 +54,7 @@ class ExecutorState:
         tasks.append( taskId )
       self.__execTasks.pop( eId )
       self.__maxTasks.pop( eId )
+      self.__batchSize.pop( eId )
       return tasks
     finally:
       self.__lock.release()
@@ -73,6 +77,12 @@ class ExecutorState:
     except KeyError:
       return 0
 
+  def batchSize( self, eId ):
+    try:
+      return self.__batchSize[ eId ]
+    except KeyError:
+      return 1
+
   def getFreeExecutors( self, eType ):
     execs = {}
     try:
@@ -199,6 +209,31 @@ class ExecutorQueues:
     #Not found. release and return None
     return None
 
+  def popTasks( self, eTypes, maxTasks = 1 ):
+    """ Pop up to maxTasks tasks waiting for the first of eTypes that has any
+    """
+    if type( eTypes ) not in ( types.ListType, types.TupleType ):
+      eTypes = [ eTypes ]
+    self.__lock.acquire()
+    try:
+      for eType in eTypes:
+        try:
+          queue = self.__queues[ eType ]
+        except KeyError:
+          continue
+        if not queue:
+          continue
+        taskIds = queue[ :maxTasks ]
+        del( queue[ :maxTasks ] )
+        for taskId in taskIds:
+          del( self.__taskInQueue[ taskId ] )
+        self.__lastUse[ eType ] = time.time()
+        self.__log.verbose( "Popped tasks %s from executor %s waiting queue" % ( taskIds, eType ) )
+        return ( taskIds, eType )
+    finally:
+      self.__lock.release()
+    return None
+
   def getState( self ):
     self.__lock.acquire()
     try:
@@ -246,6 +281,9 @@ class ExecutorDispatcherCallbacks:
   def cbSendTask( self, taskId, taskObj, eId, eType ):
     return S_ERROR( "No send task callback defined" )
 
+  def cbSendTasks( self, taskList, eId, eType ):
+    return S_ERROR( "No send tasks callback defined" )
+
   def cbDisconectExecutor( self, eId ):
     return S_ERROR( "No disconnect callback defined" )
 
@@ -311,6 +349,8 @@ class ExecutorDispatcher:
                                        "Executors", "tasks", self.__monitor.OP_RATE, 300 )
       self.__monitor.registerActivity( "taskTime", "Task processing time",
                                        "Executors", "seconds", self.__monitor.OP_MEAN, 300 )
+      self.__monitor.registerActivity( "batchSize", "Tasks sent per message",
+                                       "Executors", "tasks", self.__monitor.OP_MEAN, 300 )
 
   def setFailedOnTooFrozen( self, value ):
     self.__failedOnTooFrozen = value
@@ -352,9 +392,10 @@ class ExecutorDispatcher:
         self.__monitor.addMark( "executors-%s" % eType, self.__execTypes[ eType ] )
       except KeyError:
         pass
+      self.__monitor.addMark( "waiting-%s" % eType, self.__queues.waitingTasks( eType ) )
     self.__monitor.addMark( "executors", len( self.__idMap ) )
 
-  def addExecutor( self, eId, eTypes, maxTasks = 1 ):
+  def addExecutor( self, eId, eTypes, maxTasks = 1, batchSize = 1 ):
     self.__log.verbose( "Adding new %s executor to the pool %s" % ( eId, ", ".join ( eTypes ) ) )
     self.__executorsLock.acquire()
     try:
@@ -363,7 +404,7 @@ class ExecutorDispatcher:
       if type( eTypes ) not in ( types.ListType, types.TupleType ):
         eTypes = [ eTypes ]
       self.__idMap[ eId ] = list( eTypes )
-      self.__states.addExecutor( eId, eTypes, maxTasks )
+      self.__states.addExecutor( eId, eTypes, maxTasks, batchSize )
       for eType in eTypes:
         if eType not in self.__execTypes:
           self.__execTypes[ eType ] = 0
@@ -374,6 +415,10 @@ class ExecutorDispatcher:
                                              "Executors", "tasks", self.__monitor.OP_RATE, 300 )
             self.__monitor.registerActivity( "taskTime-%s" % eType, "Task processing time for %s" % eType,
                                              "Executors", "seconds", self.__monitor.OP_MEAN, 300 )
+            self.__monitor.registerActivity( "waiting-%s" % eType, "Tasks waiting for %s" % eType,
+                                             "Executors", "tasks", self.__monitor.OP_MEAN, 300 )
+            self.__monitor.registerActivity( "batchSize-%s" % eType, "Tasks sent per message to %s" % eType,
+                                             "Executors", "tasks", self.__monitor.OP_MEAN, 300 )
         self.__execTypes[ eType ] += 1
     finally:
       self.__executorsLock.release()
@@ -459,13 +504,14 @@ class ExecutorDispatcher:
 
   def __unfreezeTasks( self, eType = False ):
     iP = 0
+    unfrozenTypes = set()
     while iP < len( self.__taskFreezer ):
       self.__freezerLock.acquire()
       try:
         try:
           taskId = self.__taskFreezer[ iP ]
         except IndexError:
-          return
+          break
         try:
           eTask = self.__tasks[ taskId ]
         except KeyError:
@@ -485,7 +531,15 @@ class ExecutorDispatcher:
       #Out of the lock zone to minimize zone of exclusion
       eTask.frozenTime += time.time() - eTask.frozenSince
       self.__log.verbose( "Unfreezed task %s" % taskId )
-      self.__dispatchTask( taskId, defrozeIfNeeded = False )
+      self.__dispatchTask( taskId, defrozeIfNeeded = False, fillExecutors = False )
+      try:
+        unfrozenTypes.add( self.__tasks[ taskId ].eType )
+      except KeyError:
+        pass
+    #Fill the executors once all the tasks are queued so they go in batches
+    for unfrozenType in unfrozenTypes:
+      if unfrozenType in self.__execTypes:
+        self.__fillExecutors( unfrozenType, defrozeIfNeeded = False )
 
   def __addTaskIfNew( self, taskId, taskObj ):
     self.__tasksLock.acquire()
@@ -505,7 +559,7 @@ class ExecutorDispatcher:
     except KeyError:
       return None
 
-  def __dispatchTask( self, taskId, defrozeIfNeeded = True ):
+  def __dispatchTask( self, taskId, defrozeIfNeeded = True, fillExecutors = True ):
     self.__log.verbose( "Dispatching task %s" % taskId )
     #If task already in executor skip
     if self.__states.getExecutorOfTask( taskId ):
@@ -541,7 +595,8 @@ class ExecutorDispatcher:
       return self.removeTask( taskId )
 
     self.__queues.pushTask( eType, taskId )
-    self.__fillExecutors( eType, defrozeIfNeeded = defrozeIfNeeded )
+    if fillExecutors:
+      self.__fillExecutors( eType, defrozeIfNeeded = defrozeIfNeeded )
     return S_OK()
 
   def __taskProcessedCallback( self, taskId, taskObj, eType ):
@@ -771,19 +826,55 @@ class ExecutorDispatcher:
         except ValueError:
           pass
         searchTypes.append( eType )
-    pData = self.__queues.popTask( searchTypes ) 
+    #Batch as many tasks as the executor accepts in one message. While it is
+    #busy wait until there is room for a whole batch
+    batchSize = self.__states.batchSize( eId )
+    freeSlots = self.__states.freeSlots( eId )
+    if batchSize > 1 and freeSlots < batchSize and self.__states.getTasksForExecutor( eId ):
+      return S_OK()
+    maxTasks = min( batchSize, max( 1, freeSlots ) )
+    pData = self.__queues.popTasks( searchTypes, maxTasks )
     if pData == None:
       self.__log.verbose( "No more tasks for %s" % eTypes )
       return S_OK()
-    taskId, eType = pData
-    self.__log.verbose( "Sending task %s to %s=%s" % ( taskId, eType, eId ) )
-    self.__states.addTask( eId, taskId )
-    result = self.__msgTaskToExecutor( taskId, eId, eType )
+    taskIds, eType = pData
+    self.__log.verbose( "Sending tasks %s to %s=%s" % ( taskIds, eType, eId ) )
+    for taskId in taskIds:
+      self.__states.addTask( eId, taskId )
+    if len( taskIds ) == 1:
+      result = self.__msgTaskToExecutor( taskIds[0], eId, eType )
+    else:
+      result = self.__msgTasksToExecutor( taskIds, eId, eType )
     if not result[ 'OK' ]:
-      self.__queues.pushTask( eType, taskId, ahead = True )
-      self.__states.removeTask( taskId )
+      for taskId in reversed( taskIds ):
+        self.__queues.pushTask( eType, taskId, ahead = True )
+        self.__states.removeTask( taskId )
+      return result
+    if self.__monitor:
+      self.__monitor.addMark( "batchSize-%s" % eType, len( taskIds ) )
+      self.__monitor.addMark( "batchSize", len( taskIds ) )
+    return S_OK( taskIds[0] )
+
+  def __msgTasksToExecutor( self, taskIds, eId, eType ):
+    taskList = []
+    now = time.time()
+    for taskId in taskIds:
+      try:
+        eTask = self.__tasks[ taskId ]
+      except KeyError:
+        return S_ERROR( "Task %s has been deleted" % taskId )
+      eTask.sendTime = now
+      taskList.append( ( taskId, eTask.taskObj ) )
+    try:
+      result = self.__cbHolder.cbSendTasks( taskList, eId, eType )
+    except:
+      self.__log.exception( "Exception while sending tasks to executor" )
+      return S_ERROR( "Exception while sending tasks to executor" )
+    if isReturnStructure( result ):
       return result
-    return S_OK( taskId )
+    errMsg = "Send tasks callback did not send back an S_OK/S_ERROR structure"
+    self.__log.fatal( errMsg )
+    return S_ERROR( errMsg )
 
   def __msgTaskToExecutor( self, taskId, eId, eType ):
     try:
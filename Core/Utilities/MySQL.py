@@ -3,19 +3,22 @@
 ########################################################################
 """ DIRAC Basic MySQL Class
     It provides access to the basic MySQL methods in a multithread-safe mode
-    keeping used connections in a python Queue for further reuse.
+    keeping used connections in a pool (DBConnectionPool) for further reuse.
 
     These are the coded methods:
 
 
-    __init__( host, user, passwd, name, [maxConnsInQueue=10] )
+    __init__( host, user, passwd, name, [port=3306], [maxQueueSize=3], [debug=False],
+              [minQueueSize=1], [idleTimeout=600], [maxConnectionAge=3600], [slowQueryTime=1.0] )
 
-    Initializes the Queue and tries to connect to the DB server,
+    Initializes the connection pool and tries to connect to the DB server,
     using the _connect method.
-    "maxConnsInQueue" defines the size of the Queue of open connections
-    that are kept for reuse. It also defined the maximum number of open
-    connections available from the object.
-    maxConnsInQueue = 0 means unlimited and it is not supported.
+    "maxQueueSize" defines the maximum number of connections used at the
+    same time by the object, further queries wait for a free one.
+    "minQueueSize" connections are kept open even if they are idle for more
+    than "idleTimeout" secs. No connection is used for more than
+    "maxConnectionAge" secs. Idle connections are pinged before being used.
+    Statements taking more than "slowQueryTime" secs are logged.
 
 
     _except( methodName, exception, errorMessage )
@@ -35,20 +38,20 @@
     _query( cmd, [conn] )
 
     Executes SQL command "cmd".
-    Gets a connection from the Queue (or open a new one if none is available),
-    the used connection is  back into the Queue.
+    Gets a connection from the pool (or open a new one if none is available),
+    the used connection is put back into the pool.
     If a connection to the the DB is passed as second argument this connection
-    is used and is not  in the Queue.
+    is used and is not put in the pool.
     Returns S_OK with fetchall() out in Value or S_ERROR upon failure.
 
 
     _update( cmd, [conn] )
 
     Executes SQL command "cmd" and issue a commit
-    Gets a connection from the Queue (or open a new one if none is available),
-    the used connection is  back into the Queue.
+    Gets a connection from the pool (or open a new one if none is available),
+    the used connection is put back into the pool.
     If a connection to the the DB is passed as second argument this connection
-    is used and is not  in the Queue
+    is used and is not put in the pool
     Returns S_OK with number of updated registers in Value or S_ERROR upon failure.
 
 
@@ -59,10 +62,18 @@
 
     _getConnection()
 
-    Gets a connection from the Queue (or open a new one if none is available)
+    Gets a connection from the pool (or open a new one if none is available)
     Returns S_OK with connection in Value or S_ERROR
     the calling method is responsible for closing this connection once it is no
-    longer needed.
+    longer needed. It does not count for the maxQueueSize limit.
+
+
+    getQueryReport( [sortBy='totalTime'], [limit=0] )
+
+    Returns S_OK with a dictionary with the connection pool statistics in
+    'Pool' and the latency statistics of the statements executed by _query
+    and _update, grouped by fingerprint (the statement with the literals
+    replaced by ?), in 'Queries'. See QueryStats.getReport.
 
 
 
@@ -93,6 +104,18 @@
       String type values will be appropriately escaped.
 
 
+    insertMultipleRows( self, tableName, inFields, rowList, conn = None,
+                        updateFields = None, ignore = False ):
+
+      Insert many rows in "tableName", each one a list of values for the
+      fields "inFields", with multi-row INSERT statements kept below the
+      server max_allowed_packet. Rows with an existing unique key get the
+      "updateFields" set to the new values (ON DUPLICATE KEY UPDATE) or are
+      skipped if "ignore" is True.
+      return S_OK( number of affected rows )
+      String type values will be appropriately escaped, None is NULL.
+
+
     updateFields( self, tableName, updateFields = None, updateValues = None,
                   condDict = None,
                   limit = False, conn = None,
@@ -156,6 +179,8 @@ __RCSID__ = "$Id$"
 from DIRAC                                  import gLogger
 from DIRAC                                  import S_OK, S_ERROR
 from DIRAC                                  import Time
+from DIRAC.Core.Utilities.DBConnectionPool  import DBConnectionPool
+from DIRAC.Core.Utilities.QueryStats        import QueryStats
 
 import MySQLdb
 # This is for proper initialization of embeded server, it should only be called once
@@ -163,13 +188,16 @@ MySQLdb.server_init( ['--defaults-file=/opt/dirac/etc/my.cnf', '--datadir=/opt/m
 gInstancesCount = 0
 gDebugFile = None
 
-import Queue
 import types
 import time
 import threading
 from types import StringTypes, DictType, ListType
 
 MAXCONNECTRETRY = 10
+# Upper limit for the size of the statements built by insertMultipleRows
+MAXBULKSTATEMENTSIZE = 4 * 1024 * 1024
+# Size assumed if max_allowed_packet can not be read
+DEFAULTMAXPACKETSIZE = 1024 * 1024
 
 def _checkQueueSize( maxQueueSize ):
   """
@@ -225,7 +253,8 @@ class MySQL:
   """
   __initialized = False
 
-  def __init__( self, hostName, userName, passwd, dbName, port = 3306, maxQueueSize = 3, debug = False ):
+  def __init__( self, hostName, userName, passwd, dbName, port = 3306, maxQueueSize = 3, debug = False,
+                minQueueSize = 1, idleTimeout = 600, maxConnectionAge = 3600, slowQueryTime = 1.0 ):
     """
     set MySQL connection parameters and try to connect
     """
@@ -249,10 +278,14 @@ class MySQL:
     self.__passwd = str( passwd )
     self.__dbName = str( dbName )
     self.__port = port
-    # Create the connection Queue to reuse connections
-    self.__connectionQueue = Queue.Queue( maxQueueSize )
-    # Create the connection Semaphore to limit total number of open connection
-    self.__connectionSemaphore = threading.Semaphore( maxQueueSize )
+    # Create the connection pool to reuse connections and limit the number of them in use
+    self.__connectionPool = DBConnectionPool( self.__connectWithRetries,
+                                              minSize = minQueueSize,
+                                              maxSize = maxQueueSize,
+                                              idleTimeout = idleTimeout,
+                                              maxAge = maxConnectionAge )
+    self.__queryStats = QueryStats( slowQueryTime, logger = self.log )
+    self.__maxPacketSize = 0
 
     self.__initialized = True
     self._connect()
@@ -267,14 +300,8 @@ class MySQL:
   def __del__( self ):
     global gInstancesCount
     try:
-      while 1 and self.__initialized:
-        self.__connectionSemaphore.release()
-        try:
-          connection = self.__connectionQueue.get_nowait()
-          connection.close()
-        except Queue.Empty:
-          self.log.debug( 'No more connection in Queue' )
-          break
+      if self.__initialized:
+        self.__connectionPool.close()
       if gInstancesCount == 1:
         # only when the last instance of a MySQL object is deleted, the server
         # can be ended
@@ -372,16 +399,16 @@ class MySQL:
     """
     self.log.debug( '_escapeValues:', inValues )
 
-    retDict = self.__getConnection()
-    if not retDict['OK']:
-      return retDict
-    connection = retDict['Value']
-
     inEscapeValues = []
 
     if not inValues:
       return S_OK( inEscapeValues )
 
+    retDict = self.__getConnection()
+    if not retDict['OK']:
+      return retDict
+    connection = retDict['Value']
+
     for value in inValues:
       if type( value ) in StringTypes:
         retDict = self.__escapeString( value, connection )
@@ -401,7 +428,7 @@ class MySQL:
 
   def _connect( self ):
     """
-    open connection to MySQL DB and put Connection into Queue
+    open connection to MySQL DB and put Connection into the pool
     set connected flag to True and return S_OK
     return S_ERROR upon failure
     """
@@ -418,7 +445,7 @@ class MySQL:
                        '[%s@%s] by user %s/%s.' %
                        ( self.__dbName, self.__hostName, self.__userName, self.__passwd ) )
     try:
-      self.__newConnection()
+      self.__connectionPool.put( self.__newConnection() )
       self.log.verbose( '_connect: Connected.' )
       self._connected = True
       return S_OK()
@@ -441,17 +468,13 @@ class MySQL:
       else:
         self.logger.verbose( '_query:', cmd[:min( len( cmd ) , 512 )] )
 
-    if gDebugFile:
-      start = time.time()
-
-    if conn:
-      connection = conn
-    else:
-      retDict = self._getConnection()
-      if not retDict['OK']:
-        return retDict
-      connection = retDict[ 'Value' ]
+    retDict = self.__getConnection( conn = conn )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict[ 'Value' ]
 
+    start = time.time()
+    lostConnection = False
     try:
       cursor = connection.cursor()
       if cursor.execute( cmd ):
@@ -476,13 +499,17 @@ class MySQL:
       retDict = S_OK( res )
     except Exception , x:
       self.log.warn( '_query:', cmd )
+      lostConnection = isinstance( x, MySQLdb.OperationalError )
       retDict = self._except( '_query', x, 'Execution failed.' )
 
     try:
       cursor.close()
     except Exception:
       pass
+    if not conn:
+      self.__putConnection( connection, discard = lostConnection )
 
+    self.__queryStats.record( cmd, time.time() - start, error = not retDict['OK'] )
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
       gDebugFile.flush()
@@ -503,14 +530,13 @@ class MySQL:
       else:
         self.logger.verbose( '_update:', cmd[:min( len( cmd ) , 512 )] )
 
-    if gDebugFile:
-      start = time.time()
-
     retDict = self.__getConnection( conn = conn )
     if not retDict['OK']:
       return retDict
     connection = retDict['Value']
 
+    start = time.time()
+    lostConnection = False
     try:
       cursor = connection.cursor()
       res = cursor.execute( cmd )
@@ -524,6 +550,7 @@ class MySQL:
         retDict[ 'lastRowId' ] = cursor.lastrowid
     except Exception, x:
       self.log.warn( '_update: %s: %s' % ( cmd, str(x) ) )
+      lostConnection = isinstance( x, MySQLdb.OperationalError )
       retDict = self._except( '_update', x, 'Execution failed.' )
 
     try:
@@ -531,8 +558,9 @@ class MySQL:
     except Exception:
       pass
     if not conn:
-      self.__putConnection( connection )
+      self.__putConnection( connection, discard = lostConnection )
 
+    self.__queryStats.record( cmd, time.time() - start, error = not retDict['OK'] )
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
       gDebugFile.flush()
@@ -553,12 +581,10 @@ class MySQL:
       return S_ERROR( "_transaction: wrong type (%s) for cmdList" % type( cmdList ) )
 
     ## get connection 
-    connection = conn
-    if not connection:
-      retDict = self._getConnection()
-      if not retDict['OK']:
-        return retDict
-      connection = retDict[ 'Value' ]
+    retDict = self.__getConnection( conn = conn )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict[ 'Value' ]
 
     ## list with cmds and their results   
     cmdRet = []
@@ -568,14 +594,19 @@ class MySQL:
         cmdRet.append( ( cmd, cursor.execute( cmd ) ) )
       connection.commit()
     except Exception, error:
-      self.logger.execption( error )
+      self.logger.exception( error )
       ## rollback, put back connection to the pool 
-      connection.rollback()
-      self.__putConnection( connection )
+      try:
+        connection.rollback()
+      except Exception:
+        pass
+      if not conn:
+        self.__putConnection( connection, discard = isinstance( error, MySQLdb.OperationalError ) )
       return S_ERROR( error )
     ## close cursor, put back connection to the pool
     cursor.close()
-    self.__putConnection( connection )
+    if not conn:
+      self.__putConnection( connection )
     return S_OK( cmdRet )
 
   def _createTables( self, tableDict, force = False ):
@@ -775,41 +806,48 @@ class MySQL:
 
   def __newConnection( self ):
     """
-    Create a New connection and put it in the Queue
+    Open a new connection to the DB
     """
     self.log.debug( '__newConnection:' )
 
-    connection = MySQLdb.connect( host = self.__hostName,
-                                  port = self.__port,
-                                  user = self.__userName,
-                                  passwd = self.__passwd,
-                                  db = self.__dbName )
-    self.__putConnection( connection )
+    return MySQLdb.connect( host = self.__hostName,
+                            port = self.__port,
+                            user = self.__userName,
+                            passwd = self.__passwd,
+                            db = self.__dbName )
 
+  def __connectWithRetries( self ):
+    """
+    Open a new connection to the DB, it will retry MAXCONNECTRETRY times
+    before giving up
+    """
+    trial = 0
+    while True:
+      try:
+        return self.__newConnection()
+      except Exception, x:
+        trial += 1
+        if trial >= MAXCONNECTRETRY:
+          raise
+        self.log.debug( '__connectWithRetries: Fails to open connection', x )
+        time.sleep( trial * 5.0 )
 
-  def __putConnection( self, connection ):
+  def __putConnection( self, connection, discard = False ):
     """
-    Put a connection in the Queue, if the queue is full, the connection is closed
+    Give back a connection to the pool, if the pool is full or the connection
+    is broken it is closed
     """
     self.log.debug( '__putConnection:' )
 
-    # Release the semaphore first, in case something fails
-    self.__connectionSemaphore.release()
     try:
-      self.__connectionQueue.put_nowait( connection )
-    except Queue.Full, x:
-      self.log.debug( '__putConnection: Full Queue' )
-      try:
-        connection.close()
-      except:
-        pass
+      self.__connectionPool.put( connection, discard = discard )
     except Exception, x:
-      self._except( '__putConnection', x, 'Failed to put Connection in Queue' )
+      self._except( '__putConnection', x, 'Failed to put Connection in pool' )
 
   def _getConnection( self ):
     """
-    Return a new connection to the DB
-    It uses the private method __getConnection
+    Return a connection to the DB for the exclusive use of the caller.
+    It does not count for the limit of connections in use
     """
     if not self.__initialized:
       error = 'DB not properly initialized'
@@ -818,54 +856,35 @@ class MySQL:
 
     self.log.debug( '_getConnection:' )
 
-    retDict = self.__getConnection( trial = 0 )
-    self.__connectionSemaphore.release()
-    return retDict
+    return self.__getConnection( detached = True )
 
-  def __getConnection( self, conn = None, trial = 0 ):
+  def __getConnection( self, conn = None, detached = False ):
     """
-    Return a new connection to the DB,
+    Return a connection to the DB,
     if conn is provided then just return it.
-    then try the Queue, if it is empty add a newConnection to the Queue and retry
-    it will retry MAXCONNECTRETRY to open a new connection and will return
-    an error if it fails.
+    Otherwise borrow one from the pool, that waits for one to be free if
+    maxQueueSize are in use
     """
     self.log.debug( '__getConnection:' )
 
     if conn:
       return S_OK( conn )
 
-    try:
-      self.__connectionSemaphore.acquire()
-      connection = self.__connectionQueue.get_nowait()
-      self.log.debug( '__getConnection: Got a connection from Queue' )
-      if connection:
-        try:
-          # This will try to reconnect if the connection has timeout
-          connection.ping( True )
-        except:
-          # if the ping fails try with a new connection from the Queue
-          self.__connectionSemaphore.release()
-          return self.__getConnection()
-        return S_OK( connection )
-    except Queue.Empty, x:
-      self.__connectionSemaphore.release()
-      self.log.debug( '__getConnection: Empty Queue' )
-      try:
-        if trial == min( 10, MAXCONNECTRETRY ):
-          return S_ERROR( 'Could not get a connection after %s retries.' % MAXCONNECTRETRY )
-        try:
-          self.__newConnection()
-          return self.__getConnection()
-        except Exception, x:
-          self.log.debug( '__getConnection: Fails to get connection from Queue', x )
-          time.sleep( trial * 5.0 )
-          newtrial = trial + 1
-          return self.__getConnection( trial = newtrial )
-      except Exception, x:
-        return self._except( '__getConnection:', x, 'Failed to get connection from Queue' )
-    except Exception, x:
-      return self._except( '__getConnection:', x, 'Failed to get connection from Queue' )
+    retDict = self.__connectionPool.get( detached = detached )
+    if not retDict['OK']:
+      self.log.error( '__getConnection: Failed to get connection from pool', retDict['Message'] )
+    return retDict
+
+  def getQueryReport( self, sortBy = 'totalTime', limit = 0 ):
+    """
+    Statistics of the connection pool and of the statements executed
+    """
+    return S_OK( { 'Pool' : self.__connectionPool.getStats(),
+                   'Queries' : self.__queryStats.getReport( sortBy = sortBy, limit = limit ) } )
+
+  def resetQueryReport( self ):
+    self.__queryStats.reset()
+    return S_OK()
 
 ########################################################################################
 #
@@ -1331,6 +1350,149 @@ class MySQL:
     return self._update( 'INSERT INTO %s %s VALUES %s' %
                          ( table, inFieldString, inValueString ), conn, debug = True )
 
+  def __getMaxStatementSize( self, connection ):
+    """
+    Max size of the statements sent to the server, from its max_allowed_packet
+    """
+    if not self.__maxPacketSize:
+      retDict = self._query( 'SELECT @@max_allowed_packet', connection, debug = True )
+      if retDict['OK'] and retDict['Value']:
+        self.__maxPacketSize = int( retDict['Value'][0][0] )
+      else:
+        self.__maxPacketSize = DEFAULTMAXPACKETSIZE
+    return min( self.__maxPacketSize, MAXBULKSTATEMENTSIZE )
+
+  def __escapeRow( self, row, connection ):
+    """
+    Build the "( v1, v2, ... )" string of a row for insertMultipleRows
+    """
+    specialValues = ( 'UTC_TIMESTAMP', 'TIMESTAMPADD', 'TIMESTAMPDIFF' )
+    escaped = []
+    for value in row:
+      if value is None:
+        escaped.append( 'NULL' )
+      elif type( value ) in ( types.IntType, types.LongType ):
+        #repr would give 17L for the longs MySQLdb returns for INT columns
+        escaped.append( '%d' % value )
+      elif type( value ) == types.FloatType:
+        escaped.append( repr( value ) )
+      else:
+        value = str( value )
+        if value.startswith( specialValues ):
+          escaped.append( value )
+        else:
+          escaped.append( '"%s"' % connection.escape_string( value ) )
+    return '(%s)' % ','.join( escaped )
+
+  def _buildMultipleRowInserts( self, tableName, inFields, rowList, conn = None,
+                                updateFields = None, ignore = False ):
+    """
+      Build the multi-row INSERT statements below the server max_allowed_packet
+      for the rows in rowList, lists of values for inFields, without executing
+      them, so that they can go into a _transaction.
+      Rows with an existing unique key get the updateFields set to the new
+      values, or are skipped if ignore is True.
+      Return S_OK( [ statement1, ... ] )
+    """
+    table = _quotedList( [tableName] )
+    if not table:
+      error = 'Invalid tableName argument'
+      self.log.warn( 'insertMultipleRows:', error )
+      return S_ERROR( error )
+
+    inFieldString = _quotedList( inFields )
+    if inFieldString == None:
+      error = 'Invalid inFields arguments'
+      self.log.warn( 'insertMultipleRows:', error )
+      return S_ERROR( error )
+
+    if not rowList:
+      return S_OK( [] )
+
+    for row in rowList:
+      if len( row ) != len( inFields ):
+        error = 'Mismatch between inFields and row values'
+        self.log.warn( 'insertMultipleRows:', error )
+        return S_ERROR( error )
+
+    suffix = ''
+    if updateFields:
+      updateList = [ _quotedList( [ field ] ) for field in updateFields ]
+      if None in updateList:
+        error = 'Invalid updateFields arguments'
+        self.log.warn( 'insertMultipleRows:', error )
+        return S_ERROR( error )
+      suffix = ' ON DUPLICATE KEY UPDATE %s' % ', '.join( [ '%s=VALUES(%s)' % ( field, field )
+                                                            for field in updateList ] )
+    ignoreString = ''
+    if ignore and not updateFields:
+      ignoreString = ' IGNORE'
+    prefix = 'INSERT%s INTO %s ( %s ) VALUES ' % ( ignoreString, table, inFieldString )
+
+    retDict = self.__getConnection( conn )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict['Value']
+
+    try:
+      maxSize = self.__getMaxStatementSize( connection ) - len( prefix ) - len( suffix ) - 1024
+
+      cmdList = []
+      chunk = []
+      chunkSize = 0
+      for row in rowList:
+        try:
+          rowString = self.__escapeRow( row, connection )
+        except Exception, x:
+          return self._except( 'insertMultipleRows', x, 'Could not escape values' )
+        if len( rowString ) > maxSize:
+          return S_ERROR( 'Row too large for max_allowed_packet (%s bytes)' % len( rowString ) )
+        if chunk and chunkSize + len( rowString ) + 1 > maxSize:
+          cmdList.append( '%s%s%s' % ( prefix, ','.join( chunk ), suffix ) )
+          chunk = []
+          chunkSize = 0
+        chunk.append( rowString )
+        chunkSize += len( rowString ) + 1
+      cmdList.append( '%s%s%s' % ( prefix, ','.join( chunk ), suffix ) )
+      return S_OK( cmdList )
+    finally:
+      if not conn:
+        self.__putConnection( connection )
+
+  def insertMultipleRows( self, tableName, inFields, rowList, conn = None,
+                          updateFields = None, ignore = False ):
+    """
+      Insert the rows in rowList, lists of values for inFields, using multi-row
+      INSERT statements below the server max_allowed_packet.
+      When several statements are needed they run in a single transaction,
+      so that either all the rows or none are inserted.
+      Rows with an existing unique key get the updateFields set to the new
+      values, or are skipped if ignore is True.
+      Return S_OK( number of affected rows )
+    """
+    retDict = self.__getConnection( conn )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict['Value']
+
+    try:
+      retDict = self._buildMultipleRowInserts( tableName, inFields, rowList, connection,
+                                               updateFields = updateFields, ignore = ignore )
+      if not retDict['OK']:
+        return retDict
+      self.log.verbose( 'insertMultipleRows:', 'inserting %s rows into table %s' % ( len( rowList ), tableName ) )
+
+      cmdList = retDict['Value']
+      if len( cmdList ) == 1:
+        return self._update( cmdList[0], connection, debug = True )
+      retDict = self._transaction( cmdList, connection )
+      if not retDict['OK']:
+        return retDict
+      return S_OK( sum( [ affected for cmd, affected in retDict['Value'] ] ) )
+    finally:
+      if not conn:
+        self.__putConnection( connection )
+
 #####################################################################################
 #
 #   This is a test code for this class, it requires access to a MySQL DB
@@ -1462,6 +1624,35 @@ if __name__ == '__main__':
     assert RESULT['OK']
     assert RESULT['Value'] == []
 
+    RESULT = TESTDB.insertMultipleRows( NAME, SOMEFIELDS, [ ['Name3', 'Surn3', J] for J in range( 100 ) ] )
+    assert RESULT['OK']
+    assert RESULT['Value'] == 100
+
+    RESULT = TESTDB.deleteEntries( NAME )
+    assert RESULT['OK']
+    assert RESULT['Value'] == 100
+
+    RESULT = TESTDB.insertMultipleRows( NAME, ['ID', 'Count'], [ [5000, 1] ] )
+    assert RESULT['OK']
+    assert RESULT['Value'] == 1
+
+    # Updated rows count twice
+    RESULT = TESTDB.insertMultipleRows( NAME, ['ID', 'Count'], [ [5000, 2], [5001, 2] ], updateFields = ['Count'] )
+    assert RESULT['OK']
+    assert RESULT['Value'] == 3
+
+    RESULT = TESTDB.insertMultipleRows( NAME, ['ID', 'Count'], [ [5000, 3] ], ignore = True )
+    assert RESULT['OK']
+    assert RESULT['Value'] == 0
+
+    RESULT = TESTDB.getFields( NAME, ['Count'], {'Count' : 2} )
+    assert RESULT['OK']
+    assert len( RESULT['Value'] ) == 2
+
+    RESULT = TESTDB.deleteEntries( NAME )
+    assert RESULT['OK']
+    assert RESULT['Value'] == 2
+
     RESULT = TESTDB.insertFields( NAME, inFields = ALLFIELDS, inValues = ALLVALUES )
     assert RESULT['OK']
     assert RESULT['Value'] == 1
@@ -126,6 +126,19 @@ def checkHostsMatch( host1, host2 ):
       return S_OK( True )
   return S_OK( False )
 
-
-
-
+def setReusePort( sock ):
+  """
+  Allow several processes to listen on the same port (SO_REUSEPORT).
+  The kernel balances the incoming connections between them
+  """
+  reusePort = getattr( socket, 'SO_REUSEPORT', False )
+  if not reusePort and platform.system() == "Linux":
+    #Python 2 doesn't define it. Available since Linux 3.9
+    reusePort = 15
+  if not reusePort:
+    return S_ERROR( "SO_REUSEPORT is not supported in this platform" )
+  try:
+    sock.setsockopt( socket.SOL_SOCKET, reusePort, 1 )
+  except socket.error, e:
+    return S_ERROR( "Cannot set SO_REUSEPORT: %s" % str( e ) )
+  return S_OK()
@@ -0,0 +1,135 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Per statement latency statistics for the MySQL class
+
+    Statements are grouped by fingerprint: the SQL with literals replaced by ?
+    and value lists collapsed, so that the same query with different arguments
+    is accounted together. For each fingerprint a latency histogram is kept,
+    from which the percentiles of the report are estimated.
+"""
+
+__RCSID__ = "$Id$"
+
+import re
+import threading
+from DIRAC import gLogger
+
+#Upper limits of the histogram buckets in millisecs. The last one takes the rest
+HISTOGRAM_BUCKETS = ( 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000 )
+
+MAX_FINGERPRINT_LENGTH = 300
+
+_reString = re.compile( r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"" )
+_reNumber = re.compile( r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b" )
+_reInList = re.compile( r"\(\s*\?(?:\s*,\s*\?)*\s*\)" )
+_reValues = re.compile( r"\(\?\)(?:\s*,\s*\(\?\))+" )
+_reSpaces = re.compile( r"\s+" )
+#Whole VALUES list of multi-row INSERTs, up to the ON DUPLICATE KEY clause if any
+_reInsertValues = re.compile( r"(?<!=)(?<!= )\bVALUES\s*\(.*?\)(?=\s*(?:ON\s+DUPLICATE\b.*)?;?\s*$)", re.I | re.S )
+
+def fingerprint( cmd ):
+  """
+  Normalize an SQL statement so that the ones differing only in literals match
+  """
+  fp = _reInsertValues.sub( "VALUES (?)", cmd )
+  fp = _reString.sub( "?", fp )
+  fp = _reNumber.sub( "?", fp )
+  fp = _reInList.sub( "(?)", fp )
+  fp = _reValues.sub( "(?)", fp )
+  fp = _reSpaces.sub( " ", fp ).strip()
+  if len( fp ) > MAX_FINGERPRINT_LENGTH:
+    fp = "%s..." % fp[ :MAX_FINGERPRINT_LENGTH ]
+  return fp
+
+class QueryStats:
+
+  def __init__( self, slowQueryTime = 1.0, maxFingerprints = 1000, logger = None ):
+    """ Statements taking more than slowQueryTime secs are logged """
+    self.slowQueryTime = slowQueryTime
+    self.maxFingerprints = maxFingerprints
+    if logger:
+      self.log = logger
+    else:
+      self.log = gLogger.getSubLogger( "QueryStats" )
+    self.__lock = threading.Lock()
+    self.__stats = {}
+
+  def __newEntry( self ):
+    return { 'count' : 0, 'errors' : 0, 'totalTime' : 0.0, 'maxTime' : 0.0, 'slow' : 0,
+             'histogram' : [ 0 ] * ( len( HISTOGRAM_BUCKETS ) + 1 ) }
+
+  def record( self, cmd, elapsed, error = False ):
+    """
+    Account a statement that took elapsed secs
+    """
+    fp = fingerprint( cmd )
+    millis = elapsed * 1000
+    bucket = len( HISTOGRAM_BUCKETS )
+    for i in range( len( HISTOGRAM_BUCKETS ) ):
+      if millis <= HISTOGRAM_BUCKETS[i]:
+        bucket = i
+        break
+    slow = self.slowQueryTime and elapsed > self.slowQueryTime
+    self.__lock.acquire()
+    try:
+      if fp not in self.__stats:
+        if len( self.__stats ) >= self.maxFingerprints:
+          fp = "<other>"
+        if fp not in self.__stats:
+          self.__stats[ fp ] = self.__newEntry()
+      entry = self.__stats[ fp ]
+      entry[ 'count' ] += 1
+      entry[ 'totalTime' ] += elapsed
+      entry[ 'maxTime' ] = max( entry[ 'maxTime' ], elapsed )
+      entry[ 'histogram' ][ bucket ] += 1
+      if error:
+        entry[ 'errors' ] += 1
+      if slow:
+        entry[ 'slow' ] += 1
+    finally:
+      self.__lock.release()
+    if slow:
+      self.log.warn( "Slow query (%.3f secs)" % elapsed, cmd[ :1000 ] )
+
+  def __percentile( self, histogram, count, maxTime, pct ):
+    """ Upper limit in secs of the bucket containing the percentile, bounded by maxTime """
+    target = count * pct / 100.
+    seen = 0
+    for i in range( len( histogram ) ):
+      seen += histogram[i]
+      if seen >= target:
+        if i < len( HISTOGRAM_BUCKETS ):
+          return min( HISTOGRAM_BUCKETS[i] / 1000., maxTime )
+        return maxTime
+    return 0.0
+
+  def getReport( self, sortBy = 'totalTime', limit = 0 ):
+    """
+    List of dicts, one per fingerprint, sorted by sortBy in decreasing order.
+    Times are in secs and percentiles are bucket upper limits
+    """
+    self.__lock.acquire()
+    try:
+      items = [ ( fp, dict( entry, histogram = list( entry[ 'histogram' ] ) ) ) for fp, entry in self.__stats.items() ]
+    finally:
+      self.__lock.release()
+    report = []
+    for fp, entry in items:
+      count = entry[ 'count' ]
+      entry[ 'fingerprint' ] = fp
+      entry[ 'meanTime' ] = entry[ 'totalTime' ] / max( count, 1 )
+      for pct in ( 50, 95, 99 ):
+        entry[ 'p%s' % pct ] = self.__percentile( entry[ 'histogram' ], count, entry[ 'maxTime' ], pct )
+      report.append( entry )
+    report.sort( key = lambda entry: entry.get( sortBy, 0 ), reverse = True )
+    if limit:
+      report = report[ :limit ]
+    return report
+
+  def reset( self ):
+    self.__lock.acquire()
+    try:
+      self.__stats = {}
+    finally:
+      self.__lock.release()
@@ -24,6 +24,14 @@ class ThreadScheduler:
     self.__sleeper = time.sleep
     self.__min = min
 
+  def resetAfterFork( self ):
+    """
+    Threads don't survive a fork. Start a new executor thread in the child process
+    """
+    self.__thId = False
+    if self.__hood:
+      self.__createExecutorIfNeeded()
+
   def setMinValidPeriod( self, period ):
     self.__minPeriod = period
 
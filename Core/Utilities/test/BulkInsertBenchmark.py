@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: BulkInsertBenchmark.py
+########################################################################
+""" Compare inserting rows one statement per row with MySQL.insertMultipleRows
+
+    It needs access to a MySQL server. A LoggingInfo like table is created
+    in the given DB, filled in both ways and dropped. Rows per second are
+    printed for per row inserts, bulk inserts and bulk upserts.
+
+    Usage: BulkInsertBenchmark.py host user password dbName [rows]
+"""
+__RCSID__ = "$Id $"
+
+import sys
+import time
+from DIRAC.Core.Utilities.MySQL import MySQL
+
+TABLE = 'BulkInsertBenchmark'
+FIELDS = [ 'JobID', 'Status', 'MinorStatus', 'ApplicationStatus', 'StatusTime', 'StatusTimeOrder', 'StatusSource' ]
+
+def createTable( db ):
+  result = db._update( 'DROP TABLE IF EXISTS `%s`' % TABLE )
+  if not result['OK']:
+    return result
+  return db._update( 'CREATE TABLE `%s` ( `ID` INTEGER NOT NULL AUTO_INCREMENT, `JobID` INTEGER NOT NULL, '
+                     '`Status` VARCHAR(32) NOT NULL, `MinorStatus` VARCHAR(128) NOT NULL, '
+                     '`ApplicationStatus` VARCHAR(256) NOT NULL, `StatusTime` DATETIME NOT NULL, '
+                     '`StatusTimeOrder` DOUBLE(11,3) NOT NULL, `StatusSource` VARCHAR(32) NOT NULL, '
+                     'PRIMARY KEY (`ID`), INDEX (`JobID`) ) ENGINE = InnoDB' % TABLE )
+
+def makeRows( numRows ):
+  now = time.strftime( '%Y-%m-%d %H:%M:%S', time.gmtime() )
+  return [ [ i, 'Running', "Application 'step %s'" % i, 'DaVinci v%s' % i, now, 1000. + i, 'JobWrapper' ]
+           for i in range( numRows ) ]
+
+def perRow( db, rows ):
+  for row in rows:
+    result = db.insertFields( TABLE, list( FIELDS ), list( row ) )
+    if not result['OK']:
+      return result
+  return result
+
+def bulk( db, rows ):
+  return db.insertMultipleRows( TABLE, FIELDS, rows )
+
+def upsert( db, rows ):
+  rows = [ [ i + 1 ] + row for i, row in enumerate( rows ) ]
+  return db.insertMultipleRows( TABLE, [ 'ID' ] + FIELDS, rows, updateFields = [ 'Status', 'MinorStatus' ] )
+
+def run( name, db, function, rows ):
+  start = time.time()
+  result = function( db, rows )
+  elapsed = time.time() - start
+  if not result['OK']:
+    print "%-10s failed: %s" % ( name, result['Message'] )
+    return 0
+  rate = len( rows ) / max( elapsed, 0.000001 )
+  print "%-10s %8d rows in %7.2f secs: %10.1f rows/s" % ( name, len( rows ), elapsed, rate )
+  return rate
+
+if __name__ == "__main__":
+  if len( sys.argv ) < 5:
+    print __doc__
+    sys.exit( 1 )
+  host, user, passwd, dbName = sys.argv[1:5]
+  numRows = 10000
+  if len( sys.argv ) > 5:
+    numRows = int( sys.argv[5] )
+  db = MySQL( host, user, passwd, dbName )
+  result = createTable( db )
+  if not result['OK']:
+    print "Cannot create table: %s" % result['Message']
+    sys.exit( 1 )
+  rows = makeRows( numRows )
+  try:
+    perRowRate = run( "Per row", db, perRow, rows )
+    db._update( 'TRUNCATE TABLE `%s`' % TABLE )
+    bulkRate = run( "Bulk", db, bulk, rows )
+    run( "Upsert", db, upsert, rows )
+    if perRowRate:
+      print "Bulk insert is x%.1f faster" % ( bulkRate / perRowRate )
+  finally:
+    db._update( 'DROP TABLE IF EXISTS `%s`' % TABLE )
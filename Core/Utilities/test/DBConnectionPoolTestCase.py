@@ -0,0 +1,196 @@
+########################################################################
+# $HeadURL $
+# File: DBConnectionPoolTestCase.py
+########################################################################
+
+""" :mod: DBConnectionPoolTestCase
+    =======================
+
+    .. module: DBConnectionPoolTestCase
+    :synopsis: test cases for DIRAC.Core.Utilities.DBConnectionPool and QueryStats
+
+    Test cases for the MySQL connection pool and statement statistics, using
+    stand-in connections so no MySQL server is needed
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import time
+import threading
+import unittest
+from DIRAC.Core.Utilities.DBConnectionPool import DBConnectionPool
+from DIRAC.Core.Utilities.QueryStats import QueryStats, fingerprint
+
+class FakeConnection:
+  """ Stand-in MySQLdb connection """
+
+  def __init__( self ):
+    self.alive = True
+    self.closed = False
+    self.pings = 0
+
+  def ping( self ):
+    self.pings += 1
+    if not self.alive:
+      raise Exception( "MySQL server has gone away" )
+
+  def close( self ):
+    self.closed = True
+
+class DBConnectionPoolTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.opened = []
+    self.pool = DBConnectionPool( self.connect, minSize = 1, maxSize = 2, idleTimeout = 600,
+                                  maxAge = 3600, waitTimeout = 0.5 )
+
+  def connect( self ):
+    connection = FakeConnection()
+    self.opened.append( connection )
+    return connection
+
+  def testReuse( self ):
+    """ given back connections are reused """
+    conn = self.pool.get()[ 'Value' ]
+    self.pool.put( conn )
+    self.assertEqual( self.pool.get()[ 'Value' ], conn )
+    self.assertEqual( len( self.opened ), 1 )
+    stats = self.pool.getStats()
+    self.assertEqual( stats[ 'inUse' ], 1 )
+    self.assertEqual( stats[ 'reused' ], 1 )
+
+  def testMaxSize( self ):
+    """ no more than maxSize connections are borrowed, get waits for a free one """
+    conn1 = self.pool.get()[ 'Value' ]
+    conn2 = self.pool.get()[ 'Value' ]
+    start = time.time()
+    result = self.pool.get()
+    self.assertFalse( result[ 'OK' ] )
+    self.assert_( time.time() - start >= 0.4 )
+    timer = threading.Timer( 0.1, self.pool.put, args = ( conn1, ) )
+    timer.start()
+    result = self.pool.get()
+    timer.join()
+    self.assert_( result[ 'OK' ] )
+    self.assertEqual( result[ 'Value' ], conn1 )
+    self.pool.put( conn2 )
+    self.assertEqual( self.pool.getStats()[ 'waits' ], 2 )
+    self.assertEqual( self.pool.getStats()[ 'timeouts' ], 1 )
+
+  def testDetached( self ):
+    """ detached connections do not count for maxSize """
+    detached = [ self.pool.get( detached = True )[ 'Value' ] for i in range( 3 ) ]
+    self.assert_( self.pool.get()[ 'OK' ] )
+    self.assert_( self.pool.get()[ 'OK' ] )
+    self.assertEqual( self.pool.getStats()[ 'inUse' ], 2 )
+    #No room for the detached ones
+    self.pool.put( detached[0] )
+    self.assert_( detached[0].closed )
+
+  def testDeadConnection( self ):
+    """ dead idle connections are replaced when borrowed """
+    conn = self.pool.get()[ 'Value' ]
+    self.pool.put( conn )
+    conn.alive = False
+    #Only connections idle for a while are pinged
+    self.pool._DBConnectionPool__idle[-1][2] -= 10
+    newConn = self.pool.get()[ 'Value' ]
+    self.assertNotEqual( newConn, conn )
+    self.assert_( conn.closed )
+    self.assertEqual( self.pool.getStats()[ 'pingFailures' ], 1 )
+
+  def testDiscard( self ):
+    """ discarded connections are closed """
+    conn = self.pool.get()[ 'Value' ]
+    self.pool.put( conn, discard = True )
+    self.assert_( conn.closed )
+    self.assertEqual( self.pool.getStats()[ 'idle' ], 0 )
+    self.assertEqual( self.pool.getStats()[ 'inUse' ], 0 )
+
+  def testExpiration( self ):
+    """ idle connections are closed after idleTimeout keeping minSize, old ones always """
+    pool = DBConnectionPool( self.connect, minSize = 1, maxSize = 3, idleTimeout = 0.1, maxAge = 3600 )
+    conns = [ pool.get()[ 'Value' ] for i in range( 3 ) ]
+    for conn in conns:
+      pool.put( conn )
+    time.sleep( 0.2 )
+    self.assertEqual( pool.closeIdle(), 2 )
+    self.assertEqual( pool.getStats()[ 'idle' ], 1 )
+    pool = DBConnectionPool( self.connect, minSize = 1, maxSize = 3, maxAge = 0.1 )
+    conn = pool.get()[ 'Value' ]
+    time.sleep( 0.2 )
+    pool.put( conn )
+    self.assert_( conn.closed )
+    self.assertEqual( pool.getStats()[ 'idle' ], 0 )
+
+  def testFill( self ):
+    """ fill opens minSize connections """
+    pool = DBConnectionPool( self.connect, minSize = 2, maxSize = 3 )
+    self.assert_( pool.fill()[ 'OK' ] )
+    self.assertEqual( pool.getStats()[ 'idle' ], 2 )
+    pool.close()
+    self.assert_( self.opened[0].closed and self.opened[1].closed )
+
+  def testConnectError( self ):
+    """ connection failures free the slot """
+    def failConnect():
+      raise Exception( "Can't connect" )
+    pool = DBConnectionPool( failConnect, maxSize = 1, waitTimeout = 0.1 )
+    self.assertFalse( pool.get()[ 'OK' ] )
+    self.assertEqual( pool.getStats()[ 'inUse' ], 0 )
+
+class QueryStatsTestCase( unittest.TestCase ):
+
+  def testFingerprint( self ):
+    """ literals are replaced """
+    self.assertEqual( fingerprint( "SELECT JobID FROM Jobs WHERE Status='Waiting' AND JobID = 12" ),
+                      "SELECT JobID FROM Jobs WHERE Status=? AND JobID = ?" )
+    self.assertEqual( fingerprint( "SELECT * FROM Jobs WHERE JobID IN ( 1, 2, 3 )" ),
+                      fingerprint( "SELECT * FROM Jobs WHERE JobID IN (4,5)" ) )
+    self.assertEqual( fingerprint( "INSERT INTO T (a,b) VALUES (1,'x'),(2,'y')" ),
+                      "INSERT INTO T (a,b) VALUES (?)" )
+    self.assertEqual( fingerprint( 'SELECT * FROM T2 WHERE b="it\\"s"' ), "SELECT * FROM T2 WHERE b=?" )
+    self.assertEqual( fingerprint( "INSERT INTO T (a,b) VALUES (1,NULL),(2,UTC_TIMESTAMP()) "
+                                   "ON DUPLICATE KEY UPDATE b=VALUES(b)" ),
+                      "INSERT INTO T (a,b) VALUES (?) ON DUPLICATE KEY UPDATE b=VALUES(b)" )
+    self.assert_( len( fingerprint( "SELECT %s" % ( "a" * 1000 ) ) ) < 400 )
+
+  def testReport( self ):
+    """ latencies are accounted per fingerprint """
+    stats = QueryStats( slowQueryTime = 0.5 )
+    for i in range( 98 ):
+      stats.record( "SELECT * FROM Jobs WHERE JobID=%s" % i, 0.003 )
+    stats.record( "SELECT * FROM Jobs WHERE JobID=98", 0.3 )
+    stats.record( "SELECT * FROM Jobs WHERE JobID=99", 0.7, error = True )
+    stats.record( "UPDATE Jobs SET Status='Done'", 0.001 )
+    report = stats.getReport()
+    self.assertEqual( len( report ), 2 )
+    entry = report[0]
+    self.assertEqual( entry[ 'fingerprint' ], "SELECT * FROM Jobs WHERE JobID=?" )
+    self.assertEqual( entry[ 'count' ], 100 )
+    self.assertEqual( entry[ 'errors' ], 1 )
+    self.assertEqual( entry[ 'slow' ], 1 )
+    self.assertAlmostEqual( entry[ 'maxTime' ], 0.7 )
+    self.assertEqual( entry[ 'p50' ], 0.005 )
+    self.assertEqual( entry[ 'p99' ], 0.5 )
+    self.assertEqual( len( stats.getReport( sortBy = 'count', limit = 1 ) ), 1 )
+    stats.reset()
+    self.assertEqual( stats.getReport(), [] )
+
+  def testMaxFingerprints( self ):
+    """ fingerprints beyond the limit are accounted together """
+    stats = QueryStats( maxFingerprints = 2 )
+    for table in ( "A", "B", "C", "D" ):
+      stats.record( "SELECT * FROM %s" % table, 0.001 )
+    report = stats.getReport( sortBy = 'count' )
+    self.assertEqual( len( report ), 3 )
+    self.assertEqual( report[0][ 'fingerprint' ], "<other>" )
+    self.assertEqual( report[0][ 'count' ], 2 )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( DBConnectionPoolTestCase )
+  SUITE.addTest( TESTLOADER.loadTestsFromTestCase( QueryStatsTestCase ) )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
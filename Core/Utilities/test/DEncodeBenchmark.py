@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: DEncodeBenchmark.py
+########################################################################
+""" Compare the DEncode encoders and decoders on replica dictionaries like the ones
+    returned by the FileCatalog getReplicas call
+
+    Usage: DEncodeBenchmark.py [numberOfLFNs] [chunkSize]
+"""
+__RCSID__ = "$Id $"
+
+import sys
+import time
+from DIRAC.Core.Utilities import DEncode
+
+def generateReplicas( numLFNs ):
+  """ S_OK structure with numLFNs LFNs and two replicas each """
+  successful = {}
+  for i in range( numLFNs ):
+    lfn = "/lhcb/data/2012/RAW/FULL/LHCb/COLLISION12/%06d/%06d_%010d.raw" % ( i / 1000, i / 1000, i )
+    successful[ lfn ] = { 'CERN-RAW' : "srm://srm-lhcb.cern.ch/castor/cern.ch/grid%s" % lfn,
+                          'CNAF-RAW' : "srm://storm-fe-lhcb.cr.cnaf.infn.it/t0d1%s" % lfn }
+  return { 'OK' : True, 'Value' : { 'Successful' : successful, 'Failed' : {} } }
+
+def timeIt( func, *args ):
+  start = time.time()
+  result = func( *args )
+  return time.time() - start, result
+
+def streamDecode( data, chunkSize ):
+  decoder = DEncode.StreamDecoder()
+  for pos in range( 0, len( data ), chunkSize ):
+    decoder.feed( data[ pos : pos + chunkSize ] )
+  return decoder.finish()[0]
+
+if __name__ == "__main__":
+  numLFNs = 100000
+  chunkSize = 16384
+  if len( sys.argv ) > 1:
+    numLFNs = int( sys.argv[1] )
+  if len( sys.argv ) > 2:
+    chunkSize = int( sys.argv[2] )
+  obj = generateReplicas( numLFNs )
+  encTime, data = timeIt( DEncode.encode, obj )
+  print "Payload: %s LFNs, %.2f MB" % ( numLFNs, len( data ) / 1048576. )
+  print "%-30s %.3f secs" % ( "encode", encTime )
+  sizeTime, dummy = timeIt( DEncode.encodedSize, obj )
+  print "%-30s %.3f secs" % ( "encodedSize", sizeTime )
+  chunkTime, chunks = timeIt( list, DEncode.encodeInChunks( obj, chunkSize ) )
+  if "".join( chunks ) != data:
+    print "ERROR: chunked encoding differs from encode"
+  print "%-30s %.3f secs" % ( "encodeInChunks (%s bytes)" % chunkSize, chunkTime )
+  for name, func, args in ( ( "recursive", DEncode.decodeRecursive, ( data, ) ),
+                            ( "iterative", DEncode.decode, ( data, ) ),
+                            ( "stream (%s bytes chunks)" % chunkSize, streamDecode, ( data, chunkSize ) ) ):
+    decTime, result = timeIt( func, *args )
+    if type( result ) == tuple:
+      result = result[0]
+    if result != obj:
+      print "ERROR: %s decoder result differs from the original object" % name
+    print "%-30s %.3f secs %.2f MB/s" % ( name, decTime, len( data ) / 1048576. / decTime )
@@ -0,0 +1,97 @@
+########################################################################
+# $HeadURL $
+# File: DEncodeTestCase.py
+########################################################################
+
+""" :mod: DEncodeTestCase
+    =======================
+
+    .. module: DEncodeTestCase
+    :synopsis: test case for DIRAC.Core.Utilities.DEncode module
+
+    test case for DIRAC.Core.Utilities.DEncode module
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import datetime
+import unittest
+
+## from DIRAC
+from DIRAC.Core.Utilities import DEncode
+
+########################################################################
+class DEncodeTestCase( unittest.TestCase ):
+  """
+  .. class:: DEncodeTestCase
+
+  Checks the streaming encoder and decoders against the plain ones.
+  """
+
+  def setUp( self ):
+    """ test objects """
+    self.objects = [ 1, -3, 2L ** 70, 1.5, 2.0 * 10 ** 20, 2.0 * 10 ** -10, True, False, None,
+                     "", "with:colon", u"h\xe9llo", [], (), {},
+                     datetime.datetime.utcnow(), datetime.date.today(), datetime.time( 12, 30 ),
+                     { 'OK' : True, 'Value' : { 'Successful' : { '/lfn/a' : { 'SE-A' : 'srm://a' } },
+                                                'Failed' : {} } },
+                     [ 1, ( 2, [ 3, { 4 : ( 5, ) } ] ), "e" ] ]
+
+  def testDecode( self ):
+    """ decode is the inverse of encode """
+    for obj in self.objects:
+      encoded = DEncode.encode( obj )
+      self.assertEqual( DEncode.decode( encoded ), ( obj, len( encoded ) ) )
+      self.assertEqual( DEncode.decode( encoded )[0], DEncode.decodeRecursive( encoded )[0] )
+
+  def testDecodeBuffers( self ):
+    """ buffer and memoryview input """
+    for obj in self.objects:
+      encoded = DEncode.encode( obj )
+      self.assertEqual( DEncode.decode( buffer( encoded ) )[0], obj )
+      self.assertEqual( DEncode.decode( memoryview( encoded ) )[0], obj )
+
+  def testStreamDecoder( self ):
+    """ chunked decoding """
+    for obj in self.objects:
+      encoded = DEncode.encode( obj )
+      for chunkSize in ( 1, 2, 5, 64 ):
+        decoder = DEncode.StreamDecoder()
+        for pos in range( 0, len( encoded ), chunkSize ):
+          decoder.feed( encoded[ pos : pos + chunkSize ] )
+        self.assertEqual( decoder.finish(), ( obj, 0 ) )
+
+  def testStreamDecoderTrailing( self ):
+    """ bytes after the object are reported """
+    decoder = DEncode.StreamDecoder()
+    self.assertEqual( decoder.feed( "ls1:a" ), False )
+    self.assertEqual( decoder.feed( "i1eexyz" ), True )
+    self.assertEqual( decoder.finish(), ( [ "a", 1 ], 3 ) )
+
+  def testEncodedSize( self ):
+    """ size is computed without encoding """
+    for obj in self.objects:
+      self.assertEqual( DEncode.encodedSize( obj ), len( DEncode.encode( obj ) ) )
+
+  def testEncodeInChunks( self ):
+    """ chunked encoding gives the same data in bounded pieces """
+    for obj in self.objects:
+      encoded = DEncode.encode( obj )
+      for chunkSize in ( 1, 3, 64 ):
+        chunks = list( DEncode.encodeInChunks( obj, chunkSize ) )
+        self.assertEqual( "".join( chunks ), encoded )
+        self.assertEqual( max( [ len( chunk ) for chunk in chunks ] ) <= chunkSize, True )
+
+  def testTruncated( self ):
+    """ incomplete data is an error """
+    decoder = DEncode.StreamDecoder()
+    decoder.feed( "ls10:abc" )
+    self.assertRaises( ValueError, decoder.finish )
+    self.assertRaises( ValueError, DEncode.decode, "li1e" )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( DEncodeTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
@@ -0,0 +1,107 @@
+########################################################################
+# $HeadURL $
+# File: ExecutorDispatcherTestCase.py
+########################################################################
+
+""" :mod: ExecutorDispatcherTestCase
+    =======================
+
+    .. module: ExecutorDispatcherTestCase
+    :synopsis: test cases for DIRAC.Core.Utilities.ExecutorDispatcher
+
+    Test cases for sending tasks to the executors one by one and in batches
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+from DIRAC import S_OK
+from DIRAC.Core.Utilities.ExecutorDispatcher import ExecutorDispatcher, ExecutorDispatcherCallbacks, \
+                                                    ExecutorQueues
+
+class Callbacks( ExecutorDispatcherCallbacks ):
+  """ Every task goes through type1 and then type2 """
+
+  def __init__( self ):
+    self.sent = []
+
+  def cbDispatch( self, taskId, taskObj, pathExecuted ):
+    for eType in ( 'type1', 'type2' ):
+      if eType not in pathExecuted:
+        return S_OK( eType )
+    return S_OK()
+
+  def cbSendTask( self, taskId, taskObj, eId, eType ):
+    self.sent.append( ( eId, eType, [ taskId ] ) )
+    return S_OK()
+
+  def cbSendTasks( self, taskList, eId, eType ):
+    self.sent.append( ( eId, eType, [ taskId for taskId, taskObj in taskList ] ) )
+    return S_OK()
+
+class ExecutorDispatcherTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.callbacks = Callbacks()
+    self.dispatcher = ExecutorDispatcher()
+    self.dispatcher.setCallbacks( self.callbacks )
+
+  def testPopTasks( self ):
+    """ tasks are popped in order from the first type having any """
+    queues = ExecutorQueues()
+    for taskId in range( 5 ):
+      queues.pushTask( 'type2', taskId )
+    self.assertEqual( queues.popTasks( [ 'type1', 'type2' ], 3 ), ( [ 0, 1, 2 ], 'type2' ) )
+    self.assertEqual( queues.popTasks( 'type2', 3 ), ( [ 3, 4 ], 'type2' ) )
+    self.assertEqual( queues.popTasks( 'type2', 3 ), None )
+    self.assertEqual( queues.waitingTasks( 'type2' ), 0 )
+
+  def testSingle( self ):
+    """ executors without batches get one task per message """
+    self.dispatcher.addExecutor( 'e1', [ 'type1' ] )
+    for taskId in range( 3 ):
+      self.dispatcher.addTask( taskId, 'task%s' % taskId )
+    self.assertEqual( self.callbacks.sent, [ ( 'e1', 'type1', [ 0 ] ) ] )
+    self.dispatcher.taskProcessed( 'e1', 0 )
+    self.assertEqual( self.callbacks.sent[ -1 ], ( 'e1', 'type1', [ 1 ] ) )
+
+  def testBatch( self ):
+    """ queued tasks go in batches, a busy executor waits for room for a whole batch """
+    for taskId in range( 7 ):
+      self.dispatcher.addTask( taskId, 'task%s' % taskId )
+    self.dispatcher.addExecutor( 'e1', [ 'type1', 'type2' ], maxTasks = 6, batchSize = 3 )
+    self.assertEqual( self.callbacks.sent, [ ( 'e1', 'type1', [ 0, 1, 2 ] ), ( 'e1', 'type1', [ 3, 4, 5 ] ) ] )
+    self.dispatcher.taskProcessed( 'e1', 0 )
+    self.dispatcher.taskProcessed( 'e1', 1 )
+    self.assertEqual( len( self.callbacks.sent ), 2 )
+    #Room for a batch again
+    self.dispatcher.taskProcessed( 'e1', 2 )
+    self.assertEqual( len( self.callbacks.sent ), 3 )
+    #Process everything in the order it was sent
+    processed = 3
+    while processed < sum( [ len( taskIds ) for eId, eType, taskIds in self.callbacks.sent ] ):
+      taskIds = [ taskId for eId, eType, taskIds in self.callbacks.sent for taskId in taskIds ]
+      self.dispatcher.taskProcessed( 'e1', taskIds[ processed ] )
+      processed += 1
+    for eType in ( 'type1', 'type2' ):
+      taskIds = [ taskId for eId, sentType, taskIds in self.callbacks.sent if sentType == eType
+                  for taskId in taskIds ]
+      self.assertEqual( sorted( taskIds ), range( 7 ) )
+    self.assert_( max( [ len( taskIds ) for eId, eType, taskIds in self.callbacks.sent ] ) <= 3 )
+    self.assertEqual( self.dispatcher.getTaskIds(), [] )
+
+  def testRequeue( self ):
+    """ the tasks of a disconnected executor go back to the front of the queue """
+    self.dispatcher.addExecutor( 'e1', [ 'type1' ], maxTasks = 3, batchSize = 3 )
+    for taskId in range( 4 ):
+      self.dispatcher.addTask( taskId, 'task%s' % taskId )
+    self.dispatcher.removeExecutor( 'e1' )
+    self.dispatcher.addExecutor( 'e2', [ 'type1' ], maxTasks = 4, batchSize = 4 )
+    self.assertEqual( sorted( self.callbacks.sent[ -1 ][2] ), [ 0, 1, 2, 3 ] )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( ExecutorDispatcherTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
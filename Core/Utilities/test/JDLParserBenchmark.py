@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: JDLParserBenchmark.py
+########################################################################
+""" Compare the old scanning JDL parser with the tokenizer based one, with and
+    without the parse cache, on the jobs of parametric productions expanded
+    the way the JobManager does it. Every job JDL is parsed numberOfPasses
+    times, as it is on its way through the JobManager, the JobDB, the
+    optimizers and the JobWrapper
+
+    Usage: JDLParserBenchmark.py [numberOfJobs] [numberOfPasses]
+"""
+__RCSID__ = "$Id $"
+
+import sys
+import time
+from DIRAC.Core.Utilities.ClassAd.ClassAdLight import ClassAd
+from DIRAC.Core.Utilities.ClassAd.JDLParser import parseJDL, JDLCache
+
+PARAMETRIC_JDL = """[
+    Origin = "DIRAC";
+    Executable = "$DIRACROOT/scripts/dirac-jobexec";
+    Arguments = "jobDescription.xml -o LogLevel=info";
+    JobName = "00012345_%n";
+    JobGroup = "00012345";
+    JobType = "MCSimulation";
+    LogLevel = "info";
+    Priority = 1;
+    CPUTime = 100000;
+    Site = "ANY";
+    BannedSites =
+        {
+            "LCG.Dummy.fr",
+            "LCG.Other.it"
+        };
+    InputSandbox =
+        {
+            "jobDescription.xml",
+            "SB:ProductionSandboxSE|/SandBox/l/lhcb_mc/1/2/%s.tar.bz2"
+        };
+    OutputSandbox =
+        {
+            "std.err",
+            "std.out"
+        };
+    StdOutput = "std.out";
+    StdError = "std.err";
+    InputData = "/lhcb/MC/2012/SIM/00012345/0000/00012345_%s_1.sim";
+    Parameters = %d;
+    ParameterStart = 1;
+    ParameterStep = 1;
+    JobRequirements =
+        [
+            OwnerDN = "/DC=ch/DC=cern/OU=Users/CN=lhcbprod";
+            OwnerGroup = "lhcb_mc";
+            Setup = "LHCb-Production";
+            UserPriority = 1;
+            CPUTime = 100000;
+        ];
+]"""
+
+def generateJobs( numJobs ):
+  """ Expand a parametric JDL in numJobs job JDLs like the JobManager """
+  jobDesc = PARAMETRIC_JDL.replace( '%d', str( numJobs ) )
+  nParam = numJobs - 1
+  jdlList = []
+  for n in range( numJobs ):
+    p = n + 1
+    classAd = ClassAd( jobDesc.replace( '%s', str( p ) ).replace( '%n', str( n ).zfill( len( str( nParam ) ) ) ) )
+    for attr in [ 'Parameters', 'ParameterStart', 'ParameterStep' ]:
+      classAd.deleteAttribute( attr )
+    classAd.insertAttributeString( 'Parameter', str( p ) )
+    classAd.insertAttributeInt( 'ParameterNumber', n )
+    jdlList.append( classAd.asJDL() )
+  return jdlList
+
+def scanJDL( jdl ):
+  """ The parser ClassAdLight had before the tokenizer """
+  jdl = jdl.strip()
+  result = {}
+  if jdl[0] != '[' or jdl[-1] != ']':
+    return result
+  body = jdl[1:-1]
+  index = 0
+  namemode = 1
+  while index < len( body ):
+    if namemode:
+      ind = body.find( "=", index )
+      if ind == -1:
+        break
+      name = body[index:ind]
+      index = ind + 1
+      namemode = 0
+    else:
+      ind1 = body.find( "[", index )
+      ind2 = body.find( ";", index )
+      if ind1 != -1 and ind1 < ind2:
+        value, newind = findSubJDL( body, ind1 )
+      elif ind1 == -1 and ind2 == -1:
+        value = body[index:]
+        newind = len( body )
+      else:
+        if index == ind2:
+          return {}
+        value = body[index:ind2]
+        newind = ind2 + 1
+      result[name.strip()] = value.strip().replace( '\n', '' )
+      index = newind
+      namemode = 1
+  return result
+
+def findSubJDL( body, index ):
+  depth = 0
+  ind = index
+  while depth < 10:
+    ind1 = body.find( ']', ind + 1 )
+    ind2 = body.find( '[', ind + 1 )
+    if ind2 != -1 and ind2 < ind1:
+      depth += 1
+      ind = ind2
+    elif depth > 0:
+      depth -= 1
+      ind = ind1
+    else:
+      if body[ind1 + 1] == ";":
+        return body[index:ind1 + 1], ind1 + 2
+      return body[index:ind1 + 1], 0
+  return '', 0
+
+def parseAll( parser, jdlList, numPasses ):
+  for i in range( numPasses ):
+    for jdl in jdlList:
+      parser( jdl )
+
+if __name__ == "__main__":
+  numJobs = 10000
+  numPasses = 6
+  if len( sys.argv ) > 1:
+    numJobs = int( sys.argv[1] )
+  if len( sys.argv ) > 2:
+    numPasses = int( sys.argv[2] )
+  jdlList = generateJobs( numJobs )
+  print "Corpus: %s parametric jobs, %.2f MB of JDL, %s passes" % ( numJobs,
+                                                                    sum( [ len( jdl ) for jdl in jdlList ] ) / 1048576.,
+                                                                    numPasses )
+  mismatches = [ jdl for jdl in jdlList if scanJDL( jdl ) != parseJDL( jdl ) ]
+  if mismatches:
+    print "ERROR: %s JDLs parsed differently, first one:\n%s" % ( len( mismatches ), mismatches[0] )
+  cache = JDLCache( maxSize = numJobs )
+  for name, parser in ( ( "scanning", scanJDL ),
+                        ( "tokenizer", parseJDL ),
+                        ( "tokenizer + cache", cache.parse ) ):
+    start = time.time()
+    parseAll( parser, jdlList, numPasses )
+    elapsed = time.time() - start
+    print "%-30s %.3f secs %8.0f JDLs/s" % ( name, elapsed, numJobs * numPasses / elapsed )
+  print "Cache: %s" % cache.getStats()
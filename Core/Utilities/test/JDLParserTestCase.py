@@ -0,0 +1,115 @@
+########################################################################
+# $HeadURL $
+# File: JDLParserTestCase.py
+########################################################################
+
+""" :mod: JDLParserTestCase
+    =======================
+
+    .. module: JDLParserTestCase
+    :synopsis: test cases for DIRAC.Core.Utilities.ClassAd.JDLParser
+
+    Test cases for the tokenizer based JDL parser and its cache
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import time
+import unittest
+from DIRAC.Core.Utilities.ClassAd.JDLParser import parseJDL, JDLCache
+from DIRAC.Core.Utilities.ClassAd.ClassAdLight import ClassAd
+
+JDL = """[
+    Executable = "dirac-jobexec";
+    Arguments = "jobDescription.xml -o LogLevel=info";
+    InputSandbox =
+        {
+            "jobDescription.xml",
+            "SB:ProductionSandboxSE|/SandBox/l/lhcb.tar.bz2"
+        };
+    Priority = 1;
+    JobRequirements =
+        [
+            OwnerGroup = "lhcb_mc";
+            CPUTime = 100000;
+        ];
+    Requirements = other.Site == "LCG.CERN.ch"
+]"""
+
+class JDLParserTestCase( unittest.TestCase ):
+
+  def testParse( self ):
+    """ attributes, lists, sub JDLs and an unterminated last attribute """
+    attributes = parseJDL( JDL )
+    self.assertEqual( sorted( attributes ), [ 'Arguments', 'Executable', 'InputSandbox', 'JobRequirements',
+                                              'Priority', 'Requirements' ] )
+    self.assertEqual( attributes[ 'Arguments' ], '"jobDescription.xml -o LogLevel=info"' )
+    self.assertEqual( attributes[ 'Priority' ], '1' )
+    self.assertEqual( attributes[ 'Requirements' ], 'other.Site == "LCG.CERN.ch"' )
+    self.assert_( attributes[ 'JobRequirements' ].startswith( '[' ) )
+    self.assert_( attributes[ 'JobRequirements' ].endswith( ']' ) )
+    self.assert_( '\n' not in attributes[ 'InputSandbox' ] )
+    subAttributes = parseJDL( attributes[ 'JobRequirements' ] )
+    self.assertEqual( subAttributes, { 'OwnerGroup' : '"lhcb_mc"', 'CPUTime' : '100000' } )
+    #Delimiters in strings are not special
+    attributes = parseJDL( '[ A = "x;y[=]"; B = 2; ]' )
+    self.assertEqual( attributes, { 'A' : '"x;y[=]"', 'B' : '2' } )
+    #Deeply nested sub JDLs
+    attributes = parseJDL( '[ A = [ B = [ C = "]"; ]; ]; D = 1 ]' )
+    self.assertEqual( attributes, { 'A' : '[ B = [ C = "]"; ]; ]', 'D' : '1' } )
+
+  def testInvalid( self ):
+    """ invalid JDLs give no attributes """
+    self.assertEqual( parseJDL( 'A = 1;' ), {} )
+    self.assertEqual( parseJDL( '[ A = [ B = 1; ]' ), {} )
+    self.failIf( ClassAd( '[ A = [ B = 1; ]' ).isOK() )
+
+  def testMalformed( self ):
+    """ malformed and unterminated JDLs are dealt with in linear time """
+    malformed = [ '[ab = [";Name = "v";==Name = "v"; \n\n]',
+                  '[b = b = =["x;y"aName = "v";Name = "v";[=]',
+                  '[ A = "x; B = [ C = "y; ]',
+                  '[ A = "x\\' + '"; B = [' * 20 + ']' ]
+    for jdl in list( malformed ):
+      malformed.append( jdl[:-1] + jdl[1:-1] * 200 + ']' )
+    start = time.time()
+    for jdl in malformed:
+      parseJDL( jdl )
+    self.assert_( time.time() - start < 1 )
+    self.assertEqual( parseJDL( malformed[1] ), {} )
+    self.assertEqual( parseJDL( malformed[3] ), {} )
+    #An unterminated string runs to the end of the JDL
+    self.assertEqual( parseJDL( '[ A = 1; B = "x; C = 2 ]' ), { 'A' : '1', 'B' : '"x; C = 2' } )
+
+  def testReadOnly( self ):
+    """ the parsed attributes cannot change, the ClassAds have their copy """
+    attributes = parseJDL( JDL )
+    self.assertRaises( TypeError, attributes.__setitem__, 'A', '1' )
+    self.assertRaises( TypeError, attributes.pop, 'Priority' )
+    classAd = ClassAd( JDL )
+    classAd.insertAttributeInt( 'Priority', 3 )
+    self.assertEqual( ClassAd( JDL ).getAttributeInt( 'Priority' ), 1 )
+
+  def testCache( self ):
+    """ hits for known JDLs, least recently used ones evicted """
+    cache = JDLCache( maxSize = 4 )
+    jdls = [ '[ A = %s; ]' % i for i in range( 5 ) ]
+    for jdl in jdls[:4]:
+      cache.parse( jdl )
+    self.assert_( cache.parse( jdls[0] ) is cache.parse( jdls[0] ) )
+    cache.parse( jdls[4] )
+    stats = cache.getStats()
+    self.assertEqual( ( stats[ 'hits' ], stats[ 'misses' ] ), ( 2, 5 ) )
+    self.assert_( stats[ 'size' ] <= 4 )
+    #The most recently used survive
+    cache.parse( jdls[0] )
+    cache.parse( jdls[4] )
+    self.assertEqual( cache.getStats()[ 'hits' ], 4 )
+    self.assertEqual( cache.parse( u'[ A = 1; ]' ), { 'A' : '1' } )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( JDLParserTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
@@ -0,0 +1,110 @@
+########################################################################
+# $HeadURL $
+# File: MySQLTestCase.py
+########################################################################
+
+""" :mod: MySQLTestCase
+    =======================
+
+    .. module: MySQLTestCase
+    :synopsis: test cases for the multi-row inserts of DIRAC.Core.Utilities.MySQL
+
+    Test cases for building and running the multi-row INSERT statements, using
+    a stand-in connection so no MySQL server is needed
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import re
+import unittest
+from DIRAC import gLogger
+from DIRAC.Core.Utilities.MySQL import MySQL
+
+class FakeCursor:
+
+  def __init__( self, connection ):
+    self.connection = connection
+    self.lastrowid = 0
+
+  def execute( self, cmd ):
+    if 'fail' in cmd:
+      raise Exception( 'Execution failed' )
+    self.connection.executed.append( cmd )
+    return cmd.count( '),(' ) + 1
+
+  def close( self ):
+    pass
+
+class FakeConnection:
+  """ Stand-in MySQLdb connection, statements are only committed on commit """
+
+  def __init__( self ):
+    self.executed = []
+    self.committed = []
+
+  def cursor( self ):
+    return FakeCursor( self )
+
+  def escape_string( self, value ):
+    return value.replace( '"', '\\"' )
+
+  def commit( self ):
+    self.committed.extend( self.executed )
+    self.executed = []
+
+  def rollback( self ):
+    self.executed = []
+
+class FakeMySQL( MySQL ):
+  """ MySQL without a server behind, with a small max_allowed_packet """
+
+  def __init__( self, maxPacketSize ):
+    self.log = gLogger.getSubLogger( 'FakeMySQL' )
+    self.logger = self.log
+    self._MySQL__maxPacketSize = maxPacketSize
+    self._MySQL__queryStats = None
+
+  def _update( self, cmd, conn = None, debug = False ):
+    conn.cursor().execute( cmd )
+    conn.commit()
+    return { 'OK' : True, 'Value' : cmd.count( '),(' ) + 1 }
+
+class MySQLTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.connection = FakeConnection()
+
+  def testEscapeValues( self ):
+    """ ints, longs, floats, NULLs, strings and the special values """
+    db = FakeMySQL( 1024 * 1024 )
+    rows = [ [ 17L, 3, 0.5, None, 'a"b', 'UTC_TIMESTAMP()' ] ]
+    result = db._buildMultipleRowInserts( 'T', [ 'A', 'B', 'C', 'D', 'E', 'F' ], rows, self.connection )
+    self.assert_( result['OK'] )
+    self.assertEqual( result['Value'], [ 'INSERT INTO `T` ( `A`, `B`, `C`, `D`, `E`, `F` ) VALUES '
+                                         '(17,3,0.5,NULL,"a\\"b",UTC_TIMESTAMP())' ] )
+
+  def testChunks( self ):
+    """ rows are split below max_allowed_packet and inserted all or none """
+    db = FakeMySQL( 2048 )
+    rows = [ [ long( i ), 'x' * 50 ] for i in range( 100 ) ]
+    result = db._buildMultipleRowInserts( 'T', [ 'ID', 'Name' ], rows, self.connection )
+    self.assert_( len( result['Value'] ) > 1 )
+    self.assert_( max( [ len( cmd ) for cmd in result['Value'] ] ) <= 2048 )
+    self.failIf( re.search( r'\dL', ''.join( result['Value'] ) ) )
+    result = db.insertMultipleRows( 'T', [ 'ID', 'Name' ], rows, self.connection )
+    self.assertEqual( result['Value'], 100 )
+    self.assertEqual( len( self.connection.committed ), len( db._buildMultipleRowInserts( 'T', [ 'ID', 'Name' ],
+                                                                                        rows, self.connection )['Value'] ) )
+    #A failing chunk rolls back the others
+    self.connection.committed = []
+    rows[-1][1] = 'fail'
+    result = db.insertMultipleRows( 'T', [ 'ID', 'Name' ], rows, self.connection )
+    self.failIf( result['OK'] )
+    self.assertEqual( self.connection.committed, [] )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( MySQLTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
@@ -7,6 +7,7 @@
     The failover transfer client exposes the following methods:
     - transferAndRegisterFile()
     - transferAndRegisterFileFailover()
+    - transferAndRegisterFiles()
     - getRequestObject()
     
     Initially these methods were developed inside workflow modules but 
@@ -19,6 +20,10 @@
     a file to a list of alternative SEs and set appropriate replication 
     to the original target SE as well as the removal request for the 
     temporary replica.
+
+    The transferAndRegisterFiles() method uploads several files in parallel,
+    falling back to the failover SEs file by file, computes the checksums
+    while the uploads run and registers all the uploaded files in one go.
     
     getRequestObject() allows to retrieve the modified request object 
     after transfer operations.
@@ -28,10 +33,16 @@ __RCSID__ = "$Id: FailoverTransfer 18161 2009-11-11 12:07:09Z acasajus $"
 
 from DIRAC.DataManagementSystem.Client.ReplicaManager      import ReplicaManager
 from DIRAC.RequestManagementSystem.Client.RequestContainer import RequestContainer
+from DIRAC.Resources.Catalog.FileCatalog                   import FileCatalog
+from DIRAC.AccountingSystem.Client.DataStoreClient         import gDataStoreClient
+from DIRAC.AccountingSystem.Client.Types.DataOperation     import DataOperation
+from DIRAC.Core.Utilities.Adler                            import fileAdler
+from DIRAC.Core.Utilities.File                             import makeGuid, getSize
 
-from DIRAC import S_OK, S_ERROR, gLogger
+from DIRAC import S_OK, S_ERROR, gLogger, Time
 
-import types
+import DIRAC
+import os, types, time, threading, Queue
 
 class FailoverTransfer:
 
@@ -122,12 +133,234 @@ class FailoverTransfer:
 
     return S_OK( '%s uploaded to a failover SE' % fileName )
 
+  #############################################################################
+  def transferAndRegisterFiles( self, fileList, failoverSEList = None, fileCatalog = None, numberOfThreads = 4 ):
+    """Uploads several files in parallel and registers them in bulk.
+
+       'fileList' is a list of ( fileName, localPath, lfn, destinationSEList, fileGUID ) tuples.
+       A file that can not be uploaded to any of its destination SEs goes to the
+       failover SEs, with requests to replicate it to the first destination SE
+       and to remove the failover replica. Registrations that fail are turned
+       into registration requests.
+
+       Returns S_OK( { 'Successful' : { lfn : metadata }, 'Failed' : { lfn : error } } )
+       where the metadata holds the uploadedSE and the put, checksum and register times.
+    """
+    successful = {}
+    failed = {}
+    if not failoverSEList:
+      failoverSEList = []
+
+    files = {}
+    for fileName, localPath, lfn, destinationSEList, fileGUID in fileList:
+      if not os.path.exists( localPath ):
+        failed[lfn] = 'Supplied file does not exist'
+        continue
+      size = getSize( localPath )
+      if not size:
+        failed[lfn] = 'Supplied file is zero size'
+        continue
+      if not fileGUID:
+        fileGUID = makeGuid( localPath )
+      files[lfn] = { 'fileName' : fileName, 'localPath' : localPath, 'size' : size, 'guid' : fileGUID,
+                     'destinationSEs' : list( destinationSEList ) }
+
+    #Check in bulk that the files can be written and do not exist yet
+    result = self.__checkDestinations( files, fileCatalog )
+    if not result['OK']:
+      return result
+    for lfn, error in result['Value'].items():
+      self.log.error( 'Can not upload %s:' % lfn, error )
+      failed[lfn] = error
+      del files[lfn]
+
+    #Upload in parallel
+    fileQueue = Queue.Queue()
+    for lfn in files:
+      fileQueue.put( lfn )
+    workers = []
+    for i in range( min( max( 1, numberOfThreads ), len( files ) ) ):
+      worker = threading.Thread( target = self.__uploadWorker, args = ( fileQueue, files, failoverSEList ) )
+      worker.setDaemon( True )
+      worker.start()
+      workers.append( worker )
+    for worker in workers:
+      worker.join()
+
+    toRegister = {}
+    for lfn, metadata in files.items():
+      if 'uploadedSE' in metadata:
+        toRegister[lfn] = metadata
+      else:
+        failed[lfn] = metadata.get( 'error', 'Failed to upload output data file' )
+
+    #Register everything uploaded at once
+    if toRegister:
+      fileTuples = [ ( lfn, metadata['pfn'], metadata['size'], metadata['uploadedSE'], metadata['guid'],
+                       metadata['checksum'] ) for lfn, metadata in toRegister.items() ]
+      start = time.time()
+      result = self.rm.registerFile( fileTuples, fileCatalog )
+      registerTime = time.time() - start
+      self.log.info( 'Registered %s files in %.1f seconds' % ( len( fileTuples ), registerTime ) )
+      registered = {}
+      if result['OK']:
+        registered = result['Value']['Successful']
+      else:
+        self.log.error( 'Bulk registration failed', result['Message'] )
+      for lfn, metadata in toRegister.items():
+        metadata['register'] = registerTime
+        if lfn in registered:
+          metadata['registration'] = 'catalog'
+        else:
+          fileDict = { 'LFN' : lfn, 'PFN' : metadata['pfn'], 'Size' : metadata['size'],
+                       'TargetSE' : metadata['uploadedSE'], 'GUID' : metadata['guid'], 'Addler' : metadata['checksum'] }
+          result = self.__setRegistrationRequest( lfn, metadata['uploadedSE'], fileCatalog or '', fileDict )
+          if not result['OK']:
+            self.log.error( 'Failed to set registration request for: SE %s and metadata: \n%s' % ( metadata['uploadedSE'],
+                                                                                                  fileDict ) )
+            failed[lfn] = 'Failed to set registration request'
+            continue
+          metadata['registration'] = 'request'
+        if metadata['failover'] and metadata['destinationSEs']:
+          result = self.__setFileReplicationRequest( lfn, metadata['destinationSEs'][0] )
+          if result['OK']:
+            result = self.__setReplicaRemovalRequest( lfn, metadata['uploadedSE'] )
+          if not result['OK']:
+            self.log.error( 'Could not set failover requests', result['Message'] )
+            failed[lfn] = result['Message']
+            continue
+        successful[lfn] = metadata
+
+    self.__sendAccounting( toRegister )
+    return S_OK( { 'Successful' : successful, 'Failed' : failed } )
+
   #############################################################################
   def getRequestObject( self ):
     """Returns the potentially modified request object in order to propagate changes.
     """
     return S_OK( self.request )
 
+  #############################################################################
+  def __checkDestinations( self, files, fileCatalog ):
+    """ Check the write permission and the existence of the LFNs for all files at once
+    """
+    if not files:
+      return S_OK( {} )
+    errors = {}
+    catalog = FileCatalog( fileCatalog ) if fileCatalog else FileCatalog()
+    directories = list( set( [ os.path.dirname( lfn ) for lfn in files ] ) )
+    result = catalog.getPathPermissions( directories )
+    if not result['OK']:
+      return result
+    for lfn in files:
+      permissions = result['Value']['Successful'].get( os.path.dirname( lfn ), {} )
+      if not permissions.get( 'Write' ):
+        errors[lfn] = 'Write access not permitted for this credential'
+
+    guids = dict( [ ( lfn, metadata['guid'] ) for lfn, metadata in files.items() if lfn not in errors ] )
+    if not guids:
+      return S_OK( errors )
+    result = catalog.exists( guids )
+    if not result['OK']:
+      return result
+    for lfn in guids:
+      if lfn not in result['Value']['Successful']:
+        errors[lfn] = 'Failed to determine existence of destination LFN'
+      elif result['Value']['Successful'][lfn] == lfn:
+        errors[lfn] = 'The supplied LFN already exists in the File Catalog'
+      elif result['Value']['Successful'][lfn]:
+        errors[lfn] = 'This file GUID already exists for another file %s' % result['Value']['Successful'][lfn]
+    return S_OK( errors )
+
+  #############################################################################
+  def __uploadWorker( self, fileQueue, files, failoverSEList ):
+    """ Upload the files in the queue until it is empty
+    """
+    # The ReplicaManager is not shared between the threads
+    replicaManager = ReplicaManager()
+    while True:
+      try:
+        lfn = fileQueue.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        self.__uploadFile( replicaManager, lfn, files[lfn], failoverSEList )
+      except Exception, x:
+        self.log.exception( 'Exception while uploading %s' % lfn )
+        files[lfn]['error'] = str( x )
+
+  #############################################################################
+  def __uploadFile( self, replicaManager, lfn, metadata, failoverSEList ):
+    """ Put a file to the first destination SE that takes it, or else to a failover SE,
+        computing its checksum in the meantime
+    """
+    checksumThread = threading.Thread( target = self.__getChecksum, args = ( metadata, ) )
+    checksumThread.setDaemon( True )
+    checksumThread.start()
+
+    metadata['startTime'] = Time.dateTime()
+    start = time.time()
+    metadata['failover'] = False
+    errorList = []
+    for seList, failover in ( ( metadata['destinationSEs'], False ), ( failoverSEList, True ) ):
+      for se in seList:
+        self.log.info( 'Attempting rm.put("%s","%s","%s")' % ( lfn, metadata['localPath'], se ) )
+        result = replicaManager.put( lfn, metadata['localPath'], se )
+        if result['OK'] and lfn in result['Value']['Successful']:
+          self.log.info( 'rm.put successfully uploaded %s to %s' % ( metadata['fileName'], se ) )
+          metadata['uploadedSE'] = se
+          metadata['pfn'] = result['Value']['Successful'][lfn]
+          metadata['failover'] = failover
+          break
+        if result['OK']:
+          result = S_ERROR( result['Value']['Failed'].get( lfn, 'Unknown error' ) )
+        self.log.error( 'rm.put failed with message', result['Message'] )
+        errorList.append( result['Message'] )
+      if 'uploadedSE' in metadata:
+        break
+    metadata['put'] = time.time() - start
+    metadata['endTime'] = Time.dateTime()
+    checksumThread.join()
+    if 'uploadedSE' not in metadata:
+      self.log.error( 'Encountered %s errors during attempts to upload %s' % ( len( errorList ), lfn ) )
+      metadata['error'] = 'Failed to upload output data file'
+
+  #############################################################################
+  def __getChecksum( self, metadata ):
+    """ Adler32 of a file, run alongside its upload
+    """
+    start = time.time()
+    metadata['checksum'] = fileAdler( metadata['localPath'] ) or None
+    metadata['checksumTime'] = time.time() - start
+
+  #############################################################################
+  def __sendAccounting( self, files ):
+    """ One putAndRegister record per uploaded file, committed together
+    """
+    if not files:
+      return
+    for lfn, metadata in files.items():
+      oDataOperation = DataOperation()
+      oDataOperation.setValuesFromDict( { 'OperationType' : 'putAndRegister',
+                                          'User' : 'acsmith',
+                                          'Protocol' : 'ReplicaManager',
+                                          'RegistrationTime' : metadata.get( 'register', 0.0 ),
+                                          'RegistrationOK' : int( metadata.get( 'registration' ) == 'catalog' ),
+                                          'RegistrationTotal' : 1,
+                                          'Destination' : metadata['uploadedSE'],
+                                          'TransferTotal' : 1,
+                                          'TransferOK' : 1,
+                                          'TransferSize' : metadata['size'],
+                                          'TransferTime' : metadata['put'],
+                                          'FinalStatus' : 'Successful',
+                                          'Source' : DIRAC.siteName() } )
+      oDataOperation.setStartTime( metadata['startTime'] )
+      oDataOperation.setEndTime( metadata['endTime'] )
+      gDataStoreClient.addRegister( oDataOperation )
+    start = time.time()
+    gDataStoreClient.commit()
+    self.log.info( 'Sending accounting took %.1f seconds' % ( time.time() - start ) )
+
   #############################################################################
   def __setFileReplicationRequest( self, lfn, se ):
     """ Sets a registration request.
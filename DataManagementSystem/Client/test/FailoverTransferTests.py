@@ -0,0 +1,113 @@
+########################################################################
+# $HeadURL $
+# File: FailoverTransferTests.py
+########################################################################
+
+""" :mod: FailoverTransferTests
+    =======================
+
+    .. module: FailoverTransferTests
+    :synopsis: unit tests for FailoverTransfer
+
+    unit tests for the parallel upload and bulk registration of FailoverTransfer
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import os
+import shutil
+import tempfile
+import unittest
+from DIRAC import S_OK
+## SUT
+import DIRAC.DataManagementSystem.Client.FailoverTransfer as FailoverTransferModule
+from DIRAC.DataManagementSystem.Client.FailoverTransfer import FailoverTransfer
+
+class FakeCatalog:
+  """ everything is writable, only /vo/exists exists """
+  def __init__( self, catalogs = None ):
+    pass
+  def getPathPermissions( self, paths ):
+    return S_OK( { 'Successful' : dict( [ ( path, { 'Write' : True } ) for path in paths ] ), 'Failed' : {} } )
+  def exists( self, lfns ):
+    return S_OK( { 'Successful' : dict( [ ( lfn, lfn == '/vo/exists' and lfn ) for lfn in lfns ] ), 'Failed' : {} } )
+
+class FakeReplicaManager:
+  """ BadSE never takes files, registrations of /vo/noregister fail """
+  registered = []
+  def put( self, lfn, localPath, se ):
+    if se == 'BadSE':
+      return S_OK( { 'Successful' : {}, 'Failed' : { lfn : 'SE down' } } )
+    return S_OK( { 'Successful' : { lfn : 'srm://%s%s' % ( se, lfn ) }, 'Failed' : {} } )
+  def registerFile( self, fileTuples, catalog = '' ):
+    FakeReplicaManager.registered.append( fileTuples )
+    successful = dict( [ ( fileTuple[0], True ) for fileTuple in fileTuples if fileTuple[0] != '/vo/noregister' ] )
+    return S_OK( { 'Successful' : successful, 'Failed' : {} } )
+
+class FakeDataStoreClient:
+  def addRegister( self, register ):
+    pass
+  def commit( self ):
+    return S_OK()
+
+########################################################################
+class FailoverTransferTestCase( unittest.TestCase ):
+  """
+  .. class:: FailoverTransferTestCase
+
+  """
+  def setUp( self ):
+    self.saved = ( FailoverTransferModule.FileCatalog, FailoverTransferModule.ReplicaManager,
+                   FailoverTransferModule.gDataStoreClient )
+    FailoverTransferModule.FileCatalog = FakeCatalog
+    FailoverTransferModule.ReplicaManager = FakeReplicaManager
+    FailoverTransferModule.gDataStoreClient = FakeDataStoreClient()
+    FakeReplicaManager.registered = []
+    self.tmpDir = tempfile.mkdtemp()
+
+  def tearDown( self ):
+    FailoverTransferModule.FileCatalog, FailoverTransferModule.ReplicaManager, \
+    FailoverTransferModule.gDataStoreClient = self.saved
+    shutil.rmtree( self.tmpDir )
+
+  def __file( self, name ):
+    path = os.path.join( self.tmpDir, name )
+    open( path, 'w' ).write( name * 100 )
+    return ( name, path, '/vo/%s' % name, [ 'BadSE', 'GoodSE' ], None )
+
+  def testTransferAndRegisterFiles( self ):
+    """ uploads with fallback, bulk registration, failover and registration requests """
+    fileList = [ self.__file( 'f%s' % i ) for i in range( 6 ) ]
+    fileList.append( self.__file( 'exists' ) )
+    fileList.append( self.__file( 'noregister' ) )
+    failover = self.__file( 'failover' )
+    fileList.append( failover[:3] + ( [ 'BadSE' ], None ) )
+    fileList.append( ( 'missing', os.path.join( self.tmpDir, 'missing' ), '/vo/missing', [ 'GoodSE' ], None ) )
+
+    failoverTransfer = FailoverTransfer()
+    result = failoverTransfer.transferAndRegisterFiles( fileList, [ 'FailoverSE' ], numberOfThreads = 3 )
+    self.assert_( result['OK'] )
+    successful = result['Value']['Successful']
+    self.assertEqual( sorted( result['Value']['Failed'] ), [ '/vo/exists', '/vo/missing' ] )
+    self.assertEqual( len( successful ), 8 )
+    self.assertEqual( successful['/vo/f0']['uploadedSE'], 'GoodSE' )
+    self.assertEqual( successful['/vo/f0']['registration'], 'catalog' )
+    self.assert_( successful['/vo/f0']['checksum'] )
+    self.assertEqual( successful['/vo/noregister']['registration'], 'request' )
+    self.assertEqual( successful['/vo/failover']['uploadedSE'], 'FailoverSE' )
+    self.failUnless( successful['/vo/failover']['failover'] )
+    #A single registration call for all the files
+    self.assertEqual( len( FakeReplicaManager.registered ), 1 )
+    self.assertEqual( len( FakeReplicaManager.registered[0] ), 8 )
+    #registerFile, replicateAndRegister and replicaRemoval requests
+    request = failoverTransfer.getRequestObject()['Value']
+    self.assertEqual( request.getNumSubRequests( 'register' )['Value'], 1 )
+    self.assertEqual( request.getNumSubRequests( 'transfer' )['Value'], 1 )
+    self.assertEqual( request.getNumSubRequests( 'removal' )['Value'], 1 )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( FailoverTransferTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
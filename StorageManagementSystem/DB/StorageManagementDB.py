@@ -521,20 +521,24 @@ class StorageManagementDB( DB ):
         return res
       existingReplicas = res['Value']
       # Insert the CacheReplicas that do not already exist
+      newLfns = []
       for lfn in lfns:
-        if lfn in existingReplicas.keys():
+        if lfn in existingReplicas:
           gLogger.verbose( 'StorageManagementDB.setRequest: Replica already exists in CacheReplicas table %s @ %s' % ( lfn, se ) )
           existingFileState = existingReplicas[lfn][1]
           taskState = self.__getTaskStateFromReplicaState( existingFileState )
-        else:
-          res = self._insertReplicaInformation( lfn, se, 'Stage', connection = connection )
-          if not res['OK']:
-            self._cleanTask( taskID, connection = connection )
-            return res
-
-          existingReplicas[lfn] = ( res['Value'], 'New' )
-          newFileState = existingReplicas[lfn][1]
-          taskState = self.__getTaskStateFromReplicaState( newFileState )
+          if not taskState in taskStates:
+            taskStates.append( taskState )
+        elif not lfn in newLfns:
+          newLfns.append( lfn )
+      if newLfns:
+        res = self._insertReplicasInformation( newLfns, se, 'Stage', connection = connection )
+        if not res['OK']:
+          self._cleanTask( taskID, connection = connection )
+          return res
+        for lfn, replicaID in res['Value'].items():
+          existingReplicas[lfn] = ( replicaID, 'New' )
+        taskState = self.__getTaskStateFromReplicaState( 'New' )
         if not taskState in taskStates:
           taskStates.append( taskState )
 
@@ -612,15 +616,34 @@ class StorageManagementDB( DB ):
     #gLogger.verbose("_insertReplicaInformation: Inserted Replica ('%s','%s') and obtained ReplicaID %s" % (lfn,storageElement,replicaID))
     return S_OK( replicaID )
 
+  def _insertReplicasInformation( self, lfns, storageElement, type, connection = False ):
+    """ Enter many replicas of the same SE into the CacheReplicas table """
+    connection = self.__getConnection( connection )
+    rows = [ ( type, storageElement, lfn, '', 0, '', '', 'UTC_TIMESTAMP()', 'UTC_TIMESTAMP()' ) for lfn in lfns ]
+    res = self.insertMultipleRows( 'CacheReplicas', ['Type', 'SE', 'LFN', 'PFN', 'Size', 'FileChecksum', 'GUID',
+                                                     'SubmitTime', 'LastUpdate'], rows, conn = connection )
+    if not res['OK']:
+      gLogger.error( "_insertReplicasInformation: Failed to insert to CacheReplicas table.", res['Message'] )
+      return res
+    # Get back the ReplicaIDs
+    res = self._getExistingReplicas( storageElement, lfns, connection = connection )
+    if not res['OK']:
+      return res
+    replicaIDs = {}
+    for lfn, ( replicaID, _status ) in res['Value'].items():
+      replicaIDs[lfn] = replicaID
+    missing = [ lfn for lfn in lfns if not lfn in replicaIDs ]
+    if missing:
+      return S_ERROR( "Inserted CacheReplicas not found: %s" % ', '.join( missing[:10] ) )
+    gLogger.info( "%s.%s_DB: inserted %s CacheReplicas at %s" % ( self._caller(), '_insertReplicasInformation',
+                                                                 len( replicaIDs ), storageElement ) )
+    return S_OK( replicaIDs )
+
   def _insertTaskReplicaInformation( self, taskID, replicaIDs, connection = False ):
     """ Enter the replicas into TaskReplicas table """
     connection = self.__getConnection( connection )
-    req = "INSERT INTO TaskReplicas (TaskID,ReplicaID) VALUES "
-    for replicaID, status in replicaIDs:
-      replicaString = "(%s,%s)," % ( taskID, replicaID )
-      req = "%s %s" % ( req, replicaString )
-    req = req.rstrip( ',' )
-    res = self._update( req, connection )
+    rows = [ ( taskID, replicaID ) for replicaID, _status in replicaIDs ]
+    res = self.insertMultipleRows( 'TaskReplicas', ['TaskID', 'ReplicaID'], rows, conn = connection )
     if not res['OK']:
       gLogger.error( 'StorageManagementDB._insertTaskReplicaInformation: Failed to insert to TaskReplicas table.', res['Message'] )
       return res
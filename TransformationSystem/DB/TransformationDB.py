@@ -703,11 +703,9 @@ class TransformationDB( DB ):
       fileIDs.remove( tupleIn[0] )
     if not fileIDs:
       return S_OK( [] )
-    req = "INSERT INTO TransformationFiles (TransformationID,FileID,LastUpdate,InsertedTime) VALUES"
-    for fileID in fileIDs:
-      req = "%s (%d,%d,UTC_TIMESTAMP(),UTC_TIMESTAMP())," % ( req, transID, fileID )
-    req = req.rstrip( ',' )
-    res = self._update( req, connection )
+    rows = [ ( transID, fileID, 'UTC_TIMESTAMP()', 'UTC_TIMESTAMP()' ) for fileID in fileIDs ]
+    res = self.insertMultipleRows( 'TransformationFiles', ['TransformationID', 'FileID', 'LastUpdate', 'InsertedTime'],
+                                   rows, conn = connection )
     if not res['OK']:
       return res
     return S_OK( fileIDs )
@@ -1224,13 +1222,18 @@ class TransformationDB( DB ):
     if not res['OK']:
       return res
     _fileIDs, lfnFileIDs = res['Value']
-    for lfn in lfns:
-      if not lfn in lfnFileIDs.keys():
-        req = "INSERT INTO DataFiles (LFN,Status) VALUES ('%s','New');" % lfn
-        res = self._update( req, connection )
-        if not res['OK']:
-          return res
-        lfnFileIDs[lfn] = res['lastRowId']
+    newLfns = [ lfn for lfn in set( lfns ) if not lfn in lfnFileIDs ]
+    if not newLfns:
+      return S_OK( lfnFileIDs )
+    # Files added meanwhile by somebody else are ignored, their IDs are read back below
+    res = self.insertMultipleRows( 'DataFiles', ['LFN', 'Status'], [ ( lfn, 'New' ) for lfn in newLfns ],
+                                   conn = connection, ignore = True )
+    if not res['OK']:
+      return res
+    res = self.__getFileIDsForLfns( newLfns, connection = connection )
+    if not res['OK']:
+      return res
+    lfnFileIDs.update( res['Value'][1] )
     return S_OK( lfnFileIDs )
 
   def __setDataFileStatus( self, fileIDs, status, connection = False ):
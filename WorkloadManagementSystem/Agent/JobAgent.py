@@ -81,6 +81,9 @@ class JobAgent( AgentModule ):
     self.fillingMode = self.am_getOption( 'FillingModeFlag', False )
     self.stopOnApplicationFailure = self.am_getOption( 'StopOnApplicationFailure', True )
     self.stopAfterFailedMatches = self.am_getOption( 'StopAfterFailedMatches', 10 )
+    #Jobs matched per request for CEs with several free slots
+    self.jobsPerRequest = self.am_getOption( 'JobsPerRequest', 1 )
+    self.matchedJobs = []
     self.jobCount = 0
     self.matchFailedCount = 0
     #Timeleft
@@ -108,7 +111,7 @@ class JobAgent( AgentModule ):
         result = self.computingElement.setCPUTimeLeft( cpuTimeLeft = self.timeLeft )
         if not result['OK']:
           return self.__finish( result['Message'] )
-      else:
+      elif not self.matchedJobs:
         return self.__finish( 'Filling Mode is Disabled' )
 
     self.log.verbose( 'Job Agent execution loop' )
@@ -141,9 +144,14 @@ class JobAgent( AgentModule ):
       ceDict.update( requirementsDict )
 
     self.log.verbose( ceDict )
-    start = time.time()
-    jobRequest = self.__requestJob( ceDict )
-    matchTime = time.time() - start
+    if self.matchedJobs:
+      #Already matched in the last bulk request
+      jobRequest = S_OK( self.matchedJobs.pop( 0 ) )
+      matchTime = 0.0
+    else:
+      start = time.time()
+      jobRequest = self.__requestJobs( ceDict, min( self.jobsPerRequest, available['Value'] ) )
+      matchTime = time.time() - start
     self.log.info( 'MatcherTime = %.2f (s)' % ( matchTime ) )
 
     self.stopAfterFailedMatches = self.am_getOption( 'StopAfterFailedMatches', self.stopAfterFailedMatches )
@@ -585,6 +593,48 @@ class JobAgent( AgentModule ):
       self.log.exception( lException = x )
       return S_ERROR( 'Job request to matcher service failed with exception' )
 
+  #############################################################################
+  def __requestJobs( self, ceDict, numJobs ):
+    """Request up to numJobs jobs from the matcher service in one go. The first
+       one is returned, the rest are kept for the next cycles.
+    """
+    if numJobs <= 1:
+      return self.__requestJob( ceDict )
+    try:
+      matcher = RPCClient( 'WorkloadManagement/Matcher', timeout = 600 )
+      result = matcher.requestJobs( ceDict, numJobs )
+    except Exception, x:
+      self.log.exception( lException = x )
+      return S_ERROR( 'Job request to matcher service failed with exception' )
+    if not result['OK']:
+      if result['Message'].find( 'Unknown method' ) != -1:
+        self.log.warn( 'Matcher service does not serve several jobs per request, requesting one' )
+        self.jobsPerRequest = 1
+        return self.__requestJob( ceDict )
+      return result
+    jobList = result['Value']
+    self.log.info( 'Matcher returned %s jobs' % len( jobList ) )
+    self.matchedJobs = jobList[1:]
+    return S_OK( jobList[0] )
+
+  #############################################################################
+  def __rescheduleMatchedJobs( self ):
+    """Give back the jobs of the last bulk request that will not be run here
+    """
+    if not self.matchedJobs:
+      return S_OK()
+    jobIDs = [ int( matcherInfo['JobID'] ) for matcherInfo in self.matchedJobs ]
+    self.matchedJobs = []
+    self.log.info( 'Rescheduling %s matched jobs not started: %s' % ( len( jobIDs ), jobIDs ) )
+    for jobID in jobIDs:
+      jobReport = JobReport( jobID, 'JobAgent@%s' % self.siteName )
+      jobReport.setJobStatus( status = 'Rescheduled', application = 'Job not started by the pilot',
+                              sendFlag = True )
+    result = RPCClient( 'WorkloadManagement/JobManager' ).rescheduleJob( jobIDs )
+    if not result['OK']:
+      self.log.error( 'Failed to reschedule matched jobs', result['Message'] )
+    return result
+
   #############################################################################
   def __getJDLParameters( self, jdl ):
     """Returns a dictionary of JDL parameters.
@@ -680,6 +730,7 @@ class JobAgent( AgentModule ):
     """
     self.log.info( 'JobAgent will stop with message "%s", execution complete.' % message )
     if stop:
+      self.__rescheduleMatchedJobs()
       self.am_stopExecution()
       return S_ERROR( message )
     else:
@@ -7,6 +7,10 @@
 """ The Download Input Data module wraps around the Replica Management
     components to provide access to datasets by available site protocols as
     defined in the CS for the VO.
+
+    The files are downloaded by a pool of threads, with a limit on the
+    concurrent connections to each SE. A file is tried from all its local
+    replicas before falling back to a download from anywhere.
 """
 
 __RCSID__ = "$Id$"
@@ -17,9 +21,13 @@ from DIRAC.Resources.Storage.StorageElement                         import Stora
 from DIRAC.Core.Utilities.Os                                        import getDiskSpace
 from DIRAC                                                          import S_OK, S_ERROR, gLogger
 
-import os, tempfile, random
+import os, tempfile, random, threading, time, Queue
 
 COMPONENT_NAME = 'DownloadInputData'
+DEFAULT_DOWNLOAD_THREADS = 4
+DEFAULT_SE_CONNECTIONS = 2
+DEFAULT_DOWNLOAD_RETRIES = 1
+PROGRESS_PERIOD = 60
 
 class DownloadInputData:
   """
@@ -42,6 +50,11 @@ class DownloadInputData:
     self.jobID = None
     self.replicaManager = ReplicaManager()
     self.counter = 1
+    self.numberOfThreads = max( 1, int( self.configuration.get( 'DownloadThreads', DEFAULT_DOWNLOAD_THREADS ) ) )
+    self.seConnections = max( 1, int( self.configuration.get( 'MaxSEConnections', DEFAULT_SE_CONNECTIONS ) ) )
+    self.retries = max( 0, int( self.configuration.get( 'DownloadRetries', DEFAULT_DOWNLOAD_RETRIES ) ) )
+    self.__lock = threading.Lock()
+    self.__seSemaphores = {}
 
   #############################################################################
   def execute( self, dataToResolve = None ):
@@ -113,14 +126,9 @@ class DownloadInputData:
       self.log.verbose( lfn )
       if not reps['SE']:
         self.log.info( 'Failed to find data at local SEs, will try to download from anywhere', lfn )
-        reps['SE'] = ''
-        reps['PFN'] = ''
-      else:
-        if len( reps['SE'] ) > 1:
-          # if more than one SE is available randomly select one
-          random.shuffle( reps['SE'] )
-        reps['PFN'] = reps['SE'][0][1]
-        reps['SE'] = reps['SE'][0][0]
+      elif len( reps['SE'] ) > 1:
+        # if more than one SE is available try them in random order
+        random.shuffle( reps['SE'] )
       for item, value in sorted( reps.items() ):
         if value:
           self.log.verbose( '%s %s' % ( item, value ) )
@@ -148,64 +156,34 @@ class DownloadInputData:
       result['Successful'] = {}
       return result
 
-    resolvedData = {}
-    localSECount = 0
-    for lfn in downloadReplicas.keys():
-      pfn = downloadReplicas[lfn]['PFN']
-      seName = downloadReplicas[lfn]['SE']
-      guid = downloadReplicas[lfn]['GUID']
-      result = self.replicaManager.getStorageFileMetadata( [pfn], seName )
-      if not result['OK']:
-        self.log.error( result['Message'] )
-        failedReplicas.append( lfn )
-        continue
-      if result['Value']['Failed']:
-        error = 'Could not get Storage Metadata from %s' % seName
-        self.log.error( error )
-        failedReplicas.append( lfn )
-        continue
-      metadata = result['Value']['Successful'][pfn]
-      if metadata['Lost']:
-        error = "PFN has been Lost by the StorageElement"
-        self.log.error( error , pfn )
-        failedReplicas.append( lfn )
-        continue
-      elif metadata['Unavailable']:
-        error = "PFN is declared Unavailable by the StorageElement"
-        self.log.error( error, pfn )
-        failedReplicas.append( lfn )
-        continue
-      elif seName in tapeSEs and not metadata['Cached']:
-        error = "PFN is no longer in StorageElement Cache"
-        self.log.error( error, pfn )
-        failedReplicas.append( lfn )
-        continue
-
-      self.log.info( 'Preliminary checks OK, download from LocalSE:', pfn )
-      result = self.__getPFN( pfn, seName, guid )
-      if not result['OK']:
-        self.log.warn( 'Download from localSE failed with message:\n%s' % ( result ) )
-        # if the replica was NOT on a Tape SE attempt a download from elsewhere
-        if seName not in tapeSEs:
-          self.log.info( 'Trying to download from any SE:', pfn )
-          result = self.__getLFN( lfn, pfn, seName, guid )
-          if not result['OK']:
-            self.log.warn( 'Download from any SE failed with message:\n%s' % ( result ) )
-            failedReplicas.append( lfn )
-        else:
-          failedReplicas.append( lfn )
-      else:
-        localSECount += 1
-      if result['OK']:
-        # Rename file if downloaded FileName does not match the LFN
-        lfnName = os.path.basename( lfn )
-        oldPath = result['Value']['path']
-        fileName = os.path.basename( oldPath )
-        if lfnName != fileName:
-          newPath = os.path.join( os.path.dirname( oldPath, lfnName ) )
-          os.rename( oldPath, newPath )
-          result['Value']['path'] = newPath
-        resolvedData[lfn] = result['Value']
+    fileQueue = Queue.Queue()
+    for lfn in downloadReplicas:
+      fileQueue.put( lfn )
+    downloadState = { 'Successful' : {}, 'Failed' : [], 'LocalSE' : 0, 'Bytes' : 0 }
+    workers = []
+    for i in range( min( self.numberOfThreads, len( downloadReplicas ) ) ):
+      worker = threading.Thread( target = self.__downloadWorker,
+                                 args = ( fileQueue, downloadReplicas, tapeSEs, downloadState ) )
+      worker.setDaemon( True )
+      worker.start()
+      workers.append( worker )
+    self.log.info( 'Downloading %s files with %s threads' % ( len( downloadReplicas ), len( workers ) ) )
+
+    start = time.time()
+    lastReport = start
+    for worker in workers:
+      while worker.isAlive():
+        worker.join( 5 )
+        if time.time() - lastReport > PROGRESS_PERIOD:
+          lastReport = time.time()
+          self.__setJobParam( 'InputDataProgress', self.__progressReport( downloadState, len( downloadReplicas ),
+                                                                          lastReport - start ) )
+    progress = self.__progressReport( downloadState, len( downloadReplicas ), time.time() - start )
+    self.log.info( progress )
+
+    resolvedData = downloadState['Successful']
+    failedReplicas.extend( downloadState['Failed'] )
+    localSECount = downloadState['LocalSE']
 
     #Report datasets that could not be downloaded
     report = ''
@@ -220,7 +198,8 @@ class DownloadInputData:
       for lfn, reps in resolvedData.items():
         report += '%s\n' % ( lfn )
       totalLFNs = len( resolvedData.keys() )
-      report += '\nDownloaded %s / %s files from local Storage Elements on first attempt.' % ( localSECount, totalLFNs )
+      report += '\nDownloaded %s / %s files from local Storage Elements.' % ( localSECount, totalLFNs )
+      report += '\n%s' % progress
       self.__setJobParam( COMPONENT_NAME, report )
 
     result = S_OK()
@@ -228,6 +207,146 @@ class DownloadInputData:
     result['Failed'] = failedReplicas #lfn list to be passed to another resolution mechanism
     return result
 
+  #############################################################################
+  def __downloadWorker( self, fileQueue, downloadReplicas, tapeSEs, downloadState ):
+    """ Download the files in the queue until it is empty
+    """
+    # The ReplicaManager is not shared between the threads
+    replicaManager = ReplicaManager()
+    while True:
+      try:
+        lfn = fileQueue.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        result = self.__downloadFile( replicaManager, lfn, downloadReplicas[lfn], tapeSEs )
+      except Exception, x:
+        self.log.exception( 'Exception while downloading %s' % lfn )
+        result = S_ERROR( str( x ) )
+      self.__lock.acquire()
+      try:
+        if result['OK']:
+          fileDict, localSE = result['Value']
+          downloadState['Successful'][lfn] = fileDict
+          downloadState['Bytes'] += int( downloadReplicas[lfn]['Size'] )
+          if localSE:
+            downloadState['LocalSE'] += 1
+        else:
+          downloadState['Failed'].append( lfn )
+      finally:
+        self.__lock.release()
+
+  #############################################################################
+  def __downloadFile( self, replicaManager, lfn, reps, tapeSEs ):
+    """ Download a file trying all its local replicas, and if none of them is
+        on tape, from anywhere as a last resort
+    """
+    guid = reps['GUID']
+    candidates = list( reps['SE'] )
+    for attempt in range( self.retries + 1 ):
+      for seName, pfn in list( candidates ):
+        semaphore = self.__getSESemaphore( seName )
+        semaphore.acquire()
+        try:
+          result = self.__checkReplica( replicaManager, pfn, seName, seName in tapeSEs )
+          if not result['OK']:
+            # The replica is not usable, no point in retrying it
+            candidates.remove( ( seName, pfn ) )
+            continue
+          self.log.info( 'Preliminary checks OK, download from LocalSE:', pfn )
+          result = self.__getPFN( replicaManager, pfn, seName, guid )
+        finally:
+          semaphore.release()
+        if result['OK']:
+          return S_OK( ( self.__renameToLFN( lfn, result['Value'] ), True ) )
+        self.log.warn( 'Download of %s from %s failed (attempt %s):\n%s' % ( lfn, seName, attempt + 1, result ) )
+      if not candidates:
+        break
+
+    if [ seName for seName, pfn in reps['SE'] if seName in tapeSEs ]:
+      return S_ERROR( 'Failed to download %s from the local tape SEs' % lfn )
+    self.log.info( 'Trying to download from any SE:', lfn )
+    result = self.__getLFN( replicaManager, lfn, guid )
+    if not result['OK']:
+      self.log.warn( 'Download from any SE failed with message:\n%s' % ( result ) )
+      return result
+    return S_OK( ( self.__renameToLFN( lfn, result['Value'] ), False ) )
+
+  #############################################################################
+  def __checkReplica( self, replicaManager, pfn, seName, tapeSE ):
+    """ Check the storage metadata of a replica before downloading it
+    """
+    result = replicaManager.getStorageFileMetadata( [pfn], seName )
+    if not result['OK']:
+      self.log.error( result['Message'] )
+      return result
+    if result['Value']['Failed']:
+      error = 'Could not get Storage Metadata from %s' % seName
+      self.log.error( error )
+      return S_ERROR( error )
+    metadata = result['Value']['Successful'][pfn]
+    if metadata['Lost']:
+      error = "PFN has been Lost by the StorageElement"
+    elif metadata['Unavailable']:
+      error = "PFN is declared Unavailable by the StorageElement"
+    elif tapeSE and not metadata['Cached']:
+      error = "PFN is no longer in StorageElement Cache"
+    else:
+      return S_OK()
+    self.log.error( error, pfn )
+    return S_ERROR( error )
+
+  #############################################################################
+  def __getSESemaphore( self, seName ):
+    self.__lock.acquire()
+    try:
+      if seName not in self.__seSemaphores:
+        self.__seSemaphores[seName] = threading.BoundedSemaphore( self.seConnections )
+      return self.__seSemaphores[seName]
+    finally:
+      self.__lock.release()
+
+  #############################################################################
+  def __getDownloadDir( self ):
+    """ Directory for the next download according to the InputDataDirectory
+    """
+    if self.inputDataDirectory == "PerFile":
+      self.__lock.acquire()
+      try:
+        counter = self.counter
+        self.counter += 1
+      finally:
+        self.__lock.release()
+      return tempfile.mkdtemp( prefix = 'InputData_%s' % ( counter ), dir = os.getcwd() )
+    elif self.inputDataDirectory == "CWD":
+      return os.getcwd()
+    return self.inputDataDirectory
+
+  #############################################################################
+  def __renameToLFN( self, lfn, fileDict ):
+    """ Rename file if downloaded FileName does not match the LFN
+    """
+    lfnName = os.path.basename( lfn )
+    oldPath = fileDict['path']
+    if os.path.basename( oldPath ) != lfnName:
+      newPath = os.path.join( os.path.dirname( oldPath ), lfnName )
+      os.rename( oldPath, newPath )
+      fileDict['path'] = newPath
+    return fileDict
+
+  #############################################################################
+  def __progressReport( self, downloadState, totalFiles, elapsed ):
+    self.__lock.acquire()
+    try:
+      done = len( downloadState['Successful'] )
+      failed = len( downloadState['Failed'] )
+      megaBytes = downloadState['Bytes'] / 1048576.
+    finally:
+      self.__lock.release()
+    return 'Downloaded %s / %s files (%s failed), %.1f MB in %.1f s, %.2f MB/s' % ( done, totalFiles, failed,
+                                                                                  megaBytes, elapsed,
+                                                                                  megaBytes / max( elapsed, 0.001 ) )
+
   #############################################################################
   def __checkDiskSpace( self, totalSize ):
     """Compare available disk space to the file size reported from the catalog
@@ -248,23 +367,14 @@ class DownloadInputData:
       return S_ERROR( msg )
 
   #############################################################################
-  def __getLFN( self, lfn, pfn, seName, guid ):
-    """ Download a local copy of a single LFN from the specified Storage Element.
+  def __getLFN( self, replicaManager, lfn, guid ):
+    """ Download a local copy of a single LFN from any Storage Element.
         This is used as a last resort to attempt to retrieve the file.  The Replica
         Manager will perform an LFC lookup to refresh the stored result.
     """
-    start = os.getcwd()
-    if self.inputDataDirectory == "PerFile":
-      downloadDir = tempfile.mkdtemp( prefix = 'InputData_%s' % ( self.counter ), dir = start )
-    elif self.inputDataDirectory == "CWD":
-      downloadDir = start
-    else:
-      downloadDir = self.inputDataDirectory
-    self.counter += 1
-    os.chdir( downloadDir )
+    downloadDir = self.__getDownloadDir()
     self.log.verbose( 'Attempting to ReplicaManager.getFile for %s in %s' % ( lfn, downloadDir ) )
-    result = self.replicaManager.getFile( lfn )
-    os.chdir( start )
+    result = replicaManager.getFile( lfn, destinationDir = downloadDir )
     if not result['OK']:
       return result
     self.log.verbose( result )
@@ -275,15 +385,15 @@ class DownloadInputData:
     fileName = os.path.basename( result['Value']['Successful'][lfn] )
     localFile = os.path.join( downloadDir, fileName )
     if os.path.exists( localFile ):
-      self.log.verbose( 'File %s exists in current directory' % ( fileName ) )
-      fileDict = {'turl':'Downloaded', 'protocol':'Downloaded', 'se':seName, 'pfn':pfn, 'guid':guid, 'path':localFile}
+      self.log.verbose( 'File %s exists in %s' % ( fileName, downloadDir ) )
+      fileDict = {'turl':'Downloaded', 'protocol':'Downloaded', 'se':'', 'pfn':'', 'guid':guid, 'path':localFile}
       return S_OK( fileDict )
     else:
       self.log.warn( 'File does not exist in local directory after download' )
       return S_ERROR( 'OK download result but file missing in current directory' )
 
   #############################################################################
-  def __getPFN( self, pfn, seName, guid ):
+  def __getPFN( self, replicaManager, pfn, seName, guid ):
     """ Download a local copy of a single PFN from the specified Storage Element.
     """
     if not pfn:
@@ -300,16 +410,8 @@ class DownloadInputData:
                    'path': os.path.join( os.getcwd(), fileName )}
       return S_OK( fileDict )
 
-    start = os.getcwd()
-    if self.inputDataDirectory == "PerFile":
-      downloadDir = tempfile.mkdtemp( prefix = 'InputData_%s' % ( self.counter ), dir = start )
-    elif self.inputDataDirectory == "CWD":
-      downloadDir = start
-    else:
-      downloadDir = self.inputDataDirectory
-    self.counter += 1
-
-    result = self.replicaManager.getStorageFile( pfn, seName, localPath = downloadDir, singleFile = True )
+    downloadDir = self.__getDownloadDir()
+    result = replicaManager.getStorageFile( pfn, seName, localPath = downloadDir, singleFile = True )
     if not result['OK']:
       self.log.warn( 'Problem getting PFN %s:\n%s' % ( pfn, result ) )
       return result
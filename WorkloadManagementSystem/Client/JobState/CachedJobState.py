@@ -5,17 +5,20 @@ from DIRAC import S_OK, S_ERROR, gLogger
 from DIRAC.WorkloadManagementSystem.Client.JobState.JobState import JobState
 from DIRAC.WorkloadManagementSystem.Client.JobState.JobManifest import JobManifest
 
+#Attributes checked to know if somebody else changed the job
+INIT_STATE_ATTRIBUTES = [ "Status", "MinorStatus", "LastUpdateTime" ]
+
 class CachedJobState( object ):
 
   log = gLogger.getSubLogger( "CachedJobState" )
 
-  def __init__( self, jid, skipInitState = False ):
+  def __init__( self, jid, skipInitState = False, initState = None ):
     self.dOnlyCache = False
     self.__jid = jid
     self.__jobState = JobState( jid )
-    self.cleanState( skipInitState = skipInitState )
+    self.cleanState( skipInitState = skipInitState, initState = initState )
 
-  def cleanState( self, skipInitState = False ):
+  def cleanState( self, skipInitState = False, initState = None ):
     self.__cache = {}
     self.__jobLog = []
     self.__insertIntoTQ = False
@@ -23,8 +26,13 @@ class CachedJobState( object ):
     self.__manifest = False
     self.__initState = None
     self.__lastValidState = time.time()
-    if not skipInitState:
-      result = self.getAttributes( [ "Status", "MinorStatus", "LastUpdateTime" ] )
+    if initState:
+      #Already retrieved by the caller, usually in bulk for many jobs
+      self.__initState = dict( [ ( key, initState[ key ] ) for key in INIT_STATE_ATTRIBUTES ] )
+      for key in INIT_STATE_ATTRIBUTES:
+        self.__cache[ "att.%s" % key ] = initState[ key ]
+    elif not skipInitState:
+      result = self.getAttributes( INIT_STATE_ATTRIBUTES )
       if result[ 'OK' ]:
         self.__initState = result[ 'Value' ]
       else:
@@ -34,7 +42,7 @@ class CachedJobState( object ):
     now = time.time()
     if graceTime <= 0 or now - self.__lastValidState > graceTime:
       self.__lastValidState = now
-      result = self.__jobState.getAttributes( [ "Status", "MinorStatus", "LastUpdateTime" ] )
+      result = self.__jobState.getAttributes( INIT_STATE_ATTRIBUTES )
       if not result[ 'OK' ]:
         return result
       currentState = result[ 'Value' ]
@@ -57,6 +65,10 @@ class CachedJobState( object ):
   def commitChanges( self ):
     if self.__initState == None:
       return S_ERROR( "CachedJobState( %d ) is not valid" % self.__jid )
+    #Nothing to write, the cached state stays as it is
+    if not self.__dirtyKeys and not self.__jobLog and not self.__insertIntoTQ and \
+       not ( self.__manifest and self.__manifest.isDirty() ):
+      return S_OK()
     changes = {}
     for k in self.__dirtyKeys:
       changes[ k ] = self.__cache[ k ]
@@ -3,12 +3,14 @@
 ########################################################################
 
 import os
+import time
 import tarfile
 try:
   import hashlib as md5
 except:
   import md5
 import tempfile
+import threading
 import types
 import re
 from DIRAC.Core.DISET.TransferClient import TransferClient
@@ -17,10 +19,31 @@ from DIRAC.DataManagementSystem.Client.ReplicaManager import ReplicaManager
 from DIRAC.Core.Utilities.File import getGlobbedTotalSize
 from DIRAC import gLogger, S_OK, S_ERROR, gConfig
 
+class HashingFile:
+  """ Write only file object computing the MD5 of what goes through it
+  """
+
+  def __init__( self, fileObj ):
+    self.__fileObj = fileObj
+    self.__oMD5 = md5.md5()
+
+  def write( self, data ):
+    self.__oMD5.update( data )
+    self.__fileObj.write( data )
+
+  def close( self ):
+    self.__fileObj.close()
+
+  def hexdigest( self ):
+    return self.__oMD5.hexdigest()
+
 class SandboxStoreClient:
 
   __validSandboxTypes = ( 'Input', 'Output' )
   __smdb = None
+  __uploadAttempts = 3
+  #Seconds to wait before a new attempt, multiplied by the attempt number
+  __uploadRetryDelay = 5
 
   def __init__( self, rpcClient = False, transferClient = False, **kwargs ):
                
@@ -101,10 +124,13 @@ class SandboxStoreClient:
     except Exception, e:
       return S_ERROR( "Cannot create temporal file: %s" % str( e ) )
 
-    tf = tarfile.open( name = tmpFilePath, mode = "w|bz2" )
+    #Hash the tar while it is written instead of reading it again
+    hashingFile = HashingFile( open( tmpFilePath, "wb" ) )
+    tf = tarfile.open( mode = "w|bz2", fileobj = hashingFile )
     for file in files2Upload:
       tf.add( os.path.realpath( file ), os.path.basename( file ), recursive = True )
     tf.close()
+    hashingFile.close()
 
     if sizeLimit > 0:
       # Evaluate the compressed size of the sandbox
@@ -113,16 +139,7 @@ class SandboxStoreClient:
         result[ 'SandboxFileName' ] = tmpFilePath
         return result
 
-    oMD5 = md5.md5()
-    fd = open( tmpFilePath, "rb" )
-    bData = fd.read( 10240 )
-    while bData:
-      oMD5.update( bData )
-      bData = fd.read( 10240 )
-    fd.close()
-
-    transferClient = self.__getTransferClient()
-    result = transferClient.sendFile( tmpFilePath, ( "%s.tar.bz2" % oMD5.hexdigest(), assignTo ) )
+    result = self.__uploadSandboxFile( tmpFilePath, "%s.tar.bz2" % hashingFile.hexdigest(), assignTo )
     result[ 'SandboxFileName' ] = tmpFilePath
     try:
       os.unlink( tmpFilePath )
@@ -130,6 +147,41 @@ class SandboxStoreClient:
       pass
     return result
 
+  def __uploadSandboxFile( self, tmpFilePath, fileId, assignTo ):
+    """ Offer the sandbox hash to the store and upload the sandbox only if it is
+        not there yet, resuming from the received bytes after a failure
+    """
+    rpcClient = self.__getRPCClient()
+    result = S_ERROR( "No upload attempted" )
+    for attempt in range( self.__uploadAttempts ):
+      if attempt:
+        time.sleep( self.__uploadRetryDelay * attempt )
+      offer = rpcClient.offerSandbox( fileId, assignTo )
+      if not offer[ 'OK' ]:
+        #Store without resumable uploads
+        gLogger.verbose( "Cannot offer the sandbox to the store", offer[ 'Message' ] )
+        return self.__getTransferClient().sendFile( tmpFilePath, ( fileId, assignTo ) )
+      if 'SandboxURL' in offer[ 'Value' ]:
+        gLogger.info( "Sandbox is already in the store, skipping upload" )
+        return S_OK( offer[ 'Value' ][ 'SandboxURL' ] )
+      offset = offer[ 'Value' ][ 'Offset' ]
+      if offset:
+        gLogger.info( "Resuming sandbox upload at byte %s" % offset )
+        #The size of a descriptor is not known, send the remaining bytes so the store can check the limit
+        remainingSize = os.path.getsize( tmpFilePath ) - offset
+        fd = open( tmpFilePath, "rb" )
+        try:
+          fd.seek( offset )
+          result = self.__getTransferClient().sendFile( fd, ( fileId, assignTo, offset ), fileSize = remainingSize )
+        finally:
+          fd.close()
+      else:
+        result = self.__getTransferClient().sendFile( tmpFilePath, ( fileId, assignTo, 0 ) )
+      if result[ 'OK' ]:
+        return result
+      gLogger.warn( "Sandbox upload attempt %s failed" % ( attempt + 1 ), result[ 'Message' ] )
+    return result
+
   ##############
   # Download sandbox
 
@@ -155,16 +207,26 @@ class SandboxStoreClient:
       except:
         pass
 
+    #Sandboxes in the store are extracted while they are received
+    if unpack and not inMemory and SEPFN.find( "://" ) == -1:
+      result = self.__streamSandbox( SEPFN, destinationDir )
+      if result[ 'OK' ]:
+        return result
+      gLogger.verbose( "Cannot stream the sandbox from the store, downloading it", result[ 'Message' ] )
+
     try:
       tmpSBDir = tempfile.mkdtemp( prefix = "TMSB." )
     except Exception, e:
       return S_ERROR( "Cannot create temporal file: %s" % str( e ) )
 
     rm = ReplicaManager()
+    sbFileName = os.path.basename( SEPFN )
     result = rm.getStorageFile( SEPFN, SEName, tmpSBDir, singleFile = True )
     if not result[ 'OK' ]:
-      return result
-    sbFileName = os.path.basename( SEPFN )
+      #The store keeps the sandboxes until they are copied to the external SE
+      retVal = self.__getTransferClient().receiveFile( os.path.join( tmpSBDir, sbFileName ), SEPFN )
+      if not retVal[ 'OK' ]:
+        return result
 
     result = S_OK()
     tarFileName = os.path.join( tmpSBDir, sbFileName )
@@ -205,6 +267,48 @@ class SandboxStoreClient:
 
     return result
 
+  def __streamSandbox( self, sbPath, destinationDir ):
+    """ Receive a sandbox from the store through a pipe and extract it on the fly
+    """
+    rPipe, wPipe = os.pipe()
+    retList = []
+    receiver = threading.Thread( target = self.__receiveToPipe, args = ( sbPath, wPipe, retList ) )
+    receiver.setDaemon( True )
+    receiver.start()
+    sandboxSize = 0
+    error = ""
+    dataSource = os.fdopen( rPipe, "rb" )
+    try:
+      try:
+        tf = tarfile.open( mode = "r|*", fileobj = dataSource )
+        for tarinfo in tf:
+          tf.extract( tarinfo, path = destinationDir )
+          sandboxSize += tarinfo.size
+        tf.close()
+      except Exception, e:
+        error = "Could not open bundle: %s" % str( e )
+      #Drain the pipe for the receiver to finish
+      while dataSource.read( 1048576 ):
+        pass
+    finally:
+      dataSource.close()
+    receiver.join()
+    if not retList[0][ 'OK' ]:
+      return retList[0]
+    if error:
+      return S_ERROR( error )
+    return S_OK( sandboxSize )
+
+  def __receiveToPipe( self, sbPath, wPipe, retList ):
+    dataSink = os.fdopen( wPipe, "wb" )
+    try:
+      try:
+        retList.append( self.__getTransferClient().receiveFile( dataSink, sbPath ) )
+      except Exception, e:
+        retList.append( S_ERROR( "Error while receiving sandbox: %s" % str( e ) ) )
+    finally:
+      dataSink.close()
+
   ##############
   # Jobs
 
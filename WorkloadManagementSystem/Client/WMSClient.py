@@ -104,14 +104,15 @@ class WMSClient:
         return result
     return S_OK()
 
-  def submitJob( self, jdl ):
-    """ Submit one job specified by its JDL to WMS
-    """
-
+  def __getJobManager( self ):
     if not self.jobManagerClient:
-      jobManager = RPCClient( 'WorkloadManagement/JobManager', useCertificates = self.useCertificates, timeout = self.timeout )
-    else:
-      jobManager = self.jobManagerClient
+      return RPCClient( 'WorkloadManagement/JobManager', useCertificates = self.useCertificates, timeout = self.timeout )
+    return self.jobManagerClient
+
+  def __prepareJDL( self, jdl ):
+    """ Check the JDL given as a file name or as a string and upload its
+        input sandbox. Returns the ClassAd of the job
+    """
     if os.path.exists( jdl ):
       fic = open ( jdl, "r" )
       jdlString = fic.read()
@@ -133,6 +134,16 @@ class WMSClient:
     result = self.__uploadInputSandbox( classAdJob )
     if not result['OK']:
       return result
+    return S_OK( classAdJob )
+
+  def submitJob( self, jdl ):
+    """ Submit one job specified by its JDL to WMS
+    """
+    jobManager = self.__getJobManager()
+    result = self.__prepareJDL( jdl )
+    if not result['OK']:
+      return result
+    classAdJob = result['Value']
 
     # Submit the job now and get the new job ID
     result = jobManager.submitJob( classAdJob.asJDL() )
@@ -148,6 +159,23 @@ class WMSClient:
     #print "Sandbox uploading"
     return S_OK( jobID )
 
+  def submitJobs( self, jdlList ):
+    """ Submit many jobs specified by their JDLs to WMS at once, they are
+        inserted in bulk. Returns the list of the new job IDs
+    """
+    jobManager = self.__getJobManager()
+    jdlStrings = []
+    for jdl in jdlList:
+      result = self.__prepareJDL( jdl )
+      if not result['OK']:
+        return result
+      jdlStrings.append( result['Value'].asJDL() )
+
+    result = jobManager.submitJobs( jdlStrings )
+    if not result['OK']:
+      return result
+    return S_OK( result['Value'] )
+
   #This is the OLD method
 
   def __checkInputSandbox( self, classAdJob ):
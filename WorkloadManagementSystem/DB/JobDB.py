@@ -14,6 +14,7 @@
     getAllJobAttributes()
     getDistinctJobAttributes()
     getAttributesForJobList()
+    getJobAttributesUpdatedSince()
     getJobParameter()
     getJobParameters()
     getAllJobParameters()
@@ -26,13 +27,17 @@
 
     setJobAttribute()
     setJobAttributes()
+    setJobAttributesBulk()
     setJobParameter()
     setJobParameters()
+    setJobParametersBulk()
     setJobJDL()
     setJobStatus()
     setInputData()
+    addHeartBeatRecords()
 
     insertNewJobIntoDB()
+    insertNewJobsIntoDB()
     removeJobFromDB()
 
     rescheduleJob()
@@ -44,12 +49,15 @@
     banSiteInMask()
 
     getCounters()
+
+    getHeartBeatData()
+    getHeartBeatSeries()
 """
 
 __RCSID__ = "$Id$"
 
-import sys, types
-import time, operator
+import sys, types, os
+import time, operator, random
 
 from DIRAC.Core.Utilities.ClassAd.ClassAdLight               import ClassAd
 from DIRAC                                                   import S_OK, S_ERROR, Time
@@ -58,6 +66,9 @@ from DIRAC.ConfigurationSystem.Client.Helpers.Registry       import getVOForGrou
 from DIRAC.Core.Base.DB                                      import DB
 from DIRAC.ConfigurationSystem.Client.Helpers.Registry       import getUsernameForDN, getDNForUsername
 from DIRAC.WorkloadManagementSystem.Client.JobState.JobManifest   import JobManifest
+from DIRAC.WorkloadManagementSystem.private.HeartBeatSeries  import packPoints, unpackPoints, downsample, \
+                                                                    toSeriesTime, fromSeriesTime, toEpoch, \
+                                                                    DEFAULT_MAX_POINTS, DEFAULT_RECENT_POINTS
 
 DEBUG = False
 JOB_STATES = ['Received', 'Checking', 'Staging', 'Waiting', 'Matched',
@@ -87,6 +98,10 @@ class JobDB( DB ):
     DB.__init__( self, 'JobDB', 'WorkloadManagement/JobDB', maxQueueSize, debug = DEBUG )
 
     self.maxRescheduling = gConfig.getValue( self.cs_path + '/MaxRescheduling', 3 )
+    # Rows: a row per heart beat value, Series: packed series per job and parameter
+    self.heartBeatStorage = gConfig.getValue( self.cs_path + '/HeartBeatStorage', 'Rows' )
+    self.heartBeatMaxPoints = gConfig.getValue( self.cs_path + '/HeartBeatMaxPoints', DEFAULT_MAX_POINTS )
+    self.heartBeatRecentPoints = gConfig.getValue( self.cs_path + '/HeartBeatRecentPoints', DEFAULT_RECENT_POINTS )
 
     self.jobAttributeNames = []
     self.nJobAttributeNames = 0
@@ -100,6 +115,7 @@ class JobDB( DB ):
       return
 
     self.log.info( "MaxReschedule:  %s" % self.maxRescheduling )
+    self.log.info( "HeartBeatStorage:  %s" % self.heartBeatStorage )
     self.log.info( "==================================================" )
 
     if DEBUG:
@@ -211,6 +227,30 @@ class JobDB( DB ):
       return S_ERROR( 'JobDB.getAttributesForJobList: Failed\n%s' % str( x ) )
 
 
+#############################################################################
+  def getJobAttributesUpdatedSince( self, attrList, condDict = None, newer = None ):
+    """ Get attributes of the jobs selected by condDict, only of those updated
+        since newer if given. The DB time when the selection started is returned
+        to be used as newer in the next call.
+        Returns S_OK( ( dbTime, { jobID : { attrName : attrValue } } ) )
+    """
+    result = self._query( "SELECT UTC_TIMESTAMP()" )
+    if not result['OK']:
+      return result
+    dbTime = result['Value'][0][0]
+    try:
+      cond = self.buildCondition( condDict, newer = newer, timeStamp = 'LastUpdateTime' )
+    except Exception, x:
+      return S_ERROR( str( x ) )
+    cmd = 'SELECT JobID,%s FROM Jobs %s' % ( ','.join( attrList ), cond )
+    result = self._query( cmd )
+    if not result['OK']:
+      return result
+    retDict = {}
+    for retValues in result['Value']:
+      retDict[ int( retValues[0] ) ] = dict( zip( attrList, retValues[1:] ) )
+    return S_OK( ( dbTime, retDict ) )
+
 #############################################################################
   def getDistinctJobAttributes( self, attribute, condDict = None, older = None,
                                 newer = None, timeStamp = 'LastUpdateTime' ):
@@ -726,6 +766,47 @@ class JobDB( DB ):
     else:
       return S_ERROR( 'JobDB.setAttributes: failed to set attribute' )
 
+#############################################################################
+  def setJobAttributesBulk( self, updateList ):
+    """ Set attributes of many jobs in one transaction. updateList is a list of
+        ( jobID, attrDict, update ) with update meaning to refresh LastUpdateTime.
+        StartExecTime and EndExecTime are only set if not set yet, like in
+        setStartExecTime and setEndExecTime. The jobs with the same updates
+        share the statement
+    """
+    jobGroups = {}
+    for jobID, attrDict, update in updateList:
+      key = ( tuple( sorted( attrDict.items() ) ), bool( update ) )
+      jobGroups.setdefault( key, [] ).append( int( jobID ) )
+
+    cmdList = []
+    for ( attrItems, update ), jobIDList in jobGroups.items():
+      attr = []
+      for attrName, attrValue in attrItems:
+        ret = self._escapeString( attrValue )
+        if not ret['OK']:
+          return ret
+        value = ret['Value']
+        if attrName in ( 'StartExecTime', 'EndExecTime' ):
+          attr.append( "%s=IFNULL(%s,%s)" % ( attrName, attrName, value ) )
+        else:
+          attr.append( "%s=%s" % ( attrName, value ) )
+      if update:
+        attr.append( "LastUpdateTime=UTC_TIMESTAMP()" )
+      if not attr:
+        continue
+      jobIDList.sort()
+      for i in range( 0, len( jobIDList ), 1000 ):
+        jobIDString = ','.join( [str( j ) for j in jobIDList[i:i + 1000]] )
+        cmdList.append( 'UPDATE Jobs SET %s WHERE JobID IN (%s)' % ( ', '.join( attr ), jobIDString ) )
+
+    if not cmdList:
+      return S_OK( 0 )
+    result = self._transaction( cmdList )
+    if not result['OK']:
+      return S_ERROR( 'JobDB.setJobAttributesBulk: failed to set attributes: %s' % result['Message'] )
+    return S_OK( len( cmdList ) )
+
 #############################################################################
   def setJobStatus( self, jobID, status = '', minor = '', application = '', appCounter = None ):
     """ Set status of the job specified by its jobID
@@ -910,6 +991,17 @@ class JobDB( DB ):
 
     return result
 
+#############################################################################
+  def setJobParametersBulk( self, parameterList ):
+    """ Set parameters of many jobs, parameterList is a list of ( jobID, name, value )
+    """
+    result = self.insertMultipleRows( 'JobParameters', [ 'JobID', 'Name', 'Value' ],
+                                      [ ( int( jobID ), name, value ) for jobID, name, value in parameterList ],
+                                      updateFields = [ 'Value' ] )
+    if not result['OK']:
+      return S_ERROR( 'JobDB.setJobParametersBulk: operation failed.' )
+    return result
+
  #############################################################################
   def setJobOptParameter( self, jobID, name, value ):
     """ Set an optimzer parameter specified by name,value pair for the job JobID
@@ -1110,12 +1202,9 @@ class JobDB( DB ):
       return result
 
 #############################################################################
-  def insertNewJobIntoDB( self, jdl, owner, ownerDN, ownerGroup, diracSetup ):
-    """ Insert the initial JDL into the Job database,
-        Do initial JDL crosscheck,
-        Set Initial job Attributes and Status
+  def __loadJobManifest( self, jdl, owner, ownerDN, ownerGroup, diracSetup ):
+    """ Load and check the manifest of a new job
     """
-
     jobManifest = JobManifest()
     result = jobManifest.load( jdl )
     if not result['OK']:
@@ -1127,20 +1216,20 @@ class JobDB( DB ):
     result = jobManifest.check()
     if not result['OK']:
       return result
+    return S_OK( jobManifest )
+
+  def __prepareNewJob( self, jobID, jobManifest, owner, ownerDN, ownerGroup, diracSetup ):
+    """ Do initial JDL crosscheck and build what has to be written for a new job
+        with an already allocated jobID, without writing anything.
+        Returns S_OK( dict ) with the Jobs attribute names and values, the JDL,
+        the input data and the initial job parameters, or the S_ERROR of the
+        checks with the attribute names and values of the failed job
+    """
+    jobManifest.setOption( 'JobID', jobID )
+
     jobAttrNames = []
     jobAttrValues = []
 
-    # 1.- insert original JDL on DB and get new JobID
-    # Fix the possible lack of the brackets in the JDL
-    if jdl.strip()[0].find( '[' ) != 0 :
-      jdl = '[' + jdl + ']'
-    result = self.__insertNewJDL( jdl )
-    if not result[ 'OK' ]:
-      return S_ERROR( 'Can not insert JDL in to DB' )
-    jobID = result[ 'Value' ]
-
-    jobManifest.setOption( 'JobID', jobID )
-
     jobAttrNames.append( 'JobID' )
     jobAttrValues.append( jobID )
 
@@ -1162,11 +1251,16 @@ class JobDB( DB ):
     jobAttrNames.append( 'DIRACSetup' )
     jobAttrValues.append( diracSetup )
 
-    # 2.- Check JDL and Prepare DIRAC JDL
+    jobDict = { 'JobID' : jobID,
+                'AttrNames' : jobAttrNames,
+                'AttrValues' : jobAttrValues,
+                'JDL' : '',
+                'InputData' : [],
+                'Parameters' : [] }
+
+    # Check JDL and Prepare DIRAC JDL
     classAdJob = ClassAd( jobManifest.dumpAsJDL() )
     classAdReq = ClassAd( '[]' )
-    retVal = S_OK( jobID )
-    retVal['JobID'] = jobID
     if not classAdJob.isOK():
       jobAttrNames.append( 'Status' )
       jobAttrValues.append( 'Failed' )
@@ -1174,13 +1268,9 @@ class JobDB( DB ):
       jobAttrNames.append( 'MinorStatus' )
       jobAttrValues.append( 'Error in JDL syntax' )
 
-      result = self.insertFields( 'Jobs', jobAttrNames, jobAttrValues )
-      if not result['OK']:
-        return result
-
-      retVal['Status'] = 'Failed'
-      retVal['MinorStatus'] = 'Error in JDL syntax'
-      return retVal
+      jobDict['Status'] = 'Failed'
+      jobDict['MinorStatus'] = 'Error in JDL syntax'
+      return S_OK( jobDict )
 
     classAdJob.insertAttributeInt( 'JobID', jobID )
     result = self.__checkAndPrepareJob( jobID, classAdJob, classAdReq,
@@ -1188,6 +1278,8 @@ class JobDB( DB ):
                                         ownerGroup, diracSetup,
                                         jobAttrNames, jobAttrValues )
     if not result['OK']:
+      result['AttrNames'] = jobAttrNames
+      result['AttrValues'] = jobAttrValues
       return result
 
     priority = classAdJob.getAttributeInt( 'Priority' )
@@ -1226,50 +1318,218 @@ class JobDB( DB ):
     # Replace the JobID placeholder if any
     if jobJDL.find( '%j' ) != -1:
       jobJDL = jobJDL.replace( '%j', str( jobID ) )
-
-    result = self.setJobJDL( jobID, jobJDL )
-    if not result['OK']:
-      return result
+    jobDict['JDL'] = jobJDL
 
     inputData = []
     if classAdJob.lookupAttribute( 'InputData' ):
       inputData = classAdJob.getListFromExpression( 'InputData' )
-    values = []
+    # some jobs are setting empty string as InputData
+    jobDict['InputData'] = [ lfn.strip() for lfn in inputData if lfn ]
 
-    ret = self._escapeString( jobID )
-    if not ret['OK']:
-      return ret
-    e_jobID = ret['Value']
+    # Initial job parameters as defined in the Classad
+    if classAdJob.lookupAttribute( "Parameters" ):
+      jobDict['Parameters'] = classAdJob.getDictionaryFromSubJDL( "Parameters" ).items()
 
-    for lfn in inputData:
-      # some jobs are setting empty string as InputData
-      if not lfn:
-        continue
-      ret = self._escapeString( lfn.strip() )
-      if not ret['OK']:
-        return ret
-      lfn = ret['Value']
+    jobDict['Status'] = 'Received'
+    jobDict['MinorStatus'] = 'Job accepted'
+    return S_OK( jobDict )
 
-      values.append( '(%s, %s )' % ( e_jobID, lfn ) )
+  def insertNewJobIntoDB( self, jdl, owner, ownerDN, ownerGroup, diracSetup ):
+    """ Insert the initial JDL into the Job database,
+        Do initial JDL crosscheck,
+        Set Initial job Attributes and Status
+    """
+    result = self.__loadJobManifest( jdl, owner, ownerDN, ownerGroup, diracSetup )
+    if not result['OK']:
+      return result
+    jobManifest = result['Value']
 
-    if values:
-      cmd = 'INSERT INTO InputData (JobID,LFN) VALUES %s' % ', '.join( values )
-      result = self._update( cmd )
+    # 1.- insert original JDL on DB and get new JobID
+    # Fix the possible lack of the brackets in the JDL
+    if jdl.strip()[0].find( '[' ) != 0 :
+      jdl = '[' + jdl + ']'
+    result = self.__insertNewJDL( jdl )
+    if not result[ 'OK' ]:
+      return S_ERROR( 'Can not insert JDL in to DB' )
+    jobID = result[ 'Value' ]
+
+    # 2.- Check JDL and Prepare DIRAC JDL
+    result = self.__prepareNewJob( jobID, jobManifest, owner, ownerDN, ownerGroup, diracSetup )
+    if not result['OK']:
+      resultInsert = self.setJobAttributes( jobID, result['AttrNames'], result['AttrValues'] )
+      if not resultInsert['OK']:
+        result['MinorStatus'] += '; %s' % resultInsert['Message']
+      del result['AttrNames']
+      del result['AttrValues']
+      return result
+    jobDict = result['Value']
+
+    retVal = S_OK( jobID )
+    retVal['JobID'] = jobID
+    retVal['Status'] = jobDict['Status']
+    retVal['MinorStatus'] = jobDict['MinorStatus']
+
+    if jobDict['JDL']:
+      result = self.setJobJDL( jobID, jobDict['JDL'] )
       if not result['OK']:
         return result
 
-    result = self.__setInitialJobParameters( classAdJob, jobID )
+      if jobDict['InputData']:
+        result = self.insertMultipleRows( 'InputData', [ 'JobID', 'LFN' ],
+                                          [ ( jobID, lfn ) for lfn in jobDict['InputData'] ] )
+        if not result['OK']:
+          return result
+
+      result = self.setJobParameters( jobID, jobDict['Parameters'] )
+      if not result['OK']:
+        return result
+
+    result = self.insertFields( 'Jobs', jobDict['AttrNames'], jobDict['AttrValues'] )
     if not result['OK']:
       return result
 
-    result = self.insertFields( 'Jobs', jobAttrNames, jobAttrValues )
+    return retVal
+
+  def __insertNewJDLs( self, jdlList ):
+    """ Insert the original JDLs of many new jobs with multi-row inserts.
+        The auto increment values of a multi-row insert are not consecutive
+        with innodb_autoinc_lock_mode 2, so the rows are inserted with a token
+        in the JDL field and their JobIDs are read back with it. The JDL is
+        set by insertNewJobsIntoDB afterwards
+    """
+    token = 'NewJobs:%s:%.6f:%s' % ( os.getpid(), time.time(), random.random() )
+    res = self._getConnection()
+    if not res['OK']:
+      return res
+    connection = res['Value']
+
+    try:
+      res = self._escapeString( token, connection )
+      if not res['OK']:
+        return res
+      tokenString = res['Value']
+      res = self._buildMultipleRowInserts( 'JobJDLs', [ 'OriginalJDL', 'JDL' ],
+                                           [ ( jdl, token ) for jdl in jdlList ], connection )
+      if not res['OK']:
+        return res
+      firstJobID = 0
+      for cmd in res['Value']:
+        res = self._update( cmd, connection )
+        if not res['OK']:
+          break
+        if not firstJobID:
+          res = self._query( 'SELECT LAST_INSERT_ID()', connection )
+          if not res['OK']:
+            self.log.error( 'Can not retrieve LAST_INSERT_ID', res['Message'] )
+            break
+          firstJobID = int( res['Value'][0][0] )
+      if res['OK']:
+        # The JobIDs of the batch come after the first one, in the order of the rows
+        cmd = 'SELECT JobID FROM JobJDLs WHERE JobID >= %d AND JDL = %s ORDER BY JobID' % ( firstJobID,
+                                                                                           tokenString )
+        res = self._query( cmd, connection )
+      if not res['OK']:
+        # Only the rows with the token are ours
+        self._update( 'DELETE FROM JobJDLs WHERE JobID >= %d AND JDL = %s' % ( firstJobID, tokenString ),
+                      connection )
+        return res
+      jobIDList = [ int( row[0] ) for row in res['Value'] ]
+    finally:
+      connection.close()
+
+    if len( jobIDList ) != len( jdlList ):
+      if jobIDList:
+        self.__removeNewJDLs( jobIDList )
+      return S_ERROR( 'Got %s JobIDs for %s jobs' % ( len( jobIDList ), len( jdlList ) ) )
+
+    self.log.info( 'JobDB: %s new JobIDs served from %s' % ( len( jobIDList ), jobIDList[0] ) )
+    return S_OK( jobIDList )
+
+  def __removeNewJDLs( self, jobIDList ):
+    """ Free the JobIDs of new jobs that could not be inserted
+    """
+    jobIDString = ','.join( [str( j ) for j in jobIDList] )
+    cmd = 'DELETE FROM JobJDLs WHERE JobID IN ( %s )' % jobIDString
+    result = self._update( cmd )
     if not result['OK']:
-      return result
+      self.log.error( 'Can not remove the JDLs of the failed jobs', result['Message'] )
+    return result
 
-    retVal['Status'] = 'Received'
-    retVal['MinorStatus'] = 'Job accepted'
+  def insertNewJobsIntoDB( self, jdlList, owner, ownerDN, ownerGroup, diracSetup ):
+    """ Insert many new jobs at once, like the jobs of a parametric job:
+        the JobIDs are allocated in a block and the Jobs, JobJDLs, InputData
+        and JobParameters rows of all the jobs are written with multi-row
+        inserts in one transaction. Either all the jobs are inserted or none.
+        The jobs are checked like in insertNewJobIntoDB, jobs with errors in
+        the JDL syntax are inserted as Failed.
+        Returns S_OK( [ { 'JobID', 'Status', 'MinorStatus' } ] ) in the
+        order of jdlList
+    """
+    if not jdlList:
+      return S_OK( [] )
 
-    return retVal
+    jobManifests = []
+    fixedJDLs = []
+    for jdl in jdlList:
+      result = self.__loadJobManifest( jdl, owner, ownerDN, ownerGroup, diracSetup )
+      if not result['OK']:
+        return result
+      jobManifests.append( result['Value'] )
+      # Fix the possible lack of the brackets in the JDL
+      if jdl.strip()[0].find( '[' ) != 0 :
+        jdl = '[' + jdl + ']'
+      fixedJDLs.append( jdl )
+
+    result = self.__insertNewJDLs( fixedJDLs )
+    if not result['OK']:
+      return S_ERROR( 'Can not insert JDLs in to DB: %s' % result['Message'] )
+    jobIDList = result['Value']
+
+    jobList = []
+    for jobID, jobManifest in zip( jobIDList, jobManifests ):
+      result = self.__prepareNewJob( jobID, jobManifest, owner, ownerDN, ownerGroup, diracSetup )
+      if not result['OK']:
+        self.__removeNewJDLs( jobIDList )
+        del result['AttrNames']
+        del result['AttrValues']
+        return result
+      jobList.append( result['Value'] )
+
+    # Jobs with the same attributes defined go in the same statements
+    jobRows = {}
+    jdlRows = []
+    inputDataRows = []
+    parameterRows = []
+    for jobDict in jobList:
+      jobID = jobDict['JobID']
+      jobRows.setdefault( tuple( jobDict['AttrNames'] ), [] ).append( jobDict['AttrValues'] )
+      # Also replaces the token of __insertNewJDLs for the jobs without JDL
+      jdlRows.append( ( jobID, jobDict['JDL'] ) )
+      inputDataRows.extend( [ ( jobID, lfn ) for lfn in jobDict['InputData'] ] )
+      parameterRows.extend( [ ( jobID, name, value ) for name, value in jobDict['Parameters'] ] )
+
+    tableRows = [ ( 'JobJDLs', [ 'JobID', 'JDL' ], jdlRows, [ 'JDL' ] ),
+                  ( 'InputData', [ 'JobID', 'LFN' ], inputDataRows, None ),
+                  ( 'JobParameters', [ 'JobID', 'Name', 'Value' ], parameterRows, [ 'Value' ] ) ]
+    for attrNames in jobRows:
+      tableRows.append( ( 'Jobs', list( attrNames ), jobRows[ attrNames ], None ) )
+
+    cmdList = []
+    for tableName, fields, rows, updateFields in tableRows:
+      result = self._buildMultipleRowInserts( tableName, fields, rows, updateFields = updateFields )
+      if not result['OK']:
+        self.__removeNewJDLs( jobIDList )
+        return result
+      cmdList.extend( result['Value'] )
+
+    result = self._transaction( cmdList )
+    if not result['OK']:
+      self.__removeNewJDLs( jobIDList )
+      return S_ERROR( 'Can not insert the new jobs: %s' % result['Message'] )
+
+    return S_OK( [ { 'JobID' : jobDict['JobID'],
+                     'Status' : jobDict['Status'],
+                     'MinorStatus' : jobDict['MinorStatus'] } for jobDict in jobList ] )
 
   def __checkAndPrepareJob( self, jobID, classAdJob, classAdReq, owner, ownerDN,
                             ownerGroup, diracSetup, jobAttrNames, jobAttrValues ):
@@ -1362,9 +1622,6 @@ class JobDB( DB ):
 
       jobAttrNames.append( 'MinorStatus' )
       jobAttrValues.append( error )
-      resultInsert = self.setJobAttributes( jobID, jobAttrNames, jobAttrValues )
-      if not resultInsert['OK']:
-        retVal['MinorStatus'] += '; %s' % resultInsert['Message']
 
       return retVal
 
@@ -1411,6 +1668,7 @@ class JobDB( DB ):
                    'JobParameters',
                    'AtticJobParameters',
                    'HeartBeatLoggingInfo',
+                   'HeartBeatSeries',
                    'OptimizerParameters',
                    'Jobs'
                    ):
@@ -2140,38 +2398,84 @@ class JobDB( DB ):
       self.log.warn( result['Message'] )
 
     # Add dynamic data to the job heart beat log
-    # start = time.time()
-    valueList = []
-    for key, value in dynamicDataDict.items():
-      result = self._escapeString( key )
-      if not result['OK']:
-        self.log.warn( 'Failed to escape string ' + key )
-        continue
-      e_key = result['Value']
-      result = self._escapeString( value )
-      if not result['OK']:
-        self.log.warn( 'Failed to escape string ' + value )
-        continue
-      e_value = result['Value']
-      valueList.append( "( %s, %s,%s,UTC_TIMESTAMP())" % ( e_jobID, e_key, e_value ) )
-
-    if valueList:
-
-      valueString = ','.join( valueList )
-      req = "INSERT INTO HeartBeatLoggingInfo (JobID,Name,Value,HeartBeatTime) VALUES "
-      req += valueString
-      result = self._update( req )
-      if not result['OK']:
-        ok = False
-        self.log.warn( result['Message'] )
-
-    #print "AT >>>> insertion time ",time.time()-start
+    heartBeatTime = Time.dateTime()
+    result = self.addHeartBeatRecords( [ ( jobID, key, value, heartBeatTime )
+                                         for key, value in dynamicDataDict.items() ] )
+    if not result['OK']:
+      ok = False
+      self.log.warn( result['Message'] )
 
     if ok:
       return S_OK()
     else:
       return S_ERROR( 'Failed to store some or all the parameters' )
 
+#####################################################################################
+  def addHeartBeatRecords( self, recordList ):
+    """ Add the dynamic heart beat data of many jobs to the heart beat log,
+        recordList is a list of ( jobID, name, value, heartBeatTime ).
+        With the Series storage the numeric values are appended to the series
+        of the jobs, the rest still go to the HeartBeatLoggingInfo rows
+    """
+    rowList = []
+    seriesPoints = {}
+    for jobID, name, value, heartBeatTime in recordList:
+      if self.heartBeatStorage == 'Series':
+        try:
+          point = ( toSeriesTime( heartBeatTime ), float( str( value ).replace( '"', '' ) ) )
+          seriesPoints.setdefault( ( int( jobID ), name ), [] ).append( point )
+          continue
+        except ValueError:
+          pass
+      rowList.append( ( int( jobID ), name, value, heartBeatTime ) )
+
+    result = self.insertMultipleRows( 'HeartBeatLoggingInfo', [ 'JobID', 'Name', 'Value', 'HeartBeatTime' ],
+                                      rowList )
+    if not result['OK']:
+      return result
+    if seriesPoints:
+      return self.__appendHeartBeatSeries( seriesPoints )
+    return result
+
+  def __appendHeartBeatSeries( self, seriesPoints ):
+    """ Append the points to the series, { ( jobID, name ) : [ ( seriesTime, value ) ] },
+        and downsample the series getting too long
+    """
+    valueList = []
+    for jobID, name in seriesPoints:
+      ret = self._escapeString( name )
+      if not ret['OK']:
+        return ret
+      points = seriesPoints[ ( jobID, name ) ]
+      valueList.append( "(%d,%s,%d,0x%s)" % ( jobID, ret['Value'], len( points ),
+                                              packPoints( points ).encode( 'hex' ) ) )
+    for i in range( 0, len( valueList ), 500 ):
+      req = "INSERT INTO HeartBeatSeries (JobID,Name,NumPoints,Points) VALUES %s" % ','.join( valueList[i:i + 500] )
+      req += " ON DUPLICATE KEY UPDATE Points=CONCAT(Points,VALUES(Points)), NumPoints=NumPoints+VALUES(NumPoints)"
+      result = self._update( req )
+      if not result['OK']:
+        return result
+
+    jobIDString = ','.join( [ str( j ) for j in set( [ jobID for jobID, name in seriesPoints ] ) ] )
+    req = "SELECT JobID,Name,NumPoints,Points FROM HeartBeatSeries WHERE JobID IN (%s) AND NumPoints>%d" % \
+          ( jobIDString, self.heartBeatMaxPoints )
+    result = self._query( req )
+    if not result['OK']:
+      return result
+    for jobID, name, numPoints, data in result['Value']:
+      points = downsample( unpackPoints( data ), self.heartBeatMaxPoints, self.heartBeatRecentPoints )
+      ret = self._escapeString( name )
+      if not ret['OK']:
+        return ret
+      # Do not overwrite the points appended meanwhile, they will be downsampled next time
+      req = "UPDATE HeartBeatSeries SET NumPoints=%d, Points=0x%s WHERE JobID=%d AND Name=%s AND NumPoints=%d" % \
+            ( len( points ), packPoints( points ).encode( 'hex' ), jobID, ret['Value'], numPoints )
+      result = self._update( req )
+      if not result['OK']:
+        self.log.warn( 'Failed to downsample the heart beat series', '%s %s: %s' % ( jobID, name,
+                                                                                   result['Message'] ) )
+    return S_OK()
+
 #####################################################################################
   def getHeartBeatData( self, jobID ):
     """ Retrieve the job's heart beat data
@@ -2186,16 +2490,73 @@ class JobDB( DB ):
     if not res['OK']:
       return res
 
-    if len( res['Value'] ) == 0:
-      return S_OK ( [] )
-
     result = []
     values = res['Value']
     for row in values:
       result.append( ( str( row[0] ), '%.01f' % ( float( row[1].replace( '"', '' ) ) ), str( row[2] ) ) )
 
+    res = self.__getHeartBeatSeries( jobID )
+    if not res['OK']:
+      return res
+    for name, points in res['Value'].items():
+      for seriesTime, value in points:
+        result.append( ( name, '%.01f' % value, str( fromSeriesTime( seriesTime ) ) ) )
+
     return S_OK( result )
 
+  def __getHeartBeatSeries( self, e_jobID, nameList = None ):
+    """ Series of the job, { name : [ ( seriesTime, value ) ] }
+    """
+    cmd = 'SELECT Name,Points FROM HeartBeatSeries WHERE JobID=%s' % e_jobID
+    if nameList:
+      e_names = []
+      for name in nameList:
+        ret = self._escapeString( name )
+        if not ret['OK']:
+          return ret
+        e_names.append( ret['Value'] )
+      cmd += ' AND Name IN (%s)' % ','.join( e_names )
+    res = self._query( cmd )
+    if not res['OK']:
+      return res
+    return S_OK( dict( [ ( str( name ), unpackPoints( data ) ) for name, data in res['Value'] ] ) )
+
+  def getHeartBeatSeries( self, jobID, nameList = None, maxPoints = 0 ):
+    """ Get the heart beat data of the job as series for plotting,
+        { name : [ ( epoch, value ) ] } sorted by time, with the points of
+        both storages. With maxPoints the series are downsampled to it
+    """
+    ret = self._escapeString( jobID )
+    if not ret['OK']:
+      return ret
+    e_jobID = ret['Value']
+
+    res = self.__getHeartBeatSeries( e_jobID, nameList )
+    if not res['OK']:
+      return res
+    series = res['Value']
+
+    cmd = 'SELECT Name,Value,HeartBeatTime FROM HeartBeatLoggingInfo WHERE JobID=%s' % e_jobID
+    res = self._query( cmd )
+    if not res['OK']:
+      return res
+    for name, value, heartBeatTime in res['Value']:
+      name = str( name )
+      if nameList and name not in nameList:
+        continue
+      try:
+        value = float( str( value ).replace( '"', '' ) )
+      except ValueError:
+        continue
+      series.setdefault( name, [] ).append( ( toSeriesTime( heartBeatTime ), value ) )
+
+    for name in series:
+      points = sorted( series[ name ] )
+      if maxPoints:
+        points = downsample( points, maxPoints, 0 )
+      series[ name ] = [ ( toEpoch( seriesTime ), value ) for seriesTime, value in points ]
+    return S_OK( series )
+
 #####################################################################################
   def setJobCommand( self, jobID, command, arguments = None ):
     """ Store a command to be passed to the job together with the
@@ -54,6 +54,7 @@ CREATE TABLE Jobs (
     SubmissionTime DATETIME,
     RescheduleTime DATETIME,
     LastUpdateTime DATETIME,
+    INDEX (LastUpdateTime),
     StartExecTime DATETIME,
     HeartBeatTime DATETIME,
     EndExecTime DATETIME,
@@ -81,6 +82,10 @@ CREATE TABLE Jobs (
 ) ENGINE = InnoDB;
 
 -- ------------------------------------------------------------------------------
+-- JobJDLs and InputData are InnoDB so that the bulk job insertion is a single
+-- transaction. Existing installations have to convert them:
+--   ALTER TABLE JobJDLs ENGINE = InnoDB;
+--   ALTER TABLE InputData ENGINE = InnoDB;
 DROP TABLE IF EXISTS JobJDLs;
 CREATE TABLE JobJDLs (
     JobID INTEGER NOT NULL AUTO_INCREMENT,
@@ -88,7 +93,7 @@ CREATE TABLE JobJDLs (
     JobRequirements BLOB NOT NULL DEFAULT '',
     OriginalJDL BLOB NOT NULL DEFAULT '',
     PRIMARY KEY (JobID)
-);
+) ENGINE = InnoDB;
 
 -- ------------------------------------------------------------------------------
 DROP TABLE IF EXISTS SubJobs;
@@ -111,7 +116,7 @@ CREATE TABLE InputData (
     Status VARCHAR(32) NOT NULL DEFAULT 'AprioriGood',
     LFN VARCHAR(255),
     PRIMARY KEY(JobID, LFN)
-);
+) ENGINE = InnoDB;
 
 -- ------------------------------------------------------------------------------
 DROP TABLE IF EXISTS JobParameters;
@@ -190,6 +195,16 @@ CREATE TABLE HeartBeatLoggingInfo (
     INDEX (JobID)
 )ENGINE = InnoDB;
 
+-- ------------------------------------------------------------------------------
+DROP TABLE IF EXISTS HeartBeatSeries;
+CREATE TABLE HeartBeatSeries (
+    JobID INTEGER NOT NULL,
+    Name VARCHAR(100) NOT NULL,
+    NumPoints INTEGER NOT NULL DEFAULT 0,
+    Points MEDIUMBLOB NOT NULL,
+    PRIMARY KEY (JobID, Name)
+) ENGINE = InnoDB;
+
 -- ------------------------------------------------------------------------------
 DROP TABLE IF EXISTS JobCommands;
 CREATE TABLE JobCommands (
@@ -5,6 +5,7 @@
     The following methods are provided
 
     addLoggingRecord()
+    addLoggingRecords()
     getJobLoggingInfo()
     getWMSTimeStamps()    
 """    
@@ -51,9 +52,12 @@ class JobLoggingDB(DB):
         UTC time is used. 
     """
   
-    event = 'status/minor/app=%s/%s/%s' % (status,minor,application)
-    self.gLogger.info("Adding record for job "+str(jobID)+": '"+event+"' from "+source)
-  
+    return self.addLoggingRecords( [ ( jobID, status, minor, application, date, source ) ] )
+
+#############################################################################
+  def __getStatusTime( self, date ):
+    """ Get the status time and its order number from the date of the record
+    """
     if not date:
       # Make the UTC datetime string and float
       _date = Time.dateTime()
@@ -80,12 +84,23 @@ class JobLoggingDB(DB):
         _date = Time.dateTime()
         epoc = time.mktime(_date.timetuple()) - MAGIC_EPOC_NUMBER
         time_order = round(epoc,3)     
+    return _date, time_order
+
+#############################################################################
+  def addLoggingRecords( self, records ):
+    """ Add many entries to the JobLoggingDB table with a single statement.
+        Records are ( jobID, status, minor, application, date, source ) tuples
+        with the same meaning as the addLoggingRecord arguments
+    """
+    rows = []
+    for jobID, status, minor, application, date, source in records:
+      event = 'status/minor/app=%s/%s/%s' % (status,minor,application)
+      self.gLogger.info("Adding record for job "+str(jobID)+": '"+event+"' from "+source)
+      _date, time_order = self.__getStatusTime( date )
+      rows.append( ( int(jobID), status, minor, application, str(_date), time_order, source ) )
 
-    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
-          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
-           (int(jobID),status,minor,application,str(_date),time_order,source)
-            
-    return self._update( cmd )
+    return self.insertMultipleRows( 'LoggingInfo', [ 'JobId', 'Status', 'MinorStatus', 'ApplicationStatus',
+                                                     'StatusTime', 'StatusTimeOrder', 'StatusSource' ], rows )
     
 #############################################################################
   def getJobLoggingInfo(self, jobID):
@@ -12,13 +12,12 @@ import time
 from DIRAC  import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.private.SharesCorrector import SharesCorrector
 from DIRAC.WorkloadManagementSystem.private.Queues import maxCPUSegments
+from DIRAC.WorkloadManagementSystem.private.TQPriorityCalculator import calculateTQPriorities, DEFAULT_GROUP_SHARE
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.Core.Utilities import List, DictCache
 from DIRAC.Core.Base.DB import DB
 from DIRAC.Core.Security import Properties, CS
 
-DEFAULT_GROUP_SHARE = 1000
-TQ_MIN_SHARE = 0.001
 
 class TaskQueueDB( DB ):
 
@@ -115,6 +114,19 @@ class TaskQueueDB( DB ):
                                        'Indexes': { 'TaskIndex': [ 'TQId' ] },
                                      }
 
+    #Jobs taken out of tq_Jobs by the job reservoir of a Matcher until they are handed out
+    self.__tablesDesc[ 'tq_JobLeases' ] = { 'Fields' : { 'JobId' : 'INTEGER UNSIGNED NOT NULL',
+                                                         'TQId' : 'INTEGER UNSIGNED NOT NULL',
+                                                         'Priority' : 'INTEGER UNSIGNED NOT NULL',
+                                                         'RealPriority' : 'FLOAT NOT NULL',
+                                                         'LeaseOwner' : 'VARCHAR(128) NOT NULL',
+                                                         'LeaseExpiry' : 'DATETIME NOT NULL'
+                                                       },
+                                            'PrimaryKey' : 'JobId',
+                                            'Indexes': { 'TaskIndex': [ 'TQId' ], 'OwnerIndex' : [ 'LeaseOwner' ],
+                                                         'ExpiryIndex' : [ 'LeaseExpiry' ] },
+                                          }
+
     for multiField in self.__multiValueDefFields:
       tableName = 'tq_TQTo%s' % multiField
       self.__tablesDesc[ tableName ] = { 'Fields' : { 'TQId' : 'INTEGER UNSIGNED NOT NULL',
@@ -323,7 +335,9 @@ class TaskQueueDB( DB ):
     Delete all empty task queues
     """
     self.log.info( "Cleaning orphaned TQs" )
-    result = self._update( "DELETE FROM `tq_TaskQueues` WHERE Enabled >= 1 AND TQId not in ( SELECT DISTINCT TQId from `tq_Jobs` )", conn = connObj )
+    sqlCmd = "DELETE FROM `tq_TaskQueues` WHERE Enabled >= 1 AND TQId not in ( SELECT DISTINCT TQId from `tq_Jobs` )"
+    sqlCmd = "%s AND TQId not in ( SELECT DISTINCT TQId from `tq_JobLeases` )" % sqlCmd
+    result = self._update( sqlCmd, conn = connObj )
     if not result[ 'OK' ]:
       return result
     for mvField in self.__multiValueDefFields:
@@ -737,7 +751,8 @@ class TaskQueueDB( DB ):
       return S_ERROR( "Could not get job from task queue %s: %s" % ( jobId, retVal[ 'Message' ] ) )
     data = retVal[ 'Value' ]
     if not data:
-      return S_OK( False )
+      #It may be leased by the job reservoir of a Matcher
+      return self.__deleteJobLease( jobId, connObj = connObj )
     tqId, tqOwnerDN, tqOwnerGroup = data[0]
     self.log.info( "Deleting job %s" % jobId )
     retVal = self._update( "DELETE FROM `tq_Jobs` WHERE JobId = %s" % jobId, conn = connObj )
@@ -752,6 +767,177 @@ class TaskQueueDB( DB ):
     self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
     return S_OK( True )
 
+  def claimJob( self, jobId, tqId, tqOwnerDN, tqOwnerGroup, connObj = False ):
+    """
+    Take a job out of its task queue when the task queue is already known.
+    Only one of the concurrent claims of a job succeeds
+    Return S_OK( True/False ) / S_ERROR
+    """
+    retVal = self._update( "DELETE FROM `tq_Jobs` WHERE JobId = %d AND TQId = %d" % ( jobId, tqId ), conn = connObj )
+    if not retVal[ 'OK' ]:
+      return S_ERROR( "Could not claim job %s from task queue %s: %s" % ( jobId, tqId, retVal[ 'Message' ] ) )
+    if retVal[ 'Value' ] == 0:
+      return S_OK( False )
+    self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
+    return S_OK( True )
+
+  def __deleteJobLease( self, jobId, connObj = False ):
+    """
+    Delete the lease of a job, the reservoir holding it won't hand it out
+    """
+    sqlCmd = "SELECT t.TQId, t.OwnerDN, t.OwnerGroup FROM `tq_TaskQueues` t, `tq_JobLeases` l"
+    retVal = self._query( "%s WHERE l.JobId = %s AND t.TQId = l.TQId" % ( sqlCmd, jobId ), conn = connObj )
+    if not retVal[ 'OK' ]:
+      return S_ERROR( "Could not get job lease %s: %s" % ( jobId, retVal[ 'Message' ] ) )
+    if not retVal[ 'Value' ]:
+      return S_OK( False )
+    tqId, tqOwnerDN, tqOwnerGroup = retVal[ 'Value' ][0]
+    retVal = self._update( "DELETE FROM `tq_JobLeases` WHERE JobId = %s" % jobId, conn = connObj )
+    if not retVal[ 'OK' ]:
+      return S_ERROR( "Could not delete job lease %s: %s" % ( jobId, retVal[ 'Message' ] ) )
+    if retVal[ 'Value' ] == 0:
+      return S_OK( False )
+    self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
+    return S_OK( True )
+
+  def leaseJobs( self, tqId, numJobs, leaseOwner, leaseTime ):
+    """
+    Move up to numJobs jobs of a task queue to the leases table for leaseTime secs
+    leaseOwner has to be unique for each call
+    Return S_OK( [ ( jobId, priority, realPriority ), ... ] )
+    """
+    result = self._escapeString( leaseOwner )
+    if not result[ 'OK' ]:
+      return result
+    leaseOwner = result[ 'Value' ]
+    tqId = int( tqId )
+    #The jobs of the TQ are locked until the transaction ends so no one else takes them meanwhile
+    cmdList = [ "SELECT JobId FROM `tq_Jobs` WHERE TQId = %d FOR UPDATE" % tqId ]
+    sqlCmd = "INSERT INTO `tq_JobLeases` ( JobId, TQId, Priority, RealPriority, LeaseOwner, LeaseExpiry )"
+    sqlCmd = "%s SELECT JobId, TQId, Priority, RealPriority, %s, TIMESTAMPADD( SECOND, %d, UTC_TIMESTAMP() )" % ( sqlCmd,
+                                                                                                  leaseOwner, leaseTime )
+    cmdList.append( "%s FROM `tq_Jobs` WHERE TQId = %d ORDER BY RAND() / RealPriority ASC LIMIT %d" % ( sqlCmd, tqId,
+                                                                                                     numJobs ) )
+    sqlCmd = "DELETE j FROM `tq_Jobs` j, `tq_JobLeases` l WHERE j.JobId = l.JobId AND l.LeaseOwner = %s" % leaseOwner
+    cmdList.append( sqlCmd )
+    result = self._transaction( cmdList )
+    if not result[ 'OK' ]:
+      return S_ERROR( "Could not lease jobs of task queue %s: %s" % ( tqId, result[ 'Message' ] ) )
+    if not result[ 'Value' ][1][1]:
+      return S_OK( [] )
+    sqlCmd = "SELECT JobId, Priority, RealPriority FROM `tq_JobLeases` WHERE LeaseOwner = %s" % leaseOwner
+    result = self._query( "%s ORDER BY RealPriority DESC" % sqlCmd )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( [ tuple( row ) for row in result[ 'Value' ] ] )
+
+  def consumeJobLease( self, jobId, leaseOwner, tqId, tqOwnerDN, tqOwnerGroup ):
+    """
+    Take a leased job for good. It fails if the lease has expired and the job was returned
+    Return S_OK( True/False )
+    """
+    result = self._escapeString( leaseOwner )
+    if not result[ 'OK' ]:
+      return result
+    sqlCmd = "DELETE FROM `tq_JobLeases` WHERE JobId = %d AND LeaseOwner = %s" % ( jobId, result[ 'Value' ] )
+    result = self._update( sqlCmd )
+    if not result[ 'OK' ]:
+      return S_ERROR( "Could not take leased job %s: %s" % ( jobId, result[ 'Message' ] ) )
+    if result[ 'Value' ] == 0:
+      return S_OK( False )
+    self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
+    return S_OK( True )
+
+  def __returnJobLeases( self, sqlCond ):
+    """ Move back the leased jobs matching the condition to their task queues """
+    cmdList = [ "SELECT JobId FROM `tq_JobLeases` WHERE %s FOR UPDATE" % sqlCond ]
+    sqlCmd = "INSERT IGNORE INTO `tq_Jobs` ( TQId, JobId, Priority, RealPriority )"
+    cmdList.append( "%s SELECT TQId, JobId, Priority, RealPriority FROM `tq_JobLeases` WHERE %s" % ( sqlCmd, sqlCond ) )
+    cmdList.append( "DELETE FROM `tq_JobLeases` WHERE %s" % sqlCond )
+    result = self._transaction( cmdList )
+    if not result[ 'OK' ]:
+      return S_ERROR( "Could not return leased jobs: %s" % result[ 'Message' ] )
+    return S_OK( result[ 'Value' ][2][1] )
+
+  def releaseJobLeases( self, jobIdList, leaseOwner ):
+    """
+    Give back leased jobs that won't be handed out
+    Return S_OK( number of jobs returned )
+    """
+    if not jobIdList:
+      return S_OK( 0 )
+    result = self._escapeString( leaseOwner )
+    if not result[ 'OK' ]:
+      return result
+    return self.__returnJobLeases( "JobId in ( %s ) AND LeaseOwner = %s" % ( List.intListToString( jobIdList ),
+                                                                           result[ 'Value' ] ) )
+
+  def returnExpiredJobLeases( self ):
+    """
+    Give back the jobs whose lease has expired, the reservoir holding them may be gone
+    Return S_OK( number of jobs returned )
+    """
+    #The leases are set with the clock of the DB server, compare with the same one
+    return self.__returnJobLeases( "LeaseExpiry < UTC_TIMESTAMP()" )
+
+  def getTaskQueuesSummary( self ):
+    """
+    Get the priority, the number of jobs and the highest JobId of each task queue
+    Return S_OK( { tqId : ( priority, numJobs, maxJobId ) } )
+    """
+    sqlCmd = "SELECT t.TQId, t.Priority, COUNT( j.JobId ), MAX( j.JobId ) FROM `tq_TaskQueues` t"
+    sqlCmd = "%s LEFT JOIN `tq_Jobs` j ON t.TQId = j.TQId GROUP BY t.TQId" % sqlCmd
+    retVal = self._query( sqlCmd )
+    if not retVal[ 'OK' ]:
+      return retVal
+    summary = {}
+    for tqId, priority, numJobs, maxJobId in retVal[ 'Value' ]:
+      summary[ tqId ] = ( priority, numJobs, maxJobId or 0 )
+    return S_OK( summary )
+
+  def getTaskQueueDefinitions( self, tqIdList ):
+    """
+    Get the definition of the given task queues
+    Return S_OK( { tqId : { 'OwnerDN' : ..., 'Priority' : ..., 'Sites' : [ ... ], ... } } )
+    """
+    tqDefs = {}
+    maxTQsInQuery = 1000
+    fields = [ 'TQId', 'Priority' ] + list( self.__singleValueDefFields )
+    for i in range( 0, len( tqIdList ), maxTQsInQuery ):
+      tqIds = ", ".join( [ str( int( tqId ) ) for tqId in tqIdList[ i : i + maxTQsInQuery ] ] )
+      retVal = self._query( "SELECT %s FROM `tq_TaskQueues` WHERE TQId in ( %s )" % ( ", ".join( fields ), tqIds ) )
+      if not retVal[ 'OK' ]:
+        return retVal
+      for record in retVal[ 'Value' ]:
+        tqDefs[ record[0] ] = dict( zip( fields[1:], record[1:] ) )
+      for field in self.__multiValueDefFields:
+        retVal = self._query( "SELECT TQId, Value FROM `tq_TQTo%s` WHERE TQId in ( %s )" % ( field, tqIds ) )
+        if not retVal[ 'OK' ]:
+          return retVal
+        for tqId, value in retVal[ 'Value' ]:
+          if tqId in tqDefs:
+            tqDefs[ tqId ].setdefault( field, [] ).append( value )
+    return S_OK( tqDefs )
+
+  def getJobsInTaskQueues( self, tqIdList, minJobId = 0 ):
+    """
+    Get the jobs in the given task queues with a JobId higher than minJobId
+    Return S_OK( { tqId : [ ( jobId, priority, realPriority ), ... ] } )
+    """
+    tqJobs = {}
+    maxTQsInQuery = 1000
+    for i in range( 0, len( tqIdList ), maxTQsInQuery ):
+      tqIds = ", ".join( [ str( int( tqId ) ) for tqId in tqIdList[ i : i + maxTQsInQuery ] ] )
+      sqlCmd = "SELECT TQId, JobId, Priority, RealPriority FROM `tq_Jobs` WHERE TQId in ( %s )" % tqIds
+      if minJobId:
+        sqlCmd = "%s AND JobId > %d" % ( sqlCmd, minJobId )
+      retVal = self._query( sqlCmd )
+      if not retVal[ 'OK' ]:
+        return retVal
+      for tqId, jobId, priority, realPriority in retVal[ 'Value' ]:
+        tqJobs.setdefault( tqId, [] ).append( ( jobId, priority, realPriority ) )
+    return S_OK( tqJobs )
+
   def getTaskQueueForJob( self, jobId, connObj = False ):
     """
     Return TaskQueue for a given Job
@@ -837,6 +1023,7 @@ class TaskQueueDB( DB ):
       tqOwnerDN, tqOwnerGroup = data
     sqlCmd = "DELETE FROM `tq_TaskQueues` WHERE Enabled >= 1 AND `tq_TaskQueues`.TQId = %s" % tqId
     sqlCmd = "%s AND `tq_TaskQueues`.TQId not in ( SELECT DISTINCT TQId from `tq_Jobs` )" % sqlCmd
+    sqlCmd = "%s AND `tq_TaskQueues`.TQId not in ( SELECT DISTINCT TQId from `tq_JobLeases` )" % sqlCmd
     retVal = self._update( sqlCmd, conn = connObj )
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
@@ -874,10 +1061,11 @@ class TaskQueueDB( DB ):
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     delTQ = retVal[ 'Value' ]
-    sqlCmd = "DELETE FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s" % tqId
-    retVal = self._update( sqlCmd, conn = connObj )
-    if not retVal[ 'OK' ]:
-      return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
+    for tableName in ( 'tq_Jobs', 'tq_JobLeases' ):
+      sqlCmd = "DELETE FROM `%s` WHERE TQId = %s" % ( tableName, tqId )
+      retVal = self._update( sqlCmd, conn = connObj )
+      if not retVal[ 'OK' ]:
+        return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     for mvField in self.__multiValueDefFields:
       retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % tqId, conn = connObj )
       if not retVal[ 'OK' ]:
@@ -995,141 +1183,101 @@ class TaskQueueDB( DB ):
       self.__sharesCorrector.update()
     self.__updateGlobalShares()
     self.log.info( "Recalculating shares for all TQs" )
-    retVal = self._getConnection()
-    if not retVal[ 'OK' ]:
-      return S_ERROR( "Can't insert job: %s" % retVal[ 'Message' ] )
-    connObj = retVal[ 'Value' ]
-    result = self._query( "SELECT DISTINCT( OwnerGroup ) FROM `tq_TaskQueues`" )
-    if not result[ 'OK' ]:
-      return result
-    for group in [ r[0] for r in result[ 'Value' ] ]:
-      self.recalculateTQSharesForEntity( "all", group )
-    return S_OK()
+    return self.__recalculatePriorities()
 
   def recalculateTQSharesForEntity( self, userDN, userGroup, connObj = False ):
     """
     Recalculate the shares for a userDN/userGroup combo
     """
     self.log.info( "Recalculating shares for %s@%s TQs" % ( userDN, userGroup ) )
-    if userGroup in self.__groupShares:
-      share = self.__groupShares[ userGroup ]
-    else:
-      share = float( DEFAULT_GROUP_SHARE )
-    if Properties.JOB_SHARING in CS.getPropertiesForGroup( userGroup ):
-      #If group has JobSharing just set prio for that entry, userDN is irrelevant
-      return self.__setPrioritiesForEntity( userDN, userGroup, share, connObj = connObj )
+    #The share of the owners depends on the number of owners in the group
+    return self.__recalculatePriorities( userGroup, connObj = connObj )
 
-    selSQL = "SELECT OwnerDN, COUNT(OwnerDN) FROM `tq_TaskQueues` WHERE OwnerGroup='%s' GROUP BY OwnerDN" % ( userGroup )
-    result = self._query( selSQL, conn = connObj )
+  def __loadPriorityState( self, ownerGroup = False, connObj = False ):
+    """
+    Load the owners, priorities and jobs real priorities of all the TQs, or of the
+    ones of a group, and the definitions of the enabled ones to group them.
+    Returns S_OK( { tqId : ( ownerDN, ownerGroup, priority, sumOfJobsRealPriority, numJobs, groupKey ) } )
+    """
+    tqCond = ""
+    mvCond = ""
+    if ownerGroup:
+      result = self._escapeString( ownerGroup )
+      if not result[ 'OK' ]:
+        return result
+      tqCond = "WHERE t.OwnerGroup = %s" % result[ 'Value' ]
+      mvCond = ", `tq_TaskQueues` t WHERE v.TQId = t.TQId AND t.OwnerGroup = %s" % result[ 'Value' ]
+    sqlCmd = "SELECT t.TQId, t.OwnerDN, t.OwnerGroup, t.Setup, t.CPUTime, t.Priority, t.Enabled,"
+    sqlCmd += " SUM( j.RealPriority ), COUNT( j.JobId ) FROM `tq_TaskQueues` t"
+    sqlCmd += " LEFT JOIN `tq_Jobs` j ON t.TQId = j.TQId %s GROUP BY t.TQId" % tqCond
+    result = self._query( sqlCmd, conn = connObj )
     if not result[ 'OK' ]:
       return result
-    #Get owners in this group and the amount of times they appear
-    data = [ ( r[0], r[1] ) for r in result[ 'Value' ] if r ]
-    numOwners = len( data )
-    #If there are no owners do now
-    if numOwners == 0:
-      return S_OK()
-    #Split the share amongst the number of owners
-    share /= numOwners
-    entitiesShares = dict( [ ( row[0], share ) for row in data ] )
-    #If corrector is enabled let it work it's magic
-    if self.isSharesCorrectionEnabled():
-      entitiesShares = self.__sharesCorrector.correctShares( entitiesShares, group = userGroup )
-    #Keep updating
-    owners = dict( data )
-    #IF the user is already known and has more than 1 tq, the rest of the users don't need to be modified
-    #(The number of owners didn't change)
-    if userDN in owners and owners[ userDN ] > 1:
-      return self.__setPrioritiesForEntity( userDN, userGroup, entitiesShares[ userDN ], connObj = connObj )
-    #Oops the number of owners may have changed so we recalculate the prio for all owners in the group
-    for userDN in owners:
-      self.__setPrioritiesForEntity( userDN, userGroup, entitiesShares[ userDN ], connObj = connObj )
-    return S_OK()
+    tqRecords = result[ 'Value' ]
+    #Values of the multi value fields that count for the grouping
+    mvValues = {}
+    for field in self.__multiValueDefFields:
+      if field in self.__priorityIgnoredFields:
+        continue
+      sqlCmd = "SELECT v.TQId, v.Value FROM `tq_TQTo%s` v %s" % ( field, mvCond )
+      result = self._query( sqlCmd, conn = connObj )
+      if not result[ 'OK' ]:
+        return result
+      for tqId, value in result[ 'Value' ]:
+        mvValues.setdefault( tqId, {} ).setdefault( field, [] ).append( value )
+    tqData = {}
+    for tqId, ownerDN, group, setup, cpuTime, priority, enabled, sumRealPrio, numJobs in tqRecords:
+      groupKey = None
+      if enabled >= 1:
+        tqValues = mvValues.get( tqId, {} )
+        groupKey = ( ownerDN, group, setup, cpuTime,
+                     tuple( [ ( field, tuple( sorted( tqValues[ field ] ) ) ) for field in sorted( tqValues ) ] ) )
+      tqData[ tqId ] = ( ownerDN, group, priority, sumRealPrio or 0.0, numJobs, groupKey )
+    return S_OK( tqData )
 
-  def __setPrioritiesForEntity( self, userDN, userGroup, share, connObj = False, consolidationFunc = "AVG" ):
+  def __recalculatePriorities( self, ownerGroup = False, connObj = False ):
     """
-    Set the priority for a userDN/userGroup combo given a splitted share
+    Calculate the priorities of all the TQs or of the ones of a group in bulk
+    and update the ones that changed
     """
-    self.log.info( "Setting priorities to %s@%s TQs" % ( userDN, userGroup ) )
-    tqCond = [ "t.OwnerGroup='%s'" % userGroup ]
-    allowBgTQs = gConfig.getValue( "/Registry/Groups/%s/AllowBackgroundTQs" % userGroup, False )
-    if Properties.JOB_SHARING not in CS.getPropertiesForGroup( userGroup ):
-      tqCond.append( "t.OwnerDN='%s'" % userDN )
-    tqCond.append( "t.TQId = j.TQId" )
-    if consolidationFunc == 'AVG':
-      selectSQL = "SELECT j.TQId, SUM( j.RealPriority )/COUNT(j.RealPriority) FROM `tq_TaskQueues` t, `tq_Jobs` j WHERE "
-    elif consolidationFunc == 'SUM':
-      selectSQL = "SELECT j.TQId, SUM( j.RealPriority ) FROM `tq_TaskQueues` t, `tq_Jobs` j WHERE "
-    else:
-      return S_ERROR( "Unknown consolidation func %s for setting priorities" % consolidationFunc )
-    selectSQL += " AND ".join( tqCond )
-    selectSQL += " GROUP BY t.TQId"
-    result = self._query( selectSQL, conn = connObj )
+    start = time.time()
+    result = self.__loadPriorityState( ownerGroup, connObj = connObj )
     if not result[ 'OK' ]:
       return result
-
-    tqDict = dict( result[ 'Value' ] )
-    if len( tqDict ) == 0:
-      return S_OK()
-    #Calculate Sum of priorities
-    totalPrio = 0
-    for k in tqDict:
-      if tqDict[k] > 0.1 or not allowBgTQs:
-        totalPrio += tqDict[ k ]
-    #Update prio for each TQ
-    for tqId in tqDict:
-      if tqDict[ tqId ] > 0.1 or not allowBgTQs:
-        prio = ( share / totalPrio ) * tqDict[ tqId ]
-      else:
-        prio = TQ_MIN_SHARE
-      prio = max( prio, TQ_MIN_SHARE )
-      tqDict[ tqId ] = prio
-
-    #Generate groups of TQs that will have the same prio=sum(prios) maomenos
-    result = self.retrieveTaskQueues( list( tqDict ) )
+    tqData = result[ 'Value' ]
+    groups = set( [ tqData[ tqId ][1] for tqId in tqData ] )
+    jobSharingGroups = set( [ group for group in groups if Properties.JOB_SHARING in CS.getPropertiesForGroup( group ) ] )
+    bgAllowedGroups = set( [ group for group in groups
+                             if gConfig.getValue( "/Registry/Groups/%s/AllowBackgroundTQs" % group, False ) ] )
+    correctShares = None
+    if self.isSharesCorrectionEnabled():
+      correctShares = self.__sharesCorrector.correctShares
+    groupShares = dict( [ ( group, self.__groupShares.get( group, DEFAULT_GROUP_SHARE ) ) for group in groups ] )
+    tqPrioDict = calculateTQPriorities( tqData, groupShares, jobSharingGroups, bgAllowedGroups, correctShares )
+    result = self.__updateTQPriorities( tqPrioDict, connObj = connObj )
     if not result[ 'OK' ]:
       return result
-    allTQsData = result[ 'Value' ]
-    tqGroups = {}
-    for tqid in allTQsData:
-      tqData = allTQsData[ tqid ]
-      for field in ( 'Jobs', 'Priority' ) + self.__priorityIgnoredFields:
-        if field in tqData:
-          tqData.pop( field )
-      tqHash = []
-      for f in sorted( tqData ):
-        tqHash.append( "%s:%s" % ( f, tqData[ f ] ) )
-      tqHash = "|".join( tqHash )
-      if tqHash not in tqGroups:
-        tqGroups[ tqHash ] = []
-      tqGroups[ tqHash ].append( tqid )
-    tqGroups = [ tqGroups[ td ] for td in tqGroups ]
-
-    #Do the grouping
-    for tqGroup in tqGroups:
-      totalPrio = 0
-      if len( tqGroup ) < 2:
-        continue
-      for tqid in tqGroup:
-        totalPrio += tqDict[ tqid ]
-      for tqid in tqGroup:
-        tqDict[ tqid ] = totalPrio
-
-    #Group by priorities
-    prioDict = {}
-    for tqId in tqDict:
-      prio = tqDict[ tqId ]
-      if prio not in prioDict:
-        prioDict[ prio ] = []
-      prioDict[ prio ].append( tqId )
-
-    #Execute updates
-    for prio in prioDict:
-      tqList = ", ".join( [ str( tqId ) for tqId in prioDict[ prio ] ] )
-      updateSQL = "UPDATE `tq_TaskQueues` SET Priority=%.4f WHERE TQId in ( %s )" % ( prio, tqList )
-      self._update( updateSQL, conn = connObj )
+    self.log.info( "Recalculated priorities of %s TQs in %.2f secs, %s changed" % ( len( tqData ),
+                                                                                  time.time() - start,
+                                                                                  len( tqPrioDict ) ) )
     return S_OK()
 
+  def __updateTQPriorities( self, tqPrioDict, connObj = False ):
+    """
+    Set the priorities of the TQs with one UPDATE per chunk of TQs
+    """
+    maxTQsInQuery = 1000
+    tqIdList = sorted( tqPrioDict )
+    for i in range( 0, len( tqIdList ), maxTQsInQuery ):
+      tqIds = tqIdList[ i : i + maxTQsInQuery ]
+      cases = " ".join( [ "WHEN %d THEN %.4f" % ( tqId, tqPrioDict[ tqId ] ) for tqId in tqIds ] )
+      updateSQL = "UPDATE `tq_TaskQueues` SET Priority = CASE TQId %s END WHERE TQId in ( %s )" % ( cases,
+                                                                                               List.intListToString( tqIds ) )
+      result = self._update( updateSQL, conn = connObj )
+      if not result[ 'OK' ]:
+        return result
+    return S_OK( len( tqIdList ) )
+
   def getGroupShares( self ):
     """
     Get all the shares as a DICT
@@ -49,6 +49,8 @@ class OptimizerExecutor( ExecutorModule ):
     cls.__jobData.jobState = None
     cls.__jobData.jobLog = None
     cls.ex_setProperty( 'optimizerName', cls.__optimizerName )
+    #Jobs travel with their cached state, get them in batches from the mind
+    cls.ex_setOption( 'BatchSize', 10 )
     try:
       result = cls.initializeOptimizer()
       if not result[ 'OK' ]:
@@ -93,6 +93,10 @@ class JobWrapper:
     self.bufferLimit = gConfig.getValue( self.section + '/BufferLimit', 10485760 )
     self.defaultOutputSE = gConfig.getValue( '/Resources/StorageElementGroups/SE-USER', [] )
     self.defaultCatalog = gConfig.getValue( self.section + '/DefaultCatalog', [] )
+    self.inputDataThreads = gConfig.getValue( self.section + '/InputDataThreads', 4 )
+    self.maxConnectionsPerSE = gConfig.getValue( self.section + '/MaxConnectionsPerSE', 2 )
+    self.inputDataRetries = gConfig.getValue( self.section + '/InputDataRetries', 1 )
+    self.outputDataThreads = gConfig.getValue( self.section + '/OutputDataThreads', 4 )
     self.defaultFailoverSE = gConfig.getValue( '/Resources/StorageElementGroups/Tier1-Failover', [] )
     self.defaultOutputPath = ''
     self.rm = ReplicaManager()
@@ -580,7 +584,9 @@ class JobWrapper:
             self.log.info( 'File size for LFN:%s was not a long integer, setting size to 0' % ( lfn ) )
         self.inputDataSize += lfnSize
 
-    configDict = {'JobID':self.jobID, 'LocalSEList':localSEList, 'DiskSEList':self.diskSE, 'TapeSEList':self.tapeSE}
+    configDict = {'JobID':self.jobID, 'LocalSEList':localSEList, 'DiskSEList':self.diskSE, 'TapeSEList':self.tapeSE,
+                  'DownloadThreads':self.inputDataThreads, 'MaxSEConnections':self.maxConnectionsPerSE,
+                  'DownloadRetries':self.inputDataRetries}
     self.log.info( configDict )
     argumentsDict = {'FileCatalog':resolvedData, 'Configuration':configDict, 'InputData':lfns, 'Job':self.jobArgs}
     self.log.info( argumentsDict )
@@ -633,10 +639,17 @@ class JobWrapper:
     """ Wrapper function to consult catalog for all necessary file metadata
         and check the result.
     """
+    #The GUIDs are looked up in parallel with the replicas
+    guidResult = {}
+    guidThread = threading.Thread( target = self.__getCatalogFileMetadata, args = ( lfns, guidResult ) )
+    guidThread.setDaemon( True )
+    guidThread.start()
+
     start = time.time()
     repsResult = self.rm.getReplicas( lfns )
     timing = time.time() - start
     self.log.info( 'Replica Lookup Time: %.2f seconds ' % ( timing ) )
+    guidThread.join()
     if not repsResult['OK']:
       self.log.warn( repsResult['Message'] )
       return repsResult
@@ -663,11 +676,7 @@ class JobWrapper:
       self.__setJobParam( 'MissingLFNs', param )
       return S_ERROR( 'Input Data Not Available' )
 
-    #Must retrieve GUIDs from LFC for files
-    start = time.time()
-    guidDict = self.rm.getCatalogFileMetadata( lfns )
-    timing = time.time() - start
-    self.log.info( 'GUID Lookup Time: %.2f seconds ' % ( timing ) )
+    guidDict = guidResult.get( 'Result', S_ERROR( 'GUID lookup did not complete' ) )
     if not guidDict['OK']:
       self.log.warn( 'Failed to retrieve GUIDs from file catalogue' )
       self.log.warn( guidDict['Message'] )
@@ -685,6 +694,20 @@ class JobWrapper:
     catResult = guidDict
     return catResult
 
+  #############################################################################
+  def __getCatalogFileMetadata( self, lfns, guidResult ):
+    """ Retrieve the GUIDs from the LFC for the files, with a ReplicaManager
+        of its own as it runs in a separate thread
+    """
+    start = time.time()
+    try:
+      guidResult['Result'] = ReplicaManager().getCatalogFileMetadata( lfns )
+    except Exception, x:
+      self.log.exception( 'Exception while getting the file metadata' )
+      guidResult['Result'] = S_ERROR( str( x ) )
+    timing = time.time() - start
+    self.log.info( 'GUID Lookup Time: %.2f seconds ' % ( timing ) )
+
   #############################################################################
   def processJobOutputs( self, arguments ):
     """Outputs for a job may be treated here.
@@ -849,6 +872,8 @@ class JobWrapper:
     #Instantiate the failover transfer client
     failoverTransfer = FailoverTransfer()
 
+    fileList = []
+    outputFiles = {}
     for outputFile in outputData:
       ( lfn, localfile ) = self.__getLFNfromOutputFile( outputFile, outputPath )
       if not os.path.exists( localfile ):
@@ -862,38 +887,35 @@ class JobWrapper:
         fileGUID = pfnGUID[localfile]
         self.log.verbose( 'Found GUID for file from POOL XML catalogue %s' % localfile )
 
-      outputSEList = self.__getSortedSEList( outputSE )
-      upload = failoverTransfer.transferAndRegisterFile( localfile, outputFilePath, lfn,
-                                                         outputSEList, fileGUID, self.defaultCatalog )
-      if upload['OK']:
-        self.log.info( '"%s" successfully uploaded to "%s" as "LFN:%s"' % ( localfile,
-                                                                            upload['Value']['uploadedSE'],
-                                                                            lfn ) )
-        uploaded.append( lfn )
-        continue
+      fileList.append( ( localfile, outputFilePath, lfn, self.__getSortedSEList( outputSE ), fileGUID ) )
+      outputFiles[lfn] = outputFile
 
-      self.log.error( 'Could not putAndRegister file',
-                      '%s with LFN %s to %s with GUID %s trying failover storage' % ( localfile, lfn,
-                                                                                      ', '.join( outputSEList ),
-                                                                                      fileGUID ) )
-      if not self.defaultFailoverSE:
-        self.log.info( 'No failover SEs defined for JobWrapper,',
-                       'cannot try to upload output file %s anywhere else.' % outputFile )
-        missing.append( outputFile )
-        continue
-
-      failoverSEs = self.__getSortedSEList( self.defaultFailoverSE )
-      targetSE = outputSEList[0]
-      result = failoverTransfer.transferAndRegisterFileFailover( localfile, outputFilePath,
-                                                                 lfn, targetSE, failoverSEs,
-                                                                 fileGUID, self.defaultCatalog )
-      if not result['OK']:
-        self.log.error( 'Completely failed to upload file to failover SEs with result:\n%s' % result )
-        missing.append( outputFile )
-      else:
-        self.log.info( 'File %s successfully uploaded to failover storage element' % lfn )
+    if not self.defaultFailoverSE:
+      self.log.info( 'No failover SEs defined for JobWrapper,',
+                     'output files will not be uploaded anywhere else than %s' % ', '.join( outputSE ) )
+    failoverSEs = self.__getSortedSEList( self.defaultFailoverSE )
+    result = failoverTransfer.transferAndRegisterFiles( fileList, failoverSEs, self.defaultCatalog,
+                                                        self.outputDataThreads )
+    if not result['OK']:
+      self.log.error( 'Completely failed to upload the output data', result['Message'] )
+      missing.extend( outputFiles.values() )
+    else:
+      timings = []
+      for lfn, upload in result['Value']['Successful'].items():
+        if upload['failover']:
+          self.log.info( 'File %s successfully uploaded to failover storage element' % lfn )
+        else:
+          self.log.info( '"%s" successfully uploaded to "%s" as "LFN:%s"' % ( upload['fileName'],
+                                                                              upload['uploadedSE'], lfn ) )
         uploaded.append( lfn )
-
+        timings.append( '%s: %s put %.1fs checksum %.1fs register %.1fs' % ( lfn, upload['uploadedSE'],
+                                                                             upload['put'], upload['checksumTime'],
+                                                                             upload['register'] ) )
+      for lfn, error in result['Value']['Failed'].items():
+        self.log.error( 'Could not upload file', '%s: %s' % ( outputFiles[lfn], error ) )
+        missing.append( outputFiles[lfn] )
+      if timings:
+        self.__setJobParam( 'OutputDataTimings', '\n'.join( timings ) )
 
     #For files correctly uploaded must report LFNs to job parameters
     if uploaded:
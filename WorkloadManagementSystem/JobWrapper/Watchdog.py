@@ -95,11 +95,21 @@ class Watchdog:
     self.jobCPUMargin = gConfig.getValue( self.section + '/JobCPULimitMargin', 20 ) # %age buffer before killing job
     self.minCPUWallClockRatio = gConfig.getValue( self.section + '/MinCPUWallClockRatio', 5 ) #ratio %age
     self.nullCPULimit = gConfig.getValue( self.section + '/NullCPUCountLimit', 5 ) #After 5 sample times return null CPU consumption kill job
+    #Checks and resource samples start frequent and get sparser as the job goes on
+    #Every check sends a heart beat, checking below MinCheckingTime has to be asked for explicitly
+    self.initialCheckingTime = gConfig.getValue( self.section + '/InitialCheckingTime', self.minCheckingTime )
+    self.minSampleTime = gConfig.getValue( self.section + '/MinSampleTime', self.pollingTime )
+    self.maxSampleTime = gConfig.getValue( self.section + '/MaxSampleTime', 5 * 60 ) # 5 minutes
+    self.intervalGrowth = max( 1.0, float( gConfig.getValue( self.section + '/IntervalGrowthFactor', 2 ) ) )
     self.checkCount = 0
     self.nullCPUCount = 0
     if self.checkingTime < self.minCheckingTime:
       self.log.info( 'Requested CheckingTime of %s setting to %s seconds (minimum)' % ( self.checkingTime, self.minCheckingTime ) )
       self.checkingTime = self.minCheckingTime
+    self.checkInterval = min( self.initialCheckingTime, self.checkingTime )
+    self.nextCheckTime = 0
+    self.sampleInterval = min( self.minSampleTime, self.maxSampleTime )
+    self.nextSampleTime = 0
 
     # The time left is returned in seconds @ 250 SI00 = 1 HS06,
     # the self.checkingTime and self.pollingTime are in seconds,
@@ -163,9 +173,20 @@ class Watchdog:
 
 
     #Note: need to poll regularly to see if the thread is alive
-    #      but only perform checks with a certain frequency
-    if ( time.time() - self.initialValues['StartTime'] ) > self.checkingTime * self.checkCount:
+    #      but only sample the resources and perform checks with a certain
+    #      frequency, growing from the initial to the maximum periods
+    elapsedTime = time.time() - self.initialValues['StartTime']
+    if elapsedTime >= self.nextSampleTime:
+      result = self.sampleResources()
+      if not result['OK']:
+        self.log.verbose( 'Could not sample the job resources', result['Message'] )
+      self.nextSampleTime = elapsedTime + self.sampleInterval
+      self.sampleInterval = self.__growInterval( self.sampleInterval, self.maxSampleTime )
+
+    if elapsedTime > self.nextCheckTime:
       self.checkCount += 1
+      self.nextCheckTime = elapsedTime + self.checkInterval
+      self.checkInterval = self.__growInterval( self.checkInterval, self.checkingTime )
       result = self.__performChecks()
       if not result['OK']:
         self.log.warn( 'Problem during recent checks' )
@@ -176,6 +197,12 @@ class Watchdog:
       return S_OK()
 
 
+  #############################################################################
+  def __growInterval( self, interval, maxInterval ):
+    """ Returns the period to use after the given one, never above maxInterval
+    """
+    return min( maxInterval, max( interval * self.intervalGrowth, 1 ) )
+
   #############################################################################
   def __performChecks( self ):
     """The Watchdog checks are performed at a different period to the checking of the
@@ -216,6 +243,9 @@ class Watchdog:
     msg += 'WallClock: %.2f s ' % ( result['Value'] )
     self.parameters['WallClockTime'].append( result['Value'] )
     heartBeatDict['WallClockTime'] = result['Value']
+    result = self.getSampleSummary()
+    if result['OK']:
+      heartBeatDict.update( result['Value'] )
     self.log.info( msg )
 
     result = self.__checkProgress()
@@ -277,7 +307,7 @@ class Watchdog:
     """
     cpuTime = '00:00:00'
     try:
-      cpuTime = self.processMonitor.getCPUConsumed( self.wrapperPID )
+      cpuTime = self.getCPUConsumed()
     except Exception:
       self.log.warn( 'Could not determine CPU time consumed with exception' )
       self.log.exception()
@@ -401,10 +431,17 @@ class Watchdog:
                                                                                             self.sampleCPUTime ) )
       return S_OK()
 
-    intervals = max( 1, int( self.sampleCPUTime / self.checkingTime ) )
-    if len( self.parameters['CPUConsumed'] ) < intervals + 1:
-      self.log.info( "Not enough snapshots to calculate, there are %s and we need %s" % ( len( self.parameters['CPUConsumed'] ),
-                                                                                          intervals + 1 ) )
+    #The checks are not evenly spaced, take the latest snapshot at least
+    #the sample time (give or take a polling cycle) before the last one
+    intervals = 0
+    wallClockList = self.parameters['WallClockTime']
+    for index in range( len( wallClockList ) - 2, -1, -1 ):
+      if wallClockList[-1] - wallClockList[index] >= self.sampleCPUTime - self.pollingTime:
+        intervals = len( wallClockList ) - 1 - index
+        break
+    if not intervals or len( self.parameters['CPUConsumed'] ) < intervals + 1:
+      self.log.info( "Not enough snapshots to calculate, there are %s covering %s s" % ( len( self.parameters['CPUConsumed'] ),
+                                                                                       wallClockList[-1] - wallClockList[0] ) )
       return S_OK()
 
     wallClockTime = self.parameters['WallClockTime'][-1] - self.parameters['WallClockTime'][-1 - intervals ]
@@ -689,6 +726,10 @@ class Watchdog:
     result = self.__getWallClockTime()
     wallClock = result['Value']
     summary['WallClockTime(s)'] = wallClock
+    #Process tree usage, if sampled
+    result = self.getSampleSummary()
+    if result['OK']:
+      summary.update( result['Value'] )
 
     self.__reportParameters( summary, 'UsageSummary', True )
     self.currentStats = summary
@@ -778,6 +819,21 @@ class Watchdog:
 
     return jobParam
 
+  #############################################################################
+  def getCPUConsumed( self ):
+    """ Returns the CPU (s) consumed by the job wrapper and its children, may be overridden in a subclass"""
+    return self.processMonitor.getCPUConsumed( self.wrapperPID )
+
+  #############################################################################
+  def sampleResources( self ):
+    """ Takes a sample of the resources used by the job, may be overridden in a subclass"""
+    return S_OK()
+
+  #############################################################################
+  def getSampleSummary( self ):
+    """ Returns a dictionary summarizing the samples taken so far, may be overridden in a subclass"""
+    return S_OK( {} )
+
   #############################################################################
   def getNodeInformation( self ):
     """ Attempts to retrieve all static system information, should be overridden in a subclass"""
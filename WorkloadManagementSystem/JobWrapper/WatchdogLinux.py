@@ -8,7 +8,9 @@
      the system CPU and memory consumed.  The Watchdog can determine if
      a running job is stalled and indicate this to the Job Wrapper.
 
-     This is the Unix / Linux compatible Watchdog subclass.
+     This is the Unix / Linux compatible Watchdog subclass.  The resources
+     used by the job process tree are sampled in-process from the /proc
+     file system and kept in a ring buffer, summarized with the heart beats.
 """
 
 __RCSID__ = "$Id$"
@@ -18,7 +20,43 @@ from DIRAC.Core.Utilities.Subprocess                     import shellCall
 from DIRAC                                               import S_OK, S_ERROR
 from DIRAC.Core.Utilities.Os import getDiskSpace
 
-import string,re,socket
+import os,string,re,socket,time
+
+#Number of samples kept in the history
+SAMPLE_HISTORY = 100
+
+class SampleRing:
+  """ Fixed size history of the samples, the oldest ones are overwritten
+  """
+
+  def __init__(self,size=SAMPLE_HISTORY):
+    self.size = max(1,size)
+    self.samples = []
+    self.next = 0
+    self.total = 0
+
+  def append(self,sample):
+    if len(self.samples) < self.size:
+      self.samples.append(sample)
+    else:
+      self.samples[self.next] = sample
+    self.next = (self.next + 1) % self.size
+    self.total += 1
+
+  def getSamples(self):
+    """ Returns the samples kept, oldest first
+    """
+    if len(self.samples) < self.size:
+      return list(self.samples)
+    return self.samples[self.next:] + self.samples[:self.next]
+
+  def last(self):
+    if not self.samples:
+      return None
+    return self.samples[self.next - 1]
+
+  def __len__(self):
+    return len(self.samples)
 
 class WatchdogLinux(Watchdog):
 
@@ -28,6 +66,137 @@ class WatchdogLinux(Watchdog):
     Watchdog.__init__(self,pid,thread,spObject,jobCPUtime,systemFlag)
     self.systemFlag = systemFlag
     self.pid = pid
+    self.clockTicks = 100
+    try:
+      self.clockTicks = os.sysconf('SC_CLK_TCK')
+    except Exception:
+      pass
+    self.history = SampleRing()
+    #The peaks over the whole job, the history only covers the latest samples
+    self.maxRSS = 0
+    self.maxProcesses = 0
+
+  ############################################################################
+  def __readProcStat(self,pid):
+    """ Returns ( ppid, pgrp, CPU seconds ) from /proc/<pid>/stat, the CPU includes the
+        waited for children.  The command name may hold blanks, so fields are counted after it.
+    """
+    fd = open('/proc/%s/stat' % pid,'r')
+    try:
+      stat = fd.read()
+    finally:
+      fd.close()
+    fields = stat[stat.rfind(')')+2:].split()
+    cpuTicks = int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])
+    return int(fields[1]),int(fields[2]),float(cpuTicks)/self.clockTicks
+
+  ############################################################################
+  def __readProcMemory(self,pid):
+    """ Returns ( VmRSS, VmSize ) in kB from /proc/<pid>/status, 0 for kernel threads and zombies
+    """
+    rss = 0
+    vsize = 0
+    fd = open('/proc/%s/status' % pid,'r')
+    try:
+      for line in fd:
+        if line.startswith('VmRSS:'):
+          rss = int(line.split()[1])
+        elif line.startswith('VmSize:'):
+          vsize = int(line.split()[1])
+    finally:
+      fd.close()
+    return rss,vsize
+
+  ############################################################################
+  def getProcessTree(self):
+    """ Returns a dictionary pid: ( ppid, pgrp, CPU seconds ) with the job wrapper, all its
+        descendants and the orphans left in its process group.
+    """
+    procs = {}
+    for entry in os.listdir('/proc'):
+      if not entry.isdigit():
+        continue
+      try:
+        procs[int(entry)] = self.__readProcStat(entry)
+      except Exception:
+        #The process has gone in the meantime
+        continue
+
+    rootPID = int(self.wrapperPID)
+    if rootPID not in procs:
+      return S_ERROR('Process %s does not exist' % rootPID)
+    children = {}
+    for pid,info in procs.items():
+      children.setdefault(info[0],[]).append(pid)
+    tree = {}
+    toVisit = [rootPID]
+    while toVisit:
+      pid = toVisit.pop()
+      if pid in tree:
+        continue
+      tree[pid] = procs[pid]
+      toVisit.extend(children.get(pid,[]))
+    rootGroup = procs[rootPID][1]
+    for pid,info in procs.items():
+      if info[0] == 1 and info[1] == rootGroup and pid not in tree:
+        tree[pid] = info
+    return S_OK(tree)
+
+  ############################################################################
+  def sampleResources(self):
+    """ Samples the CPU and memory used by the job process tree and the available disk space,
+        the sample is added to the history.
+    """
+    result = self.getProcessTree()
+    if not result['OK']:
+      return result
+    tree = result['Value']
+    cpu = 0.0
+    rss = 0
+    vsize = 0
+    for pid,info in tree.items():
+      cpu += info[2]
+      try:
+        pidRSS,pidVSize = self.__readProcMemory(pid)
+      except Exception:
+        continue
+      rss += pidRSS
+      vsize += pidVSize
+    diskSpace = self.getDiskSpace()['Value']
+    sample = {'Time':time.time(),'CPU':cpu,'RSS':rss,'VSize':vsize,'Processes':len(tree),'DiskSpace':diskSpace}
+    self.history.append(sample)
+    self.maxRSS = max(self.maxRSS,rss)
+    self.maxProcesses = max(self.maxProcesses,len(tree))
+    return S_OK(sample)
+
+  ############################################################################
+  def getSampleSummary(self):
+    """ Returns a compact summary of the sampled history: current and peak memory and
+        processes, the average number of CPUs used and the lowest disk space seen.
+    """
+    samples = self.history.getSamples()
+    if not samples:
+      return S_ERROR('No resource samples taken')
+    last = samples[-1]
+    summary = {'Processes':last['Processes'],
+               'MaxProcesses':self.maxProcesses,
+               'RSS(kB)':last['RSS'],
+               'MaxRSS(kB)':self.maxRSS,
+               'VSize(kB)':last['VSize'],
+               'MinDiskSpace(MB)':min([sample['DiskSpace'] for sample in samples])}
+    elapsed = last['Time'] - samples[0]['Time']
+    if elapsed > 0:
+      summary['CPUUsage'] = round((last['CPU'] - samples[0]['CPU'])/elapsed,3)
+    return S_OK(summary)
+
+  ############################################################################
+  def getCPUConsumed(self):
+    """ Returns the CPU (s) consumed by the job process tree, from a new sample.
+    """
+    result = self.sampleResources()
+    if not result['OK']:
+      return result
+    return S_OK(result['Value']['CPU'])
 
   ############################################################################
   def getNodeInformation(self):
@@ -67,12 +236,13 @@ class WatchdogLinux(Watchdog):
     """Obtains the load average.
     """
     result = S_OK()
-    comm = '/bin/cat /proc/loadavg'
-    loadAvgDict = shellCall(5,comm)
-    if loadAvgDict['OK']:
-      la = float(string.split(loadAvgDict['Value'][1])[0])
-      result['Value'] = la
-    else:
+    try:
+      fd = open('/proc/loadavg','r')
+      try:
+        result['Value'] = float(fd.read().split()[0])
+      finally:
+        fd.close()
+    except Exception:
       result = S_ERROR('Could not obtain load average')
       self.log.warn('Could not obtain load average')
       result['Value'] = 0
@@ -81,15 +251,21 @@ class WatchdogLinux(Watchdog):
 
   #############################################################################
   def getMemoryUsed(self):
-    """Obtains the memory used.
+    """Obtains the memory used (kB) in the node, as the 'used' column of free.
     """
     result = S_OK()
-    comm = '/usr/bin/free'
-    memDict = shellCall(5,comm)
-    if memDict['OK']:
-      mem = string.split(memDict['Value'][1]) [8]
-      result['Value'] = float(mem)
-    else:
+    try:
+      memInfo = {}
+      fd = open('/proc/meminfo','r')
+      try:
+        for line in fd:
+          fields = line.split()
+          if len(fields) > 1:
+            memInfo[fields[0]] = float(fields[1])
+      finally:
+        fd.close()
+      result['Value'] = memInfo['MemTotal:'] - memInfo['MemFree:']
+    except Exception:
       result = S_ERROR('Could not obtain memory used')
       self.log.warn('Could not obtain memory used')
       result['Value'] = 0
@@ -97,10 +273,19 @@ class WatchdogLinux(Watchdog):
 
  #############################################################################
   def getDiskSpace(self):
-    """Obtains the disk space used.
+    """Obtains the disk space (MB) available in the working directory.
     """
     result = S_OK()
-    diskSpace = getDiskSpace()
+    cwd = os.getcwd()
+    if cwd.startswith('/afs'):
+      #statvfs does not know about the AFS quotas
+      diskSpace = getDiskSpace(cwd)
+    else:
+      try:
+        stat = os.statvfs(cwd)
+        diskSpace = stat.f_bavail * stat.f_frsize / 1024 / 1024
+      except Exception:
+        diskSpace = -1
 
     if diskSpace == -1:
       result = S_ERROR('Could not obtain disk usage')
@@ -0,0 +1,88 @@
+########################################################################
+# $HeadURL $
+# File: WatchdogLinuxTestCase.py
+########################################################################
+
+""" :mod: WatchdogLinuxTestCase
+    =======================
+
+    .. module: WatchdogLinuxTestCase
+    :synopsis: test cases for DIRAC.WorkloadManagementSystem.JobWrapper.WatchdogLinux
+
+    Test cases for the ring buffered history and the /proc sampling of
+    the job process tree
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import os
+import subprocess
+import unittest
+from DIRAC.WorkloadManagementSystem.JobWrapper.WatchdogLinux import WatchdogLinux, SampleRing
+
+class FakeThread:
+  """ Stand-in execution thread """
+  def getCurrentPID( self ):
+    return os.getpid()
+
+class WatchdogLinuxTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.watchdog = WatchdogLinux( os.getpid(), FakeThread(), None, 0 )
+    self.child = subprocess.Popen( [ 'sleep', '30' ] )
+
+  def tearDown( self ):
+    self.child.kill()
+    self.child.wait()
+
+  def testSampleRing( self ):
+    """ the oldest samples are overwritten """
+    ring = SampleRing( 3 )
+    self.assertEqual( ring.last(), None )
+    for sample in range( 5 ):
+      ring.append( sample )
+    self.assertEqual( ring.getSamples(), [ 2, 3, 4 ] )
+    self.assertEqual( ring.last(), 4 )
+    self.assertEqual( len( ring ), 3 )
+    self.assertEqual( ring.total, 5 )
+
+  def testProcessTree( self ):
+    """ the children of the wrapper are part of the tree """
+    result = self.watchdog.getProcessTree()
+    self.assert_( result['OK'] )
+    tree = result['Value']
+    self.assert_( os.getpid() in tree )
+    self.assert_( self.child.pid in tree )
+    self.assertEqual( tree[ self.child.pid ][0], os.getpid() )
+
+  def testSampling( self ):
+    """ samples go to the history and are summarized """
+    self.failIf( self.watchdog.getSampleSummary()['OK'] )
+    #Burn some CPU between the samples
+    result = self.watchdog.sampleResources()
+    self.assert_( result['OK'] )
+    sum( xrange( 3000000 ) )
+    result = self.watchdog.getCPUConsumed()
+    self.assert_( result['OK'] )
+    self.assert_( result['Value'] > 0 )
+    self.assertEqual( len( self.watchdog.history ), 2 )
+    summary = self.watchdog.getSampleSummary()['Value']
+    self.assert_( summary['Processes'] >= 2 )
+    self.assert_( summary['RSS(kB)'] > 0 )
+    self.assert_( summary['MaxRSS(kB)'] >= summary['RSS(kB)'] )
+    self.assert_( summary['MinDiskSpace(MB)'] > 0 )
+    self.assert_( summary['CPUUsage'] >= 0 )
+
+  def testSystemInformation( self ):
+    """ load, memory and disk space come from /proc and statvfs """
+    for method in ( self.watchdog.getLoadAverage, self.watchdog.getMemoryUsed, self.watchdog.getDiskSpace ):
+      result = method()
+      self.assert_( result['OK'] )
+      self.assert_( result['Value'] >= 0 )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( WatchdogLinuxTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
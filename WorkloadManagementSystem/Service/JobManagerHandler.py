@@ -8,6 +8,7 @@
     The following methods are available in the Service interface
 
     submitJob()
+    submitJobs()
     rescheduleJob()
     deleteJob()
     killJob()
@@ -37,6 +38,7 @@ gJobLoggingDB = False
 gtaskQueueDB = False
 
 MAX_PARAMETRIC_JOBS = 20
+MAX_BULK_JOBS = 1000
 
 def initializeJobManagerHandler( serviceInfo ):
 
@@ -72,6 +74,7 @@ class JobManagerHandler( RequestHandler ):
     self.peerUsesLimitedProxy = credDict[ 'isLimitedProxy' ]
     self.diracSetup = self.serviceInfoDict['clientSetup']
     self.maxParametricJobs = self.srv_getCSOption( 'MaxParametricJobs', MAX_PARAMETRIC_JOBS )
+    self.maxBulkJobs = self.srv_getCSOption( 'MaxBulkJobs', MAX_BULK_JOBS )
     self.jobPolicy = JobPolicy( self.ownerDN, self.ownerGroup, self.userProperties )
     self.jobPolicy.setJobDB( gJobDB )
     return S_OK()
@@ -92,11 +95,9 @@ class JobManagerHandler( RequestHandler ):
     self.log.info( "Optimize msg sent for %s jobs" % len( jids ) )
 
   ###########################################################################
-  types_submitJob = [ StringType ]
-  def export_submitJob( self, jobDesc ):
-    """ Submit a single job to DIRAC WMS
+  def __checkSubmitPolicy( self ):
+    """ Check the job submission permission
     """
-
     if self.peerUsesLimitedProxy:
       return S_ERROR( "Can't submit using a limited proxy! (bad boy!)" )
 
@@ -107,7 +108,11 @@ class JobManagerHandler( RequestHandler ):
     policyDict = result['Value']
     if not policyDict[ RIGHT_SUBMIT ]:
       return S_ERROR( 'Job submission not authorized' )
+    return S_OK()
 
+  def __getJobDescList( self, jobDesc ):
+    """ Get the JDLs of the jobs described by jobDesc, many for a parametric job
+    """
     #jobDesc is JDL for now
     jobDesc = jobDesc.strip()
     if jobDesc[0] != "[":
@@ -182,24 +187,62 @@ class JobManagerHandler( RequestHandler ):
     else:
       jobDescList = [ jobDesc ]
 
-    jobIDList = []
-    for jobDescription in jobDescList:
-      result = gJobDB.insertNewJobIntoDB( jobDescription, self.owner, self.ownerDN, self.ownerGroup, self.diracSetup )
+    return S_OK( ( parametricJob, jobDescList ) )
+
+  def __insertJobs( self, jobDescList ):
+    """ Insert the jobs in the JobDB, in bulk if there are several of them,
+        and add their first logging records
+    """
+    if len( jobDescList ) == 1:
+      result = gJobDB.insertNewJobIntoDB( jobDescList[0], self.owner, self.ownerDN, self.ownerGroup, self.diracSetup )
+      if not result['OK']:
+        return result
+      jobList = [ result ]
+    else:
+      result = gJobDB.insertNewJobsIntoDB( jobDescList, self.owner, self.ownerDN, self.ownerGroup, self.diracSetup )
       if not result['OK']:
         return result
+      jobList = result['Value']
 
-      jobID = result['JobID']
+    jobIDList = []
+    records = []
+    for jobDict in jobList:
+      jobID = jobDict['JobID']
       gLogger.info( 'Job %s added to the JobDB for %s/%s' % ( jobID, self.ownerDN, self.ownerGroup ) )
-
-      gJobLoggingDB.addLoggingRecord( jobID, result['Status'], result['MinorStatus'], source = 'JobManager' )
-
+      records.append( ( jobID, jobDict['Status'], jobDict['MinorStatus'], 'idem', '', 'JobManager' ) )
       jobIDList.append( jobID )
 
+    result = gJobLoggingDB.addLoggingRecords( records )
+    if not result['OK']:
+      gLogger.error( 'Failed to add the logging records of the new jobs', result['Message'] )
+
     #Set persistency flag
     retVal = gProxyManager.getUserPersistence( self.ownerDN, self.ownerGroup )
     if 'Value' not in retVal or not retVal[ 'Value' ]:
       gProxyManager.setPersistency( self.ownerDN, self.ownerGroup, True )
 
+    self.__sendNewJobsToMind( jobIDList )
+    return S_OK( jobIDList )
+
+  ###########################################################################
+  types_submitJob = [ StringType ]
+  def export_submitJob( self, jobDesc ):
+    """ Submit a single job to DIRAC WMS
+    """
+    result = self.__checkSubmitPolicy()
+    if not result['OK']:
+      return result
+
+    result = self.__getJobDescList( jobDesc )
+    if not result['OK']:
+      return result
+    parametricJob, jobDescList = result['Value']
+
+    result = self.__insertJobs( jobDescList )
+    if not result['OK']:
+      return result
+    jobIDList = result['Value']
+
     if parametricJob:
       result = S_OK( jobIDList )
     else:
@@ -207,7 +250,38 @@ class JobManagerHandler( RequestHandler ):
 
     result['JobID'] = result['Value']
     result[ 'requireProxyUpload' ] = self.__checkIfProxyUploadIsRequired()
-    self.__sendNewJobsToMind( jobIDList )
+    return result
+
+  ###########################################################################
+  types_submitJobs = [ ListType ]
+  def export_submitJobs( self, jobDescList ):
+    """ Submit many jobs to DIRAC WMS at once. Parametric jobs are expanded,
+        all the jobs are inserted in the JobDB in bulk. Returns the list of
+        the JobIDs of all the jobs
+    """
+    result = self.__checkSubmitPolicy()
+    if not result['OK']:
+      return result
+
+    allJobDescs = []
+    for jobDesc in jobDescList:
+      if type( jobDesc ) not in StringTypes or not jobDesc.strip():
+        return S_ERROR( 'Job descriptions must be non empty strings' )
+      result = self.__getJobDescList( jobDesc )
+      if not result['OK']:
+        return result
+      allJobDescs.extend( result['Value'][1] )
+      if len( allJobDescs ) > self.maxBulkJobs:
+        return S_ERROR( 'The number of jobs exceeded the limit of %d' % self.maxBulkJobs )
+    if not allJobDescs:
+      return S_ERROR( 'No jobs to submit' )
+
+    result = self.__insertJobs( allJobDescs )
+    if not result['OK']:
+      return result
+
+    result['JobID'] = result['Value']
+    result[ 'requireProxyUpload' ] = self.__checkIfProxyUploadIsRequired()
     return result
 
 ###########################################################################
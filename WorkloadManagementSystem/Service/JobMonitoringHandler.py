@@ -445,6 +445,14 @@ class JobMonitoringHandler( RequestHandler ):
   def export_getJobHeartBeatData( self, jobID ):
     return jobDB.getHeartBeatData( jobID )
 
+##############################################################################
+  types_getJobHeartBeatSeries = [ IntType ]
+  def export_getJobHeartBeatSeries( self, jobID, nameList = [], maxPoints = 0 ):
+    """ Get the heart beat data of the job as { name : [ ( epoch, value ) ] }
+        series for plotting, downsampled to maxPoints if given
+    """
+    return jobDB.getHeartBeatSeries( jobID, nameList, maxPoints )
+
 ##############################################################################
   types_getInputData = [ [IntType, LongType] ]
   def export_getInputData( self, jobID ):
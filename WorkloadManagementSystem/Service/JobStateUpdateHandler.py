@@ -9,19 +9,26 @@
 
     setJobStatus()
 
+    With UseWriteBehindBuffer the status updates and the heart beats are
+    buffered and written in batches by a JobStateUpdateBuffer, then the
+    calls do not report errors like unknown jobs.
 """
 
 __RCSID__ = "$Id$"
 
 from types import *
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
-from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC import gLogger, gConfig, gMonitor, S_OK, S_ERROR
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
+from DIRAC.WorkloadManagementSystem.private.JobStateUpdateBuffer import JobStateUpdateBuffer
 
 # This is a global instance of the JobDB class
 jobDB = False
 logDB = False
+updateBuffer = False
+lastBufferStats = False
 
 JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
 
@@ -29,12 +36,59 @@ def initializeJobStateUpdateHandler( serviceInfo ):
 
   global jobDB
   global logDB
+  global updateBuffer
   jobDB = JobDB()
   logDB = JobLoggingDB()
+
+  #Write the status updates and heart beats in batches
+  csPath = serviceInfo[ 'serviceSectionPath' ]
+  if gConfig.getValue( "%s/UseWriteBehindBuffer" % csPath, False ):
+    updateBuffer = JobStateUpdateBuffer( jobDB, logDB,
+                                         flushPeriod = gConfig.getValue( "%s/FlushPeriod" % csPath, 2 ),
+                                         maxPendingJobs = gConfig.getValue( "%s/MaxPendingJobs" % csPath, 1000 ) )
+    updateBuffer.start()
+    gMonitor.registerActivity( 'bufferedUpdates', "Buffered job updates",
+                               'JobStateUpdate', "updates" , gMonitor.OP_SUM, 300 )
+    gMonitor.registerActivity( 'flushedJobs', "Jobs written by the buffer",
+                               'JobStateUpdate', "jobs" , gMonitor.OP_SUM, 300 )
+    gMonitor.registerActivity( 'coalescingRatio', "Job updates per job written",
+                               'JobStateUpdate', "updates/job" , gMonitor.OP_MEAN, 300 )
+    gMonitor.registerActivity( 'flushTime', "Time to write the buffered updates",
+                               'JobStateUpdate', "secs" , gMonitor.OP_MEAN, 300 )
+    gMonitor.registerActivity( 'pendingJobs', "Jobs with buffered updates",
+                               'JobStateUpdate', "jobs" , gMonitor.OP_MEAN, 300 )
+    gThreadScheduler.addPeriodicTask( 60, sendBufferStats )
   return S_OK()
 
+def sendBufferStats():
+  """ Send the counters of the write-behind buffer since the last call
+  """
+  global lastBufferStats
+  stats = updateBuffer.getStats()
+  if not lastBufferStats:
+    lastBufferStats = dict( [ ( key, 0 ) for key in stats ] )
+  updates = stats[ 'updates' ] - lastBufferStats[ 'updates' ]
+  flushedJobs = stats[ 'flushedJobs' ] - lastBufferStats[ 'flushedJobs' ]
+  flushes = stats[ 'flushes' ] - lastBufferStats[ 'flushes' ]
+  gMonitor.addMark( 'bufferedUpdates', updates )
+  gMonitor.addMark( 'flushedJobs', flushedJobs )
+  if flushedJobs:
+    gMonitor.addMark( 'coalescingRatio', float( updates ) / flushedJobs )
+  if flushes:
+    gMonitor.addMark( 'flushTime', ( stats[ 'flushTime' ] - lastBufferStats[ 'flushTime' ] ) / flushes )
+  gMonitor.addMark( 'pendingJobs', stats[ 'pendingJobs' ] )
+  lastBufferStats = stats
+
 class JobStateUpdateHandler( RequestHandler ):
 
+  def __flushJobs( self, jobIDs ):
+    """ Write the buffered updates of the jobs before changing them directly
+    """
+    if updateBuffer:
+      result = updateBuffer.flushJobs( jobIDs )
+      if not result['OK']:
+        gLogger.warn( 'Failed to write the buffered updates', result['Message'] )
+
   ###########################################################################
   types_updateJobFromStager = [[StringType, IntType, LongType], StringType]
   def export_updateJobFromStager( self, jobID, status ):
@@ -48,6 +102,7 @@ class JobStateUpdateHandler( RequestHandler ):
     else:
       return S_ERROR( "updateJobFromStager: %s status not known." % status )
 
+    self.__flushJobs( [ jobID ] )
     result = jobDB.getJobAttributes( jobID, ['Status'] )
     if not result['OK']:
       return result
@@ -71,6 +126,8 @@ class JobStateUpdateHandler( RequestHandler ):
         Set optionally the status date and source component which sends the
         status information.
     """
+    if updateBuffer:
+      return updateBuffer.setJobStatus( jobID, status, minorStatus, source, datetime )
     return self.__setJobStatus( jobID, status, minorStatus, source, datetime )
 
   ###########################################################################
@@ -81,7 +138,10 @@ class JobStateUpdateHandler( RequestHandler ):
         status information.
     """
     for jobID in jobIDs:
-      self.__setJobStatus( jobID, status, minorStatus, source, datetime )
+      if updateBuffer:
+        updateBuffer.setJobStatus( jobID, status, minorStatus, source, datetime )
+      else:
+        self.__setJobStatus( jobID, status, minorStatus, source, datetime )
     return S_OK()
 
   def __setJobStatus( self, jobID, status, minorStatus, source, datetime ):
@@ -118,6 +178,8 @@ class JobStateUpdateHandler( RequestHandler ):
         logging information in the JobLoggingDB. The statusDict has datetime
         as a key and status information dictionary as values
     """
+    if updateBuffer:
+      return updateBuffer.setJobStatusBulk( jobID, statusDict )
 
     dates = statusDict.keys()
     dates.sort()
@@ -181,6 +243,7 @@ class JobStateUpdateHandler( RequestHandler ):
       result = jobDB.setStartExecTime( jobID, startDate )
 
     # Update the JobLoggingDB records
+    records = []
     for date, sDict in statusDict.items():
 
       status = sDict['Status']
@@ -196,9 +259,10 @@ class JobStateUpdateHandler( RequestHandler ):
         status = "Running"
         minor = "Application"
       source = sDict['Source']
-      result = logDB.addLoggingRecord( jobID, status, minor, application, date, source )
-      if not result['OK']:
-        return result
+      records.append( ( jobID, status, minor, application, date, source ) )
+    result = logDB.addLoggingRecords( records )
+    if not result['OK']:
+      return result
 
     return S_OK()
 
@@ -207,6 +271,7 @@ class JobStateUpdateHandler( RequestHandler ):
   def export_setJobSite( self, jobID, site ):
     """Allows the site attribute to be set for a job specified by its jobID.
     """
+    self.__flushJobs( [ jobID ] )
     result = jobDB.setJobAttribute( jobID, 'Site', site )
     return result
 
@@ -215,6 +280,7 @@ class JobStateUpdateHandler( RequestHandler ):
   def export_setJobFlag( self, jobID, flag ):
     """ Set job flag for job with jobID
     """
+    self.__flushJobs( [ jobID ] )
     result = jobDB.setJobAttribute( jobID, flag, 'True' )
     return result
 
@@ -223,6 +289,7 @@ class JobStateUpdateHandler( RequestHandler ):
   def export_unsetJobFlag( self, jobID, flag ):
     """ Unset job flag for job with jobID
     """
+    self.__flushJobs( [ jobID ] )
     result = jobDB.setJobAttribute( jobID, flag, 'False' )
     return result
 
@@ -231,6 +298,7 @@ class JobStateUpdateHandler( RequestHandler ):
   def export_setJobApplicationStatus( self, jobID, appStatus, source = 'Unknown' ):
     """ Set the application status for job specified by its JobId.
     """
+    self.__flushJobs( [ jobID ] )
 
     result = jobDB.getJobAttributes( jobID, ['Status', 'MinorStatus'] )
     if not result['OK']:
@@ -260,6 +328,7 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Set arbitrary parameter specified by name/value pair
         for job specified by its JobId
     """
+    self.__flushJobs( [ jobID ] )
 
     result = jobDB.setJobParameter( jobID, name, value )
     return result
@@ -270,6 +339,7 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Set arbitrary parameter specified by name/value pair
         for job specified by its JobId
     """
+    self.__flushJobs( jobsParameterDict.keys() )
     for jobID in jobsParameterDict:
       jobDB.setJobParameter( jobID, str( jobsParameterDict[jobID][0] ), str( jobsParameterDict[jobID][1] ) )
     return S_OK()
@@ -280,6 +350,7 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Set arbitrary parameters specified by a list of name/value pairs
         for job specified by its JobId
     """
+    self.__flushJobs( [ jobID ] )
 
     result = jobDB.setJobParameters( jobID, parameters )
     if not result['OK']:
@@ -293,9 +364,12 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Send a heart beat sign of life for a job jobID
     """
 
-    result = jobDB.setHeartBeatData( jobID, staticData, dynamicData )
-    if not result['OK']:
-      gLogger.warn( 'Failed to set the heart beat data for job %d ' % jobID )
+    if updateBuffer:
+      updateBuffer.sendHeartBeat( jobID, dynamicData, staticData )
+    else:
+      result = jobDB.setHeartBeatData( jobID, staticData, dynamicData )
+      if not result['OK']:
+        gLogger.warn( 'Failed to set the heart beat data for job %d ' % jobID )
 
     # Restore the Running status if necessary
     #result = jobDB.getJobAttributes(jobID,['Status'])
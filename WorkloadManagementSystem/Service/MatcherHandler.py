@@ -10,7 +10,7 @@ It also provides an XMLRPC interface to the Matcher
 __RCSID__ = "$Id$"
 
 import time
-from   types import StringType, DictType, StringTypes
+from   types import StringType, DictType, StringTypes, IntType, LongType
 import threading
 
 from DIRAC.ConfigurationSystem.Client.Helpers          import Registry, Operations
@@ -25,6 +25,10 @@ from DIRAC                                             import gMonitor
 from DIRAC.Core.Utilities.ThreadScheduler              import gThreadScheduler
 from DIRAC.Core.Security                               import Properties
 from DIRAC.Core.Utilities.DictCache                    import DictCache
+from DIRAC.Core.Utilities                              import DEncode
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+from DIRAC.WorkloadManagementSystem.private.JobReservoir import JobReservoir
+from DIRAC.WorkloadManagementSystem.private.RunningJobsCache import RunningJobsCache
 
 DEBUG = 0
 
@@ -34,6 +38,10 @@ gJobDB = False
 gJobLoggingDB = False
 gTaskQueueDB = False
 gPilotAgentsDB = False
+gTaskQueueIndex = False
+gJobReservoir = False
+gRecordFile = False
+gRunningJobsCache = False
 
 def initializeMatcherHandler( serviceInfo ):
   """  Matcher Service initialization
@@ -43,6 +51,10 @@ def initializeMatcherHandler( serviceInfo ):
   global gJobLoggingDB
   global gTaskQueueDB
   global gPilotAgentsDB
+  global gTaskQueueIndex
+  global gJobReservoir
+  global gRecordFile
+  global gRunningJobsCache
 
   gJobDB = JobDB()
   gJobLoggingDB = JobLoggingDB()
@@ -64,8 +76,94 @@ def initializeMatcherHandler( serviceInfo ):
 
   sendNumTaskQueues()
 
+  #Match in memory and only claim the jobs in the DB
+  csPath = serviceInfo[ 'serviceSectionPath' ]
+  if gConfig.getValue( "%s/UseMatchIndex" % csPath, False ):
+    refreshPeriod = gConfig.getValue( "%s/MatchIndexRefreshPeriod" % csPath, 10 )
+    #The index is refreshed more often than once a minute
+    gThreadScheduler.setMinValidPeriod( 1 )
+    gTaskQueueIndex = TaskQueueIndex( gTaskQueueDB,
+                                      fullRefreshPeriod = gConfig.getValue( "%s/MatchIndexFullRefreshPeriod" % csPath, 600 ),
+                                      maxRefreshAge = refreshPeriod * 3 )
+    result = gTaskQueueIndex.refresh()
+    if not result[ 'OK' ]:
+      gLogger.error( "Cannot load the task queue index, matching in the DB until it's loaded", result[ 'Message' ] )
+    gThreadScheduler.addPeriodicTask( refreshPeriod, gTaskQueueIndex.refresh )
+    gMonitor.registerActivity( 'indexMatches', "Matches done with the TQ index",
+                               'Matching', "matches" , gMonitor.OP_RATE, 300 )
+  #Hand out pre-claimed jobs when not using the index
+  if gConfig.getValue( "%s/UseJobReservoir" % csPath, False ):
+    leaseTime = gConfig.getValue( "%s/JobLeaseTime" % csPath, 120 )
+    #Leases are expired more often than once a minute
+    gThreadScheduler.setMinValidPeriod( 1 )
+    gJobReservoir = JobReservoir( gTaskQueueDB, leaseTime = leaseTime,
+                                  maxBatchSize = gConfig.getValue( "%s/MaxJobLeaseBatch" % csPath, 10 ) )
+    gThreadScheduler.addPeriodicTask( max( 10, leaseTime / 4 ), gJobReservoir.expireLeases )
+  #Keep the running jobs of the limited sites instead of counting them for every match
+  if gConfig.getValue( "%s/UseRunningJobsCache" % csPath, False ):
+    #The counters are updated more often than once a minute
+    gThreadScheduler.setMinValidPeriod( 1 )
+    gRunningJobsCache = RunningJobsCache( gJobDB,
+                                          fullRefreshPeriod = gConfig.getValue( "%s/RunningJobsFullRefreshPeriod" % csPath, 600 ),
+                                          maxAge = gConfig.getValue( "%s/RunningJobsMaxAge" % csPath, 60 ) )
+    gThreadScheduler.addPeriodicTask( gConfig.getValue( "%s/RunningJobsUpdatePeriod" % csPath, 5 ),
+                                      gRunningJobsCache.update )
+    gThreadScheduler.addPeriodicTask( 60, sendRunningJobsCacheStats )
+    gMonitor.registerActivity( 'limiterCacheHits', "Limiter conditions from the cache",
+                               'Matching', "conditions" , gMonitor.OP_SUM, 300 )
+    gMonitor.registerActivity( 'limiterCacheMisses', "Limiter conditions loaded from the DB",
+                               'Matching', "conditions" , gMonitor.OP_SUM, 300 )
+    gMonitor.registerActivity( 'limiterCacheStale', "Limiter conditions reloaded being stale",
+                               'Matching', "conditions" , gMonitor.OP_SUM, 300 )
+    gMonitor.registerActivity( 'limiterCacheAge', "Age of the running jobs counters",
+                               'Matching', "secs" , gMonitor.OP_MEAN, 300 )
+  #Keep the match requests to replay them with MatchIndexReplayBenchmark
+  recordFile = gConfig.getValue( "%s/RecordMatchRequests" % csPath, "" )
+  if recordFile:
+    try:
+      gRecordFile = open( recordFile, "ab" )
+    except IOError, e:
+      gLogger.error( "Cannot open file to record the match requests", "%s: %s" % ( recordFile, str( e ) ) )
+
   return S_OK()
 
+def recordMatchRequest( resourceDict, negativeCond ):
+  try:
+    gMutex.acquire()
+    try:
+      gRecordFile.write( DEncode.encode( { 'resourceDict' : resourceDict, 'negativeCond' : negativeCond,
+                                           'time' : time.time() } ) )
+      gRecordFile.flush()
+    finally:
+      gMutex.release()
+  except Exception, e:
+    gLogger.error( "Cannot record match request", str( e ) )
+
+def matchAndGetJob( resourceDict, negativeCond ):
+  """ Use the TQ index if it's up to date, or else the job reservoir if enabled
+  """
+  if gRecordFile:
+    recordMatchRequest( resourceDict, negativeCond )
+  if 'JobID' not in resourceDict:
+    if gTaskQueueIndex and gTaskQueueIndex.isReady():
+      gMonitor.addMark( 'indexMatches' )
+      return gTaskQueueIndex.matchAndGetJob( resourceDict, negativeCond = negativeCond )
+    if gJobReservoir:
+      return gJobReservoir.matchAndGetJob( resourceDict, negativeCond = negativeCond )
+  return gTaskQueueDB.matchAndGetJob( resourceDict, negativeCond = negativeCond )
+
+gLastCacheStats = {}
+
+def sendRunningJobsCacheStats():
+  global gLastCacheStats
+  stats = gRunningJobsCache.getStats()
+  for key, activity in ( ( 'hits', 'limiterCacheHits' ), ( 'misses', 'limiterCacheMisses' ),
+                         ( 'stale', 'limiterCacheStale' ) ):
+    gMonitor.addMark( activity, stats[ key ] - gLastCacheStats.get( key, 0 ) )
+  gMonitor.addMark( 'limiterCacheAge', stats[ 'age' ] )
+  gLastCacheStats = stats
+  gLogger.verbose( "Running jobs cache: %s" % stats )
+
 def sendNumTaskQueues():
   result = gTaskQueueDB.getNumTaskQueues()
   if result[ 'OK' ]:
@@ -175,12 +273,15 @@ class Limiter:
         { 'JobType' : { 'Merge' : 20, 'MCGen' : 1000 } }
     """
     stuffDict = Limiter.__csDictCache.get( section )
-    if stuffDict:
+    #Sites without limits are cached too
+    if stuffDict != False:
       return S_OK( stuffDict )
 
     result = self.__opsHelper.getSections( section )
     if not result['OK']:
-      return result
+      #No section, no limits
+      Limiter.__csDictCache.add( section, 300, {} )
+      return S_OK( {} )
     attribs = result['Value']
     stuffDict = {}
     for attName in attribs:
@@ -210,6 +311,16 @@ class Limiter:
     #limitsDict is something like { 'JobType' : { 'Merge' : 20, 'MCGen' : 1000 } }
     if not limitsDict:
       return S_OK( {} )
+    if gRunningJobsCache:
+      validLimits = {}
+      for attName in limitsDict:
+        if attName not in gJobDB.jobAttributeNames:
+          gLogger.error( "Attribute %s does not exist. Check the job limits" % attName )
+        else:
+          validLimits[ attName ] = limitsDict[ attName ]
+      if not validLimits:
+        return S_OK( {} )
+      return gRunningJobsCache.getRunningCondition( siteName, validLimits )
     # Check if the site exceeding the given limits
     negCond = {}
     for attName in limitsDict:
@@ -237,6 +348,37 @@ class Limiter:
     #negCond is something like : {'JobType': ['Merge']}
     return S_OK( negCond )
 
+  def updateRunningCounters( self, siteName, jid ):
+    """ Count a job just matched in the cached running counters of the site, so
+        that several jobs matched before the counters are refreshed do not go
+        over the limits
+    """
+    siteSection = "%s/%s" % ( self.__runningLimitSection, siteName )
+    result = self.__extractCSData( siteSection )
+    if not result['OK']:
+      return result
+    limitsDict = result[ 'Value' ]
+    if not limitsDict:
+      return S_OK()
+    attNames = [ attName for attName in limitsDict if attName in gJobDB.jobAttributeNames ]
+    if not attNames:
+      return S_OK()
+    result = gJobDB.getJobAttributes( jid, attNames )
+    if not result[ 'OK' ]:
+      gLogger.error( "While retrieving attributes coming from %s: %s" % ( siteSection, result[ 'Message' ] ) )
+      return result
+    atts = result[ 'Value' ]
+    if gRunningJobsCache:
+      gRunningJobsCache.jobMatched( siteName, jid, atts )
+      return S_OK()
+    for attName in atts:
+      data = self.__condCache.get( "Running:%s:%s" % ( siteName, attName ) )
+      #Not cached, next time it will be read from the DB
+      if data:
+        attValue = atts[ attName ]
+        data[ attValue ] = data.get( attValue, 0 ) + 1
+    return S_OK()
+
   def updateDelayCounters( self, siteName, jid ):
     #Get the info from the CS
     siteSection = "%s/%s" % ( self.__matchingDelaySection, siteName )
@@ -360,12 +502,11 @@ class MatcherHandler( RequestHandler ):
 
     return resourceDict
 
-  def selectJob( self, resourceDescription ):
-    """ Main job selection function to find the highest priority job
-        matching the resource capacity
+  def __prepareMatch( self, resourceDescription ):
+    """ Build the resource dictionary checking the credentials, the pilot version
+        and the site mask, and report the pilot info.
+        Return S_OK( ( resourceDict, siteName, pilotReference, pilotInfoReported ) )
     """
-
-    startTime = time.time()
     resourceDict = self.__processResourceDescription( resourceDescription )
 
     credDict = self.getRemoteCredentials()
@@ -460,19 +601,12 @@ class MatcherHandler( RequestHandler ):
     for key in resourceDict:
      gLogger.verbose( "%s : %s" % ( key.rjust( 20 ), resourceDict[ key ] ) )
 
-    negativeCond = self.__limiter.getNegativeCondForSite( siteName )
-    result = gTaskQueueDB.matchAndGetJob( resourceDict, negativeCond = negativeCond )
-
-    if DEBUG:
-      print result
-
-    if not result['OK']:
-      return result
-    result = result['Value']
-    if not result['matchFound']:
-      return S_ERROR( 'No match found' )
+    return S_OK( ( resourceDict, siteName, pilotReference, pilotInfoReported ) )
 
-    jobID = result['jobId']
+  def __assignJob( self, jobID, siteName, pilotReference ):
+    """ Set the job taken out of the TQs as matched to the site and
+        get what has to be returned to the pilot for it
+    """
     resAtt = gJobDB.getJobAttributes( jobID, ['OwnerDN', 'OwnerGroup', 'Status'] )
     if not resAtt['OK']:
       return S_ERROR( 'Could not retrieve job attributes' )
@@ -502,21 +636,14 @@ class MatcherHandler( RequestHandler ):
     resultDict['JDL'] = result['Value']
     resultDict['JobID'] = jobID
 
-    matchTime = time.time() - startTime
-    gLogger.info( "Match time: [%s]" % str( matchTime ) )
-    gMonitor.addMark( "matchTime", matchTime )
-
     # Get some extra stuff into the response returned
     resOpt = gJobDB.getJobOptParameters( jobID )
     if resOpt['OK']:
       for key, value in resOpt['Value'].items():
         resultDict[key] = value
-    resAtt = gJobDB.getJobAttributes( jobID, ['OwnerDN', 'OwnerGroup'] )
-    if not resAtt['OK']:
-      return S_ERROR( 'Could not retrieve job attributes' )
-    if not resAtt['Value']:
-      return S_ERROR( 'No attributes returned for job' )
 
+    if self.__limiter.checkJobLimit():
+      self.__limiter.updateRunningCounters( siteName, jobID )
     if self.__opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True ):
       self.__limiter.updateDelayCounters( siteName, jobID )
 
@@ -527,9 +654,85 @@ class MatcherHandler( RequestHandler ):
 
     resultDict['DN'] = resAtt['Value']['OwnerDN']
     resultDict['Group'] = resAtt['Value']['OwnerGroup']
+    return S_OK( resultDict )
+
+  def selectJob( self, resourceDescription ):
+    """ Main job selection function to find the highest priority job
+        matching the resource capacity
+    """
+
+    startTime = time.time()
+    result = self.__prepareMatch( resourceDescription )
+    if not result[ 'OK' ]:
+      return result
+    resourceDict, siteName, pilotReference, pilotInfoReported = result[ 'Value' ]
+
+    negativeCond = self.__limiter.getNegativeCondForSite( siteName )
+    result = matchAndGetJob( resourceDict, negativeCond )
+
+    if DEBUG:
+      print result
+
+    if not result['OK']:
+      return result
+    result = result['Value']
+    if not result['matchFound']:
+      return S_ERROR( 'No match found' )
+
+    result = self.__assignJob( result['jobId'], siteName, pilotReference )
+    if not result[ 'OK' ]:
+      return result
+    resultDict = result[ 'Value' ]
     resultDict['PilotInfoReportedFlag'] = pilotInfoReported
+
+    matchTime = time.time() - startTime
+    gLogger.info( "Match time: [%s]" % str( matchTime ) )
+    gMonitor.addMark( "matchTime", matchTime )
     return S_OK( resultDict )
 
+  def selectJobs( self, resourceDescription, numJobs ):
+    """ Select up to numJobs jobs for a resource with several slots. The checks
+        of the resource are done once, the limits of the site are applied
+        again after every job matched. Jobs are matched until one match fails
+    """
+
+    startTime = time.time()
+    result = self.__prepareMatch( resourceDescription )
+    if not result[ 'OK' ]:
+      return result
+    resourceDict, siteName, pilotReference, pilotInfoReported = result[ 'Value' ]
+    #A given job is only matched once
+    if 'JobID' in resourceDict:
+      numJobs = 1
+
+    jobList = []
+    for i in range( numJobs ):
+      negativeCond = self.__limiter.getNegativeCondForSite( siteName )
+      result = matchAndGetJob( resourceDict, negativeCond )
+      if not result['OK']:
+        break
+      if not result['Value']['matchFound']:
+        result = S_ERROR( 'No match found' )
+        break
+      jobID = result['Value']['jobId']
+      result = self.__assignJob( jobID, siteName, pilotReference )
+      if not result[ 'OK' ]:
+        gLogger.warn( "Cannot assign matched job %s" % jobID, result[ 'Message' ] )
+        continue
+      resultDict = result[ 'Value' ]
+      resultDict['PilotInfoReportedFlag'] = pilotInfoReported
+      jobList.append( resultDict )
+
+    #The jobs matched are already assigned, errors only matter if there are none
+    if not jobList:
+      return result
+
+    matchTime = time.time() - startTime
+    gLogger.info( "Matched %s jobs in %s secs" % ( len( jobList ), matchTime ) )
+    for resultDict in jobList:
+      gMonitor.addMark( "matchTime", matchTime / len( jobList ) )
+    return S_OK( jobList )
+
 ##############################################################################
   types_requestJob = [ [StringType, DictType] ]
   def export_requestJob( self, resourceDescription ):
@@ -543,6 +746,19 @@ class MatcherHandler( RequestHandler ):
       gMonitor.addMark( "matchesOK" )
     return result
 
+##############################################################################
+  types_requestJobs = [ [StringType, DictType], [IntType, LongType] ]
+  def export_requestJobs( self, resourceDescription, numJobs ):
+    """ Serve up to numJobs jobs to an agent with several slots in one request.
+        Return the list of matched jobs, each one like the result of requestJob
+    """
+    maxJobs = self.srv_getCSOption( "MaxJobsPerRequest", 32 )
+    result = self.selectJobs( resourceDescription, max( 1, min( numJobs, maxJobs ) ) )
+    gMonitor.addMark( "matchesDone" )
+    if result[ 'OK' ]:
+      gMonitor.addMark( "matchesOK", len( result[ 'Value' ] ) )
+    return result
+
 ##############################################################################
   types_getActiveTaskQueues = []
   def export_getActiveTaskQueues( self ):
@@ -1,9 +1,10 @@
 import types
 from DIRAC import S_OK, S_ERROR
 from DIRAC.Core.Utilities import DEncode, ThreadScheduler
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 from DIRAC.Core.Base.ExecutorMindHandler import ExecutorMindHandler
 from DIRAC.WorkloadManagementSystem.Client.JobState.JobState import JobState
-from DIRAC.WorkloadManagementSystem.Client.JobState.CachedJobState import CachedJobState
+from DIRAC.WorkloadManagementSystem.Client.JobState.CachedJobState import CachedJobState, INIT_STATE_ATTRIBUTES
 
 class OptimizationMindHandler( ExecutorMindHandler ):
 
@@ -15,22 +16,44 @@ class OptimizationMindHandler( ExecutorMindHandler ):
 
   auth_msg_OptimizeJobs = [ 'all' ]
   def msg_OptimizeJobs( self, msgObj ):
-    jids = msgObj.jids
-    for jid in jids:
+    jids = []
+    for jid in msgObj.jids:
       try:
-        jid = int( jid )
+        jids.append( int( jid ) )
       except ValueError:
         self.log.error( "Job ID %s has to be an integer" % jid )
+    result = self.__getJobStates( jids )
+    if not result[ 'OK' ]:
+      self.log.error( "Could not get the state of the jobs to optimize: %s" % result[ 'Message' ] )
+      return result
+    jobStates = result[ 'Value' ]
+    for jid in jids:
+      if jid not in jobStates:
+        self.log.error( "Job %s to optimize is not in the JobDB" % jid )
         continue
       #Forget and add task to ensure state is reset
       self.forgetTask( jid )
-      result = self.executeTask( jid, CachedJobState( jid ) )
+      result = self.executeTask( jid, jobStates[ jid ] )
       if not result[ 'OK' ]:
-        self.log.error( "Could not add job %s to optimization: %s" % ( jid, result[ 'Value' ] ) )
+        self.log.error( "Could not add job %s to optimization: %s" % ( jid, result[ 'Message' ] ) )
       else:
         self.log.info( "Received new job %s" % jid )
     return S_OK()
 
+  @classmethod
+  def __getJobStates( cls, jidList ):
+    """ Cached states of the jobs with their initial state loaded in bulk, the
+        optimizers carry them from step to step afterwards
+    """
+    jobStates = {}
+    for jidChunk in breakListIntoChunks( jidList, 1000 ):
+      result = cls.__jobDB.getAttributesForJobList( jidChunk, INIT_STATE_ATTRIBUTES )
+      if not result[ 'OK' ]:
+        return result
+      for jid, initState in result[ 'Value' ].items():
+        jobStates[ jid ] = CachedJobState( jid, initState = initState )
+    return S_OK( jobStates )
+
   @classmethod
   def __loadJobs( cls, eTypes = None ):
     log = cls.log
@@ -64,13 +87,16 @@ class OptimizationMindHandler( ExecutorMindHandler ):
       if not result[ 'OK' ]:
         return result
       jidList = result[ 'Value' ]
-      knownJids = cls.getTaskIds()
+      knownJids = set( cls.getTaskIds() )
+      newJids = [ long( jid ) for jid in jidList if long( jid ) not in knownJids ]
+      result = cls.__getJobStates( newJids )
+      if not result[ 'OK' ]:
+        return result
+      jobStates = result[ 'Value' ]
       added = 0
-      for jid in jidList:
-        jid = long( jid )
-        if jid not in knownJids:
-          #Same as before. Check that the state is ok.
-          cls.executeTask( jid, CachedJobState( jid ) )
+      for jid in newJids:
+        if jid in jobStates:
+          cls.executeTask( jid, jobStates[ jid ] )
           added += 1
       log.info( "Added %s/%s jobs for %s state" % ( added, len( jidList ), opState ) )
     return S_OK()
@@ -5,6 +5,14 @@
 """ SandboxHandler is the implementation of the Sandbox service
     in the DISET framework
 
+    Sandboxes are addressed by the MD5 of their content. Clients offer the
+    hash with offerSandbox before uploading, so that known sandboxes are not
+    sent again, and uploads are received into a partial file that is kept
+    on disconnection so that the client can resume at the received offset.
+
+    With an external backend the sandboxes are registered with their external
+    location straight away and copied there in the background, they are served
+    from the local offload area until the copy is done.
 """
 
 __RCSID__ = "$Id$"
@@ -16,9 +24,14 @@ import random
 import types
 import threading
 import tempfile
-import threading
-from DIRAC import gLogger, S_OK, S_ERROR, gConfig
+import fcntl
+try:
+  import hashlib as md5
+except:
+  import md5
+from DIRAC import gLogger, S_OK, S_ERROR, gConfig, gMonitor
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
+from DIRAC.Core.Utilities.ThreadPool import ThreadPool
 from DIRAC.WorkloadManagementSystem.DB.SandboxMetadataDB import SandboxMetadataDB
 from DIRAC.DataManagementSystem.Client.ReplicaManager import ReplicaManager
 from DIRAC.RequestManagementSystem.Client.RequestClient import RequestClient
@@ -28,12 +41,30 @@ from DIRAC.Core.Security import Properties
 from DIRAC.Core.Utilities import List
 
 sandboxDB = False
+gSBDeletionPool = False
+gSBOffloadPool = False
 
 def initializeSandboxStoreHandler( serviceInfo ):
-  global sandboxDB, gSBDeletionPool
+  global sandboxDB, gSBDeletionPool, gSBOffloadPool
   random.seed()
   sandboxDB = SandboxMetadataDB()
   print sandboxDB
+  #Copies to the external SE and purge deletions have their own threads
+  csPath = serviceInfo[ 'serviceSectionPath' ]
+  gSBOffloadPool = ThreadPool( 1, gConfig.getValue( "%s/ExternalCopyThreads" % csPath, 4 ) )
+  gSBOffloadPool.daemonize()
+  gSBDeletionPool = ThreadPool( 1, gConfig.getValue( "%s/PurgeThreads" % csPath, 4 ) )
+  gSBDeletionPool.daemonize()
+  gMonitor.registerActivity( 'pendingOffloads', "Sandboxes waiting for the external SE",
+                             'SandboxStore', "sandboxes", gMonitor.OP_MEAN, 300 )
+  gMonitor.registerActivity( 'offloadTime', "Time to copy a sandbox to the external SE",
+                             'SandboxStore', "secs", gMonitor.OP_MEAN, 300 )
+  gMonitor.registerActivity( 'purgedSandboxes', "Purged sandboxes",
+                             'SandboxStore', "sandboxes", gMonitor.OP_SUM, 300 )
+  gMonitor.registerActivity( 'purgeFailures', "Sandboxes that could not be purged",
+                             'SandboxStore', "sandboxes", gMonitor.OP_SUM, 300 )
+  gMonitor.registerActivity( 'purgeRate', "Sandboxes purged per second",
+                             'SandboxStore', "sandboxes/s", gMonitor.OP_MEAN, 300 )
   return S_OK()
 
 class SandboxStoreHandler( RequestHandler ):
@@ -41,6 +72,8 @@ class SandboxStoreHandler( RequestHandler ):
   __purgeCount = -1
   __purgeLock = threading.Lock()
   __purgeWorking = False
+  __lastPartialPurge = 0
+  __offloadsRecovered = False
 
   def initialize( self ):
     self.__backend = self.getCSOption( "Backend", "local" )
@@ -53,6 +86,10 @@ class SandboxStoreHandler( RequestHandler ):
       self.__useLocalStorage = False
       self.__externalSEName = self.__backend
       self.__seNameToUse = self.__backend
+    self.__asyncExternalCopy = self.getCSOption( "AsyncExternalCopy", True )
+    if not self.__useLocalStorage and self.__asyncExternalCopy and not SandboxStoreHandler.__offloadsRecovered:
+      SandboxStoreHandler.__offloadsRecovered = True
+      gSBOffloadPool.generateJobAndQueueIt( self.__recoverOffloads )
     #Execute the purge once every 100 calls
     SandboxStoreHandler.__purgeCount += 1
     if SandboxStoreHandler.__purgeCount > self.getCSOption( "QueriesBeforePurge", 1000 ):
@@ -74,32 +111,83 @@ class SandboxStoreHandler( RequestHandler ):
     return os.path.join( *pathItems )
 
 
-  def transfer_fromClient( self, fileId, token, fileSize, fileHelper ):
+  def __splitFileId( self, fileId ):
+    """ Split a <hash>.tar.<compression> sandbox name
+    """
+    extPos = fileId.find( ".tar" )
+    if extPos > -1:
+      return fileId[ :extPos ], fileId[ extPos + 1: ]
+    return fileId, ""
+
+  def __getExistingSandbox( self, seName, sePFN, assignTo ):
+    """ Assign an already stored sandbox. Returns its URL or False if it is not there
     """
-    Receive a file as a sandbox
+    credDict = self.getRemoteCredentials()
+    result = sandboxDB.getSandboxId( seName, sePFN, credDict[ 'username' ], credDict[ 'group' ] )
+    if not result[ 'OK' ]:
+      return S_OK( False )
+    sbURL = "SB:%s|%s" % ( seName, sePFN )
+    assignTo = dict( [ ( key, [ ( sbURL, assignTo[ key ] ) ] ) for key in assignTo ] )
+    result = self.export_assignSandboxesToEntities( assignTo )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( sbURL )
+
+  def __getPartialPath( self, sbPath ):
+    """ Where an upload is received until it is complete
     """
+    return "%s.part" % self.__sbToHDPath( sbPath )
 
-    if self.__maxUploadBytes and fileSize > self.__maxUploadBytes:
-      fileHelper.markAsTransferred()
-      return S_ERROR( "Sandbox is too big. Please upload it to a grid storage element" )
+  types_offerSandbox = [ types.StringType, types.DictType ]
+  def export_offerSandbox( self, fileId, assignTo ):
+    """
+    Offer a sandbox by its hash before uploading it. If the sandbox is already
+    stored it is assigned and its URL returned in SandboxURL, otherwise Offset
+    is the number of bytes received by a previous interrupted upload
+    """
+    hash, extension = self.__splitFileId( fileId )
+    sbPath = self.__getSandboxPath( "%s.%s" % ( hash, extension ) )
+    result = self.__generateLocation( sbPath )
+    if not result[ 'OK' ]:
+      return result
+    seName, sePFN = result[ 'Value' ]
+    result = self.__getExistingSandbox( seName, sePFN, assignTo )
+    if not result[ 'OK' ]:
+      return result
+    if result[ 'Value' ]:
+      gLogger.info( "Sandbox %s already exists" % hash )
+      return S_OK( { 'SandboxURL' : result[ 'Value' ] } )
+    offset = 0
+    partialPath = self.__getPartialPath( sbPath )
+    if os.path.isfile( partialPath ):
+      offset = os.path.getsize( partialPath )
+    return S_OK( { 'Offset' : offset } )
+
+  def transfer_fromClient( self, fileId, token, fileSize, fileHelper ):
+    """
+    Receive a file as a sandbox.
+    fileId is ( <hash>.tar.bz2, assignTo ) or ( <hash>.tar.bz2, assignTo, offset ) to resume an upload
+    """
 
+    offset = 0
     if type( fileId ) in ( types.ListType, types.TupleType ):
       if len( fileId ) > 1:
         assignTo = fileId[1]
+        if len( fileId ) > 2:
+          offset = fileId[2]
         fileId = fileId[0]
       else:
         return S_ERROR( "File identified tuple has to have length greater than 1" )
     else:
       assignTo = {}
 
-    extPos = fileId.find( ".tar" )
-    if extPos > -1:
-      extension = fileId[ extPos + 1: ]
-      hash = fileId[ :extPos ]
-    else:
-      extension = ""
-      hash = fileId
-    gLogger.info( "Upload requested for %s [%s]" % ( hash, extension ) )
+    #Resumed uploads only send the bytes after the offset
+    if self.__maxUploadBytes and offset + fileSize > self.__maxUploadBytes:
+      fileHelper.markAsTransferred()
+      return S_ERROR( "Sandbox is too big. Please upload it to a grid storage element" )
+
+    hash, extension = self.__splitFileId( fileId )
+    gLogger.info( "Upload requested for %s [%s] from byte %s" % ( hash, extension, offset ) )
 
     credDict = self.getRemoteCredentials()
     sbPath = self.__getSandboxPath( "%s.%s" % ( hash, extension ) )
@@ -109,48 +197,118 @@ class SandboxStoreHandler( RequestHandler ):
       return result
     seName, sePFN = result[ 'Value' ]
 
-    result = sandboxDB.getSandboxId( seName, sePFN, credDict[ 'username' ], credDict[ 'group' ] )
-    if result[ 'OK' ]:
+    result = self.__getExistingSandbox( seName, sePFN, assignTo )
+    if not result[ 'OK' ]:
+      return result
+    if result[ 'Value' ]:
       gLogger.info( "Sandbox already exists. Skipping upload" )
       fileHelper.markAsTransferred()
-      sbURL = "SB:%s|%s" % ( seName, sePFN )
-      assignTo = dict( [ ( key, [ ( sbURL, assignTo[ key ] ) ] ) for key in assignTo ] )
-      result = self.export_assignSandboxesToEntities( assignTo )
-      if not result[ 'OK' ]:
-        return result
-      return S_OK( sbURL )
+      return S_OK( result[ 'Value' ] )
 
-    if self.__useLocalStorage:
-      hdPath = self.__sbToHDPath( sbPath )
-    else:
-      hdPath = False
-    #Write to local file
-    result = self.__networkToFile( fileHelper, hdPath )
+    partialPath = self.__getPartialPath( sbPath )
+    #The lock on the partial file keeps out other uploads of the same sandbox,
+    #from this process or from the other clones of the service
+    result = self.__lockPartialFile( partialPath )
+    if not result[ 'OK' ]:
+      fileHelper.markAsTransferred()
+      gLogger.error( "Cannot receive sandbox %s" % hash, result[ 'Message' ] )
+      return result
+    partialFD = result[ 'Value' ]
+    try:
+      return self.__receiveSandbox( fileHelper, hash, sbPath, partialPath, partialFD, offset, assignTo )
+    finally:
+      partialFD.close()
+
+  def __lockPartialFile( self, partialPath ):
+    """
+    Open the partial file of an upload and take an exclusive lock on it.
+    flock locks belong to the open file, so they also exclude other threads.
+    The lock is released when the returned file is closed
+    """
+    try:
+      os.makedirs( os.path.dirname( partialPath ) )
+    except:
+      pass
+    try:
+      fd = open( partialPath, "ab" )
+    except Exception, e:
+      return S_ERROR( "Cannot open to write destination file %s: %s" % ( partialPath, str( e ) ) )
+    try:
+      fcntl.flock( fd.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB )
+    except IOError:
+      fd.close()
+      return S_ERROR( "Sandbox is already being uploaded" )
+    #The previous holder of the lock may have stored or removed the file meanwhile
+    try:
+      sameFile = os.fstat( fd.fileno() ).st_ino == os.stat( partialPath ).st_ino
+    except OSError:
+      sameFile = False
+    if not sameFile:
+      fd.close()
+      return S_ERROR( "Sandbox was being uploaded, offer it again" )
+    return S_OK( fd )
+
+  def __receiveSandbox( self, fileHelper, hash, sbPath, partialPath, partialFD, offset, assignTo ):
+    """
+    Receive the data into the locked partial file and store it once complete
+    """
+    #Write to the partial file, it is kept if the connection drops
+    result = self.__networkToPartialFile( fileHelper, partialFD, offset )
     if not result[ 'OK' ]:
       gLogger.error( "Error while receiving file: %s" % result['Message'] )
       return result
-    hdPath = result[ 'Value' ]
-    gLogger.info( "Wrote sandbox to file %s" % hdPath )
-    #Check hash!
-    if fileHelper.getHash() != hash:
-      self.__secureUnlinkFile( hdPath )
+    gLogger.info( "Wrote sandbox to file %s" % partialPath )
+    #Check hash of the whole file!
+    result = self.__getFileHash( partialPath )
+    if not result[ 'OK' ]:
+      return result
+    if result[ 'Value' ] != hash:
+      self.__secureUnlinkFile( partialPath )
       gLogger.error( "Hashes don't match! Client defined hash is different with received data hash!" )
       return S_ERROR( "Hashes don't match!" )
-    #If using remote storage, copy there!
-    if not self.__useLocalStorage:
+    sbSize = os.path.getsize( partialPath )
+    offload = False
+    if self.__useLocalStorage or self.__asyncExternalCopy:
+      if self.__useLocalStorage:
+        hdPath = self.__sbToHDPath( sbPath )
+      else:
+        #Keep it in the offload area until it is copied to the external SE
+        hdPath = self.__getOffloadPath( sbPath )
+        result = self.__generateLocation( sbPath )
+        if not result[ 'OK' ]:
+          self.__secureUnlinkFile( partialPath )
+          return result
+        offload = ( hdPath, sbPath )
+        sbPath = result[ 'Value' ][1]
+      try:
+        try:
+          os.makedirs( os.path.dirname( hdPath ) )
+        except:
+          pass
+        os.rename( partialPath, hdPath )
+      except Exception, e:
+        self.__secureUnlinkFile( partialPath )
+        return S_ERROR( "Cannot move sandbox to its final path: %s" % str( e ) )
+    else:
+      #If using remote storage, copy there!
       gLogger.info( "Uploading sandbox to external storage" )
-      result = self.__copyToExternalSE( hdPath, sbPath )
-      self.__secureUnlinkFile( hdPath )
+      hdPath = False
+      result = self.__copyToExternalSE( partialPath, sbPath )
+      self.__secureUnlinkFile( partialPath )
       if not result[ 'OK' ]:
         return result
       sbPath = result[ 'Value' ][1]
     #Register!
+    credDict = self.getRemoteCredentials()
     gLogger.info( "Registering sandbox in the DB with", "SB:%s|%s" % ( self.__seNameToUse, sbPath ) )
     result = sandboxDB.registerAndGetSandbox( credDict[ 'username' ], credDict[ 'DN' ], credDict[ 'group' ],
-                                              self.__seNameToUse, sbPath, fileHelper.getTransferedBytes() )
+                                              self.__seNameToUse, sbPath, sbSize )
     if not result[ 'OK' ]:
-      self.__secureUnlinkFile( hdPath )
+      if hdPath:
+        self.__secureUnlinkFile( hdPath )
       return result
+    if offload:
+      self.__queueOffload( *offload )
 
     sbURL = "SB:%s|%s" % ( self.__seNameToUse, sbPath )
     assignTo = dict( [ ( key, [ ( sbURL, assignTo[ key ] ) ] ) for key in assignTo ] )
@@ -257,6 +415,43 @@ class SandboxStoreHandler( RequestHandler ):
     fd.close()
     return S_OK( destFileName )
 
+  def __networkToPartialFile( self, fileHelper, fd, offset ):
+    """
+    Append incoming network data to the open partial file of an upload
+    """
+    try:
+      if offset:
+        if os.fstat( fd.fileno() ).st_size != offset:
+          fileHelper.markAsTransferred()
+          return S_ERROR( "Cannot resume upload at byte %s" % offset )
+      else:
+        fd.truncate( 0 )
+    except Exception, e:
+      fileHelper.markAsTransferred()
+      return S_ERROR( "Cannot prepare the partial file: %s" % str( e ) )
+    maxFileSize = 0
+    if self.__maxUploadBytes:
+      maxFileSize = max( 1, self.__maxUploadBytes - offset )
+    try:
+      return fileHelper.networkToDataSink( fd, maxFileSize = maxFileSize )
+    finally:
+      fd.flush()
+
+  def __getFileHash( self, filePath ):
+    oMD5 = md5.md5()
+    try:
+      fd = open( filePath, "rb" )
+      try:
+        bData = fd.read( 1048576 )
+        while bData:
+          oMD5.update( bData )
+          bData = fd.read( 1048576 )
+      finally:
+        fd.close()
+    except Exception, e:
+      return S_ERROR( "Cannot read %s: %s" % ( filePath, str( e ) ) )
+    return S_OK( oMD5.hexdigest() )
+
   def __secureUnlinkFile( self, filePath ):
     try:
       os.unlink( filePath )
@@ -309,6 +504,94 @@ class SandboxStoreHandler( RequestHandler ):
     except Exception, e:
       return S_ERROR( "Error while moving sandbox to SE: %s" % str( e ) )
 
+  ##################
+  # Background copies to the external SE
+
+  def __getOffloadPath( self, sbPath ):
+    """ Local copy of a sandbox waiting for the external SE, sharded like the store
+    """
+    basePath = self.getCSOption( "BasePath", "/opt/dirac/storage/sandboxes" )
+    return os.path.join( basePath, "offload", sbPath.lstrip( "/" ) )
+
+  def __sePFNToOffloadPath( self, sePFN ):
+    """ Local copy of a sandbox from its external PFN, which ends with the sandbox path.
+        Returns False if the PFN is not a sandbox one
+    """
+    #Sandbox paths are /<prefix>/<initial>/<owner>/<hash[0:3]>/<hash[3:6]>/<file>
+    pathItems = sePFN.split( "/" )[-6:]
+    if len( pathItems ) < 6 or pathItems[0] != self.getCSOption( "SandboxPrefix", "SandBox" ):
+      return False
+    return self.__getOffloadPath( "/".join( pathItems ) )
+
+  def __lockOffloadFile( self, hdPath ):
+    """ Open the local copy of a sandbox waiting for the external SE and take an exclusive lock on it.
+        The copy is pending while the file exists, whichever clone of the service received it.
+        Returns S_OK( False ) if it is gone or another thread or clone holds the lock
+    """
+    try:
+      fd = open( hdPath, "rb" )
+    except IOError:
+      return S_OK( False )
+    try:
+      fcntl.flock( fd.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB )
+    except IOError:
+      fd.close()
+      return S_OK( False )
+    #The previous holder of the lock may have copied and removed it meanwhile
+    try:
+      sameFile = os.fstat( fd.fileno() ).st_ino == os.stat( hdPath ).st_ino
+    except OSError:
+      sameFile = False
+    if not sameFile:
+      fd.close()
+      return S_OK( False )
+    return S_OK( fd )
+
+  def __queueOffload( self, hdPath, sbPath ):
+    gSBOffloadPool.generateJobAndQueueIt( self.__offloadSandbox, args = ( hdPath, sbPath ) )
+    gMonitor.addMark( 'pendingOffloads', gSBOffloadPool.pendingJobs() )
+
+  def __offloadSandbox( self, hdPath, sbPath ):
+    """ Copy a sandbox to the external SE and drop the local copy.
+        If all attempts fail the sandbox is kept locally and served from there
+    """
+    result = self.__lockOffloadFile( hdPath )
+    if not result[ 'OK' ] or not result[ 'Value' ]:
+      #Already copied or being copied by another thread or clone
+      return result
+    fd = result[ 'Value' ]
+    try:
+      start = time.time()
+      for attempt in range( 3 ):
+        if attempt:
+          time.sleep( 60 * attempt )
+        result = self.__copyToExternalSE( hdPath, sbPath )
+        if result[ 'OK' ]:
+          break
+        gLogger.error( "Cannot copy sandbox to the external SE", "%s: %s" % ( sbPath, result[ 'Message' ] ) )
+      else:
+        return result
+      gMonitor.addMark( 'offloadTime', time.time() - start )
+      #Unlinked while locked, readers that already opened it can finish
+      self.__secureUnlinkFile( hdPath )
+    finally:
+      fd.close()
+    self.__cleanEmptyDirs( hdPath )
+    return S_OK()
+
+  def __recoverOffloads( self ):
+    """ Queue again the copies left by a previous run of the service.
+        The clones of the service all do it, the lock on the files keeps them from copying twice
+    """
+    offloadDir = self.__getOffloadPath( "/" )
+    for dirPath, dirNames, fileNames in os.walk( offloadDir ):
+      for fileName in fileNames:
+        hdPath = os.path.join( dirPath, fileName )
+        sbPath = "/%s" % hdPath[ len( offloadDir ): ].lstrip( "/" )
+        gLogger.info( "Recovering copy of sandbox to the external SE", sbPath )
+        self.__queueOffload( hdPath, sbPath )
+    return S_OK()
+
   ##################
   # Assigning sbs to jobs
 
@@ -368,13 +651,21 @@ class SandboxStoreHandler( RequestHandler ):
         token is used for access rights confirmation.
     """
     credDict = self.getRemoteCredentials()
+    hdPath = False
     result = sandboxDB.getSandboxId( self.__localSEName, fileID, credDict[ 'username' ], credDict[ 'group' ] )
     if not result[ 'OK' ]:
-      return result
+      #Sandboxes on their way to the external SE are served from here, whichever clone received them
+      hdPath = self.__sePFNToOffloadPath( fileID )
+      if not hdPath or not os.path.isfile( hdPath ):
+        return result
+      result = sandboxDB.getSandboxId( self.__seNameToUse, fileID, credDict[ 'username' ], credDict[ 'group' ] )
+      if not result[ 'OK' ]:
+        return result
     sbId = result[ 'Value' ]
     sandboxDB.accessedSandboxById( sbId )
     #If it's a local file
-    hdPath = self.__sbToHDPath( fileID )
+    if not hdPath:
+      hdPath = self.__sbToHDPath( fileID )
     if not os.path.isfile( hdPath ):
       return S_ERROR( "Sandbox does not exist" )
     result = fileHelper.getFileDescriptor( hdPath, 'rb' )
@@ -401,6 +692,7 @@ class SandboxStoreHandler( RequestHandler ):
       SandboxStoreHandler.__purgeLock.release()
 
     gLogger.info( "Purging sandboxes" )
+    self.__purgePartialUploads()
     result = sandboxDB.getUnusedSandboxes()
     if not result[ 'OK' ]:
       gLogger.error( "Error while retrieving sandboxes to purge", result[ 'Message' ] )
@@ -408,21 +700,122 @@ class SandboxStoreHandler( RequestHandler ):
       return result
     sbList = result[ 'Value' ]
     gLogger.info( "Got %s sandboxes to purge" % len( sbList ) )
-    deletedFromSE = []
-    for sbId, SEName, SEPFN in sbList:
-      self.__purgeSandbox( sbId, SEName, SEPFN )
+    batchSize = max( 1, self.getCSOption( "PurgeBatchSize", 100 ) )
+    start = time.time()
+    purged = 0
+    failed = 0
+    for i in range( 0, len( sbList ), batchSize ):
+      batch = sbList[ i:i + batchSize ]
+      deleted, postponed = self.__purgeSandboxes( batch )
+      purged += len( deleted )
+      failed += len( batch ) - len( deleted ) - postponed
+      gMonitor.addMark( 'purgedSandboxes', len( deleted ) )
+      gMonitor.addMark( 'purgeFailures', len( batch ) - len( deleted ) - postponed )
+      rate = purged / max( time.time() - start, 0.001 )
+      gMonitor.addMark( 'purgeRate', rate )
+      gLogger.info( "Purged %s / %s sandboxes (%s failed), %.1f sandboxes/s" % ( purged, len( sbList ),
+                                                                               failed, rate ) )
 
     SandboxStoreHandler.__purgeWorking = False
     return S_OK()
 
-  def __purgeSandbox( self, sbId, SEName, SEPFN ):
-    result = self.__deleteSandboxFromBackend( SEName, SEPFN )
-    if not result[ 'OK' ]:
-      gLogger.error( "Cannot delete sandbox from backend", result[ 'Message' ] )
-      return
-    result = sandboxDB.deleteSandboxes( [ sbId ] )
-    if not result[ 'OK' ]:
-      gLogger.error( "Cannot delete sandbox from DB", result[ 'Message' ] )
+  def __purgePartialUploads( self ):
+    """ Remove the partial files of the uploads abandoned for longer than PartialUploadMaxAge.
+        The store is walked at most once an hour
+    """
+    if time.time() - SandboxStoreHandler.__lastPartialPurge < 3600:
+      return S_OK( 0 )
+    SandboxStoreHandler.__lastPartialPurge = time.time()
+    maxAge = self.getCSOption( "PartialUploadMaxAge", 86400 )
+    basePath = self.getCSOption( "BasePath", "/opt/dirac/storage/sandboxes" )
+    removed = 0
+    for dirPath, dirNames, fileNames in os.walk( basePath ):
+      for fileName in fileNames:
+        if not fileName.endswith( ".part" ):
+          continue
+        partialPath = os.path.join( dirPath, fileName )
+        try:
+          if time.time() - os.path.getmtime( partialPath ) < maxAge:
+            continue
+        except OSError:
+          continue
+        #Uploads still going on hold the lock
+        result = self.__lockPartialFile( partialPath )
+        if not result[ 'OK' ]:
+          continue
+        try:
+          if self.__secureUnlinkFile( partialPath ):
+            removed += 1
+        finally:
+          result[ 'Value' ].close()
+        self.__cleanEmptyDirs( partialPath )
+    if removed:
+      gLogger.info( "Removed %s abandoned partial uploads" % removed )
+    return S_OK( removed )
+
+  def __purgeSandboxes( self, sbList ):
+    """ Purge a batch of sandboxes, except the ones still being copied to the external SE.
+        Returns the ids of the deleted sandboxes and the number of postponed ones
+    """
+    toPurge = []
+    for sbId, SEName, SEPFN in sbList:
+      #The local copy is only removed once the sandbox is in the external SE
+      if SEName != self.__localSEName:
+        hdPath = self.__sePFNToOffloadPath( SEPFN )
+        if hdPath and os.path.exists( hdPath ):
+          continue
+      toPurge.append( ( sbId, SEName, SEPFN ) )
+    postponed = len( sbList ) - len( toPurge )
+    if postponed:
+      gLogger.info( "Postponing the purge of %s sandboxes still being copied to the external SE" % postponed )
+    return self.__deleteSandboxes( toPurge ), postponed
+
+  def __deleteSandboxes( self, sbList ):
+    """ Delete a batch of sandboxes from their backends in parallel and then from the DB.
+        Returns the ids of the deleted sandboxes
+    """
+    deleted = []
+    toDelete = []
+    delayedExternal = {}
+    for sbId, SEName, SEPFN in sbList:
+      if SEName != self.__localSEName and self.getCSOption( "DelayedExternalDeletion", True ):
+        delayedExternal[ sbId ] = ( SEName, SEPFN )
+      else:
+        toDelete.append( ( sbId, SEName, SEPFN ) )
+
+    if delayedExternal:
+      result = self.__setDeletionRequest( delayedExternal.values() )
+      if result[ 'OK' ]:
+        deleted.extend( delayedExternal.keys() )
+      else:
+        gLogger.error( "Cannot set deletion request", result[ 'Message' ] )
+
+    if toDelete:
+      results = {}
+      finished = threading.Semaphore( 0 )
+      def done( threadedJob, result ):
+        results[ threadedJob.jobId() ] = result
+        finished.release()
+      def failed( threadedJob, exceptionInfo ):
+        results[ threadedJob.jobId() ] = S_ERROR( str( exceptionInfo[1] ) )
+        finished.release()
+      for sbId, SEName, SEPFN in toDelete:
+        gSBDeletionPool.generateJobAndQueueIt( self.__deleteSandboxFromBackend, args = ( SEName, SEPFN ),
+                                               sTJId = sbId, oCallback = done, oExceptionCallback = failed )
+      for i in range( len( toDelete ) ):
+        finished.acquire()
+      for sbId, result in results.items():
+        if result[ 'OK' ]:
+          deleted.append( sbId )
+        else:
+          gLogger.error( "Cannot delete sandbox from backend", result[ 'Message' ] )
+
+    if deleted:
+      result = sandboxDB.deleteSandboxes( deleted )
+      if not result[ 'OK' ]:
+        gLogger.error( "Cannot delete sandboxes from DB", result[ 'Message' ] )
+        return []
+    return deleted
 
   def __deleteSandboxFromBackend( self, SEName, SEPFN ):
     gLogger.info( "Purging sandbox" "SB:%s|%s" % ( SEName, SEPFN ) )
@@ -436,40 +829,30 @@ class SandboxStoreHandler( RequestHandler ):
         os.unlink( hdPath )
       except Exception, e:
         gLogger.error( "Cannot delete local sandbox", "%s : %s" % ( hdPath, str( e ) ) )
-      while hdPath:
-        hdPath = os.path.dirname( hdPath )
-        gLogger.info( "Checking if dir %s is empty" % hdPath )
-        if not os.path.isdir( hdPath ):
-          break
-        if len( os.listdir( hdPath ) ) > 0:
-          break
-        gLogger.info( "Trying to clean dir %s" % hdPath )
-        #Empty dir!
-        try:
-          os.rmdir( hdPath )
-        except Exception, e:
-          gLogger.error( "Cannot clean empty directory", "%s : %s" % ( hdPath, str( e ) ) )
-          break
+      self.__cleanEmptyDirs( hdPath )
     return S_OK()
 
-  def __deleteSandboxFromExternalBackend( self, SEName, SEPFN ):
-    if self.getCSOption( "DelayedExternalDeletion", True ):
-      gLogger.info( "Setting deletion request" )
+  def __cleanEmptyDirs( self, hdPath ):
+    """ Remove the directories left empty by a deleted sandbox
+    """
+    while hdPath:
+      hdPath = os.path.dirname( hdPath )
+      gLogger.info( "Checking if dir %s is empty" % hdPath )
+      if not os.path.isdir( hdPath ):
+        break
+      if len( os.listdir( hdPath ) ) > 0:
+        break
+      gLogger.info( "Trying to clean dir %s" % hdPath )
+      #Empty dir!
       try:
-        request = RequestContainer()
-        result = request.addSubRequest( { 'Attributes' : { 'Operation' : 'removePhysicalFile',
-                                                           'TargetSE' : SEName,
-                                                           'ExecutionOrder' : 1
-                                                          } },
-                                         'removal' )
-        index = result['Value']
-        fileDict = { 'PFN' : SEPFN, 'Status' : 'Waiting' }
-        request.setSubRequestFiles( index, 'removal', [ fileDict ] )
-        return RequestClient().setRequest( "RemoteSBDeletion:%s|%s:%s" % ( SEName, SEPFN, time.time() ),
-                                           request.toXML()[ 'Value' ] )
+        os.rmdir( hdPath )
       except Exception, e:
-        gLogger.exception( "Exception while setting deletion request" )
-        return S_ERROR( "Cannot set deletion request: %s" % str( e ) )
+        gLogger.error( "Cannot clean empty directory", "%s : %s" % ( hdPath, str( e ) ) )
+        break
+
+  def __deleteSandboxFromExternalBackend( self, SEName, SEPFN ):
+    if self.getCSOption( "DelayedExternalDeletion", True ):
+      return self.__setDeletionRequest( [ ( SEName, SEPFN ) ] )
     else:
       gLogger.info( "Deleting external Sandbox" )
       try:
@@ -478,3 +861,31 @@ class SandboxStoreHandler( RequestHandler ):
       except Exception, e:
         gLogger.exception( "RM raised an exception while trying to delete a remote sandbox" )
         return S_ERROR( "RM raised an exception while trying to delete a remote sandbox" )
+
+  def __setDeletionRequest( self, sbList ):
+    """ Set a single request removing a list of ( SEName, SEPFN ) sandboxes,
+        with one subrequest per SE
+    """
+    gLogger.info( "Setting deletion request for %s sandboxes" % len( sbList ) )
+    seDict = {}
+    for SEName, SEPFN in sbList:
+      seDict.setdefault( SEName, [] ).append( SEPFN )
+    try:
+      request = RequestContainer()
+      for SEName in seDict:
+        result = request.addSubRequest( { 'Attributes' : { 'Operation' : 'removePhysicalFile',
+                                                           'TargetSE' : SEName,
+                                                           'ExecutionOrder' : 1
+                                                          } },
+                                         'removal' )
+        index = result['Value']
+        fileList = [ { 'PFN' : SEPFN, 'Status' : 'Waiting' } for SEPFN in seDict[ SEName ] ]
+        request.setSubRequestFiles( index, 'removal', fileList )
+      if len( sbList ) == 1:
+        requestName = "RemoteSBDeletion:%s|%s:%s" % ( sbList[0][0], sbList[0][1], time.time() )
+      else:
+        requestName = "RemoteSBDeletion:%s:%s" % ( len( sbList ), time.time() )
+      return RequestClient().setRequest( requestName, request.toXML()[ 'Value' ] )
+    except Exception, e:
+      gLogger.exception( "Exception while setting deletion request" )
+      return S_ERROR( "Cannot set deletion request: %s" % str( e ) )
@@ -0,0 +1,87 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Compact storage of the heart beat series of the jobs
+
+    The points of a series ( a dynamic heart beat parameter of a job ) are
+    packed as binary ( seconds since 2K, value ) pairs, 12 bytes a point, so
+    that a series is a single BLOB appended to at every heart beat instead of
+    a row per point.
+
+    When a series gets too long the old points are downsampled: the most
+    recent points are kept as they are and the rest are averaged in time
+    buckets, halving their number. Repeated downsampling makes the old part
+    of the series coarser and coarser while the recent part keeps the full
+    resolution.
+"""
+
+__RCSID__ = "$Id$"
+
+import calendar
+import struct
+from DIRAC import Time
+
+POINT_FORMAT = '!Id'
+POINT_SIZE = struct.calcsize( POINT_FORMAT )
+DEFAULT_MAX_POINTS = 1000
+DEFAULT_RECENT_POINTS = 100
+EPOCH_2K = calendar.timegm( ( 2000, 1, 1, 0, 0, 0 ) )
+
+def toSeriesTime( heartBeatTime ):
+  """ Seconds since 2K of a datetime or of a date string
+  """
+  if type( heartBeatTime ) in ( type( '' ), type( u'' ) ):
+    heartBeatTime = Time.fromString( heartBeatTime )
+  return int( Time.to2K( heartBeatTime ) )
+
+def fromSeriesTime( seriesTime ):
+  return Time.from2K( seriesTime )
+
+def toEpoch( seriesTime ):
+  """ Seconds since the epoch, for plotting
+  """
+  return int( seriesTime ) + EPOCH_2K
+
+def packPoints( points ):
+  """ Pack a list of ( seriesTime, value ) points
+  """
+  return ''.join( [ struct.pack( POINT_FORMAT, int( seriesTime ), float( value ) )
+                    for seriesTime, value in points ] )
+
+def unpackPoints( data ):
+  """ Unpack the points of a series sorted by time, a trailing incomplete
+      point is ignored
+  """
+  points = []
+  for offset in range( 0, len( data ) - POINT_SIZE + 1, POINT_SIZE ):
+    points.append( struct.unpack( POINT_FORMAT, data[ offset:offset + POINT_SIZE ] ) )
+  points.sort()
+  return points
+
+def downsample( points, maxPoints = DEFAULT_MAX_POINTS, recentPoints = DEFAULT_RECENT_POINTS ):
+  """ Reduce a series sorted by time to at most maxPoints, keeping the last
+      recentPoints untouched and averaging the older ones in time buckets
+  """
+  if len( points ) <= maxPoints:
+    return points
+  recentPoints = min( recentPoints, maxPoints / 2 )
+  if recentPoints:
+    oldPoints = points[ :-recentPoints ]
+    newPoints = points[ -recentPoints: ]
+  else:
+    oldPoints = points
+    newPoints = []
+  numBuckets = max( 1, min( len( oldPoints ) / 2, ( maxPoints - len( newPoints ) ) / 2 ) )
+  startTime = oldPoints[0][0]
+  span = oldPoints[-1][0] - startTime + 1
+  buckets = {}
+  for seriesTime, value in oldPoints:
+    bucket = min( numBuckets - 1, ( seriesTime - startTime ) * numBuckets / span )
+    buckets.setdefault( bucket, [] ).append( ( seriesTime, value ) )
+  downsampled = []
+  for bucket in sorted( buckets ):
+    bucketPoints = buckets[ bucket ]
+    numPoints = len( bucketPoints )
+    downsampled.append( ( sum( [ point[0] for point in bucketPoints ] ) / numPoints,
+                          sum( [ point[1] for point in bucketPoints ] ) / numPoints ) )
+  return downsampled + newPoints
@@ -0,0 +1,193 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Reservoir of pre-claimed jobs used by the Matcher
+
+    Instead of racing with the other Matchers on the tq_Jobs rows for every
+    match, small batches of jobs of the requested task queues are leased
+    in one transaction ( TaskQueueDB.leaseJobs ) and handed out from memory.
+    Handing out a leased job only deletes its own lease row, which nobody
+    else is after.
+
+    The more a task queue is requested the bigger the batches leased for
+    it, up to maxBatchSize. Leases last leaseTime secs. Jobs not handed out
+    in time are given back to their task queue by expireLeases, which also
+    gives back the expired leases of Matchers that are gone.
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import socket
+import threading
+import time
+from DIRAC import gLogger, S_OK, S_ERROR
+
+#Leased jobs are not handed out when their lease is about to expire
+LEASE_MARGIN = 10
+MAX_MATCH_RETRY = 3
+
+class JobReservoir:
+
+  def __init__( self, tqDB, leaseTime = 120, maxBatchSize = 10, demandWindow = 60 ):
+    self.__tqDB = tqDB
+    self.__leaseTime = max( leaseTime, LEASE_MARGIN * 2 )
+    self.__maxBatchSize = max( 1, maxBatchSize )
+    self.__demandWindow = demandWindow
+    self.__leaseOwner = "%s:%s" % ( socket.getfqdn()[ :100 ], os.getpid() )
+    self.__batchCounter = 0
+    self.__lock = threading.Lock()
+    #tqId -> [ [ jobId, leaseToken, expiry ], ... ] in order of preference
+    self.__reservoir = {}
+    #tqId -> [ windowStart, requests ]
+    self.__demand = {}
+    #( jobId, leaseToken ) of jobs not handed out in time
+    self.__expired = []
+    self.__stats = { 'batches' : 0, 'leased' : 0, 'handedOut' : 0, 'lostLeases' : 0,
+                     'released' : 0, 'returnedExpired' : 0 }
+    self.log = gLogger.getSubLogger( "JobReservoir" )
+
+  def getStats( self ):
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'reserved' ] = sum( [ len( jobs ) for jobs in self.__reservoir.values() ] )
+      stats[ 'taskQueues' ] = len( [ tqId for tqId in self.__reservoir if self.__reservoir[ tqId ] ] )
+    finally:
+      self.__lock.release()
+    return stats
+
+  def __getBatchSize( self, tqId, now ):
+    """ Number of requests of the TQ in the last demandWindow secs. Must be called holding the lock """
+    windowStart, requests = self.__demand.get( tqId, ( now, 0 ) )
+    if now - windowStart > self.__demandWindow:
+      windowStart, requests = now, 0
+    self.__demand[ tqId ] = ( windowStart, requests + 1 )
+    return max( 1, min( self.__maxBatchSize, requests ) )
+
+  def __popReserved( self, tqId, now ):
+    """ Next reserved job of the TQ that can be handed out. Must be called holding the lock """
+    jobs = self.__reservoir.get( tqId )
+    while jobs:
+      jobId, leaseToken, expiry = jobs.pop( 0 )
+      if expiry - LEASE_MARGIN > now:
+        return jobId, leaseToken
+      self.__expired.append( ( jobId, leaseToken ) )
+    return False
+
+  def __newLeaseToken( self ):
+    """ Must be called holding the lock """
+    self.__batchCounter += 1
+    return "%s:%s" % ( self.__leaseOwner, self.__batchCounter )
+
+  def getJob( self, tqId, tqOwnerDN, tqOwnerGroup ):
+    """
+    Hand out a job of the TQ, leasing a new batch if there's none reserved
+    Return S_OK( jobId/False )
+    """
+    self.__lock.acquire()
+    try:
+      batchSize = self.__getBatchSize( tqId, time.time() )
+    finally:
+      self.__lock.release()
+    leased = False
+    while True:
+      now = time.time()
+      self.__lock.acquire()
+      try:
+        jobData = self.__popReserved( tqId, now )
+        if not jobData and not leased:
+          leaseToken = self.__newLeaseToken()
+      finally:
+        self.__lock.release()
+      if jobData:
+        jobId, jobLeaseToken = jobData
+        result = self.__tqDB.consumeJobLease( jobId, jobLeaseToken, tqId, tqOwnerDN, tqOwnerGroup )
+        if not result[ 'OK' ]:
+          return result
+        if result[ 'Value' ]:
+          self.__stats[ 'handedOut' ] += 1
+          return S_OK( jobId )
+        #Deleted or returned meanwhile
+        self.__stats[ 'lostLeases' ] += 1
+        continue
+      if leased:
+        return S_OK( False )
+      leased = True
+      result = self.__tqDB.leaseJobs( tqId, batchSize, leaseToken, self.__leaseTime )
+      if not result[ 'OK' ]:
+        return result
+      jobList = result[ 'Value' ]
+      if not jobList:
+        return S_OK( False )
+      expiry = now + self.__leaseTime
+      self.__lock.acquire()
+      try:
+        self.__stats[ 'batches' ] += 1
+        self.__stats[ 'leased' ] += len( jobList )
+        self.__reservoir.setdefault( tqId, [] ).extend( [ [ jobId, leaseToken, expiry ]
+                                                          for jobId, priority, realPriority in jobList ] )
+      finally:
+        self.__lock.release()
+
+  def matchAndGetJob( self, tqMatchDict, numQueuesPerTry = 10, negativeCond = {} ):
+    """
+    Same as TaskQueueDB.matchAndGetJob but taking the jobs from the reservoir
+    """
+    for matchTry in range( MAX_MATCH_RETRY ):
+      result = self.__tqDB.matchAndGetTaskQueue( tqMatchDict, numQueuesToGet = numQueuesPerTry,
+                                                 negativeCond = negativeCond )
+      if not result[ 'OK' ]:
+        return result
+      tqList = result[ 'Value' ]
+      if not tqList:
+        return S_OK( { 'matchFound' : False, 'tqMatch' : tqMatchDict } )
+      for tqId, tqOwnerDN, tqOwnerGroup in tqList:
+        result = self.getJob( tqId, tqOwnerDN, tqOwnerGroup )
+        if not result[ 'OK' ]:
+          return result
+        if result[ 'Value' ]:
+          return S_OK( { 'matchFound' : True, 'jobId' : result[ 'Value' ], 'taskQueueId' : tqId,
+                         'tqMatch' : tqMatchDict } )
+    return S_ERROR( "Could not find a match after %s match retries" % MAX_MATCH_RETRY )
+
+  def expireLeases( self ):
+    """
+    Give back the jobs not handed out in time and the expired leases of everybody
+    """
+    now = time.time()
+    self.__lock.acquire()
+    try:
+      for tqId in self.__reservoir.keys():
+        jobs = self.__reservoir[ tqId ]
+        self.__expired.extend( [ ( jobId, leaseToken ) for jobId, leaseToken, expiry in jobs
+                                 if expiry - LEASE_MARGIN <= now ] )
+        jobs = [ job for job in jobs if job[2] - LEASE_MARGIN > now ]
+        if jobs:
+          self.__reservoir[ tqId ] = jobs
+        else:
+          del( self.__reservoir[ tqId ] )
+      for tqId in self.__demand.keys():
+        if now - self.__demand[ tqId ][0] > self.__demandWindow:
+          del( self.__demand[ tqId ] )
+      expired = self.__expired
+      self.__expired = []
+    finally:
+      self.__lock.release()
+    tokenJobs = {}
+    for jobId, leaseToken in expired:
+      tokenJobs.setdefault( leaseToken, [] ).append( jobId )
+    for leaseToken in tokenJobs:
+      result = self.__tqDB.releaseJobLeases( tokenJobs[ leaseToken ], leaseToken )
+      if not result[ 'OK' ]:
+        self.log.error( "Cannot release leased jobs", result[ 'Message' ] )
+        continue
+      self.__stats[ 'released' ] += result[ 'Value' ]
+    result = self.__tqDB.returnExpiredJobLeases()
+    if not result[ 'OK' ]:
+      self.log.error( "Cannot return expired leased jobs", result[ 'Message' ] )
+      return result
+    self.__stats[ 'returnedExpired' ] += result[ 'Value' ]
+    if result[ 'Value' ]:
+      self.log.info( "Returned %s jobs with expired leases to their task queues" % result[ 'Value' ] )
+    return S_OK()
@@ -0,0 +1,354 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Write-behind buffer for the job status and heart beat updates received
+    by the JobStateUpdate service
+
+    The updates are kept per job and written in batches every flushPeriod
+    secs, or as soon as maxPendingJobs jobs have pending updates:
+
+      - The attributes of a job are coalesced, the last value wins, and go
+        into one UPDATE per job, shared by the jobs with the same updates,
+        all of them in one transaction. StartExecTime and EndExecTime keep
+        the first value, like setStartExecTime and setEndExecTime.
+      - The static heart beat data is merged into the job parameters, the
+        dynamic data is kept with the time it was received. Both are written
+        with multi-row inserts.
+      - All the logging records are kept and written with one multi-row
+        insert, with the time the update was received.
+
+    The updates of a job are written in the order they were received: only
+    one flush runs at a time and the updates of a failed flush are put back
+    in front of the newer ones. Updates for jobs that do not exist are
+    dropped at flush time. The buffered updates are lost if the service
+    stops before flushing them.
+"""
+
+__RCSID__ = "$Id$"
+
+import threading
+import time
+from DIRAC import gLogger, S_OK, Time
+
+JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
+
+class JobStateUpdateBuffer:
+
+  def __init__( self, jobDB, logDB, flushPeriod = 2, maxPendingJobs = 1000 ):
+    self.__jobDB = jobDB
+    self.__logDB = logDB
+    self.__flushPeriod = flushPeriod
+    self.__maxPendingJobs = maxPendingJobs
+    #Protects the pending updates
+    self.__lock = threading.Lock()
+    #Only one flush at a time, to keep the order of the updates of each job
+    self.__flushLock = threading.Lock()
+    self.__flushEvent = threading.Event()
+    #jobID -> pending updates
+    self.__pending = {}
+    self.__stats = { 'updates' : 0, 'heartBeats' : 0, 'flushes' : 0, 'flushFailures' : 0,
+                     'flushedJobs' : 0, 'droppedJobs' : 0, 'flushTime' : 0.0, 'maxFlushTime' : 0.0 }
+    self.__flusher = False
+    self.log = gLogger.getSubLogger( "JobStateUpdateBuffer" )
+
+  def start( self ):
+    """ Start the thread flushing the updates
+    """
+    if not self.__flusher:
+      self.__flusher = threading.Thread( target = self.__flushLoop )
+      self.__flusher.setDaemon( True )
+      self.__flusher.start()
+    return S_OK()
+
+  def __flushLoop( self ):
+    while True:
+      self.__flushEvent.wait( self.__flushPeriod )
+      self.__flushEvent.clear()
+      try:
+        self.flush()
+      except Exception, e:
+        self.log.exception( "Exception while flushing the job updates", str( e ) )
+
+  def getStats( self ):
+    """ Counters of the buffer. The coalescing ratio is the number of updates
+        received per job written
+    """
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'pendingJobs' ] = len( self.__pending )
+    finally:
+      self.__lock.release()
+    if stats[ 'flushedJobs' ]:
+      stats[ 'coalescingRatio' ] = float( stats[ 'updates' ] ) / stats[ 'flushedJobs' ]
+    else:
+      stats[ 'coalescingRatio' ] = 0.0
+    return stats
+
+  def __newEntry( self ):
+    return { 'attrs' : {}, 'update' : False, 'restoreRunning' : False,
+             'records' : [], 'parameters' : {}, 'heartBeats' : [] }
+
+  def __getEntry( self, jobID ):
+    """ Pending updates of a job. Must be called holding the lock """
+    jobID = int( jobID )
+    if jobID not in self.__pending:
+      self.__pending[ jobID ] = self.__newEntry()
+    self.__stats[ 'updates' ] += 1
+    return self.__pending[ jobID ]
+
+  def __checkSize( self ):
+    """ Must be called holding the lock """
+    if len( self.__pending ) >= self.__maxPendingJobs:
+      self.__flushEvent.set()
+
+  def setJobStatus( self, jobID, status, minorStatus, source = 'Unknown', datetime = None ):
+    """ Buffer a status update, like JobStateUpdateHandler.setJobStatus
+    """
+    now = Time.toString()
+    self.__lock.acquire()
+    try:
+      entry = self.__getEntry( jobID )
+      attrs = entry[ 'attrs' ]
+      if status:
+        attrs[ 'Status' ] = status
+        entry[ 'restoreRunning' ] = False
+      if minorStatus:
+        attrs[ 'MinorStatus' ] = minorStatus
+      # Do not update the LastUpdate time stamp if setting the Stalled status
+      if status != 'Stalled':
+        entry[ 'update' ] = True
+      if status in JOB_FINAL_STATES:
+        attrs.setdefault( 'EndExecTime', now )
+      if status == 'Running' and minorStatus == 'Application':
+        attrs.setdefault( 'StartExecTime', now )
+      entry[ 'records' ].append( ( int( jobID ), attrs.get( 'Status', 'idem' ), attrs.get( 'MinorStatus', 'idem' ),
+                                   'idem', datetime or now, source ) )
+      self.__checkSize()
+    finally:
+      self.__lock.release()
+    return S_OK()
+
+  def setJobStatusBulk( self, jobID, statusDict ):
+    """ Buffer the status updates of a job, like JobStateUpdateHandler.setJobStatusBulk
+    """
+    dates = statusDict.keys()
+    dates.sort()
+    status = ""
+    minor = ""
+    application = ""
+    appCounter = ""
+    endDate = ''
+    startDate = ''
+    startFlag = ''
+
+    # Get the last status values
+    for date in dates:
+      if statusDict[date]['Status']:
+        status = statusDict[date]['Status']
+        if status in JOB_FINAL_STATES:
+          endDate = date
+        if status == "Running":
+          startFlag = 'Running'
+      if statusDict[date]['MinorStatus']:
+        minor = statusDict[date]['MinorStatus']
+        if minor == "Application" and startFlag == 'Running':
+          startDate = date
+      if statusDict[date]['ApplicationStatus']:
+        application = statusDict[date]['ApplicationStatus']
+      if 'ApplicationCounter' in statusDict[date] and statusDict[date]['ApplicationCounter']:
+        appCounter = statusDict[date]['ApplicationCounter']
+
+    records = []
+    for date in dates:
+      sDict = statusDict[ date ]
+      recStatus = sDict['Status'] or 'idem'
+      recMinor = sDict['MinorStatus'] or 'idem'
+      recApplication = sDict['ApplicationStatus'] or 'idem'
+      if sDict['ApplicationStatus']:
+        recStatus = "Running"
+        recMinor = "Application"
+      records.append( ( int( jobID ), recStatus, recMinor, recApplication, date, sDict['Source'] ) )
+
+    self.__lock.acquire()
+    try:
+      entry = self.__getEntry( jobID )
+      attrs = entry[ 'attrs' ]
+      if status:
+        attrs[ 'Status' ] = status
+        entry[ 'restoreRunning' ] = False
+      elif attrs.get( 'Status' ) == 'Stalled':
+        attrs[ 'Status' ] = 'Running'
+      elif 'Status' not in attrs:
+        #Stalled jobs go back to Running, resolved at flush time
+        entry[ 'restoreRunning' ] = True
+      if minor:
+        attrs[ 'MinorStatus' ] = minor
+      if application:
+        attrs[ 'ApplicationStatus' ] = application
+      if appCounter:
+        attrs[ 'ApplicationNumStatus' ] = appCounter
+      entry[ 'update' ] = True
+      if endDate:
+        attrs.setdefault( 'EndExecTime', endDate )
+      if startDate:
+        attrs.setdefault( 'StartExecTime', startDate )
+      entry[ 'records' ].extend( records )
+      self.__checkSize()
+    finally:
+      self.__lock.release()
+    return S_OK()
+
+  def sendHeartBeat( self, jobID, dynamicData, staticData ):
+    """ Buffer a heart beat, like JobDB.setHeartBeatData
+    """
+    now = Time.toString()
+    self.__lock.acquire()
+    try:
+      entry = self.__getEntry( jobID )
+      self.__stats[ 'heartBeats' ] += 1
+      entry[ 'attrs' ][ 'HeartBeatTime' ] = now
+      entry[ 'attrs' ][ 'Status' ] = 'Running'
+      entry[ 'restoreRunning' ] = False
+      entry[ 'parameters' ].update( staticData )
+      entry[ 'heartBeats' ].extend( [ ( name, value, now ) for name, value in dynamicData.items() ] )
+      self.__checkSize()
+    finally:
+      self.__lock.release()
+    return S_OK()
+
+  def hasPendingUpdates( self, jobIDs ):
+    self.__lock.acquire()
+    try:
+      for jobID in jobIDs:
+        if int( jobID ) in self.__pending:
+          return True
+      return False
+    finally:
+      self.__lock.release()
+
+  def flushJobs( self, jobIDs ):
+    """ Write the pending updates if any of the jobs has some, so that changes
+        done directly in the DB come after them
+    """
+    if not self.hasPendingUpdates( jobIDs ):
+      return S_OK( 0 )
+    return self.flush()
+
+  def __mergeEntries( self, older, newer ):
+    """ Put the updates of a failed flush in front of the newer ones """
+    merged = self.__newEntry()
+    merged[ 'attrs' ] = dict( older[ 'attrs' ] )
+    for attrName in newer[ 'attrs' ]:
+      if attrName in ( 'StartExecTime', 'EndExecTime' ):
+        merged[ 'attrs' ].setdefault( attrName, newer[ 'attrs' ][ attrName ] )
+      else:
+        merged[ 'attrs' ][ attrName ] = newer[ 'attrs' ][ attrName ]
+    merged[ 'update' ] = older[ 'update' ] or newer[ 'update' ]
+    if 'Status' in newer[ 'attrs' ]:
+      merged[ 'restoreRunning' ] = newer[ 'restoreRunning' ]
+    else:
+      merged[ 'restoreRunning' ] = older[ 'restoreRunning' ] or newer[ 'restoreRunning' ]
+    for key in ( 'records', 'heartBeats' ):
+      merged[ key ] = older[ key ] + newer[ key ]
+    merged[ 'parameters' ] = dict( older[ 'parameters' ] )
+    merged[ 'parameters' ].update( newer[ 'parameters' ] )
+    return merged
+
+  def __requeue( self, pending ):
+    self.__lock.acquire()
+    try:
+      for jobID in pending:
+        if jobID in self.__pending:
+          self.__pending[ jobID ] = self.__mergeEntries( pending[ jobID ], self.__pending[ jobID ] )
+        else:
+          self.__pending[ jobID ] = pending[ jobID ]
+    finally:
+      self.__lock.release()
+
+  def flush( self ):
+    """ Write all the pending updates
+    """
+    self.__flushLock.acquire()
+    try:
+      self.__lock.acquire()
+      try:
+        pending = self.__pending
+        self.__pending = {}
+      finally:
+        self.__lock.release()
+      if not pending:
+        return S_OK( 0 )
+
+      start = time.time()
+      result = self.__write( pending )
+      flushTime = time.time() - start
+      self.__lock.acquire()
+      try:
+        self.__stats[ 'flushes' ] += 1
+        self.__stats[ 'flushTime' ] += flushTime
+        self.__stats[ 'maxFlushTime' ] = max( self.__stats[ 'maxFlushTime' ], flushTime )
+        if result[ 'OK' ]:
+          self.__stats[ 'flushedJobs' ] += result[ 'Value' ]
+          self.__stats[ 'droppedJobs' ] += len( pending ) - result[ 'Value' ]
+        else:
+          self.__stats[ 'flushFailures' ] += 1
+      finally:
+        self.__lock.release()
+      if not result[ 'OK' ]:
+        self.log.error( "Cannot write the job updates, will retry", result[ 'Message' ] )
+        self.__requeue( pending )
+        return result
+      self.log.verbose( "Wrote the updates of %s jobs in %.3f secs" % ( result[ 'Value' ], flushTime ) )
+      return result
+    finally:
+      self.__flushLock.release()
+
+  def __write( self, pending ):
+    """ Write the updates of the jobs, returns the number of jobs written.
+        Nothing is written if the jobs cannot be checked or their attributes
+        cannot be set, so that the updates can be retried
+    """
+    result = self.__jobDB.getAttributesForJobList( pending.keys(), [ 'Status' ] )
+    if not result[ 'OK' ]:
+      return result
+    jobStatus = result[ 'Value' ]
+
+    updateList = []
+    parameterList = []
+    heartBeatList = []
+    records = []
+    for jobID in pending:
+      if jobID not in jobStatus:
+        self.log.warn( "Dropping the updates of a job that does not exist", "%s" % jobID )
+        continue
+      entry = pending[ jobID ]
+      attrs = entry[ 'attrs' ]
+      if entry[ 'restoreRunning' ] and 'Status' not in attrs and jobStatus[ jobID ][ 'Status' ] == 'Stalled':
+        attrs = dict( attrs )
+        attrs[ 'Status' ] = 'Running'
+      if attrs or entry[ 'update' ]:
+        updateList.append( ( jobID, attrs, entry[ 'update' ] ) )
+      parameterList.extend( [ ( jobID, name, value ) for name, value in entry[ 'parameters' ].items() ] )
+      heartBeatList.extend( [ ( jobID, name, value, hbTime ) for name, value, hbTime in entry[ 'heartBeats' ] ] )
+      records.extend( entry[ 'records' ] )
+
+    result = self.__jobDB.setJobAttributesBulk( updateList )
+    if not result[ 'OK' ]:
+      return result
+
+    #The attributes are set, so the rest is not retried to not duplicate it
+    if parameterList:
+      result = self.__jobDB.setJobParametersBulk( parameterList )
+      if not result[ 'OK' ]:
+        self.log.error( "Cannot set the heart beat parameters", result[ 'Message' ] )
+    if heartBeatList:
+      result = self.__jobDB.addHeartBeatRecords( heartBeatList )
+      if not result[ 'OK' ]:
+        self.log.error( "Cannot add the heart beat records", result[ 'Message' ] )
+    if records:
+      result = self.__logDB.addLoggingRecords( records )
+      if not result[ 'OK' ]:
+        self.log.error( "Cannot add the logging records", result[ 'Message' ] )
+
+    return S_OK( len( pending ) - len( [ jobID for jobID in pending if jobID not in jobStatus ] ) )
@@ -0,0 +1,268 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Counters of the jobs running at the sites with running limits, used by
+    the Limiter of the Matcher to build the negative conditions
+
+    The jobs of a site are loaded from the JobDB the first time the site is
+    asked for. Then they are kept up to date with the jobs whose
+    LastUpdateTime changed since the last update, instead of recounting
+    them for every match request. The jobs matched by the Matcher are
+    added right away. Everything is reloaded every fullRefreshPeriod secs
+    to fix what the incremental updates cannot see, like status changes
+    that do not touch LastUpdateTime.
+
+    The negative condition of a site is computed once and kept until the
+    counters of the site change. Sites not updated for maxAge secs are
+    stale and get loaded again when asked for.
+"""
+
+__RCSID__ = "$Id$"
+
+import threading
+import time
+from DIRAC import gLogger, S_OK
+
+RUNNING_STATES = [ 'Running', 'Matched', 'Stalled' ]
+
+class RunningJobsCache:
+
+  def __init__( self, jobDB, fullRefreshPeriod = 600, maxAge = 60 ):
+    self.__jobDB = jobDB
+    self.__fullRefreshPeriod = fullRefreshPeriod
+    self.__maxAge = maxAge
+    self.__lock = threading.Lock()
+    #site -> [ attNames ]
+    self.__siteAttNames = {}
+    #site -> { jobId : { attName : attValue } }
+    self.__siteJobs = {}
+    #site -> { attName : { attValue : numJobs } }
+    self.__counters = {}
+    #jobId -> site
+    self.__jobSite = {}
+    #site -> time of the last load or update
+    self.__siteTime = {}
+    #site -> time of the last request
+    self.__siteAccess = {}
+    #site -> ( limitsDict, negCond )
+    self.__conditions = {}
+    #DB time of the last update, to get the jobs updated after it
+    self.__lastDBTime = False
+    self.__lastUpdate = 0
+    self.__lastFullRefresh = time.time()
+    self.__stats = { 'hits' : 0, 'misses' : 0, 'stale' : 0, 'updates' : 0, 'updateFailures' : 0,
+                     'fullRefreshes' : 0, 'jobChanges' : 0 }
+    self.log = gLogger.getSubLogger( "RunningJobsCache" )
+
+  def getStats( self ):
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'sites' ] = len( self.__siteJobs )
+      stats[ 'jobs' ] = len( self.__jobSite )
+      if self.__lastUpdate:
+        stats[ 'age' ] = time.time() - self.__lastUpdate
+      else:
+        stats[ 'age' ] = 0
+    finally:
+      self.__lock.release()
+    return stats
+
+  def __addJob( self, site, jobId, atts ):
+    """ Must be called holding the lock """
+    if self.__jobSite.get( jobId ) == site:
+      if self.__siteJobs[ site ][ jobId ] == atts:
+        return
+      self.__removeJob( jobId )
+    elif jobId in self.__jobSite:
+      self.__removeJob( jobId )
+    self.__siteJobs[ site ][ jobId ] = atts
+    self.__jobSite[ jobId ] = site
+    counters = self.__counters[ site ]
+    for attName in atts:
+      attCounters = counters.setdefault( attName, {} )
+      attCounters[ atts[ attName ] ] = attCounters.get( atts[ attName ], 0 ) + 1
+    self.__conditions.pop( site, None )
+    self.__stats[ 'jobChanges' ] += 1
+
+  def __removeJob( self, jobId ):
+    """ Must be called holding the lock """
+    site = self.__jobSite.pop( jobId, None )
+    if not site:
+      return
+    atts = self.__siteJobs[ site ].pop( jobId )
+    counters = self.__counters[ site ]
+    for attName in atts:
+      attCounters = counters[ attName ]
+      attCounters[ atts[ attName ] ] -= 1
+      if not attCounters[ atts[ attName ] ]:
+        del( attCounters[ atts[ attName ] ] )
+    self.__conditions.pop( site, None )
+    self.__stats[ 'jobChanges' ] += 1
+
+  def __setSiteJobs( self, site, attNames, jobs, loadTime ):
+    """ Replace the jobs of a site. Must be called holding the lock """
+    for jobId in self.__siteJobs.get( site, {} ).keys():
+      self.__removeJob( jobId )
+    self.__siteAttNames[ site ] = attNames
+    self.__siteJobs[ site ] = {}
+    self.__counters[ site ] = {}
+    self.__conditions.pop( site, None )
+    for jobId in jobs:
+      self.__addJob( site, jobId, dict( [ ( attName, jobs[ jobId ][ attName ] ) for attName in attNames ] ) )
+    self.__siteTime[ site ] = loadTime
+
+  def __loadSites( self, siteAttNames ):
+    """ Load the running jobs of the sites from the JobDB """
+    attNames = []
+    for site in siteAttNames:
+      attNames.extend( [ attName for attName in siteAttNames[ site ] if attName not in attNames ] )
+    loadTime = time.time()
+    result = self.__jobDB.getJobAttributesUpdatedSince( [ 'Site' ] + attNames,
+                                                       { 'Site' : siteAttNames.keys(),
+                                                         'Status' : RUNNING_STATES } )
+    if not result[ 'OK' ]:
+      return result
+    dbTime, jobs = result[ 'Value' ]
+    siteJobs = dict( [ ( site, {} ) for site in siteAttNames ] )
+    for jobId in jobs:
+      siteJobs[ jobs[ jobId ][ 'Site' ] ][ jobId ] = jobs[ jobId ]
+    self.__lock.acquire()
+    try:
+      for site in siteAttNames:
+        self.__setSiteJobs( site, siteAttNames[ site ], siteJobs[ site ], loadTime )
+      if not self.__lastDBTime:
+        self.__lastDBTime = dbTime
+    finally:
+      self.__lock.release()
+    return S_OK()
+
+  def getRunningCondition( self, siteName, limitsDict ):
+    """ Negative condition of the site for the given running limits, like
+        { 'JobType' : [ 'Merge' ] } for limitsDict { 'JobType' : { 'Merge' : 20 } }
+    """
+    now = time.time()
+    attNames = sorted( limitsDict )
+    self.__lock.acquire()
+    try:
+      self.__siteAccess[ siteName ] = now
+      loaded = siteName in self.__siteJobs and set( attNames ).issubset( self.__siteAttNames[ siteName ] )
+      fresh = loaded and now - self.__siteTime[ siteName ] < self.__maxAge
+      if fresh and siteName in self.__conditions and self.__conditions[ siteName ][0] == limitsDict:
+        self.__stats[ 'hits' ] += 1
+        return S_OK( self.__copyCond( self.__conditions[ siteName ][1] ) )
+      if loaded and not fresh:
+        self.__stats[ 'stale' ] += 1
+      else:
+        self.__stats[ 'misses' ] += 1
+      if siteName in self.__siteAttNames:
+        attNames = sorted( set( attNames ).union( self.__siteAttNames[ siteName ] ) )
+    finally:
+      self.__lock.release()
+    if not fresh:
+      result = self.__loadSites( { siteName : attNames } )
+      if not result[ 'OK' ]:
+        return result
+    self.__lock.acquire()
+    try:
+      counters = self.__counters[ siteName ]
+      negCond = {}
+      for attName in limitsDict:
+        for attValue in limitsDict[ attName ]:
+          limit = limitsDict[ attName ][ attValue ]
+          running = counters.get( attName, {} ).get( attValue, 0 )
+          if running >= limit:
+            gLogger.verbose( 'Job Limit imposed at %s on %s/%s=%d,'
+                             ' %d jobs already deployed' % ( siteName, attName, attValue, limit, running ) )
+            negCond.setdefault( attName, [] ).append( attValue )
+      self.__conditions[ siteName ] = ( limitsDict, negCond )
+    finally:
+      self.__lock.release()
+    return S_OK( self.__copyCond( negCond ) )
+
+  def __copyCond( self, negCond ):
+    return dict( [ ( attName, list( negCond[ attName ] ) ) for attName in negCond ] )
+
+  def jobMatched( self, siteName, jobId, atts ):
+    """ Count a job just matched to the site, atts has to contain the
+        attributes of the job the site is limited on
+    """
+    self.__lock.acquire()
+    try:
+      if siteName not in self.__siteJobs:
+        return
+      attNames = self.__siteAttNames[ siteName ]
+      if not set( attNames ).issubset( atts ):
+        return
+      self.__addJob( siteName, jobId, dict( [ ( attName, atts[ attName ] ) for attName in attNames ] ) )
+    finally:
+      self.__lock.release()
+
+  def update( self ):
+    """ Apply the changes of the jobs updated since the last update, and reload
+        everything every fullRefreshPeriod secs
+    """
+    now = time.time()
+    self.__lock.acquire()
+    try:
+      if now - self.__lastFullRefresh > self.__fullRefreshPeriod:
+        #Forget the sites not asked for since the last full refresh
+        for site in self.__siteJobs.keys():
+          if self.__siteAccess.get( site, 0 ) < self.__lastFullRefresh:
+            self.__setSiteJobs( site, [], {}, now )
+            for siteDict in ( self.__siteJobs, self.__counters, self.__siteAttNames, self.__siteTime ):
+              del( siteDict[ site ] )
+        fullRefresh = True
+      else:
+        fullRefresh = False
+      siteAttNames = dict( [ ( site, self.__siteAttNames[ site ] ) for site in self.__siteJobs ] )
+      lastDBTime = self.__lastDBTime
+    finally:
+      self.__lock.release()
+    if not siteAttNames:
+      self.__lastUpdate = now
+      self.__lastFullRefresh = now
+      return S_OK()
+    if fullRefresh or not lastDBTime:
+      result = self.__loadSites( siteAttNames )
+      if not result[ 'OK' ]:
+        self.__stats[ 'updateFailures' ] += 1
+        self.log.error( "Cannot reload the running jobs", result[ 'Message' ] )
+        return result
+      self.__stats[ 'fullRefreshes' ] += 1
+      self.__lastFullRefresh = now
+      self.__lastUpdate = now
+      return S_OK()
+
+    attNames = []
+    for site in siteAttNames:
+      attNames.extend( [ attName for attName in siteAttNames[ site ] if attName not in attNames ] )
+    result = self.__jobDB.getJobAttributesUpdatedSince( [ 'Site', 'Status' ] + attNames, newer = lastDBTime )
+    if not result[ 'OK' ]:
+      self.__stats[ 'updateFailures' ] += 1
+      self.log.error( "Cannot get the updated jobs", result[ 'Message' ] )
+      return result
+    dbTime, jobs = result[ 'Value' ]
+    self.__lock.acquire()
+    try:
+      for jobId in jobs:
+        atts = jobs[ jobId ]
+        site = atts[ 'Site' ]
+        #Sites loaded meanwhile may need more attributes, they are up to date anyway
+        if site in self.__siteJobs and not set( self.__siteAttNames[ site ] ).issubset( atts ):
+          continue
+        if atts[ 'Status' ] in RUNNING_STATES and site in self.__siteJobs:
+          self.__addJob( site, jobId, dict( [ ( attName, atts[ attName ] )
+                                              for attName in self.__siteAttNames[ site ] ] ) )
+        else:
+          self.__removeJob( jobId )
+      for site in siteAttNames:
+        if site in self.__siteTime:
+          self.__siteTime[ site ] = max( self.__siteTime[ site ], now )
+      self.__lastDBTime = dbTime
+      self.__stats[ 'updates' ] += 1
+    finally:
+      self.__lock.release()
+    self.__lastUpdate = now
+    self.log.verbose( "%s jobs updated since %s" % ( len( jobs ), lastDBTime ) )
+    return S_OK()
@@ -0,0 +1,103 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Calculation of the priorities of the task queues from the group shares
+
+    The same calculation TaskQueueDB used to do owner by owner with a few
+    queries each, done for all the task queues at once over their state
+    loaded in bulk:
+
+      - The share of a group is split evenly among the owners of its TQs,
+        unless the group has job sharing, then the group is a single owner.
+        The shares corrector can correct the owner shares.
+      - The share of an owner is split among its TQs with jobs in proportion
+        to the average real priority of their jobs. With background TQs
+        allowed, TQs averaging 0.1 or less get the minimum share.
+      - Enabled TQs of the same owner differing only in the ignored fields
+        ( Sites, BannedSites ) all get the sum of their priorities.
+
+    Only the TQs whose priority changed are returned, so that only those
+    have to be updated.
+"""
+
+__RCSID__ = "$Id$"
+
+DEFAULT_GROUP_SHARE = 1000
+TQ_MIN_SHARE = 0.001
+#Priorities are stored as FLOAT, written with 4 decimals by TaskQueueDB
+PRIORITY_DIGITS = 4
+PRIORITY_TOLERANCE = 0.00001
+
+def _ownerPriorities( tqIds, tqData, share, allowBgTQs ):
+  """ Priorities of the TQs of an owner with the given share """
+  tqPrios = {}
+  for tqId in tqIds:
+    numJobs = tqData[ tqId ][4]
+    if numJobs:
+      tqPrios[ tqId ] = tqData[ tqId ][3] / numJobs
+  if not tqPrios:
+    return tqPrios
+  totalPrio = 0.0
+  for tqId in tqPrios:
+    if tqPrios[ tqId ] > 0.1 or not allowBgTQs:
+      totalPrio += tqPrios[ tqId ]
+  for tqId in tqPrios:
+    if totalPrio and ( tqPrios[ tqId ] > 0.1 or not allowBgTQs ):
+      prio = ( share / totalPrio ) * tqPrios[ tqId ]
+    else:
+      prio = TQ_MIN_SHARE
+    tqPrios[ tqId ] = max( prio, TQ_MIN_SHARE )
+  #TQs that only differ in the ignored fields share the sum
+  tqGroups = {}
+  for tqId in tqPrios:
+    groupKey = tqData[ tqId ][5]
+    if groupKey is not None:
+      tqGroups.setdefault( groupKey, [] ).append( tqId )
+  for tqGroup in tqGroups.values():
+    if len( tqGroup ) < 2:
+      continue
+    totalPrio = sum( [ tqPrios[ tqId ] for tqId in tqGroup ] )
+    for tqId in tqGroup:
+      tqPrios[ tqId ] = totalPrio
+  return tqPrios
+
+def calculateTQPriorities( tqData, groupShares, jobSharingGroups = (), bgAllowedGroups = (),
+                           correctShares = None ):
+  """ Calculate the priorities of the TQs
+
+      tqData is { tqId : ( ownerDN, ownerGroup, priority, sumOfJobsRealPriority, numJobs, groupKey ) }
+      with groupKey being the TQ definition without the ignored fields for the
+      enabled TQs, None for the rest. correctShares( ownerShares, group ) is
+      the shares corrector, if enabled.
+
+      Returns { tqId : newPriority } of the TQs whose priority changed
+  """
+  groupOwners = {}
+  for tqId in tqData:
+    ownerDN, ownerGroup = tqData[ tqId ][ :2 ]
+    groupOwners.setdefault( ownerGroup, {} ).setdefault( ownerDN, [] ).append( tqId )
+
+  newPrios = {}
+  for group in groupOwners:
+    share = float( groupShares.get( group, DEFAULT_GROUP_SHARE ) )
+    owners = groupOwners[ group ]
+    if group in jobSharingGroups:
+      entities = [ ( share, [ tqId for ownerDN in owners for tqId in owners[ ownerDN ] ] ) ]
+    else:
+      share /= len( owners )
+      ownerShares = dict( [ ( ownerDN, share ) for ownerDN in owners ] )
+      if correctShares:
+        ownerShares = correctShares( ownerShares, group = group )
+      entities = [ ( ownerShares[ ownerDN ], owners[ ownerDN ] ) for ownerDN in owners ]
+    allowBgTQs = group in bgAllowedGroups
+    for entityShare, tqIds in entities:
+      newPrios.update( _ownerPriorities( tqIds, tqData, entityShare, allowBgTQs ) )
+
+  changed = {}
+  for tqId in newPrios:
+    oldPrio = tqData[ tqId ][2]
+    #Compare with the value that would be stored, not the exact one
+    newPrio = round( newPrios[ tqId ], PRIORITY_DIGITS )
+    if abs( newPrio - oldPrio ) > max( PRIORITY_TOLERANCE, abs( oldPrio ) * PRIORITY_TOLERANCE ):
+      changed[ tqId ] = newPrios[ tqId ]
+  return changed
@@ -0,0 +1,566 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" In memory index of the task queues used by the Matcher
+
+    The task queue definitions and their jobs are loaded from the TaskQueueDB
+    and kept in memory, bucketed by Setup, OwnerGroup, Site, Platform and
+    CPU segment. A match request only looks at the task queues in the
+    intersection of its buckets, checks them with the same rules as the
+    match SQL of the TaskQueueDB and picks the job in memory. The DB is only
+    touched to claim the chosen job with a single DELETE.
+
+    The index is refreshed incrementally: a summary of the task queues
+    ( priority, number of jobs and highest JobId ) is compared with the
+    memory and only the definitions of new task queues and the jobs of the
+    changed ones are loaded. Every fullRefreshPeriod secs everything is
+    reloaded.
+"""
+
+__RCSID__ = "$Id$"
+
+import bisect
+import heapq
+import random
+import threading
+import time
+import types
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.Core.Security import Properties, CS
+
+#Same semantics as in the TaskQueueDB
+BANNED_MATCH_FIELDS = ( 'Site', )
+STRICT_MATCH_FIELDS = ( 'SubmitPool', 'Platform', 'PilotType' )
+MAX_MATCH_RETRY = 3
+MAX_CLAIMS_PER_MATCH = 20
+MAX_CACHED_CANDIDATES = 10000
+
+def _toList( value ):
+  if type( value ) in ( types.ListType, types.TupleType ):
+    return list( value )
+  return [ value ]
+
+def _normalize( value ):
+  """ MySQL comparisons are case insensitive and ignore trailing spaces """
+  return str( value ).strip().lower()
+
+class TaskQueueIndex:
+
+  def __init__( self, source, fullRefreshPeriod = 600, maxRefreshAge = 60, groupPropertiesFunction = False ):
+    """ source is a TaskQueueDB or anything with the same getTaskQueuesSummary, getTaskQueueDefinitions,
+        getJobsInTaskQueues and claimJob methods
+    """
+    self.__source = source
+    self.__fullRefreshPeriod = fullRefreshPeriod
+    self.__maxRefreshAge = maxRefreshAge
+    if not groupPropertiesFunction:
+      groupPropertiesFunction = CS.getPropertiesForGroup
+    self.__getGroupProperties = groupPropertiesFunction
+    self.__multiValueMatchFields = source.getMultiValueMatchFields()
+    self.log = gLogger.getSubLogger( "TaskQueueIndex" )
+    self.__lock = threading.Lock()
+    self.__refreshLock = threading.Lock()
+    self.__lastRefresh = 0
+    self.__lastFullRefresh = 0
+    self.__maxJobId = 0
+    self.__stats = { 'refreshes' : 0, 'fullRefreshes' : 0, 'refreshErrors' : 0, 'refreshTime' : 0.0,
+                     'matches' : 0, 'matchesOK' : 0, 'claims' : 0, 'claimFailures' : 0 }
+    self.__setEmpty()
+
+  def __setEmpty( self ):
+    #tqId -> task queue dict
+    self.__tqs = {}
+    #jobId -> tqId
+    self.__jobs = {}
+    #Buckets: field -> normalized value -> set of tqIds. '' holds the TQs without value
+    self.__buckets = dict( [ ( field, {} ) for field in ( 'Setup', 'OwnerGroup', 'Site', 'Platform', 'CPUTime' ) ] )
+    #Bucket keys of a request -> candidate TQs. Pilots of the same site send the same requests
+    self.__candidatesCache = {}
+
+  def isReady( self ):
+    """ The index can be used if it has been refreshed recently """
+    return time.time() - self.__lastRefresh < self.__maxRefreshAge
+
+  def getStats( self ):
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'taskQueues' ] = len( self.__tqs )
+      stats[ 'jobs' ] = len( self.__jobs )
+      stats[ 'refreshAge' ] = time.time() - self.__lastRefresh
+    finally:
+      self.__lock.release()
+    return stats
+
+  #
+  # Loading
+  #
+
+  def __buildTaskQueue( self, tqId, tqDef, priority ):
+    tq = { 'TQId' : tqId, 'OwnerDN' : tqDef[ 'OwnerDN' ],
+           'OwnerGroup' : tqDef[ 'OwnerGroup' ], 'CPUTime' : tqDef[ 'CPUTime' ],
+           'MaxJobId' : 0,
+           #priority -> [ sum of RealPriority, sorted list of JobIds ]
+           'Levels' : {}, 'JobData' : {} }
+    self.__setPriority( tq, priority )
+    for field in ( 'OwnerDN', 'OwnerGroup', 'Setup' ):
+      tq[ 'norm%s' % field ] = _normalize( tqDef[ field ] )
+    for field in self.__multiValueMatchFields:
+      tq[ field ] = set( [ _normalize( value ) for value in tqDef.get( "%ss" % field, [] ) ] )
+    tq[ 'BannedSite' ] = set( [ _normalize( value ) for value in tqDef.get( 'BannedSites', [] ) ] )
+    return tq
+
+  def __setPriority( self, tq, priority ):
+    tq[ 'Priority' ] = float( priority )
+    tq[ 'InvPriority' ] = 1 / max( tq[ 'Priority' ], 0.000001 )
+
+  def __bucketKeys( self, tq ):
+    keys = [ ( 'Setup', tq[ 'normSetup' ] ), ( 'OwnerGroup', tq[ 'normOwnerGroup' ] ),
+             ( 'CPUTime', tq[ 'CPUTime' ] ) ]
+    for field in ( 'Site', 'Platform' ):
+      if tq[ field ]:
+        keys.extend( [ ( field, value ) for value in tq[ field ] ] )
+      else:
+        keys.append( ( field, '' ) )
+    return keys
+
+  def __addTaskQueue( self, tq ):
+    """ Must be called holding the lock """
+    self.__tqs[ tq[ 'TQId' ] ] = tq
+    self.__candidatesCache = {}
+    for field, key in self.__bucketKeys( tq ):
+      self.__buckets[ field ].setdefault( key, set() ).add( tq[ 'TQId' ] )
+
+  def __removeTaskQueue( self, tqId ):
+    """ Must be called holding the lock """
+    tq = self.__tqs.pop( tqId, None )
+    if not tq:
+      return
+    self.__candidatesCache = {}
+    for jobId in tq[ 'JobData' ]:
+      self.__jobs.pop( jobId, None )
+    for field, key in self.__bucketKeys( tq ):
+      bucket = self.__buckets[ field ].get( key )
+      if bucket:
+        bucket.discard( tqId )
+        if not bucket:
+          del( self.__buckets[ field ][ key ] )
+
+  def __addJob( self, tq, jobId, priority, realPriority ):
+    """ Must be called holding the lock """
+    if jobId in tq[ 'JobData' ]:
+      return
+    tq[ 'JobData' ][ jobId ] = ( priority, realPriority )
+    level = tq[ 'Levels' ].setdefault( priority, [ 0.0, [] ] )
+    level[0] += realPriority
+    bisect.insort( level[1], jobId )
+    tq[ 'MaxJobId' ] = max( tq[ 'MaxJobId' ], jobId )
+    self.__jobs[ jobId ] = tq[ 'TQId' ]
+
+  def __removeJob( self, tq, jobId ):
+    """ Must be called holding the lock """
+    jobData = tq[ 'JobData' ].pop( jobId, None )
+    if not jobData:
+      return
+    self.__jobs.pop( jobId, None )
+    priority, realPriority = jobData
+    level = tq[ 'Levels' ][ priority ]
+    del( level[1][ bisect.bisect_left( level[1], jobId ) ] )
+    level[0] -= realPriority
+    if not level[1]:
+      del( tq[ 'Levels' ][ priority ] )
+
+  def __setJobs( self, tq, jobList ):
+    """ Must be called holding the lock """
+    for jobId in tq[ 'JobData' ]:
+      self.__jobs.pop( jobId, None )
+    tq[ 'JobData' ] = {}
+    tq[ 'Levels' ] = {}
+    tq[ 'MaxJobId' ] = 0
+    for jobId, priority, realPriority in jobList:
+      self.__addJob( tq, jobId, priority, realPriority )
+
+  def refresh( self ):
+    """
+    Bring the index up to date with the TaskQueueDB
+    """
+    if not self.__refreshLock.acquire( False ):
+      return S_OK()
+    try:
+      start = time.time()
+      if start - self.__lastFullRefresh > self.__fullRefreshPeriod:
+        result = self.__fullRefresh()
+      else:
+        result = self.__incrementalRefresh()
+      if not result[ 'OK' ]:
+        self.__stats[ 'refreshErrors' ] += 1
+        self.log.error( "Cannot refresh the task queue index", result[ 'Message' ] )
+        return result
+      self.__lastRefresh = start
+      self.__stats[ 'refreshes' ] += 1
+      self.__stats[ 'refreshTime' ] = time.time() - start
+      return result
+    finally:
+      self.__refreshLock.release()
+
+  def __fullRefresh( self ):
+    result = self.__source.getTaskQueuesSummary()
+    if not result[ 'OK' ]:
+      return result
+    summary = result[ 'Value' ]
+    tqIds = summary.keys()
+    result = self.__source.getTaskQueueDefinitions( tqIds )
+    if not result[ 'OK' ]:
+      return result
+    tqDefs = result[ 'Value' ]
+    result = self.__source.getJobsInTaskQueues( tqIds )
+    if not result[ 'OK' ]:
+      return result
+    tqJobs = result[ 'Value' ]
+    self.__lock.acquire()
+    try:
+      self.__setEmpty()
+      self.__maxJobId = 0
+      for tqId in tqDefs:
+        tq = self.__buildTaskQueue( tqId, tqDefs[ tqId ], summary[ tqId ][0] )
+        self.__addTaskQueue( tq )
+        self.__setJobs( tq, tqJobs.get( tqId, [] ) )
+        self.__maxJobId = max( self.__maxJobId, tq[ 'MaxJobId' ] )
+    finally:
+      self.__lock.release()
+    self.__lastFullRefresh = time.time()
+    self.__stats[ 'fullRefreshes' ] += 1
+    self.log.info( "Loaded %s task queues with %s jobs" % ( len( self.__tqs ), len( self.__jobs ) ) )
+    return S_OK()
+
+  def __incrementalRefresh( self ):
+    result = self.__source.getTaskQueuesSummary()
+    if not result[ 'OK' ]:
+      return result
+    summary = result[ 'Value' ]
+    self.__lock.acquire()
+    try:
+      newTQs = [ tqId for tqId in summary if tqId not in self.__tqs ]
+      for tqId in [ tqId for tqId in self.__tqs if tqId not in summary ]:
+        self.__removeTaskQueue( tqId )
+      grownTQs = []
+      changedTQs = []
+      for tqId in summary:
+        if tqId not in self.__tqs:
+          continue
+        tq = self.__tqs[ tqId ]
+        priority, numJobs, maxJobId = summary[ tqId ]
+        self.__setPriority( tq, priority )
+        if numJobs == len( tq[ 'JobData' ] ) and maxJobId == tq[ 'MaxJobId' ]:
+          continue
+        if maxJobId > self.__maxJobId and numJobs > len( tq[ 'JobData' ] ):
+          grownTQs.append( tqId )
+        else:
+          changedTQs.append( tqId )
+      minJobId = self.__maxJobId
+    finally:
+      self.__lock.release()
+
+    tqDefs = {}
+    if newTQs:
+      result = self.__source.getTaskQueueDefinitions( newTQs )
+      if not result[ 'OK' ]:
+        return result
+      tqDefs = result[ 'Value' ]
+    #Only the new jobs of the task queues that just grew
+    newJobs = {}
+    if grownTQs:
+      result = self.__source.getJobsInTaskQueues( grownTQs, minJobId = minJobId )
+      if not result[ 'OK' ]:
+        return result
+      newJobs = result[ 'Value' ]
+      self.__lock.acquire()
+      try:
+        for tqId in grownTQs:
+          tq = self.__tqs.get( tqId )
+          if not tq:
+            continue
+          for jobId, priority, realPriority in newJobs.get( tqId, [] ):
+            self.__addJob( tq, jobId, priority, realPriority )
+          if len( tq[ 'JobData' ] ) != summary[ tqId ][1] or tq[ 'MaxJobId' ] != summary[ tqId ][2]:
+            changedTQs.append( tqId )
+      finally:
+        self.__lock.release()
+    #Everything else is reloaded
+    reloadTQs = changedTQs + [ tqId for tqId in newTQs if tqId in tqDefs ]
+    tqJobs = {}
+    if reloadTQs:
+      result = self.__source.getJobsInTaskQueues( reloadTQs )
+      if not result[ 'OK' ]:
+        return result
+      tqJobs = result[ 'Value' ]
+
+    self.__lock.acquire()
+    try:
+      for tqId in tqDefs:
+        if tqId in summary:
+          self.__addTaskQueue( self.__buildTaskQueue( tqId, tqDefs[ tqId ], summary[ tqId ][0] ) )
+      for tqId in reloadTQs:
+        tq = self.__tqs.get( tqId )
+        if tq:
+          self.__setJobs( tq, tqJobs.get( tqId, [] ) )
+      for tqId in summary:
+        self.__maxJobId = max( self.__maxJobId, summary[ tqId ][2] )
+    finally:
+      self.__lock.release()
+    if newTQs or reloadTQs:
+      self.log.verbose( "%s new task queues, %s reloaded, %s with new jobs" % ( len( newTQs ), len( changedTQs ),
+                                                                                  len( grownTQs ) ) )
+    return S_OK()
+
+  #
+  # Matching
+  #
+
+  def __prepareMatchDict( self, tqMatchDict ):
+    """ Normalized version of the match dict with list values """
+    matchDict = {}
+    for field in tqMatchDict:
+      value = tqMatchDict[ field ]
+      if field == 'CPUTime':
+        matchDict[ field ] = max( [ int( v ) for v in _toList( value ) ] )
+      elif field in ( 'OwnerDN', 'OwnerGroup', 'Setup' ):
+        matchDict[ field ] = [ _normalize( v ) for v in _toList( value ) ]
+      else:
+        multiField = field
+        if field[ :6 ] == 'Banned':
+          multiField = field[ 6: ]
+        if multiField in self.__multiValueMatchFields:
+          #Empty values do not restrict the match but are still there for the strict fields
+          matchDict[ field ] = []
+          if value:
+            matchDict[ field ] = [ _normalize( v ) for v in _toList( value ) ]
+    if 'OwnerDN' in matchDict and 'OwnerGroup' in matchDict:
+      owners = []
+      for group in _toList( tqMatchDict[ 'OwnerGroup' ] ):
+        if Properties.JOB_SHARING in self.__getGroupProperties( group ):
+          owners.append( ( None, _normalize( group ) ) )
+        else:
+          for dn in matchDict[ 'OwnerDN' ]:
+            owners.append( ( dn, _normalize( group ) ) )
+      matchDict[ 'Owners' ] = owners
+    return matchDict
+
+  def __prepareNegativeCond( self, negativeCond ):
+    if not negativeCond:
+      return []
+    condList = negativeCond
+    if type( negativeCond ) == types.DictType:
+      condList = [ negativeCond ]
+    normCondList = []
+    for cond in condList:
+      normCond = {}
+      for field in cond:
+        if field in self.__multiValueMatchFields or field in ( 'OwnerDN', 'OwnerGroup', 'Setup', 'CPUTime' ):
+          normCond[ field ] = [ _normalize( v ) for v in _toList( cond[ field ] ) ]
+      normCondList.append( normCond )
+    return normCondList
+
+  def __matchesOwner( self, tq, matchDict ):
+    if 'Owners' in matchDict:
+      for dn, group in matchDict[ 'Owners' ]:
+        if tq[ 'normOwnerGroup' ] == group and ( dn is None or tq[ 'normOwnerDN' ] == dn ):
+          return True
+      return False
+    for field in ( 'OwnerDN', 'OwnerGroup' ):
+      if field in matchDict and tq[ 'norm%s' % field ] not in matchDict[ field ]:
+        return False
+    return True
+
+  def __passesNegativeCond( self, tq, cond ):
+    """ The TQ has none of the values of the condition """
+    for field in cond:
+      for value in cond[ field ]:
+        if field in self.__multiValueMatchFields:
+          if value in tq[ field ]:
+            return False
+        elif field == 'CPUTime':
+          if value == str( tq[ 'CPUTime' ] ):
+            return False
+        elif value == tq[ 'norm%s' % field ]:
+          return False
+    return True
+
+  def __matchesNegativeCond( self, tq, normCondList ):
+    """ A list of conditions is an OR of them """
+    if not normCondList:
+      return True
+    for cond in normCondList:
+      if self.__passesNegativeCond( tq, cond ):
+        return True
+    return False
+
+  def matches( self, tq, matchDict, normCondList ):
+    """ Same rules as TaskQueueDB.__generateTQMatchSQL """
+    if not self.__matchesOwner( tq, matchDict ):
+      return False
+    if 'CPUTime' in matchDict and tq[ 'CPUTime' ] > matchDict[ 'CPUTime' ]:
+      return False
+    if 'Setup' in matchDict and tq[ 'normSetup' ] not in matchDict[ 'Setup' ]:
+      return False
+    for field in self.__multiValueMatchFields:
+      values = matchDict.get( field )
+      if values:
+        tqValues = tq[ field ]
+        if not ( not tqValues and ( field != 'GridCE' or 'Site' in matchDict ) ):
+          if not [ value for value in values if value in tqValues ]:
+            return False
+        if field in BANNED_MATCH_FIELDS:
+          if not [ value for value in values if value not in tq[ 'Banned%s' % field ] ]:
+            return False
+      bannedValues = matchDict.get( 'Banned%s' % field )
+      if bannedValues:
+        if not [ value for value in bannedValues if value not in tq[ field ] ]:
+          return False
+    for field in STRICT_MATCH_FIELDS:
+      if field not in matchDict and tq[ field ]:
+        return False
+    return self.__matchesNegativeCond( tq, normCondList )
+
+  def __getCandidates( self, matchDict ):
+    """ TQs that may match. Must be called holding the lock """
+    bucketKeys = [ ( 'Setup', matchDict[ 'Setup' ] ) ]
+    if 'OwnerGroup' in matchDict:
+      bucketKeys.append( ( 'OwnerGroup', matchDict[ 'OwnerGroup' ] ) )
+    if 'CPUTime' in matchDict:
+      cpuTime = matchDict[ 'CPUTime' ]
+      bucketKeys.append( ( 'CPUTime', [ segment for segment in self.__buckets[ 'CPUTime' ] if segment <= cpuTime ] ) )
+    if matchDict.get( 'Site' ):
+      bucketKeys.append( ( 'Site', matchDict[ 'Site' ] + [ '' ] ) )
+    if 'Platform' not in matchDict:
+      bucketKeys.append( ( 'Platform', [ '' ] ) )
+    elif matchDict[ 'Platform' ]:
+      bucketKeys.append( ( 'Platform', matchDict[ 'Platform' ] + [ '' ] ) )
+    cacheKey = tuple( [ ( field, tuple( keys ) ) for field, keys in bucketKeys ] )
+    if cacheKey in self.__candidatesCache:
+      return self.__candidatesCache[ cacheKey ]
+    if len( self.__candidatesCache ) > MAX_CACHED_CANDIDATES:
+      self.__candidatesCache = {}
+    self.__candidatesCache[ cacheKey ] = self.__findCandidates( bucketKeys )
+    return self.__candidatesCache[ cacheKey ]
+
+  def __findCandidates( self, bucketKeys ):
+    fieldSets = []
+    for field, keys in bucketKeys:
+      buckets = self.__buckets[ field ]
+      sets = [ buckets[ key ] for key in keys if key in buckets ]
+      if not sets:
+        return []
+      fieldSets.append( ( sum( [ len( bucket ) for bucket in sets ] ), sets ) )
+    #Start with the most selective field and only filter with the rest, unions are expensive
+    fieldSets.sort()
+    candidates = set()
+    for bucket in fieldSets[0][1]:
+      candidates.update( bucket )
+    for size, sets in fieldSets[1:]:
+      if len( sets ) == 1:
+        candidates = candidates.intersection( sets[0] )
+      else:
+        candidates = set( [ tqId for tqId in candidates if [ True for bucket in sets if tqId in bucket ] ] )
+    return [ self.__tqs[ tqId ] for tqId in candidates ]
+
+  def getMatchingTaskQueues( self, tqMatchDict, negativeCond = {}, numQueuesToGet = 0 ):
+    """
+    TQ ids matching in order of preference
+    """
+    if 'LHCbPlatform' in tqMatchDict and 'Platform' not in tqMatchDict:
+      tqMatchDict = dict( tqMatchDict )
+      tqMatchDict[ 'Platform' ] = tqMatchDict[ 'LHCbPlatform' ]
+    for field in ( 'Setup', 'CPUTime' ):
+      if field not in tqMatchDict:
+        return S_ERROR( "Missing mandatory field '%s' in match request definition" % field )
+    try:
+      matchDict = self.__prepareMatchDict( tqMatchDict )
+    except ValueError, e:
+      return S_ERROR( "Invalid match request: %s" % str( e ) )
+    normCondList = self.__prepareNegativeCond( negativeCond )
+    self.__lock.acquire()
+    try:
+      #Same ordering as ORDER BY RAND() / Priority. Candidates are only checked
+      #in that order until there are enough of them
+      rand = random.random
+      ranking = [ ( rand() * tq[ 'InvPriority' ], tq ) for tq in self.__getCandidates( matchDict ) if tq[ 'JobData' ] ]
+      heapq.heapify( ranking )
+      tqList = []
+      while ranking and ( not numQueuesToGet or len( tqList ) < numQueuesToGet ):
+        tq = heapq.heappop( ranking )[1]
+        if self.matches( tq, matchDict, normCondList ):
+          tqList.append( tq[ 'TQId' ] )
+    finally:
+      self.__lock.release()
+    return S_OK( tqList )
+
+  def __pickJob( self, tqId, numJobsPerTry ):
+    """ Choose a job of the TQ and take it out of the index. Must be called holding the lock """
+    tq = self.__tqs.get( tqId )
+    if not tq or not tq[ 'Levels' ]:
+      return False
+    #Same as ORDER BY RAND() / RealPriority: levels weighted by their total real priority
+    levels = tq[ 'Levels' ].items()
+    total = sum( [ max( level[0], 0 ) for prio, level in levels ] )
+    chosen = levels[-1][1]
+    if total > 0:
+      point = random.random() * total
+      for prio, level in levels:
+        point -= max( level[0], 0 )
+        if point < 0:
+          chosen = level
+          break
+    jobIds = chosen[1][ :numJobsPerTry ]
+    jobId = jobIds[ random.randint( 0, len( jobIds ) - 1 ) ]
+    self.__removeJob( tq, jobId )
+    return jobId, tq[ 'OwnerDN' ], tq[ 'OwnerGroup' ]
+
+  def matchAndGetJob( self, tqMatchDict, numJobsPerTry = 50, numQueuesPerTry = 10, negativeCond = {} ):
+    """
+    Same as TaskQueueDB.matchAndGetJob but only claiming the job goes to the DB
+    """
+    self.__stats[ 'matches' ] += 1
+    claims = 0
+    for matchTry in range( MAX_MATCH_RETRY ):
+      result = self.getMatchingTaskQueues( tqMatchDict, negativeCond = negativeCond,
+                                           numQueuesToGet = numQueuesPerTry )
+      if not result[ 'OK' ]:
+        return result
+      tqList = result[ 'Value' ]
+      if not tqList:
+        return S_OK( { 'matchFound' : False, 'tqMatch' : tqMatchDict } )
+      for tqId in tqList:
+        while claims < MAX_CLAIMS_PER_MATCH:
+          self.__lock.acquire()
+          try:
+            jobData = self.__pickJob( tqId, numJobsPerTry )
+          finally:
+            self.__lock.release()
+          if not jobData:
+            break
+          jobId, tqOwnerDN, tqOwnerGroup = jobData
+          claims += 1
+          self.__stats[ 'claims' ] += 1
+          result = self.__source.claimJob( jobId, tqId, tqOwnerDN, tqOwnerGroup )
+          if not result[ 'OK' ]:
+            return result
+          if result[ 'Value' ]:
+            self.__stats[ 'matchesOK' ] += 1
+            self.log.verbose( "Extracted job %s from TQ %s" % ( jobId, tqId ) )
+            return S_OK( { 'matchFound' : True, 'jobId' : jobId, 'taskQueueId' : tqId, 'tqMatch' : tqMatchDict } )
+          #Someone else got it
+          self.__stats[ 'claimFailures' ] += 1
+      if claims >= MAX_CLAIMS_PER_MATCH:
+        break
+    return S_ERROR( "Could not find a match after %s match retries" % MAX_MATCH_RETRY )
+
+  def forgetJob( self, jobId ):
+    """ Take a job out of the index """
+    self.__lock.acquire()
+    try:
+      tqId = self.__jobs.get( jobId )
+      if tqId in self.__tqs:
+        self.__removeJob( self.__tqs[ tqId ], jobId )
+    finally:
+      self.__lock.release()
@@ -0,0 +1,164 @@
+########################################################################
+# $HeadURL $
+# File: DownloadInputDataTestCase.py
+########################################################################
+
+""" :mod: DownloadInputDataTestCase
+    =======================
+
+    .. module: DownloadInputDataTestCase
+    :synopsis: test cases for DIRAC.WorkloadManagementSystem.Client.DownloadInputData
+
+    Test cases for the threaded download of the input data, using stand-in
+    ReplicaManager and StorageElement
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from DIRAC import S_OK, S_ERROR
+## SUT
+import DIRAC.WorkloadManagementSystem.Client.DownloadInputData as DownloadInputDataModule
+from DIRAC.WorkloadManagementSystem.Client.DownloadInputData import DownloadInputData
+
+class FakeStorageElement:
+  """ DiskSE* are disk SEs, TapeSE* tape SEs """
+  def __init__( self, seName ):
+    self.seName = seName
+  def getStatus( self ):
+    return S_OK( { 'Read' : True, 'DiskSE' : self.seName.startswith( 'Disk' ),
+                   'TapeSE' : self.seName.startswith( 'Tape' ) } )
+
+class FakeReplicaManager:
+  """ Replicas can be lost, not cached or fail a number of times, the
+      concurrent downloads from each SE are recorded
+  """
+  metadata = {}
+  failures = {}
+  active = {}
+  maxActive = {}
+  getFileCalls = []
+  lock = threading.Lock()
+
+  def getStorageFileMetadata( self, pfns, seName ):
+    metadata = { 'Lost' : False, 'Unavailable' : False, 'Cached' : True }
+    metadata.update( FakeReplicaManager.metadata.get( pfns[0], {} ) )
+    return S_OK( { 'Successful' : { pfns[0] : metadata }, 'Failed' : {} } )
+
+  def getStorageFile( self, pfn, seName, localPath = None, singleFile = False ):
+    cls = FakeReplicaManager
+    cls.lock.acquire()
+    cls.active[ seName ] = cls.active.get( seName, 0 ) + 1
+    cls.maxActive[ seName ] = max( cls.maxActive.get( seName, 0 ), cls.active[ seName ] )
+    failing = cls.failures.get( pfn, 0 )
+    if failing:
+      cls.failures[ pfn ] = failing - 1
+    cls.lock.release()
+    time.sleep( 0.05 )
+    cls.lock.acquire()
+    cls.active[ seName ] -= 1
+    cls.lock.release()
+    if failing:
+      return S_ERROR( 'Transfer failed' )
+    open( os.path.join( localPath, os.path.basename( pfn ) ), 'w' ).write( pfn )
+    return S_OK( pfn )
+
+  def getFile( self, lfn, destinationDir = '' ):
+    FakeReplicaManager.getFileCalls.append( lfn )
+    localFile = os.path.join( destinationDir, os.path.basename( lfn ) )
+    open( localFile, 'w' ).write( lfn )
+    return S_OK( { 'Successful' : { lfn : localFile }, 'Failed' : {} } )
+
+class DownloadInputDataTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.saved = ( DownloadInputDataModule.ReplicaManager, DownloadInputDataModule.StorageElement,
+                   DownloadInputDataModule.getDiskSpace )
+    DownloadInputDataModule.ReplicaManager = FakeReplicaManager
+    DownloadInputDataModule.StorageElement = FakeStorageElement
+    DownloadInputDataModule.getDiskSpace = lambda: 1024 * 1024
+    FakeReplicaManager.metadata = {}
+    FakeReplicaManager.failures = {}
+    FakeReplicaManager.active = {}
+    FakeReplicaManager.maxActive = {}
+    FakeReplicaManager.getFileCalls = []
+    self.cwd = os.getcwd()
+    self.tmpDir = tempfile.mkdtemp()
+    os.chdir( self.tmpDir )
+
+  def tearDown( self ):
+    DownloadInputDataModule.ReplicaManager, DownloadInputDataModule.StorageElement, \
+    DownloadInputDataModule.getDiskSpace = self.saved
+    os.chdir( self.cwd )
+    shutil.rmtree( self.tmpDir )
+
+  def __download( self, replicas, **configuration ):
+    catalog = {}
+    for lfn, seList in replicas.items():
+      catalog[ lfn ] = { 'Size' : 10, 'GUID' : 'guid-%s' % os.path.basename( lfn ) }
+      for seName in seList:
+        #The PFN names differ from the LFN ones, so the files get renamed
+        catalog[ lfn ][ seName ] = 'srm://%s%s.pfn' % ( seName, lfn )
+    configuration[ 'LocalSEList' ] = [ 'DiskSE1', 'DiskSE2', 'TapeSE' ]
+    downloader = DownloadInputData( { 'InputData' : [ 'LFN:%s' % lfn for lfn in replicas ],
+                                      'Configuration' : configuration,
+                                      'FileCatalog' : S_OK( { 'Successful' : catalog, 'Failed' : {} } ) } )
+    return downloader.execute()
+
+  def testConnectionsPerSE( self ):
+    """ the threads never open more than MaxSEConnections to an SE """
+    replicas = dict( [ ( '/vo/f%s' % i, [ 'DiskSE1' ] ) for i in range( 8 ) ] )
+    result = self.__download( replicas, DownloadThreads = 4, MaxSEConnections = 2 )
+    self.assert_( result['OK'] )
+    self.assertEqual( sorted( result['Successful'] ), sorted( replicas ) )
+    self.assertEqual( result['Failed'], [] )
+    self.assertEqual( FakeReplicaManager.maxActive[ 'DiskSE1' ], 2 )
+    #Each file is renamed to its LFN name in its own download directory
+    for lfn, fileDict in result['Successful'].items():
+      self.assertEqual( os.path.basename( fileDict['path'] ), os.path.basename( lfn ) )
+      self.assert_( os.path.basename( os.path.dirname( fileDict['path'] ) ).startswith( 'InputData_' ) )
+      self.assert_( os.path.isfile( fileDict['path'] ) )
+
+  def testUnusableReplicas( self ):
+    """ lost and unavailable replicas are dropped, the other replica or any SE is used """
+    FakeReplicaManager.metadata[ 'srm://DiskSE1/vo/lost.pfn' ] = { 'Lost' : True }
+    FakeReplicaManager.metadata[ 'srm://DiskSE1/vo/unavailable.pfn' ] = { 'Unavailable' : True }
+    FakeReplicaManager.metadata[ 'srm://DiskSE2/vo/unavailable.pfn' ] = { 'Unavailable' : True }
+    result = self.__download( { '/vo/lost' : [ 'DiskSE1', 'DiskSE2' ], '/vo/unavailable' : [ 'DiskSE1', 'DiskSE2' ] } )
+    self.assertEqual( sorted( result['Successful'] ), [ '/vo/lost', '/vo/unavailable' ] )
+    self.assertEqual( result['Successful'][ '/vo/lost' ][ 'se' ], 'DiskSE2' )
+    self.assertEqual( result['Successful'][ '/vo/unavailable' ][ 'turl' ], 'Downloaded' )
+    self.assertEqual( result['Successful'][ '/vo/unavailable' ][ 'se' ], '' )
+    self.assertEqual( FakeReplicaManager.getFileCalls, [ '/vo/unavailable' ] )
+
+  def testRetries( self ):
+    """ failed transfers are retried DownloadRetries times before giving up """
+    FakeReplicaManager.failures[ 'srm://DiskSE1/vo/retry.pfn' ] = 1
+    result = self.__download( { '/vo/retry' : [ 'DiskSE1' ] }, DownloadRetries = 1 )
+    self.assertEqual( result['Successful'][ '/vo/retry' ][ 'se' ], 'DiskSE1' )
+    self.assertEqual( FakeReplicaManager.getFileCalls, [] )
+    #Without retries the download from anywhere is the last resort
+    FakeReplicaManager.failures[ 'srm://DiskSE1/vo/retry.pfn' ] = 1
+    result = self.__download( { '/vo/retry' : [ 'DiskSE1' ] }, DownloadRetries = 0 )
+    self.assertEqual( result['Successful'][ '/vo/retry' ][ 'se' ], '' )
+    self.assertEqual( FakeReplicaManager.getFileCalls, [ '/vo/retry' ] )
+
+  def testTape( self ):
+    """ files on a local tape SE are not downloaded from anywhere else """
+    FakeReplicaManager.metadata[ 'srm://TapeSE/vo/tape.pfn' ] = { 'Cached' : False }
+    result = self.__download( { '/vo/tape' : [ 'TapeSE' ], '/vo/cached' : [ 'TapeSE' ] } )
+    self.assertEqual( result['Failed'], [ '/vo/tape' ] )
+    self.assertEqual( result['Successful'][ '/vo/cached' ][ 'se' ], 'TapeSE' )
+    self.assertEqual( FakeReplicaManager.getFileCalls, [] )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( DownloadInputDataTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
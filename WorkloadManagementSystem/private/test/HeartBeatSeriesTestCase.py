@@ -0,0 +1,61 @@
+########################################################################
+# $HeadURL $
+# File: HeartBeatSeriesTestCase.py
+########################################################################
+
+""" :mod: HeartBeatSeriesTestCase
+    =======================
+
+    .. module: HeartBeatSeriesTestCase
+    :synopsis: test cases for DIRAC.WorkloadManagementSystem.private.HeartBeatSeries
+
+    Test cases for the packing and downsampling of the heart beat series
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+import datetime
+from DIRAC.WorkloadManagementSystem.private.HeartBeatSeries import packPoints, unpackPoints, downsample, \
+                                                                  toSeriesTime, fromSeriesTime, toEpoch, \
+                                                                  POINT_SIZE
+
+class HeartBeatSeriesTestCase( unittest.TestCase ):
+
+  def testPacking( self ):
+    """ points survive packing, appended blobs read back sorted """
+    points = [ ( 100, 1.5 ), ( 400, 2.25 ) ]
+    data = packPoints( points )
+    self.assertEqual( len( data ), 2 * POINT_SIZE )
+    self.assertEqual( unpackPoints( data ), points )
+    data += packPoints( [ ( 200, 3.0 ) ] ) + 'x'
+    self.assertEqual( unpackPoints( data ), [ ( 100, 1.5 ), ( 200, 3.0 ), ( 400, 2.25 ) ] )
+
+  def testTimes( self ):
+    """ series times are UTC seconds since 2K """
+    dateTime = datetime.datetime( 2012, 3, 4, 5, 6, 7 )
+    seriesTime = toSeriesTime( dateTime )
+    self.assertEqual( seriesTime, toSeriesTime( '2012-03-04 05:06:07' ) )
+    self.assertEqual( fromSeriesTime( seriesTime ), dateTime )
+    self.assertEqual( toEpoch( seriesTime ), 1330837567 )
+
+  def testDownsample( self ):
+    """ recent points are kept, old ones are averaged in buckets """
+    points = [ ( t * 10, float( t ) ) for t in range( 110 ) ]
+    self.assertEqual( downsample( points, 200, 10 ), points )
+    reduced = downsample( points, 100, 10 )
+    self.assertEqual( reduced[ -10: ], points[ -10: ] )
+    self.assertEqual( len( reduced ), 55 )
+    self.assertEqual( reduced[0], ( 10, 1.0 ) )
+    self.assertEqual( [ p[0] for p in reduced ], sorted( [ p[0] for p in reduced ] ) )
+    #Downsampled again the old part gets coarser
+    reduced = downsample( reduced + [ ( 1100 + t * 10, 1.0 ) for t in range( 50 ) ], 100, 10 )
+    self.assert_( len( reduced ) <= 100 )
+    self.assertEqual( len( downsample( points, 10, 0 ) ), 5 )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( HeartBeatSeriesTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
@@ -0,0 +1,130 @@
+########################################################################
+# $HeadURL $
+# File: JobReservoirTestCase.py
+########################################################################
+
+""" :mod: JobReservoirTestCase
+    =======================
+
+    .. module: JobReservoirTestCase
+    :synopsis: test cases for DIRAC.WorkloadManagementSystem.private.JobReservoir
+
+    Test cases for the reservoir of leased jobs of the Matcher, using
+    a stand-in TaskQueueDB so no MySQL server is needed
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import time
+import unittest
+from DIRAC import S_OK
+from DIRAC.WorkloadManagementSystem.private import JobReservoir as JobReservoirModule
+from DIRAC.WorkloadManagementSystem.private.JobReservoir import JobReservoir
+
+class FakeTaskQueueDB:
+  """ Stand-in TaskQueueDB with the lease methods """
+
+  def __init__( self ):
+    #tqId -> list of jobIds
+    self.jobs = {}
+    #jobId -> ( tqId, leaseOwner, expiry )
+    self.leases = {}
+    self.statements = 0
+
+  def matchAndGetTaskQueue( self, tqMatchDict, numQueuesToGet = 1, negativeCond = {} ):
+    self.statements += 1
+    return S_OK( [ ( tqId, '/DN/user', 'user' ) for tqId in sorted( self.jobs ) ][ :numQueuesToGet ] )
+
+  def leaseJobs( self, tqId, numJobs, leaseOwner, leaseTime ):
+    self.statements += 4
+    leased = self.jobs[ tqId ][ :numJobs ]
+    self.jobs[ tqId ] = self.jobs[ tqId ][ numJobs: ]
+    for jobId in leased:
+      self.leases[ jobId ] = ( tqId, leaseOwner, time.time() + leaseTime )
+    return S_OK( [ ( jobId, 1, 1.0 ) for jobId in leased ] )
+
+  def consumeJobLease( self, jobId, leaseOwner, tqId, tqOwnerDN, tqOwnerGroup ):
+    self.statements += 1
+    if jobId in self.leases and self.leases[ jobId ][1] == leaseOwner:
+      del( self.leases[ jobId ] )
+      return S_OK( True )
+    return S_OK( False )
+
+  def __return( self, jobIds ):
+    for jobId in jobIds:
+      tqId = self.leases.pop( jobId )[0]
+      self.jobs[ tqId ].append( jobId )
+    return S_OK( len( jobIds ) )
+
+  def releaseJobLeases( self, jobIdList, leaseOwner ):
+    return self.__return( [ jobId for jobId in jobIdList if jobId in self.leases and
+                            self.leases[ jobId ][1] == leaseOwner ] )
+
+  def returnExpiredJobLeases( self ):
+    return self.__return( [ jobId for jobId in self.leases if self.leases[ jobId ][2] < time.time() ] )
+
+class JobReservoirTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.db = FakeTaskQueueDB()
+    self.db.jobs[1] = range( 1, 21 )
+    self.reservoir = JobReservoir( self.db, leaseTime = 60, maxBatchSize = 5 )
+
+  def match( self ):
+    result = self.reservoir.matchAndGetJob( { 'Setup' : 'Production', 'CPUTime' : 100000 } )
+    self.assert_( result[ 'OK' ] )
+    if not result[ 'Value' ][ 'matchFound' ]:
+      return False
+    return result[ 'Value' ][ 'jobId' ]
+
+  def testBatches( self ):
+    """ hot TQs get bigger batches, every job is handed out once """
+    matched = [ self.match() for i in range( 20 ) ]
+    self.assertEqual( sorted( matched ), range( 1, 21 ) )
+    #Like the TaskQueueDB, empty TQs that are still there make the match fail
+    self.assertFalse( self.reservoir.matchAndGetJob( { 'Setup' : 'Production', 'CPUTime' : 100000 } )[ 'OK' ] )
+    stats = self.reservoir.getStats()
+    self.assertEqual( stats[ 'handedOut' ], 20 )
+    self.assertEqual( stats[ 'reserved' ], 0 )
+    #Batches grow with the demand up to maxBatchSize
+    self.assert_( stats[ 'batches' ] < 10 )
+    self.assertEqual( self.db.leases, {} )
+
+  def testLostLease( self ):
+    """ jobs deleted while leased are not handed out """
+    self.reservoir.getJob( 1, '/DN/user', 'user' )
+    self.reservoir.getJob( 1, '/DN/user', 'user' )
+    #Second call leased a batch of 1, third one a batch of 2
+    self.assertEqual( self.reservoir.getJob( 1, '/DN/user', 'user' )[ 'Value' ], 3 )
+    self.assertEqual( self.reservoir.getStats()[ 'reserved' ], 1 )
+    del( self.db.leases[4] )
+    self.assertEqual( self.reservoir.getJob( 1, '/DN/user', 'user' )[ 'Value' ], 5 )
+    self.assertEqual( self.reservoir.getStats()[ 'lostLeases' ], 1 )
+
+  def testExpiration( self ):
+    """ jobs not handed out in time go back to their TQ """
+    for i in range( 5 ):
+      self.reservoir.getJob( 1, '/DN/user', 'user' )
+    reserved = self.reservoir.getStats()[ 'reserved' ]
+    self.assert_( reserved > 0 )
+    #Leases about to expire
+    reservoir = self.reservoir._JobReservoir__reservoir
+    for job in reservoir[1]:
+      job[2] = time.time() + JobReservoirModule.LEASE_MARGIN / 2
+    self.assert_( self.reservoir.expireLeases()[ 'OK' ] )
+    stats = self.reservoir.getStats()
+    self.assertEqual( stats[ 'reserved' ], 0 )
+    self.assertEqual( stats[ 'released' ], reserved )
+    self.assertEqual( len( self.db.jobs[1] ), 20 - 5 )
+    #Leases of someone else that are gone
+    self.db.leases[ 100 ] = ( 1, 'other', time.time() - 1 )
+    self.reservoir.expireLeases()
+    self.assertEqual( self.reservoir.getStats()[ 'returnedExpired' ], 1 )
+    self.assert_( 100 in self.db.jobs[1] )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( JobReservoirTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
@@ -0,0 +1,127 @@
+########################################################################
+# $HeadURL $
+# File: JobStateUpdateBufferTestCase.py
+########################################################################
+
+""" :mod: JobStateUpdateBufferTestCase
+    =======================
+
+    .. module: JobStateUpdateBufferTestCase
+    :synopsis: test cases for DIRAC.WorkloadManagementSystem.private.JobStateUpdateBuffer
+
+    Test cases for the write-behind buffer of the JobStateUpdate service,
+    using stand-in JobDB and JobLoggingDB so no MySQL server is needed
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+from DIRAC import S_OK, S_ERROR
+from DIRAC.WorkloadManagementSystem.private.JobStateUpdateBuffer import JobStateUpdateBuffer
+
+class FakeJobDB:
+  """ Stand-in JobDB keeping the calls of the bulk methods """
+
+  def __init__( self ):
+    self.jobs = {}
+    self.updates = []
+    self.parameters = []
+    self.heartBeats = []
+    self.fail = False
+
+  def getAttributesForJobList( self, jobIDList, attrList = None ):
+    return S_OK( dict( [ ( jobID, { 'Status' : self.jobs[ jobID ] } ) for jobID in jobIDList
+                         if jobID in self.jobs ] ) )
+
+  def setJobAttributesBulk( self, updateList ):
+    if self.fail:
+      return S_ERROR( 'DB is down' )
+    self.updates.append( updateList )
+    return S_OK( len( updateList ) )
+
+  def setJobParametersBulk( self, parameterList ):
+    self.parameters.extend( parameterList )
+    return S_OK()
+
+  def addHeartBeatRecords( self, recordList ):
+    self.heartBeats.extend( recordList )
+    return S_OK()
+
+class FakeLogDB:
+
+  def __init__( self ):
+    self.records = []
+
+  def addLoggingRecords( self, records ):
+    self.records.extend( records )
+    return S_OK()
+
+class JobStateUpdateBufferTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.jobDB = FakeJobDB()
+    self.jobDB.jobs = { 1 : 'Matched', 2 : 'Stalled', 3 : 'Running' }
+    self.logDB = FakeLogDB()
+    self.buffer = JobStateUpdateBuffer( self.jobDB, self.logDB, maxPendingJobs = 2 )
+
+  def updates( self ):
+    return dict( [ ( jobID, ( attrs, update ) ) for updateList in self.jobDB.updates
+                   for jobID, attrs, update in updateList ] )
+
+  def testCoalescing( self ):
+    """ the updates of a job are written once, the last value wins """
+    self.buffer.setJobStatus( 1, 'Running', 'Job Initialization', 'JobWrapper' )
+    self.buffer.setJobStatus( 1, 'Running', 'Application', 'JobWrapper' )
+    self.buffer.setJobStatus( 1, '', 'Uploading Output', 'JobWrapper' )
+    self.buffer.sendHeartBeat( 1, { 'LoadAverage' : 1.0 }, { 'CPU' : 'x' } )
+    self.buffer.sendHeartBeat( 1, { 'LoadAverage' : 2.0 }, { 'CPU' : 'y' } )
+    self.buffer.setJobStatus( 1, 'Done', 'Execution Complete', 'JobWrapper' )
+    #Unknown jobs are dropped
+    self.buffer.setJobStatus( 4, 'Done', 'Execution Complete', 'JobWrapper' )
+    result = self.buffer.flush()
+    self.assertEqual( result[ 'Value' ], 1 )
+    attrs, update = self.updates()[ 1 ]
+    self.assertEqual( ( attrs[ 'Status' ], attrs[ 'MinorStatus' ] ), ( 'Done', 'Execution Complete' ) )
+    self.assert_( update )
+    self.assert_( 'StartExecTime' in attrs and 'EndExecTime' in attrs and 'HeartBeatTime' in attrs )
+    self.assertEqual( self.jobDB.parameters, [ ( 1, 'CPU', 'y' ) ] )
+    self.assertEqual( [ hb[2] for hb in self.jobDB.heartBeats ], [ 1.0, 2.0 ] )
+    self.assertEqual( [ rec[1:3] for rec in self.logDB.records ],
+                      [ ( 'Running', 'Job Initialization' ), ( 'Running', 'Application' ),
+                        ( 'Running', 'Uploading Output' ), ( 'Done', 'Execution Complete' ) ] )
+    stats = self.buffer.getStats()
+    self.assertEqual( ( stats[ 'updates' ], stats[ 'flushedJobs' ], stats[ 'droppedJobs' ] ), ( 7, 1, 1 ) )
+    self.assertEqual( self.buffer.flush()[ 'Value' ], 0 )
+
+  def testBulkStatus( self ):
+    """ bulk updates without status put stalled jobs back to Running """
+    statusDict = { '2012-01-01 10:00:00' : { 'Status' : '', 'MinorStatus' : 'Uploading',
+                                             'ApplicationStatus' : '', 'Source' : 'JobWrapper' } }
+    self.buffer.setJobStatusBulk( 2, statusDict )
+    self.buffer.setJobStatusBulk( 3, statusDict )
+    self.buffer.flush()
+    updates = self.updates()
+    self.assertEqual( updates[ 2 ][0], { 'Status' : 'Running', 'MinorStatus' : 'Uploading' } )
+    self.assertEqual( updates[ 3 ][0], { 'MinorStatus' : 'Uploading' } )
+    self.assertEqual( len( self.logDB.records ), 2 )
+
+  def testFailedFlush( self ):
+    """ the updates of a failed flush go before the newer ones """
+    self.buffer.setJobStatus( 1, 'Running', 'Application', 'JobWrapper' )
+    self.jobDB.fail = True
+    self.assert_( not self.buffer.flush()[ 'OK' ] )
+    self.assert_( self.buffer.hasPendingUpdates( [ 1 ] ) )
+    self.buffer.setJobStatus( 1, 'Completed', 'Uploading', 'JobWrapper' )
+    self.jobDB.fail = False
+    self.assert_( self.buffer.flushJobs( [ 1 ] )[ 'OK' ] )
+    attrs = self.updates()[ 1 ][0]
+    self.assertEqual( ( attrs[ 'Status' ], attrs[ 'MinorStatus' ] ), ( 'Completed', 'Uploading' ) )
+    self.assertEqual( [ rec[1] for rec in self.logDB.records ], [ 'Running', 'Completed' ] )
+    self.assertEqual( self.buffer.getStats()[ 'flushFailures' ], 1 )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( JobStateUpdateBufferTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
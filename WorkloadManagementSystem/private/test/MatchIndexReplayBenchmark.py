@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: MatchIndexReplayBenchmark.py
+########################################################################
+""" Replay match requests against the in memory task queue index
+
+    The requests are read from a file written by the Matcher when its
+    RecordMatchRequests option is set, or generated if no file is given.
+    A task queue population is generated from the sites, platforms and
+    groups found in the requests and served by a stand-in TaskQueueDB that
+    counts the statements it would have executed.
+
+    Matches per second, the cost of full and incremental refreshes and the
+    DB statements per match are printed. Matching in the TaskQueueDB takes
+    at least 5 statements per match: the match query, the priority and job
+    queries of the chosen TQ and the select and delete of deleteJob, plus
+    2 more per extra TQ or job tried.
+
+    Usage: MatchIndexReplayBenchmark.py [recordFile] [numTQs] [jobsPerTQ] [numRequests]
+"""
+__RCSID__ = "$Id $"
+
+import sys
+import time
+import random
+from DIRAC import S_OK
+from DIRAC.Core.Utilities import DEncode
+from DIRAC.WorkloadManagementSystem.private.Queues import maxCPUSegments
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+
+MULTI_VALUE_MATCH_FIELDS = ( 'GridCE', 'Site', 'GridMiddleware', 'Platform', 'PilotType', 'SubmitPool', 'JobType' )
+MAX_TQS_IN_QUERY = 1000
+
+class CountingTaskQueueDB:
+  """ Stand-in TaskQueueDB counting the statements """
+
+  def __init__( self ):
+    self.tqDefs = {}
+    self.priorities = {}
+    self.jobs = {}
+    self.statements = 0
+
+  def getMultiValueMatchFields( self ):
+    return MULTI_VALUE_MATCH_FIELDS
+
+  def getTaskQueuesSummary( self ):
+    self.statements += 1
+    return S_OK( dict( [ ( tqId, ( self.priorities[ tqId ], len( self.jobs[ tqId ] ),
+                                   max( self.jobs[ tqId ].keys() + [ 0 ] ) ) ) for tqId in self.tqDefs ] ) )
+
+  def getTaskQueueDefinitions( self, tqIdList ):
+    numChunks = ( len( tqIdList ) + MAX_TQS_IN_QUERY - 1 ) / MAX_TQS_IN_QUERY
+    self.statements += numChunks * ( len( MULTI_VALUE_MATCH_FIELDS ) + 2 )
+    return S_OK( dict( [ ( tqId, self.tqDefs[ tqId ] ) for tqId in tqIdList ] ) )
+
+  def getJobsInTaskQueues( self, tqIdList, minJobId = 0 ):
+    self.statements += ( len( tqIdList ) + MAX_TQS_IN_QUERY - 1 ) / MAX_TQS_IN_QUERY
+    tqJobs = {}
+    for tqId in tqIdList:
+      tqJobs[ tqId ] = [ ( jobId, ) + jobData for jobId, jobData in self.jobs[ tqId ].items() if jobId > minJobId ]
+    return S_OK( tqJobs )
+
+  def claimJob( self, jobId, tqId, tqOwnerDN, tqOwnerGroup ):
+    self.statements += 1
+    if jobId not in self.jobs[ tqId ]:
+      return S_OK( False )
+    del( self.jobs[ tqId ][ jobId ] )
+    return S_OK( True )
+
+def readRequests( fileName ):
+  data = open( fileName, "rb" ).read()
+  requests = []
+  offset = 0
+  while offset < len( data ):
+    record, offset = DEncode.decode( data, offset )
+    requests.append( ( record[ 'resourceDict' ], record.get( 'negativeCond', {} ) ) )
+  return requests
+
+def generateRequests( numRequests ):
+  sites = [ "LCG.Site%03d.org" % i for i in range( 100 ) ]
+  platforms = [ 'x86_64-slc5', 'x86_64-slc6', 'i686-slc5' ]
+  requests = []
+  for i in range( numRequests ):
+    site = random.choice( sites )
+    resourceDict = { 'Setup' : 'Production', 'Site' : site, 'GridCE' : "ce%s.%s" % ( i % 3, site.lower() ),
+                     'Platform' : random.choice( platforms ), 'CPUTime' : random.choice( maxCPUSegments ),
+                     'OwnerGroup' : [ 'lhcb_user', 'lhcb_prod', 'lhcb_mc' ], 'PilotType' : 'private' }
+    negativeCond = {}
+    if i % 10 == 0:
+      negativeCond = { 'JobType' : [ 'Merge' ] }
+    requests.append( ( resourceDict, negativeCond ) )
+  return requests
+
+def valuesOf( requests, field ):
+  values = set()
+  for resourceDict, negativeCond in requests:
+    value = resourceDict.get( field )
+    if type( value ) in ( list, tuple ):
+      values.update( value )
+    elif value:
+      values.add( value )
+  return list( values ) or [ 'Unknown' ]
+
+def populate( source, requests, numTQs, jobsPerTQ, firstTQId = 1, firstJobId = 1 ):
+  """ TQs built from the values seen in the requests so that they match """
+  setups = valuesOf( requests, 'Setup' )
+  sites = valuesOf( requests, 'Site' )
+  platforms = valuesOf( requests, 'Platform' )
+  groups = valuesOf( requests, 'OwnerGroup' )
+  jobId = firstJobId
+  for tqId in range( firstTQId, firstTQId + numTQs ):
+    tqDef = { 'OwnerDN' : '/DN/user%s' % ( tqId % 500 ), 'OwnerGroup' : random.choice( groups ),
+              'Setup' : random.choice( setups ), 'CPUTime' : random.choice( maxCPUSegments[ :6 ] ),
+              'JobTypes' : [ random.choice( [ 'User', 'MCSimulation', 'Merge' ] ) ] }
+    if random.random() < 0.7:
+      tqDef[ 'Sites' ] = random.sample( sites, min( len( sites ), random.randint( 1, 3 ) ) )
+    if random.random() < 0.5:
+      tqDef[ 'Platforms' ] = [ random.choice( platforms ) ]
+    source.tqDefs[ tqId ] = tqDef
+    source.priorities[ tqId ] = random.uniform( 0.1, 10 )
+    source.jobs[ tqId ] = {}
+    for i in range( jobsPerTQ ):
+      source.jobs[ tqId ][ jobId ] = ( random.randint( 1, 3 ), random.uniform( 0.1, 1 ) )
+      jobId += 1
+  return jobId
+
+def timeRefresh( index, source ):
+  statements = source.statements
+  start = time.time()
+  index.refresh()
+  return time.time() - start, source.statements - statements
+
+if __name__ == "__main__":
+  args = [ "", 5000, 20, 20000 ]
+  for i in range( min( len( sys.argv ) - 1, len( args ) ) ):
+    if i == 0:
+      args[i] = sys.argv[ i + 1 ]
+    else:
+      args[i] = int( sys.argv[ i + 1 ] )
+  recordFile, numTQs, jobsPerTQ, numRequests = args
+  if recordFile and recordFile != "-":
+    requests = readRequests( recordFile )
+    print "Read %s recorded requests from %s" % ( len( requests ), recordFile )
+  else:
+    requests = generateRequests( numRequests )
+    print "Generated %s requests" % len( requests )
+
+  source = CountingTaskQueueDB()
+  nextJobId = populate( source, requests, numTQs, jobsPerTQ )
+  index = TaskQueueIndex( source, groupPropertiesFunction = lambda group: [] )
+  elapsed, statements = timeRefresh( index, source )
+  print "Full refresh of %s TQs with %s jobs: %.2f secs, %s statements" % ( numTQs, numTQs * jobsPerTQ,
+                                                                            elapsed, statements )
+
+  source.statements = 0
+  matched = 0
+  start = time.time()
+  for resourceDict, negativeCond in requests:
+    result = index.matchAndGetJob( resourceDict, negativeCond = negativeCond )
+    if result[ 'OK' ] and result[ 'Value' ][ 'matchFound' ]:
+      matched += 1
+  elapsed = time.time() - start
+  print "%s requests, %s matched in %.2f secs: %.1f requests/s" % ( len( requests ), matched, elapsed,
+                                                                   len( requests ) / max( elapsed, 0.000001 ) )
+  print "DB statements per match: %.2f with the index, at least 5 in the TaskQueueDB" % ( source.statements /
+                                                                                          float( max( matched, 1 ) ) )
+
+  #Some new TQs and jobs to pick up incrementally
+  populate( source, requests, max( 1, numTQs / 100 ), jobsPerTQ, firstTQId = numTQs + 1, firstJobId = nextJobId )
+  elapsed, statements = timeRefresh( index, source )
+  print "Incremental refresh: %.3f secs, %s statements" % ( elapsed, statements )
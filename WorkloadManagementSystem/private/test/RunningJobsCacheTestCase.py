@@ -0,0 +1,118 @@
+########################################################################
+# $HeadURL $
+# File: RunningJobsCacheTestCase.py
+########################################################################
+
+""" :mod: RunningJobsCacheTestCase
+    =======================
+
+    .. module: RunningJobsCacheTestCase
+    :synopsis: test cases for DIRAC.WorkloadManagementSystem.private.RunningJobsCache
+
+    Test cases for the running jobs counters of the Matcher Limiter, using
+    a stand-in JobDB so no MySQL server is needed
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+from DIRAC import S_OK
+from DIRAC.WorkloadManagementSystem.private.RunningJobsCache import RunningJobsCache
+
+class FakeJobDB:
+  """ Stand-in JobDB with a clock ticking at every change """
+
+  def __init__( self ):
+    self.jobs = {}
+    self.clock = 0
+    self.queries = 0
+
+  def setJob( self, jobId, site, status, jobType = 'User', touch = True ):
+    self.clock += 1
+    lastUpdate = self.clock
+    if not touch and jobId in self.jobs:
+      lastUpdate = self.jobs[ jobId ][ 'LastUpdateTime' ]
+    self.jobs[ jobId ] = { 'Site' : site, 'Status' : status, 'JobType' : jobType, 'LastUpdateTime' : lastUpdate }
+
+  def getJobAttributesUpdatedSince( self, attrList, condDict = None, newer = None ):
+    self.queries += 1
+    result = {}
+    for jobId, job in self.jobs.items():
+      if newer is not None and job[ 'LastUpdateTime' ] < newer:
+        continue
+      if condDict and [ key for key in condDict if job[ key ] not in condDict[ key ] ]:
+        continue
+      result[ jobId ] = dict( [ ( attrName, job[ attrName ] ) for attrName in attrList ] )
+    return S_OK( ( self.clock, result ) )
+
+class RunningJobsCacheTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.db = FakeJobDB()
+    self.cache = RunningJobsCache( self.db, fullRefreshPeriod = 600, maxAge = 600 )
+    self.limits = { 'JobType' : { 'Merge' : 2, 'MCSimulation' : 10 } }
+
+  def condition( self, site = 'LCG.CERN.ch' ):
+    result = self.cache.getRunningCondition( site, self.limits )
+    self.assert_( result[ 'OK' ] )
+    return result[ 'Value' ]
+
+  def testLimits( self ):
+    """ conditions come from the cache until the counters change """
+    self.db.setJob( 1, 'LCG.CERN.ch', 'Running', 'Merge' )
+    self.db.setJob( 2, 'LCG.CERN.ch', 'Waiting', 'Merge' )
+    self.db.setJob( 3, 'LCG.PIC.es', 'Running', 'Merge' )
+    self.assertEqual( self.condition(), {} )
+    self.assertEqual( self.condition(), {} )
+    self.assertEqual( self.db.queries, 1 )
+    stats = self.cache.getStats()
+    self.assertEqual( ( stats[ 'hits' ], stats[ 'misses' ] ), ( 1, 1 ) )
+    #Matched by this Matcher
+    self.cache.jobMatched( 'LCG.CERN.ch', 2, { 'JobType' : 'Merge' } )
+    self.assertEqual( self.condition(), { 'JobType' : [ 'Merge' ] } )
+    #The caller can change the returned condition
+    self.condition()[ 'JobType' ].append( 'User' )
+    self.assertEqual( self.condition(), { 'JobType' : [ 'Merge' ] } )
+    self.assertEqual( self.db.queries, 1 )
+
+  def testUpdates( self ):
+    """ jobs changing status or site are picked up incrementally """
+    for jobId in range( 1, 4 ):
+      self.db.setJob( jobId, 'LCG.CERN.ch', 'Running', 'Merge' )
+    self.assertEqual( self.condition(), { 'JobType' : [ 'Merge' ] } )
+    self.db.setJob( 1, 'LCG.CERN.ch', 'Done', 'Merge' )
+    self.db.setJob( 2, 'ANY', 'Waiting', 'Merge' )
+    self.db.setJob( 4, 'LCG.CERN.ch', 'Matched', 'MCSimulation' )
+    self.assert_( self.cache.update()[ 'OK' ] )
+    self.assertEqual( self.condition(), {} )
+    self.assertEqual( self.cache.getStats()[ 'jobs' ], 2 )
+    self.db.setJob( 5, 'LCG.CERN.ch', 'Running', 'Merge' )
+    self.cache.update()
+    self.assertEqual( self.condition(), { 'JobType' : [ 'Merge' ] } )
+    #Changes not touching LastUpdateTime wait for the full refresh
+    self.db.setJob( 6, 'LCG.PIC.es', 'Running', 'Merge' )
+    self.cache.update()
+    self.db.setJob( 5, 'LCG.CERN.ch', 'Done', 'Merge', touch = False )
+    self.cache.update()
+    self.assertEqual( self.condition(), { 'JobType' : [ 'Merge' ] } )
+    self.cache._RunningJobsCache__lastFullRefresh -= 1000
+    self.cache.update()
+    self.assertEqual( self.condition(), {} )
+    self.assertEqual( self.cache.getStats()[ 'fullRefreshes' ], 1 )
+
+  def testStale( self ):
+    """ sites not updated in time are loaded again """
+    self.db.setJob( 1, 'LCG.CERN.ch', 'Running', 'Merge' )
+    self.condition()
+    self.cache._RunningJobsCache__siteTime[ 'LCG.CERN.ch' ] -= 1000
+    self.db.setJob( 2, 'LCG.CERN.ch', 'Running', 'Merge' )
+    self.assertEqual( self.condition(), { 'JobType' : [ 'Merge' ] } )
+    self.assertEqual( self.cache.getStats()[ 'stale' ], 1 )
+    self.assertEqual( self.db.queries, 2 )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( RunningJobsCacheTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
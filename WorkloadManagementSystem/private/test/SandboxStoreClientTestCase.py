@@ -0,0 +1,139 @@
+########################################################################
+# $HeadURL $
+# File: SandboxStoreClientTestCase.py
+########################################################################
+
+""" :mod: SandboxStoreClientTestCase
+    =======================
+
+    .. module: SandboxStoreClientTestCase
+    :synopsis: test cases for DIRAC.WorkloadManagementSystem.Client.SandboxStoreClient
+
+    Test cases for the hash offer, the resumed uploads and the downloads
+    of the sandbox client, using stand-in RPC and transfer clients
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import os
+import shutil
+import tarfile
+import tempfile
+import types
+import unittest
+from DIRAC import S_OK, S_ERROR
+from DIRAC.WorkloadManagementSystem.Client.SandboxStoreClient import SandboxStoreClient
+
+class FakeStore:
+  """ Stand-in SandboxStore service, dropping the connection after the first packet when asked to """
+
+  def __init__( self ):
+    self.stored = {}
+    self.partial = {}
+    self.sends = []
+    self.sizes = []
+    self.dropAfter = 0
+
+  def offerSandbox( self, fileId, assignTo ):
+    if fileId in self.stored:
+      return S_OK( { 'SandboxURL' : 'SB:SandboxSE|/%s' % fileId } )
+    return S_OK( { 'Offset' : len( self.partial.get( fileId, '' ) ) } )
+
+  def sendFile( self, fileName, fileId, token = "", fileSize = False ):
+    self.sends.append( fileId )
+    if type( fileName ) in types.StringTypes:
+      data = open( fileName, 'rb' ).read()
+    else:
+      data = fileName.read()
+    if fileSize is False:
+      fileSize = len( data )
+    self.sizes.append( fileSize )
+    name, assignTo, offset = fileId
+    if self.dropAfter:
+      self.partial[ name ] = self.partial.get( name, '' )[:offset] + data[:self.dropAfter]
+      self.dropAfter = 0
+      return S_ERROR( 'Connection lost' )
+    self.stored[ name ] = self.partial.pop( name, '' )[:offset] + data
+    return S_OK( 'SB:SandboxSE|/%s' % name )
+
+  def receiveFile( self, dataSink, fileId ):
+    if fileId not in self.stored:
+      return S_ERROR( 'Sandbox does not exist' )
+    if type( dataSink ) in types.StringTypes:
+      open( dataSink, 'wb' ).write( self.stored[ fileId ] )
+    else:
+      dataSink.write( self.stored[ fileId ] )
+    return S_OK()
+
+class SandboxStoreClientTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.store = FakeStore()
+    self.client = SandboxStoreClient( rpcClient = self.store, transferClient = self.store )
+    #Don't wait between upload attempts
+    self.client._SandboxStoreClient__uploadRetryDelay = 0
+    self.tmpDir = tempfile.mkdtemp()
+    self.files = []
+    for i in range( 3 ):
+      fileName = os.path.join( self.tmpDir, 'file%s.txt' % i )
+      open( fileName, 'w' ).write( os.urandom( 100000 ).encode( 'hex' ) )
+      self.files.append( fileName )
+
+  def tearDown( self ):
+    shutil.rmtree( self.tmpDir )
+
+  def testUploadOffer( self ):
+    """ a known sandbox is not sent again """
+    result = self.client.uploadFilesAsSandbox( self.files )
+    self.assert_( result[ 'OK' ] )
+    self.assertEqual( len( self.store.sends ), 1 )
+    fileId = self.store.sends[0][0]
+    self.assert_( fileId.endswith( '.tar.bz2' ) )
+    #The name is the MD5 of the tar
+    import hashlib
+    self.assertEqual( fileId[:-8], hashlib.md5( self.store.stored[ fileId ] ).hexdigest() )
+    result = self.client.uploadFilesAsSandbox( self.files )
+    self.assertEqual( result[ 'Value' ], 'SB:SandboxSE|/%s' % fileId )
+    self.assertEqual( len( self.store.sends ), 1 )
+
+  def testResume( self ):
+    """ an interrupted upload goes on from the received bytes """
+    self.store.dropAfter = 1000
+    result = self.client.uploadFilesAsSandbox( self.files )
+    self.assert_( result[ 'OK' ] )
+    self.assertEqual( [ offset for name, assignTo, offset in self.store.sends ], [ 0, 1000 ] )
+    #The resumed upload announces the bytes it sends
+    self.assertEqual( self.store.sizes[1], len( self.store.stored[ self.store.sends[0][0] ] ) - 1000 )
+
+  def testStreamedDownload( self ):
+    """ sandboxes of the store are extracted while received """
+    result = self.client.uploadFilesAsSandbox( self.files )
+    fileId = self.store.sends[0][0]
+    destDir = os.path.join( self.tmpDir, 'download' )
+    result = self.client.downloadSandbox( 'SB:SandboxSE|%s' % fileId, destDir )
+    self.assert_( result[ 'OK' ] )
+    self.assertEqual( result[ 'Value' ], sum( [ os.path.getsize( fileName ) for fileName in self.files ] ) )
+    for fileName in self.files:
+      self.assertEqual( open( os.path.join( destDir, os.path.basename( fileName ) ) ).read(),
+                        open( fileName ).read() )
+    #Bad bundles are reported
+    self.store.stored[ 'bad.tar.bz2' ] = 'not a tar'
+    self.failIf( self.client.downloadSandbox( 'SB:SandboxSE|bad.tar.bz2', destDir, unpack = True )[ 'OK' ] )
+
+  def testPendingOffload( self ):
+    """ sandboxes not yet on the external SE come from the store """
+    result = self.client.uploadFilesAsSandbox( self.files )
+    fileId = self.store.sends[0][0]
+    sePFN = 'srm://external.se/SandBox/%s' % fileId
+    self.store.stored[ sePFN ] = self.store.stored[ fileId ]
+    destDir = os.path.join( self.tmpDir, 'download' )
+    result = self.client.downloadSandbox( 'SB:ExternalSE|%s' % sePFN, destDir )
+    self.assert_( result[ 'OK' ] )
+    self.assertEqual( sorted( os.listdir( destDir ) ), [ os.path.basename( fileName ) for fileName in self.files ] )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( SandboxStoreClientTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: TQPriorityBenchmark.py
+########################################################################
+""" Time the bulk calculation of the task queue priorities on a synthetic
+    population of task queues
+
+    A full calculation is done from scratch, then again after changing the
+    jobs of some of the TQs, like the periodic recalculation of the Matcher
+    does. The UPDATE statements needed are compared with the ones the owner
+    by owner calculation used to need: one query per group, and per owner a
+    query of its TQs, one per field to get their definitions and one UPDATE
+    per distinct priority, for all the TQs every time.
+
+    Usage: TQPriorityBenchmark.py [numTQs] [numOwners] [numGroups] [changedFraction]
+"""
+__RCSID__ = "$Id $"
+
+import sys
+import time
+import random
+from DIRAC.WorkloadManagementSystem.private.TQPriorityCalculator import calculateTQPriorities
+
+MAX_TQS_IN_QUERY = 1000
+NUM_DEF_QUERIES = 1 + 8
+
+def populate( numTQs, numOwners, numGroups ):
+  groups = [ "group%s" % i for i in range( numGroups ) ]
+  owners = [ ( "/DN/user%s" % i, random.choice( groups ) ) for i in range( numOwners ) ]
+  tqData = {}
+  for tqId in range( 1, numTQs + 1 ):
+    ownerDN, ownerGroup = random.choice( owners )
+    numJobs = random.randint( 0, 50 )
+    sumRealPrio = sum( [ random.uniform( 0.001, 10 ) for i in range( numJobs ) ] )
+    groupKey = None
+    if random.random() < 0.95:
+      groupKey = ( ownerDN, ownerGroup, random.randint( 0, 20 ) )
+    tqData[ tqId ] = ( ownerDN, ownerGroup, 0.0, sumRealPrio, numJobs, groupKey )
+  groupShares = dict( [ ( group, random.choice( [ 100, 1000, 5000 ] ) ) for group in groups ] )
+  return tqData, groupShares
+
+def applyPriorities( tqData, tqPrios ):
+  for tqId in tqPrios:
+    tqData[ tqId ] = tqData[ tqId ][ :2 ] + ( tqPrios[ tqId ], ) + tqData[ tqId ][3:]
+
+def oldStatements( tqData ):
+  """ Priorities are real numbers, so about one UPDATE per TQ with jobs """
+  groups = set()
+  ownerTQs = {}
+  for tqId in tqData:
+    ownerDN, ownerGroup = tqData[ tqId ][ :2 ]
+    groups.add( ownerGroup )
+    ownerTQs.setdefault( ( ownerDN, ownerGroup ), 0 )
+    if tqData[ tqId ][4]:
+      ownerTQs[ ( ownerDN, ownerGroup ) ] += 1
+  statements = 1 + len( groups )
+  for owner in ownerTQs:
+    statements += 1 + NUM_DEF_QUERIES + ownerTQs[ owner ]
+  return statements
+
+def timeCalculation( tqData, groupShares ):
+  start = time.time()
+  tqPrios = calculateTQPriorities( tqData, groupShares )
+  elapsed = time.time() - start
+  updates = ( len( tqPrios ) + MAX_TQS_IN_QUERY - 1 ) / MAX_TQS_IN_QUERY
+  return tqPrios, elapsed, updates
+
+if __name__ == "__main__":
+  args = [ 50000, 2000, 20, 0.01 ]
+  for i in range( min( len( sys.argv ) - 1, len( args ) ) ):
+    args[i] = type( args[i] )( sys.argv[ i + 1 ] )
+  numTQs, numOwners, numGroups, changedFraction = args
+
+  tqData, groupShares = populate( numTQs, numOwners, numGroups )
+  tqPrios, elapsed, updates = timeCalculation( tqData, groupShares )
+  print "Full calculation for %s TQs of %s owners: %.3f secs" % ( numTQs, numOwners, elapsed )
+  print "  %s TQs changed, %s UPDATE statements, owner by owner needed %s statements" % ( len( tqPrios ), updates,
+                                                                                          oldStatements( tqData ) )
+  applyPriorities( tqData, tqPrios )
+
+  for tqId in random.sample( tqData.keys(), int( numTQs * changedFraction ) ):
+    tqData[ tqId ] = tqData[ tqId ][ :3 ] + ( tqData[ tqId ][3] + random.uniform( 0.001, 10 ), tqData[ tqId ][4] + 1,
+                                              tqData[ tqId ][5] )
+  tqPrios, elapsed, updates = timeCalculation( tqData, groupShares )
+  print "Recalculation after changing the jobs of %s TQs: %.3f secs" % ( int( numTQs * changedFraction ), elapsed )
+  print "  %s TQs changed, %s UPDATE statements, owner by owner needed %s statements" % ( len( tqPrios ), updates,
+                                                                                          oldStatements( tqData ) )
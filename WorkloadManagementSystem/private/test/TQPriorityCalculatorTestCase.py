@@ -0,0 +1,92 @@
+########################################################################
+# $HeadURL $
+# File: TQPriorityCalculatorTestCase.py
+########################################################################
+
+""" :mod: TQPriorityCalculatorTestCase
+    =======================
+
+    .. module: TQPriorityCalculatorTestCase
+    :synopsis: test cases for DIRAC.WorkloadManagementSystem.private.TQPriorityCalculator
+
+    Test cases for the bulk calculation of the task queue priorities
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+from DIRAC.WorkloadManagementSystem.private.TQPriorityCalculator import calculateTQPriorities, TQ_MIN_SHARE
+
+class TQPriorityCalculatorTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    #tqId -> ( ownerDN, ownerGroup, priority, sumOfJobsRealPriority, numJobs, groupKey )
+    self.tqData = {}
+
+  def addTQ( self, tqId, ownerDN, ownerGroup, realPrios, groupKey = False, priority = 0.0 ):
+    if groupKey is False:
+      groupKey = tqId
+    self.tqData[ tqId ] = ( ownerDN, ownerGroup, priority, float( sum( realPrios ) ), len( realPrios ), groupKey )
+
+  def assertPrios( self, prios, expected ):
+    self.assertEqual( sorted( prios ), sorted( expected ) )
+    for tqId in expected:
+      self.assertAlmostEqual( prios[ tqId ], expected[ tqId ], 6 )
+
+  def testOwnerShares( self ):
+    """ group shares are split among owners and among TQs by real priority """
+    self.addTQ( 1, '/DN/a', 'user', [ 1, 1 ] )
+    self.addTQ( 2, '/DN/a', 'user', [ 3 ] )
+    self.addTQ( 3, '/DN/b', 'user', [ 1 ] )
+    #No jobs, counts as owner but gets no priority
+    self.addTQ( 4, '/DN/c', 'user', [] )
+    self.addTQ( 5, '/DN/a', 'prod', [ 1 ] )
+    prios = calculateTQPriorities( self.tqData, { 'user' : 900, 'prod' : 100 } )
+    self.assertPrios( prios, { 1 : 75, 2 : 225, 3 : 300, 5 : 100 } )
+
+  def testJobSharingAndCorrections( self ):
+    """ job sharing groups are a single owner, the corrector changes owner shares """
+    self.addTQ( 1, '/DN/a', 'prod', [ 1 ] )
+    self.addTQ( 2, '/DN/b', 'prod', [ 1 ] )
+    self.addTQ( 3, '/DN/a', 'user', [ 1 ] )
+    self.addTQ( 4, '/DN/b', 'user', [ 1 ] )
+    def correctShares( shares, group = '' ):
+      shares = dict( shares )
+      shares[ '/DN/a' ] *= 3
+      return shares
+    prios = calculateTQPriorities( self.tqData, { 'prod' : 100, 'user' : 100 }, jobSharingGroups = [ 'prod' ],
+                                   correctShares = correctShares )
+    self.assertPrios( prios, { 1 : 50, 2 : 50, 3 : 150, 4 : 50 } )
+
+  def testBackgroundAndGrouping( self ):
+    """ background TQs get the minimum share, equivalent TQs share the sum """
+    self.addTQ( 1, '/DN/a', 'user', [ 1 ] )
+    self.addTQ( 2, '/DN/a', 'user', [ 0.05 ] )
+    prios = calculateTQPriorities( self.tqData, { 'user' : 100 }, bgAllowedGroups = [ 'user' ] )
+    self.assertPrios( prios, { 1 : 100, 2 : TQ_MIN_SHARE } )
+    self.tqData = {}
+    self.addTQ( 1, '/DN/a', 'user', [ 1 ], groupKey = 'same' )
+    self.addTQ( 2, '/DN/a', 'user', [ 3 ], groupKey = 'same' )
+    self.addTQ( 3, '/DN/a', 'user', [ 1 ], groupKey = None )
+    prios = calculateTQPriorities( self.tqData, { 'user' : 500 } )
+    self.assertPrios( prios, { 1 : 400, 2 : 400, 3 : 100 } )
+
+  def testOnlyChanged( self ):
+    """ TQs already having the right priority are not returned """
+    self.addTQ( 1, '/DN/a', 'user', [ 1 ], priority = 50 )
+    self.addTQ( 2, '/DN/a', 'user', [ 1 ], priority = 50.0000001 )
+    self.addTQ( 3, '/DN/b', 'user', [ 1 ], priority = 10 )
+    prios = calculateTQPriorities( self.tqData, { 'user' : 200 } )
+    self.assertPrios( prios, { 3 : 100 } )
+    #Small priorities are compared with the 4 decimals that are stored
+    self.tqData = {}
+    for tqId, ownerDN in ( ( 1, '/DN/a' ), ( 2, '/DN/b' ), ( 3, '/DN/c' ) ):
+      self.addTQ( tqId, ownerDN, 'user', [ 1 ], priority = 0.3333 )
+    self.assertEqual( calculateTQPriorities( self.tqData, { 'user' : 1 } ), {} )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( TQPriorityCalculatorTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
@@ -0,0 +1,195 @@
+########################################################################
+# $HeadURL $
+# File: TaskQueueIndexTestCase.py
+########################################################################
+
+""" :mod: TaskQueueIndexTestCase
+    =======================
+
+    .. module: TaskQueueIndexTestCase
+    :synopsis: test cases for DIRAC.WorkloadManagementSystem.private.TaskQueueIndex
+
+    Test cases for the in memory task queue index of the Matcher, using
+    a stand-in TaskQueueDB so no MySQL server is needed
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+from DIRAC import S_OK
+from DIRAC.Core.Security import Properties
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+
+class FakeTaskQueueDB:
+  """ Stand-in TaskQueueDB keeping the task queues in dicts """
+
+  def __init__( self ):
+    self.tqDefs = {}
+    self.priorities = {}
+    #tqId -> { jobId : ( priority, realPriority ) }
+    self.jobs = {}
+    self.claimed = []
+
+  def getMultiValueMatchFields( self ):
+    return ( 'GridCE', 'Site', 'GridMiddleware', 'Platform', 'PilotType', 'SubmitPool', 'JobType' )
+
+  def addTaskQueue( self, tqId, priority = 1, **tqDef ):
+    definition = { 'OwnerDN' : '/DN/user', 'OwnerGroup' : 'user', 'Setup' : 'Production', 'CPUTime' : 3600 }
+    definition.update( tqDef )
+    self.tqDefs[ tqId ] = definition
+    self.priorities[ tqId ] = priority
+    self.jobs[ tqId ] = {}
+
+  def addJob( self, tqId, jobId, priority = 1, realPriority = 1.0 ):
+    self.jobs[ tqId ][ jobId ] = ( priority, realPriority )
+
+  def getTaskQueuesSummary( self ):
+    summary = {}
+    for tqId in self.tqDefs:
+      summary[ tqId ] = ( self.priorities[ tqId ], len( self.jobs[ tqId ] ), max( self.jobs[ tqId ].keys() + [ 0 ] ) )
+    return S_OK( summary )
+
+  def getTaskQueueDefinitions( self, tqIdList ):
+    return S_OK( dict( [ ( tqId, self.tqDefs[ tqId ] ) for tqId in tqIdList if tqId in self.tqDefs ] ) )
+
+  def getJobsInTaskQueues( self, tqIdList, minJobId = 0 ):
+    tqJobs = {}
+    for tqId in tqIdList:
+      for jobId, jobData in self.jobs.get( tqId, {} ).items():
+        if jobId > minJobId:
+          tqJobs.setdefault( tqId, [] ).append( ( jobId, ) + jobData )
+    return S_OK( tqJobs )
+
+  def claimJob( self, jobId, tqId, tqOwnerDN, tqOwnerGroup ):
+    if jobId not in self.jobs.get( tqId, {} ):
+      return S_OK( False )
+    del( self.jobs[ tqId ][ jobId ] )
+    self.claimed.append( jobId )
+    return S_OK( True )
+
+def groupProperties( group ):
+  if group == 'lhcb_prod':
+    return [ Properties.JOB_SHARING ]
+  return []
+
+class TaskQueueIndexTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.db = FakeTaskQueueDB()
+    self.index = TaskQueueIndex( self.db, groupPropertiesFunction = groupProperties )
+
+  def match( self, **matchDict ):
+    resourceDict = { 'Setup' : 'Production', 'CPUTime' : 100000 }
+    resourceDict.update( matchDict )
+    negativeCond = resourceDict.pop( 'negativeCond', {} )
+    result = self.index.getMatchingTaskQueues( resourceDict, negativeCond = negativeCond )
+    self.assert_( result[ 'OK' ] )
+    return sorted( result[ 'Value' ] )
+
+  def testSites( self ):
+    """ sites, banned sites and CEs """
+    self.db.addTaskQueue( 1, Sites = [ 'LCG.CERN.ch' ] )
+    self.db.addTaskQueue( 2 )
+    self.db.addTaskQueue( 3, BannedSites = [ 'LCG.CERN.ch' ] )
+    self.db.addTaskQueue( 4, GridCEs = [ 'ce1.cern.ch' ] )
+    for tqId in range( 1, 5 ):
+      self.db.addJob( tqId, tqId * 10 )
+    self.index.refresh()
+    self.assertEqual( self.match( Site = 'LCG.CERN.ch' ), [ 1, 2, 4 ] )
+    self.assertEqual( self.match( Site = 'lcg.cern.ch ', GridCE = 'ce1.cern.ch' ), [ 1, 2, 4 ] )
+    self.assertEqual( self.match( Site = 'LCG.PIC.es' ), [ 2, 3, 4 ] )
+    #Masked site, only TQs asking for the CE
+    self.assertEqual( self.match( GridCE = 'ce1.cern.ch' ), [ 4 ] )
+    self.assertEqual( self.match( Site = 'LCG.CERN.ch', BannedSite = 'LCG.CERN.ch' ), [ 2, 4 ] )
+    self.assertEqual( self.match( BannedSite = 'LCG.CERN.ch' ), [ 2, 3, 4 ] )
+
+  def testStrictFields( self ):
+    """ TQs asking for a platform only match resources giving one """
+    self.db.addTaskQueue( 1, Platforms = [ 'x86_64-slc5' ] )
+    self.db.addTaskQueue( 2 )
+    self.db.addJob( 1, 1 )
+    self.db.addJob( 2, 2 )
+    self.index.refresh()
+    self.assertEqual( self.match(), [ 2 ] )
+    self.assertEqual( self.match( Platform = [ 'x86_64-slc5', 'i686-slc5' ] ), [ 1, 2 ] )
+    self.assertEqual( self.match( Platform = 'i686-slc5' ), [ 2 ] )
+    self.assertEqual( self.match( LHCbPlatform = 'x86_64-slc5' ), [ 1, 2 ] )
+
+  def testOwnersAndCPU( self ):
+    """ owner, job sharing groups, setup and CPU time """
+    self.db.addTaskQueue( 1 )
+    self.db.addTaskQueue( 2, OwnerDN = '/DN/other' )
+    self.db.addTaskQueue( 3, OwnerDN = '/DN/prod', OwnerGroup = 'lhcb_prod', CPUTime = 86400 )
+    self.db.addTaskQueue( 4, Setup = 'Certification' )
+    for tqId in range( 1, 5 ):
+      self.db.addJob( tqId, tqId )
+    self.index.refresh()
+    self.assertEqual( self.match(), [ 1, 2, 3 ] )
+    self.assertEqual( self.match( CPUTime = 3600 ), [ 1, 2 ] )
+    self.assertEqual( self.match( OwnerDN = '/DN/user', OwnerGroup = 'user' ), [ 1 ] )
+    self.assertEqual( self.match( OwnerDN = '/DN/user', OwnerGroup = [ 'user', 'lhcb_prod' ] ), [ 1, 3 ] )
+    self.assertEqual( self.match( OwnerGroup = 'user' ), [ 1, 2 ] )
+    self.assertEqual( self.match( Setup = 'Certification' ), [ 4 ] )
+
+  def testNegativeCond( self ):
+    """ negative conditions of the limiter """
+    self.db.addTaskQueue( 1, JobTypes = [ 'MCSimulation' ] )
+    self.db.addTaskQueue( 2, JobTypes = [ 'Merge' ] )
+    self.db.addTaskQueue( 3 )
+    for tqId in range( 1, 4 ):
+      self.db.addJob( tqId, tqId )
+    self.index.refresh()
+    self.assertEqual( self.match( negativeCond = { 'JobType' : [ 'Merge' ] } ), [ 1, 3 ] )
+    self.assertEqual( self.match( negativeCond = { 'JobType' : [ 'Merge', 'MCSimulation' ] } ), [ 3 ] )
+    self.assertEqual( self.match( negativeCond = [ { 'JobType' : [ 'Merge' ] },
+                                                   { 'JobType' : [ 'MCSimulation' ] } ] ), [ 1, 2, 3 ] )
+    self.assertEqual( self.match( negativeCond = { 'OwnerGroup' : 'user' } ), [] )
+
+  def testMatchAndClaim( self ):
+    """ jobs are claimed in the DB and taken out of the index """
+    self.db.addTaskQueue( 1 )
+    for jobId in range( 1, 6 ):
+      self.db.addJob( 1, jobId )
+    self.index.refresh()
+    #Someone else took two of them
+    del( self.db.jobs[1][1] )
+    del( self.db.jobs[1][2] )
+    matched = []
+    for i in range( 4 ):
+      result = self.index.matchAndGetJob( { 'Setup' : 'Production', 'CPUTime' : 100000 } )
+      self.assert_( result[ 'OK' ] )
+      if result[ 'Value' ][ 'matchFound' ]:
+        matched.append( result[ 'Value' ][ 'jobId' ] )
+    self.assertEqual( sorted( matched ), [ 3, 4, 5 ] )
+    self.assertEqual( sorted( self.db.claimed ), [ 3, 4, 5 ] )
+    self.assertEqual( self.index.getStats()[ 'jobs' ], 0 )
+    self.assertEqual( self.index.getStats()[ 'claimFailures' ], 2 )
+
+  def testIncrementalRefresh( self ):
+    """ new and removed task queues and jobs are picked up """
+    self.db.addTaskQueue( 1 )
+    self.db.addTaskQueue( 2, Sites = [ 'LCG.CERN.ch' ] )
+    self.db.addJob( 1, 1 )
+    self.db.addJob( 2, 2 )
+    self.index.refresh()
+    self.assertEqual( self.index.getStats()[ 'fullRefreshes' ], 1 )
+    self.db.addJob( 1, 3 )
+    self.db.addJob( 2, 4 )
+    del( self.db.jobs[2][2] )
+    self.db.addTaskQueue( 3 )
+    self.db.addJob( 3, 5 )
+    del( self.db.tqDefs[1] )
+    self.index.refresh()
+    stats = self.index.getStats()
+    self.assertEqual( stats[ 'fullRefreshes' ], 1 )
+    self.assertEqual( stats[ 'taskQueues' ], 2 )
+    self.assertEqual( stats[ 'jobs' ], 2 )
+    self.assertEqual( self.match( Site = 'LCG.CERN.ch' ), [ 2, 3 ] )
+    self.assert_( self.index.isReady() )
+
+# test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( TaskQueueIndexTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )